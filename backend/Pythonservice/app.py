@@ -2,8 +2,9 @@
 AI Agent for Business - Main Application
 Separated Architecture: Customer Chat vs Business Analytics
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import os
 from dotenv import load_dotenv
 import chromadb
@@ -14,13 +15,15 @@ load_dotenv()
 # Import services
 from services.ai_service import get_ai_service
 from services.analytics_rag_service import AnalyticsRAGService
+from services.llm_scheduler_service import LLMOverloadedError
+from services.rate_limit_service import RateLimitMiddleware, RateLimitExceededError
 
 # Import routers
 from routes.health import router as health_router
 from routes.analytics import router as analytics_router, set_analytics_rag_service
 from routes.business_analytics import set_chroma_client, router as business_analytics_router, set_analytics_rag_service
 from routes.data_sync import router as data_sync_router
-from routes.groq_chat import router as groq_chat_router, set_groq_client
+from routes.groq_chat import router as groq_chat_router
 from routes.admin_chat import router as admin_chat_router
 from routes.agent_actions import router as agent_actions_router
 from routes.sync_management import router as sync_management_router
@@ -34,6 +37,10 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Token bucket theo IP cho nhóm route chat / admin / sync (Redis, dùng chung giữa các worker)
+# Thêm trước CORS để CORS bọc ngoài -> response 429 vẫn có CORS headers
+app.add_middleware(RateLimitMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -43,6 +50,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloadedError):
+    """LLM scheduler từ chối (hàng đợi đầy / quá thời gian chờ) -> 503 + Retry-After"""
+    return JSONResponse(
+        status_code=503,
+        content={
+            "detail": "Hệ thống AI đang quá tải, vui lòng thử lại sau.",
+            "reason": exc.reason,
+            "retry_after": exc.retry_after
+        },
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(RateLimitExceededError)
+async def rate_limit_exceeded_handler(request: Request, exc: RateLimitExceededError):
+    """Hết token trong bucket theo user -> 429 + Retry-After"""
+    return JSONResponse(
+        status_code=429,
+        content={
+            "detail": "Bạn gửi yêu cầu quá nhanh, vui lòng thử lại sau.",
+            "group": exc.group,
+            "scope": exc.scope,
+            "retry_after": exc.retry_after
+        },
+        headers={"Retry-After": str(exc.retry_after), "X-RateLimit-Limit": str(exc.limit)}
+    )
+
 # Initialize AI Service (shared)
 ai_service = get_ai_service()
 print(f"[AI Service] Initialized with {len(ai_service.get_available_models())} models")
@@ -59,19 +95,49 @@ chroma_client = chromadb.PersistentClient(path=analytics_chroma_path)
 set_chroma_client(chroma_client)
 print(f"[ChromaDB] Initialized shared client at {analytics_chroma_path}")
 
-# Initialize Groq Chat Service (independent)
-from groq import Groq
-groq_api_key = os.getenv('GROQ_API_KEY')
-if groq_api_key:
-    groq_client = Groq(api_key=groq_api_key)
-    set_groq_client(groq_client)
+# Initialize async LLM provider (AsyncGroq + Gemini, shared connection pools)
+from services.llm_provider_service import get_llm_provider
+llm_provider = get_llm_provider()
+if llm_provider.groq_configured:
     print(f"[Groq Chat] Service initialized with API Key")
 else:
     print(f"[Groq Chat] WARNING: GROQ_API_KEY not set - service will fail at runtime")
 
+
+@app.on_event("shutdown")
+async def close_llm_provider():
+    """Đóng connection pool của LLM provider khi app shutdown"""
+    await llm_provider.aclose()
+
+
+@app.on_event("shutdown")
+async def flush_embedding_cache():
+    """Ghi các embedding mới còn trong bộ nhớ xuống disk cache"""
+    from services.embedding_cache_service import get_embedding_cache
+    written = get_embedding_cache().flush()
+    print(f"[EmbeddingCache] Flushed {written} embeddings on shutdown")
+
+
+# Query embedding dùng chung cho chat: precompute probe embeddings ở background khi startup
+from services.query_embedding_service import get_query_embedder
+
+@app.on_event("startup")
+async def warm_up_query_embedder():
+    """Load embedding model + precompute probe embeddings mà không chặn startup"""
+    import asyncio
+
+    async def _warm_up():
+        try:
+            await asyncio.to_thread(get_query_embedder().warm_up)
+        except Exception as e:
+            print(f"[QueryEmbedding] Warm-up failed (sẽ embed lười khi có request): {e}")
+
+    asyncio.create_task(_warm_up())
+
 # Initialize Redis Chat Service
 from services.redis_chat_service import RedisChatService
-from routes.groq_chat import set_redis_service
+from services.async_redis_chat_service import AsyncRedisChatService
+from routes.groq_chat import set_redis_service, set_async_redis_service
 
 try:
     redis_host = os.getenv('REDIS_HOST', 'localhost')
@@ -100,6 +166,32 @@ except Exception as e:
     print(f"[Redis Chat] ERROR: Failed to initialize Redis service: {str(e)}")
     print(f"[Redis Chat] Chat history will NOT be persisted")
 
+# Async Redis (bounded connection pool) cho route chat / history / admin - connection mở lười
+# trong event loop của app, kiểm tra kết nối lúc startup
+async_redis_chat_service = AsyncRedisChatService(
+    host=os.getenv('REDIS_HOST', 'localhost'),
+    port=int(os.getenv('REDIS_PORT', 6379)),
+    db=int(os.getenv('REDIS_DB', 0)),
+    password=os.getenv('REDIS_PASSWORD', None),
+    ttl=int(os.getenv('CHAT_HISTORY_TTL', 86400))
+)
+set_async_redis_service(async_redis_chat_service)
+
+
+@app.on_event("startup")
+async def check_async_redis():
+    """Ping Redis qua async connection pool"""
+    if await async_redis_chat_service.is_connected():
+        print(f"[Redis Chat] Async pool ready (max {async_redis_chat_service.pool.max_connections} connections)")
+    else:
+        print("[Redis Chat] WARNING: Async pool could not reach Redis - history calls will retry per request")
+
+
+@app.on_event("shutdown")
+async def close_async_redis():
+    """Đóng async Redis connection pool khi app shutdown"""
+    await async_redis_chat_service.aclose()
+
 
 # Register routers
 app.include_router(health_router, tags=["Health"])
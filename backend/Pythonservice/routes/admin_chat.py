@@ -6,8 +6,10 @@ from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-from services.redis_chat_service import get_redis_service
+from services.async_redis_chat_service import get_async_redis_service
 from services.chat_ai_rag_chroma_service import get_chat_ai_rag_service
+from services.catalog_version_service import bump_catalog_version
+from services.product_metadata_service import build_product_metadata
 import logging
 import json
 
@@ -27,46 +29,30 @@ class ModalConfigRequest(BaseModel):
 async def debug_redis_status():
     """Debug endpoint to check Redis connection and data"""
     try:
-        redis_service = get_redis_service()
+        redis_service = get_async_redis_service()
         
         # Test connection
-        is_connected = redis_service.is_connected()
+        is_connected = await redis_service.is_connected()
         logger.info(f"[Admin Debug] Redis connected: {is_connected}")
         
-        # Get all chat keys
-        all_chat_keys = redis_service.client.keys("chat:*")
-        logger.info(f"[Admin Debug] Total chat keys: {len(all_chat_keys)}")
-        
-        # Get session keys specifically
-        session_keys = redis_service.client.keys("chat:user:*:session:*")
-        logger.info(f"[Admin Debug] Session keys: {len(session_keys)}")
-        
-        # Get user keys
-        user_keys = redis_service.client.keys("chat:user:*:sessions")
-        logger.info(f"[Admin Debug] User session list keys: {len(user_keys)}")
-        
-        # Show first few keys for debugging
-        sample_keys = session_keys[:5] if session_keys else []
-        
-        debug_info = []
-        for key in sample_keys:
-            message_count = redis_service.client.zcard(key)
-            debug_info.append({
-                "key": key,
-                "message_count": message_count
-            })
+        # Thống kê duy trì khi ghi (không KEYS) + vài session hoạt động gần nhất
+        stats = await redis_service.get_chat_stats()
+        logger.info(f"[Admin Debug] Chat stats: {stats}")
+        sample_sessions = await redis_service.get_recent_sessions(limit=5)
         
         return {
             "status": "ok" if is_connected else "error",
             "redis_connected": is_connected,
-            "total_chat_keys": len(all_chat_keys),
-            "total_session_keys": len(session_keys),
-            "total_user_keys": len(user_keys),
-            "sample_keys": debug_info,
+            "total_session_keys": stats["total_sessions"],
+            "total_user_keys": stats["total_users"],
+            "total_messages": stats["total_messages"],
+            "sample_keys": [
+                {"key": session["key"], "message_count": session["message_count"]}
+                for session in sample_sessions
+            ],
             "all_keys_count": {
-                "chat": len(all_chat_keys),
-                "sessions": len(session_keys),
-                "users": len(user_keys)
+                "sessions": stats["total_sessions"],
+                "users": stats["total_users"]
             }
         }
     except Exception as e:
@@ -78,44 +64,27 @@ async def debug_redis_status():
 
 
 @router.get("/debug/all-data")
-async def debug_all_data():
-    """Show all chat data in Redis (for debugging)"""
+async def debug_all_data(offset: int = 0, limit: int = 50):
+    """Show chat data in Redis (for debugging) - session hoạt động gần nhất trước, phân trang"""
     try:
-        redis_service = get_redis_service()
-        
-        # Get all session keys
-        session_keys = redis_service.client.keys("chat:user:*:session:*")
-        logger.info(f"[Admin Debug] Showing data for {len(session_keys)} sessions")
-        
-        all_data = []
-        
-        for key in session_keys:
-            # Extract parts
-            parts = key.split(":")
-            if len(parts) >= 6:
-                user_id = parts[2]
-                session_id = parts[4]
-                
-                # Get messages
-                message_count = redis_service.client.zcard(key)
-                messages = redis_service.client.zrange(key, 0, -1)
-                
-                parsed_messages = []
-                for msg in messages:
-                    try:
-                        parsed_messages.append(json.loads(msg))
-                    except:
-                        pass
-                
-                all_data.append({
-                    "user_id": user_id,
-                    "session_id": session_id,
-                    "message_count": message_count,
-                    "messages": parsed_messages
-                })
+        redis_service = get_async_redis_service()
+        sessions = await redis_service.get_recent_sessions(offset, limit, include_messages=True)
+        logger.info(f"[Admin Debug] Showing data for {len(sessions)} sessions (offset {offset})")
+        
+        all_data = [
+            {
+                "user_id": session["user_id"],
+                "session_id": session["session_id"],
+                "message_count": session["message_count"],
+                "messages": session["messages"]
+            }
+            for session in sessions
+        ]
         
         return {
             "total_sessions": len(all_data),
+            "offset": offset,
+            "limit": limit,
             "data": all_data
         }
     except Exception as e:
@@ -130,53 +99,10 @@ async def debug_all_data():
 
 @router.get("/chat-stats")
 async def get_chat_stats():
-    """Get overall chat statistics for all users"""
+    """Get overall chat statistics for all users (counter duy trì khi ghi, không quét key)"""
     try:
-        redis_service = get_redis_service()
-        logger.info(f"[Admin Chat] Redis service connected: {redis_service.is_connected()}")
-        
-        # Get all user sessions (format: chat:user:{user_id}:session:{session_id})
-        all_keys = redis_service.client.keys("chat:user:*:session:*")
-        logger.info(f"[Admin Chat] Found {len(all_keys)} session keys")
-        logger.info(f"[Admin Chat] Session keys: {all_keys}")
-        
-        # Parse unique users and sessions
-        users_set = set()
-        total_messages = 0
-        active_sessions = 0
-        
-        for key in all_keys:
-            try:
-                # Extract user_id from key: chat:user:{user_id}:session:{session_id}
-                if key.startswith("chat:user:") and ":session:" in key:
-                    # Split into: ['chat:user', 'user-id:session', 'session-id']
-                    parts = key.split(":session:")
-                    if len(parts) == 2:
-                        user_part = parts[0].replace("chat:user:", "")
-                        user_id = user_part
-                        users_set.add(user_id)
-                        logger.info(f"[Admin Chat] Found user_id: {user_id}")
-                        
-                        # Count messages using zcard (messages are in sorted set)
-                        try:
-                            message_count = redis_service.client.zcard(key)
-                            logger.info(f"[Admin Chat] Key {key} has {message_count} messages")
-                            if message_count and message_count > 0:
-                                active_sessions += 1
-                                total_messages += message_count
-                        except Exception as e:
-                            logger.error(f"[Admin Chat] Error counting messages for {key}: {str(e)}")
-                            pass
-            except Exception as e:
-                logger.error(f"[Admin Chat] Error processing key {key}: {str(e)}")
-                pass
-        
-        result = {
-            "total_users": len(users_set),
-            "total_sessions": len(all_keys),
-            "total_messages": total_messages,
-            "active_sessions": active_sessions
-        }
+        redis_service = get_async_redis_service()
+        result = await redis_service.get_chat_stats()
         logger.info(f"[Admin Chat] Stats: {result}")
         return result
     except Exception as e:
@@ -186,94 +112,31 @@ async def get_chat_stats():
         )
 
 
+@router.post("/chat-stats/rebuild")
+async def rebuild_chat_stats():
+    """Dựng lại thống kê chat từ dữ liệu session (SCAN theo trang, pipeline)"""
+    try:
+        redis_service = get_async_redis_service()
+        rebuilt = await redis_service.rebuild_stats()
+        return {
+            "status": "success",
+            **rebuilt,
+            "stats": await redis_service.get_chat_stats()
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error rebuilding chat stats: {str(e)}"
+        )
+
+
 @router.get("/users-chat-history")
-async def get_all_users_chat_history():
-    """Get chat history for all users - Admin only"""
+async def get_all_users_chat_history(offset: int = 0, limit: Optional[int] = None):
+    """Get chat history for all users - Admin only (user hoạt động gần nhất trước, phân trang)"""
     try:
-        logger.info("[Admin Chat] ===== START: users-chat-history endpoint =====")
-        redis_service = get_redis_service()
-        logger.info(f"[Admin Chat] Redis service: {redis_service}")
-        logger.info(f"[Admin Chat] Redis client: {redis_service.client}")
-        logger.info(f"[Admin Chat] Redis connected: {redis_service.is_connected()}")
-        
-        # Get all user sessions from Redis
-        try:
-            all_keys = redis_service.client.keys("chat:user:*:session:*")
-            logger.info(f"[Admin Chat] Redis keys query returned: {type(all_keys)} with {len(all_keys) if all_keys else 0} items")
-            logger.info(f"[Admin Chat] All keys: {all_keys}")
-        except Exception as e:
-            logger.error(f"[Admin Chat] Error querying Redis keys: {str(e)}", exc_info=True)
-            return JSONResponse(content=[], status_code=200)
-        
-        if not all_keys:
-            logger.info("[Admin Chat] No session keys found in Redis")
-            return JSONResponse(content=[], status_code=200)
-        
-        logger.info(f"[Admin Chat] Found {len(all_keys)} total session keys")
-        
-        users_dict = {}
-        
-        for key in all_keys:
-            try:
-                # Extract user_id and session_id from key: chat:user:{user_id}:session:{session_id}
-                # Pattern: chat:user:user-id:session:session-id
-                logger.info(f"[Admin Chat] Processing key: {key}")
-                
-                if key.startswith("chat:user:") and ":session:" in key:
-                    # Split into: ['chat:user', 'user-id:session', 'session-id']
-                    parts = key.split(":session:")
-                    if len(parts) == 2:
-                        # Extract user_id from first part
-                        user_part = parts[0].replace("chat:user:", "")
-                        session_id = parts[1]
-                        user_id = user_part
-                        
-                        logger.info(f"[Admin Chat] Extracted user_id={user_id}, session_id={session_id}")
-                        
-                        if user_id not in users_dict:
-                            users_dict[user_id] = {
-                                "user_id": user_id,
-                                "total_sessions": 0,
-                                "total_messages": 0,
-                                "sessions": []
-                            }
-                        
-                        # Count messages using zcard (messages are in sorted set)
-                        message_count = int(redis_service.client.zcard(key) or 0)
-                        logger.info(f"[Admin Chat] Session {session_id} has {message_count} messages (zcard result)")
-                        
-                        # Get session metadata if available
-                        created_at = None
-                        try:
-                            # Try to get metadata from a separate hash if it exists
-                            meta_key = f"{key}:meta"
-                            session_data = redis_service.client.hgetall(meta_key)
-                            if "created_at" in session_data:
-                                created_at = session_data["created_at"]
-                        except:
-                            created_at = None
-                        
-                        session_info = {
-                            "session_id": session_id,
-                            "message_count": message_count,
-                            "created_at": created_at or "N/A",
-                            "last_activity": "N/A"
-                        }
-                        
-                        users_dict[user_id]["sessions"].append(session_info)
-                        users_dict[user_id]["total_sessions"] += 1
-                        users_dict[user_id]["total_messages"] += message_count
-                    else:
-                        logger.warning(f"[Admin Chat] Could not parse session from key: {key}")
-                else:
-                    logger.warning(f"[Admin Chat] Key does not match expected pattern: {key}")
-            except Exception as e:
-                logger.error(f"[Admin Chat] Error processing key {key}: {str(e)}", exc_info=True)
-                continue
-        
-        result = list(users_dict.values())
-        logger.info(f"[Admin Chat] Returning {len(result)} users with data: {result}")
-        logger.info(f"[Admin Chat] ===== END: users-chat-history endpoint =====")
+        redis_service = get_async_redis_service()
+        result = await redis_service.get_users_chat_history(offset, limit)
+        logger.info(f"[Admin Chat] Returning {len(result)} users (offset {offset}, limit {limit})")
         return JSONResponse(content=result, status_code=200)
     except Exception as e:
         logger.error(f"[Admin Chat] Error fetching users chat history: {str(e)}", exc_info=True)
@@ -287,44 +150,8 @@ async def get_all_users_chat_history():
 async def get_user_chat_history(user_id: str):
     """Get all chat history for a specific user"""
     try:
-        redis_service = get_redis_service()
-        
-        # Get all sessions for this user
-        user_sessions = redis_service.client.keys(f"chat:user:{user_id}:session:*")
-        
-        sessions = []
-        total_messages = 0
-        
-        for session_key in user_sessions:
-            # Extract session_id
-            session_id = session_key.split(":")[-1]
-            
-            # Get messages for this session
-            message_keys = redis_service.client.keys(f"{session_key}:message:*")
-            message_count = len(message_keys)
-            total_messages += message_count
-            
-            # Get session info
-            created_at = None
-            try:
-                session_data = redis_service.client.hgetall(session_key)
-                if "created_at" in session_data:
-                    created_at = session_data["created_at"]
-            except:
-                pass
-            
-            sessions.append({
-                "session_id": session_id,
-                "message_count": message_count,
-                "created_at": created_at or "N/A"
-            })
-        
-        return {
-            "user_id": user_id,
-            "total_sessions": len(sessions),
-            "total_messages": total_messages,
-            "sessions": sessions
-        }
+        redis_service = get_async_redis_service()
+        return await redis_service.get_user_chat_summary(user_id)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -336,20 +163,8 @@ async def get_user_chat_history(user_id: str):
 async def delete_user_all_sessions(user_id: str):
     """Delete all chat sessions for a specific user"""
     try:
-        redis_service = get_redis_service()
-        
-        # Get all sessions for this user
-        user_sessions = redis_service.client.keys(f"chat:user:{user_id}:session:*")
-        
-        deleted_count = 0
-        for session_key in user_sessions:
-            # Delete session hash
-            redis_service.client.delete(session_key)
-            # Delete session messages
-            message_keys = redis_service.client.keys(f"{session_key}:message:*")
-            for msg_key in message_keys:
-                redis_service.client.delete(msg_key)
-            deleted_count += 1
+        redis_service = get_async_redis_service()
+        deleted_count = await redis_service.delete_user_sessions(user_id)
         
         return {
             "status": "success",
@@ -368,15 +183,8 @@ async def delete_user_all_sessions(user_id: str):
 async def delete_user_session(user_id: str, session_id: str):
     """Delete a specific session for a user"""
     try:
-        redis_service = get_redis_service()
-        session_key = f"chat:user:{user_id}:session:{session_id}"
-        
-        # Delete session hash
-        redis_service.client.delete(session_key)
-        # Delete session messages
-        message_keys = redis_service.client.keys(f"{session_key}:message:*")
-        for msg_key in message_keys:
-            redis_service.client.delete(msg_key)
+        redis_service = get_async_redis_service()
+        await redis_service.clear_session(session_id, user_id)
         
         return {
             "status": "success",
@@ -395,20 +203,8 @@ async def delete_user_session(user_id: str, session_id: str):
 async def clear_all_chat_data():
     """Clear ALL chat data from Redis - DANGEROUS OPERATION"""
     try:
-        redis_service = get_redis_service()
-        
-        # Get all chat keys
-        all_keys = redis_service.client.keys("chat:user:*")
-        
-        deleted_count = len(all_keys)
-        for key in all_keys:
-            redis_service.client.delete(key)
-        
-        # Also delete message keys
-        all_message_keys = redis_service.client.keys("chat:*:message:*")
-        deleted_count += len(all_message_keys)
-        for key in all_message_keys:
-            redis_service.client.delete(key)
+        redis_service = get_async_redis_service()
+        deleted_count = await redis_service.clear_all_chat_data()
         
         return {
             "status": "success",
@@ -576,6 +372,8 @@ async def clear_collection(collection_name: str):
         except Exception as delete_error:
             logger.warning(f"[Admin Chat] Could not delete collection (may not exist): {str(delete_error)}")
         
+        bump_catalog_version(f"collection {collection_name} cleared")
+        
         result = {
             "status": "success",
             "collection_name": collection_name,
@@ -661,6 +459,8 @@ async def clear_all_chroma_data():
             except:
                 pass
         
+        bump_catalog_version("all chroma collections cleared")
+        
         return {
             "status": "success",
             "cleared_collections": cleared_count,
@@ -673,13 +473,34 @@ async def clear_all_chroma_data():
         )
 
 
+@router.post("/chroma/migrate-product-metadata")
+async def migrate_product_metadata():
+    """
+    Migration một lần: ghi metadata có kiểu (price:int, category_norm, brand, stock:int, img_url)
+    cho product document đã ingest trước khi có schema mới (không embed lại)
+    """
+    try:
+        chroma_service = get_chat_ai_rag_service()
+        result = chroma_service.migrate_product_metadata()
+        logger.info(f"[Admin Chat] Product metadata migration: {result}")
+        return {
+            "status": "success",
+            **result
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error migrating product metadata: {str(e)}"
+        )
+
+
 # ===== TEST DATA ENDPOINTS =====
 
 @router.post("/test-data/populate")
 async def populate_test_data():
     """Populate test chat data for development/testing"""
     try:
-        redis_service = get_redis_service()
+        redis_service = get_async_redis_service()
         logger.info("[Admin Chat] Starting test data population")
         from datetime import datetime
         
@@ -691,7 +512,7 @@ async def populate_test_data():
         ]
         
         total_sessions = 0
-        total_messages = 0
+        messages = []
         
         for user_info in test_users:
             user_id = user_info["user_id"]
@@ -704,29 +525,30 @@ async def populate_test_data():
                 num_messages = 3 + session_num  # 3, 4, 5 messages
                 for msg_num in range(num_messages):
                     # User message
-                    redis_service.save_message(
-                        session_id=session_id,
-                        user_id=user_id,
-                        role="user",
-                        content=f"Test message {msg_num + 1} from {user_id}",
-                        model="groq/llama-3.1-8b-instant",
-                        timestamp=datetime.now().isoformat()
-                    )
-                    total_messages += 1
+                    messages.append({
+                        "session_id": session_id,
+                        "user_id": user_id,
+                        "role": "user",
+                        "content": f"Test message {msg_num + 1} from {user_id}",
+                        "model": "groq/llama-3.1-8b-instant",
+                        "timestamp": datetime.now().isoformat()
+                    })
                     
                     # Assistant message
-                    redis_service.save_message(
-                        session_id=session_id,
-                        user_id=user_id,
-                        role="assistant",
-                        content=f"Test response {msg_num + 1} to {user_id}",
-                        model="groq/llama-3.1-8b-instant",
-                        timestamp=datetime.now().isoformat()
-                    )
-                    total_messages += 1
+                    messages.append({
+                        "session_id": session_id,
+                        "user_id": user_id,
+                        "role": "assistant",
+                        "content": f"Test response {msg_num + 1} to {user_id}",
+                        "model": "groq/llama-3.1-8b-instant",
+                        "timestamp": datetime.now().isoformat()
+                    })
                 
                 total_sessions += 1
         
+        # Batch import: một pipeline cho toàn bộ session
+        total_messages = await redis_service.import_messages(messages)
+        
         result = {
             "status": "success",
             "message": "Test data populated successfully",
@@ -841,7 +663,6 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
     try:
         import httpx
         import os
-        import json
         from fastapi import Header
         
         logger.info("[Admin Chat] Starting system data sync to ChromaDB")
@@ -959,7 +780,8 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
             try:
                 users_collection = chroma_service.client.get_or_create_collection(
                     name="chat_ai_users",
-                    metadata={"description": "User information for AI Chat"}
+                    metadata={"description": "User information for AI Chat"},
+                    embedding_function=chroma_service.embedding_function,
                 )
                 logger.info(f"[Admin Chat] Created users collection: {users_collection.name}")
                 
@@ -1042,7 +864,8 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
             try:
                 categories_collection = chroma_service.client.get_or_create_collection(
                     name="chat_ai_categories",
-                    metadata={"description": "Product categories for AI Chat"}
+                    metadata={"description": "Product categories for AI Chat"},
+                    embedding_function=chroma_service.embedding_function,
                 )
                 
                 for category in categories:
@@ -1108,8 +931,11 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
                 
                 products_collection = chroma_service.client.get_or_create_collection(
                     name="chat_ai_products",
-                    metadata={"description": "Product catalog for AI Chat"}
+                    metadata={"description": "Product catalog for AI Chat"},
+                    embedding_function=chroma_service.embedding_function,
                 )
+                # Service đang giữ handle của collection vừa bị xoá -> trỏ sang collection mới
+                chroma_service.product_collection = products_collection
                 
                 for i, product in enumerate(products):
                     try:
@@ -1129,7 +955,6 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
                             details = {}
                         if isinstance(details, str):
                             try:
-                                import json
                                 details = json.loads(details)
                             except:
                                 details = {}
@@ -1201,16 +1026,10 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
                             content_parts.append(f"  - URL ảnh chính: {image_urls[0] if image_urls else 'N/A'}")
                         content = "\n".join(content_parts)
                         
-                        # Tạo metadata với TẤT CẢ thông tin quan trọng + full product data
-                        metadata = {
+                        # Metadata bổ sung: TẤT CẢ thông tin quan trọng + full product data
+                        extra_metadata = {
                             "type": "product",
-                            "product_id": str(product.get('id', '')),
-                            "product_name": product.get('name', ''),
-                            "category": product.get('categoryName', ''),
-                            "price": float(product.get('price', 0)),
                             "quantity": int(product.get('quantity', 0)),  # Changed from stockQuantity
-                            "status": product.get('status', ''),
-                            "brand": brand,  # Extracted from details JSON
                             "seller_username": product.get('sellerUsername', ''),
                             "seller_id": str(product.get('sellerId', '')),
                             "total_sold": int(product.get('totalSold', 0)),
@@ -1231,6 +1050,19 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
                             "full_product_data": json.dumps(product)
                         }
                         
+                        # Metadata có kiểu (price:int, category_norm, brand, stock:int, img_url)
+                        metadata = build_product_metadata(
+                            product.get('id', ''),
+                            product.get('name', ''),
+                            price=product.get('price', 0),
+                            category=product.get('categoryName', ''),
+                            brand=brand,  # Extracted from details JSON
+                            stock=product.get('quantity', 0),
+                            img_url=image_urls[0] if image_urls else '',
+                            status=product.get('status', ''),
+                            **extra_metadata
+                        )
+                        
                         products_collection.add(
                             ids=[doc_id],
                             documents=[content],
@@ -1262,7 +1094,8 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
 
                 discounts_collection = chroma_service.client.get_or_create_collection(
                     name="chat_ai_discounts",
-                    metadata={"description": "Discount codes for AI Chat"}
+                    metadata={"description": "Discount codes for AI Chat"},
+                    embedding_function=chroma_service.embedding_function,
                 )
 
                 processed_ids = set()  # Track processed IDs to avoid duplicates
@@ -1390,7 +1223,8 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
             try:
                 orders_collection = chroma_service.client.get_or_create_collection(
                     name="chat_ai_orders",
-                    metadata={"description": "Order history for AI Chat"}
+                    metadata={"description": "Order history for AI Chat"},
+                    embedding_function=chroma_service.embedding_function,
                 )
                 
                 for order in orders:
@@ -1488,6 +1322,9 @@ async def sync_system_data_to_chroma(authorization: Optional[str] = None):
         
         total_documents = sum(synced_data.values())
         
+        # Catalog (products, discounts...) vừa được sync lại -> invalidate response cache
+        bump_catalog_version("sync-system-data")
+        
         result = {
             "status": "success",
             "message": "System data synced to ChromaDB successfully",
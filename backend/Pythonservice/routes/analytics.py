@@ -8,6 +8,7 @@ from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from services.analytics_rag_service import AnalyticsRAGService
 from services.ai_service import get_ai_service
+from services.llm_scheduler_service import LLMOverloadedError, PRIORITY_ANALYTICS
 from datetime import datetime
 
 router = APIRouter()
@@ -185,10 +186,11 @@ Use quantitative analysis where possible and explain in Vietnamese."""
         system_instruction += data_context
         
         # Generate analysis
-        analysis_text = ai_service.generate(
+        analysis_text = await ai_service.generate_async(
             model_id=request.model_id,
             prompt=request.query,
-            system_instruction=system_instruction
+            system_instruction=system_instruction,
+            priority=PRIORITY_ANALYTICS
         )
         
         # Extract insights (simple version)
@@ -260,6 +262,8 @@ Use quantitative analysis where possible and explain in Vietnamese."""
             "insights": insights
         }
         
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         print(f"[Analytics] Error: {e}")
         raise HTTPException(status_code=500, detail=f"Analytics error: {str(e)}")
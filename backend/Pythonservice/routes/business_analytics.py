@@ -19,6 +19,8 @@ import base64
 from services.document_processing_service import get_document_processor
 from services.analytics_rag_service import AnalyticsRAGService
 from services.forecasting_service import get_forecasting_service
+from services.llm_provider_service import get_llm_provider
+from services.llm_scheduler_service import LLMOverloadedError, PRIORITY_ANALYTICS
 
 router = APIRouter()
 
@@ -1073,11 +1075,13 @@ async def get_ai_insights(request: AIInsightsRequest):
         
         print(f"[Analytics] Model: {model_name}, Provider: {'Groq' if is_groq else 'Gemini'}")
         
-        if is_groq and groq_client:
-            # Use Groq API
+        llm = get_llm_provider()
+        
+        if is_groq and llm.groq_configured:
+            # Use Groq API (async, shared connection pool)
             print(f"[Analytics] Using Groq API")
             try:
-                chat_completion = groq_client.chat.completions.create(
+                chat_completion = await llm.groq_chat_completion(
                     messages=[
                         {
                             "role": "user",
@@ -1087,16 +1091,20 @@ async def get_ai_insights(request: AIInsightsRequest):
                     model=model_name,
                     temperature=0.7,
                     max_tokens=8192,
+                    priority=PRIORITY_ANALYTICS,
                 )
                 ai_insights = chat_completion.choices[0].message.content
+            except LLMOverloadedError:
+                # Quá tải do hàng đợi (không phải lỗi Groq) -> không fallback, trả 503 + Retry-After
+                raise
             except Exception as groq_error:
                 print(f"[Analytics] Groq API error: {groq_error}")
                 # Fallback to Gemini if Groq fails
                 print(f"[Analytics] Fallback to Gemini API")
                 try:
-                    model = genai.GenerativeModel('gemini-2.5-flash')
-                    response = model.generate_content(prompt)
-                    ai_insights = response.text
+                    ai_insights = await llm.gemini_generate('gemini-2.5-flash', prompt, priority=PRIORITY_ANALYTICS)
+                except LLMOverloadedError:
+                    raise
                 except Exception as gemini_error:
                     print(f"[Analytics] Gemini fallback also failed: {gemini_error}")
                     raise HTTPException(status_code=500, detail=f"Both Groq and Gemini APIs failed. Groq: {groq_error}, Gemini: {gemini_error}")
@@ -1104,9 +1112,9 @@ async def get_ai_insights(request: AIInsightsRequest):
             # Use Gemini API
             print(f"[Analytics] Using Gemini API")
             try:
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(prompt)
-                ai_insights = response.text
+                ai_insights = await llm.gemini_generate(model_name, prompt, priority=PRIORITY_ANALYTICS)
+            except LLMOverloadedError:
+                raise
             except Exception as gemini_error:
                 print(f"[Analytics] Gemini API error: {gemini_error}")
                 raise HTTPException(status_code=500, detail=f"Gemini API error: {gemini_error}")
@@ -1118,6 +1126,8 @@ async def get_ai_insights(request: AIInsightsRequest):
             'analysis_type': request.type
         }
         
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         print(f"Error in AI insights: {e}")
         import traceback
@@ -4,105 +4,97 @@ Independent chat controller using Groq API for direct AI interaction.
 Completely separate from other controllers.
 Includes Redis session history management.
 """
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Awaitable, AsyncIterator, Tuple
+from dataclasses import dataclass, field
 import os
-from groq import Groq
+import json
+import asyncio
 from datetime import datetime
 import uuid
 import httpx
-from services.redis_chat_service import RedisChatService, get_redis_service, ChatMessage as RedisMessage
+from services.redis_chat_service import (
+    RedisChatService, set_redis_service as set_shared_redis_service,
+    ChatMessage as RedisMessage, CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_MAX_PAGE_SIZE
+)
+from services.async_redis_chat_service import (
+    AsyncRedisChatService, get_async_redis_service, set_async_redis_service as set_shared_async_redis_service
+)
 from services.chat_ai_rag_chroma_service import get_chat_ai_rag_service
+from services.chat_context_service import ChatRetrievalResult, gather_chat_context
+from services.embedding_cache_service import get_embedding_function
+from services.query_embedding_service import EmbeddingContext
+from services.context_assembler_service import (
+    estimate_tokens, context_token_budget, SECTION_PROFILE, SECTION_CART, SECTION_ORDERS
+)
+from services.response_cache_service import get_response_cache
+from services.answer_verifier_service import (
+    AnswerVerifier, VerificationResult, ANSWER_VERIFIER_ENABLED, ANSWER_VERIFIER_MAX_RETRIES,
+    get_answer_verifier_metrics, is_price_sensitive
+)
+from services.query_intent_service import QueryIntent, analyze_query
+from services.prompt_registry_service import (
+    CHAT_PERSONALIZED_PROMPT, CHAT_ANONYMOUS_PROMPT,
+    build_context_message, build_chat_messages, get_prompt_metrics, list_prompts
+)
+from config.chat_agent_rag_config import get_config
+from services.llm_provider_service import AsyncLLMProvider, get_llm_provider
+from services.llm_scheduler_service import (
+    LLMOverloadedError, PROVIDER_GROQ, PRIORITY_CHAT, get_llm_scheduler
+)
 from services.jwt_util import JwtUtil
+from services.rate_limit_service import GROUP_CHAT, get_rate_limiter, user_rate_limit
+from services.single_flight_service import get_single_flight, make_key
+from services.product_search_service import get_product_lexical_index
+from services.chat_memory_service import get_chat_memory
 
 # Initialize router
 router = APIRouter()
 
-# Initialize Groq client (will be set during app startup)
-_groq_client: Optional[Groq] = None
-_redis_service: Optional[RedisChatService] = None
+# Chat agent config profile (token budget, limits...)
+CHAT_AGENT_CONFIG = get_config(os.getenv('CHAT_AGENT_PROFILE', 'default'))
 
+# Section chứa dữ liệu cá nhân - lượt chat có các section này không dùng response cache
+USER_SPECIFIC_SECTIONS = {SECTION_PROFILE, SECTION_CART, SECTION_ORDERS}
 
-def get_groq_client() -> Groq:
-    """Get or initialize Groq client"""
-    global _groq_client
-    if _groq_client is None:
-        groq_api_key = os.getenv('GROQ_API_KEY')
-        if not groq_api_key:
-            raise HTTPException(
-                status_code=500,
-                detail="GROQ_API_KEY not configured in environment variables"
-            )
-        _groq_client = Groq(api_key=groq_api_key)
-    return _groq_client
+# Async Redis service cho route chat / history / admin (will be set during app startup)
+_redis_service: Optional[AsyncRedisChatService] = None
 
 
-def set_groq_client(client: Groq) -> None:
-    """Set Groq client from external source"""
-    global _groq_client
-    _groq_client = client
+def get_llm() -> AsyncLLMProvider:
+    """Get async LLM provider (AsyncGroq with shared connection pool)"""
+    llm = get_llm_provider()
+    if not llm.groq_configured:
+        raise HTTPException(
+            status_code=500,
+            detail="GROQ_API_KEY not configured in environment variables"
+        )
+    return llm
 
 
 def set_redis_service(service: RedisChatService) -> None:
-    """Set Redis service from external source"""
+    """Set sync Redis service cho các service đọc Redis qua get_redis_service() (cache, catalog version...)"""
+    set_shared_redis_service(service)
+
+
+def set_async_redis_service(service: AsyncRedisChatService) -> None:
+    """Set async Redis service from external source"""
     global _redis_service
     _redis_service = service
+    # Dùng chung instance với admin routes (get_async_redis_service())
+    set_shared_async_redis_service(service)
 
 
-def get_redis() -> RedisChatService:
-    """Get Redis service instance"""
+def get_redis() -> AsyncRedisChatService:
+    """Get async Redis service instance"""
     global _redis_service
     if _redis_service is None:
-        _redis_service = get_redis_service()
+        _redis_service = get_async_redis_service()
     return _redis_service
 
 
-def validate_price_filtering_response(response: str, context: str) -> Dict[str, Any]:
-    """
-    Validate if AI response follows price filtering rules
-    
-    Args:
-        response: AI response text
-        context: Context containing product information
-        
-    Returns:
-        Dict with validation result
-    """
-    # Extract product names from context
-    import re
-    context_products = []
-    
-    # Find all product names in context (format: 📱 SẢN PHẨM X: Name)
-    product_matches = re.findall(r'📱 SẢN PHẨM \d+: ([^(]+)', context)
-    for match in product_matches:
-        product_name = match.strip()
-        context_products.append(product_name.lower())
-    
-    # Extract product names mentioned in response
-    response_lower = response.lower()
-    
-    # Common headphone brands that might be mentioned incorrectly
-    invalid_brands = ['jbl', 'jabra', 'bose', 'sony', 'sennheiser', 'airpods']
-    
-    for brand in invalid_brands:
-        if brand in response_lower and brand not in [p.lower() for p in context_products]:
-            # Check if it's actually in context products
-            found_in_context = False
-            for ctx_product in context_products:
-                if brand in ctx_product:
-                    found_in_context = True
-                    break
-            
-            if not found_in_context:
-                return {
-                    "valid": False,
-                    "reason": f"Response mentions {brand} which is not in filtered context products: {context_products}"
-                }
-    
-    return {"valid": True, "reason": "Response follows filtering rules"}
-
-
 def verify_user_authorization(requested_user_id: str, auth_user_id: str) -> bool:
     """
     Verify that the requesting user can access the requested user's data
@@ -158,7 +150,11 @@ def get_authenticated_user(authorization: Optional[str] = None) -> Optional[Dict
 # Pydantic models
 class ChatRequest(BaseModel):
     """Chat request - message, model, session_id, and user_id"""
-    message: str = Field(..., description="User message to send")
+    message: str = Field(
+        ...,
+        max_length=CHAT_AGENT_CONFIG.max_input_length,
+        description="User message to send"
+    )
     model: Optional[str] = Field(
         default=None,
         description="Groq model to use (optional - will use admin config if available)"
@@ -200,6 +196,7 @@ class ChatHistoryResponse(BaseModel):
     messages: List[HistoryMessage]
     message_count: int
     last_message_time: Optional[str] = None
+    next_cursor: Optional[str] = None  # Chỉ khi phân trang (cursor / limit): None = hết message
 
 
 class SessionListResponse(BaseModel):
@@ -214,20 +211,23 @@ class AvailableModelsResponse(BaseModel):
     default_model: str
 
 
-def detect_action_intent(message: str, products: List[Dict], discounts: List[Dict] = None, ai_response: str = "") -> List[Dict]:
+def detect_action_intent(message: str, products: List[Dict], discounts: List[Dict] = None, ai_response: str = "",
+                         intent: Optional[QueryIntent] = None) -> List[Dict]:
     """
     Detect if user wants to perform an action
     Returns list of action buttons to display
+    
+    Args:
+        intent: QueryIntent của message (None -> analyze_query(message))
     """
-    message_lower = message.lower()
+    if intent is None:
+        intent = analyze_query(message)
+    message_lower = intent.text
     response_lower = ai_response.lower() if ai_response else ""
     actions = []
     
     # EARLY DETECTION: VIEW_CART intent - When viewing cart, show checkout instead of add-to-cart
-    view_cart_keywords = ['giỏ hàng', 'trong giỏ', 'sản phẩm trong giỏ', 'cart', 'gio hang', 'có gì trong giỏ']
-    is_viewing_cart = any(kw in message_lower for kw in view_cart_keywords) and 'thêm' not in message_lower
-    
-    if is_viewing_cart:
+    if intent.is_viewing_cart:
         # When viewing cart, show comprehensive action buttons
         actions.append({
             "type": "GO_TO_CHECKOUT",
@@ -258,18 +258,8 @@ def detect_action_intent(message: str, products: List[Dict], discounts: List[Dic
         
         return actions  # Return early - skip ADD_TO_CART logic below
     
-    # CHECK_ORDER intent - User wants to check their orders
-    check_order_keywords = [
-        'kiểm tra đơn hàng', 'đơn hàng của tôi', 'tra cứu đơn', 
-        'xem đơn hàng', 'order của tôi', 'check order', 'my orders',
-        'đơn hàng của mình', 'có đơn hàng nào', 'đơn đặt hàng'
-    ]
-    # Also check for specific order number patterns: "don hang 30", "đơn hàng #30", "order 30"
-    import re
-    order_pattern = re.compile(r'(don\s*hang|đơn\s*hàng|order)\s*#?\s*\d+', re.IGNORECASE)
-    is_checking_order = any(kw in message_lower for kw in check_order_keywords) or bool(order_pattern.search(message_lower))
-    
-    if is_checking_order:
+    # CHECK_ORDER intent - User wants to check their orders (keywords hoặc "đơn hàng #30")
+    if intent.is_checking_order:
         actions.append({
             "type": "CHECK_ORDERS",
             "label": "📦 Xem tất cả đơn hàng"
@@ -277,8 +267,7 @@ def detect_action_intent(message: str, products: List[Dict], discounts: List[Dic
         return actions  # Return early - this is the primary intent
     
     # ADD_TO_CART intent
-    cart_keywords = ['thêm vào giỏ', 'mua ngay', 'đặt mua', 'add to cart', 'thêm giỏ', 'mua sản phẩm', 'cho vào giỏ', 'thêm giỏ hàng']
-    if any(kw in message_lower for kw in cart_keywords):
+    if intent.wants_add_to_cart:
         found_product = False
         
         # First, try to find product mentioned in user message
@@ -325,8 +314,7 @@ def detect_action_intent(message: str, products: List[Dict], discounts: List[Dic
                 })
     
     # APPLY_DISCOUNT intent - Show available discounts
-    discount_keywords = ['mã giảm giá', 'khuyến mãi', 'voucher', 'coupon', 'giảm giá', 'apply']
-    if any(kw in message_lower for kw in discount_keywords) and discounts:
+    if intent.wants_discount and discounts:
         for discount in discounts[:3]:  # Max 3 discount suggestions
             code = discount.get('code', '')
             desc = discount.get('description', '')
@@ -338,11 +326,7 @@ def detect_action_intent(message: str, products: List[Dict], discounts: List[Dic
             })
     
     # CREATE_ORDER intent - Cả từ user và AI suggest
-    order_keywords = [
-        'đặt hàng', 'tạo đơn', 'checkout', 'thanh toán', 'mua luôn', 'order',
-        'dat hang', 'tao don', 'thanh toan', 'mua luon', 'mua ngay'
-    ]
-    is_ordering = any(kw in message_lower for kw in order_keywords)
+    is_ordering = intent.wants_create_order
     ai_suggesting_order = any(kw in response_lower for kw in ['đặt hàng ngay', 'tiến hành đặt hàng', 'hoàn tất đơn hàng', 'xác nhận đơn hàng'])
     
     if is_ordering or ai_suggesting_order:
@@ -356,7 +340,8 @@ def detect_action_intent(message: str, products: List[Dict], discounts: List[Dic
     return actions
 
 
-def extract_inline_products(products: List[Dict], query: str = "", max_products: int = 5) -> List[Dict]:
+def extract_inline_products(products: List[Dict], query: str = "", max_products: int = 5,
+                            intent: Optional[QueryIntent] = None) -> List[Dict]:
     """
     Extract products để hiển thị inline với buttons trong chat
     
@@ -364,6 +349,7 @@ def extract_inline_products(products: List[Dict], query: str = "", max_products:
         products: List of product dicts from detect_action_intent
         query: User query để filter relevant products
         max_products: Số sản phẩm tối đa trả về
+        intent: QueryIntent của query (None -> analyze_query(query))
         
     Returns:
         List of products với format cho frontend
@@ -376,26 +362,16 @@ def extract_inline_products(products: List[Dict], query: str = "", max_products:
     return []
     
     # Detect category from query
-    query_lower = query.lower()
-    category_keywords = {
-        'laptop': ['laptop', 'may tinh', 'máy tính', 'macbook', 'asus', 'lenovo', 'dell', 'hp'],
-        'dien thoai': ['dien thoai', 'điện thoại', 'phone', 'iphone', 'samsung', 'xiaomi', 'oppo', 'vivo'],
-        'tai nghe': ['tai nghe', 'headphone', 'earphone', 'airpods'],
-        'dong ho': ['dong ho', 'đồng hồ', 'watch', 'smartwatch']
-    }
+    if intent is None:
+        intent = analyze_query(query)
+    detected_category = intent.category
     
-    detected_category = None
-    for category, keywords in category_keywords.items():
-        if any(kw in query_lower for kw in keywords):
-            detected_category = category
-            break
-    
-    # Map detected category (no diacritics) to actual category names in DB
+    # Map detected category to actual category names in DB
     category_mapping = {
         'laptop': 'Laptop',
-        'dien thoai': 'Điện thoại',
+        'điện thoại': 'Điện thoại',
         'tai nghe': 'Tai nghe',
-        'dong ho': 'Đồng hồ'
+        'đồng hồ thông minh': 'Đồng hồ'
     }
     
     # Filter products by detected category
@@ -413,10 +389,7 @@ def extract_inline_products(products: List[Dict], query: str = "", max_products:
         print(f"[INLINE_PRODUCTS] Detected category: {detected_category} -> {actual_category}, filtered {len(filtered_products)}/{len(products)} products")
     
     # Additional filtering for gaming laptops
-        is_gaming_query = any(kw in query_lower for kw in [
-            'gaming', 'game', 'choi game', 'rog', 'legion', 
-            'chơi game', 'fps', 'pubg', 'lol', 'liên quân'
-        ])
+        is_gaming_query = intent.is_gaming or intent.purpose == 'gaming'
         if detected_category == 'laptop' and is_gaming_query:
             # Filter for gaming laptops only (ROG, Legion, Gaming in name)
             gaming_laptops = [
@@ -446,7 +419,7 @@ def extract_inline_products(products: List[Dict], query: str = "", max_products:
 
 
 @router.get("/health", tags=["Groq Chat"])
-async def groq_chat_health(client: Groq = Depends(get_groq_client)):
+async def groq_chat_health(llm: AsyncLLMProvider = Depends(get_llm)):
     """
     Health check for Groq Chat service
     
@@ -469,8 +442,112 @@ async def groq_chat_health(client: Groq = Depends(get_groq_client)):
         )
 
 
+@router.get("/prompt-metrics", tags=["Groq Chat"])
+async def get_prompt_cache_metrics():
+    """
+    Prompt registry + prompt tokens metrics
+    
+    Returns:
+        - prompts: Prompt tĩnh đã compile (tokens, prefix hash)
+        - metrics: Prompt tokens dùng chung prefix / cached tokens provider báo về
+    """
+    return {
+        "prompts": [prompt.to_dict() for prompt in list_prompts()],
+        "metrics": get_prompt_metrics().snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/response-cache/stats", tags=["Groq Chat"])
+async def get_response_cache_stats():
+    """
+    Response cache stats (hits, misses, entries, catalog version)
+    """
+    return {
+        **(await get_response_cache().stats()),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/answer-verifier/stats", tags=["Groq Chat"])
+async def get_answer_verifier_stats():
+    """
+    Answer verifier stats (số response đã verify, sửa giá, ghi chú, re-generate, lỗi theo loại)
+    """
+    return {
+        **get_answer_verifier_metrics().snapshot(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/llm-scheduler/stats", tags=["Groq Chat"])
+async def get_llm_scheduler_stats():
+    """
+    LLM scheduler stats (queue depth, in-flight theo model, thời gian chờ, request bị từ chối)
+    """
+    return {
+        **get_llm_scheduler().stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/rate-limit/stats", tags=["Groq Chat"])
+async def get_rate_limit_stats():
+    """
+    Rate limit stats của worker này (giới hạn theo nhóm route, số request cho qua / bị chặn)
+    """
+    return {
+        **get_rate_limiter().stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/single-flight/stats", tags=["Groq Chat"])
+async def get_single_flight_stats():
+    """
+    Single-flight stats (số lần chạy thật / được gộp theo stage: products, knowledge, discounts, completion)
+    """
+    return {
+        **get_single_flight().stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/product-search/stats", tags=["Groq Chat"])
+async def get_product_search_stats():
+    """
+    Lexical index (BM25) của sản phẩm: catalog version đã index, số sản phẩm / term, số lần reindex
+    """
+    return {
+        **get_product_lexical_index().stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/chat-memory/stats", tags=["Groq Chat"])
+async def get_chat_memory_stats():
+    """
+    Conversation memory stats (history token budget, summary được dùng / refresh, message bị cắt theo budget)
+    """
+    return {
+        **get_chat_memory().stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@router.get("/embedding-cache/stats", tags=["Groq Chat"])
+async def get_embedding_cache_stats():
+    """
+    Embedding cache stats (memory/disk hits, model calls, số embedding trên disk)
+    """
+    return {
+        **get_embedding_function().stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 @router.get("/models", tags=["Groq Chat"])
-async def get_available_models(client: Groq = Depends(get_groq_client)):
+async def get_available_models(llm: AsyncLLMProvider = Depends(get_llm)):
     """
     Get available Groq models from Groq API (not hardcoded)
     
@@ -478,10 +555,10 @@ async def get_available_models(client: Groq = Depends(get_groq_client)):
     """
     try:
         # Get models from Groq API
-        models_response = client.models.list()
+        models_data = await llm.list_groq_models()
         
         # Extract model IDs
-        available_models = [model.id for model in models_response.data]
+        available_models = [model.id for model in models_data]
         
         # Default model
         default_model = available_models[0] if available_models else "openai/gpt-oss-20b"
@@ -550,11 +627,663 @@ async def get_real_cart_context(authorization: str) -> str:
     return ""
 
 
-@router.post("/chat", tags=["Groq Chat"])
+@dataclass
+class ChatTurn:
+    """State của một lượt chat sau giai đoạn auth + retrieval + build prompt"""
+    session_id: str
+    user_id: str
+    model: str
+    temperature: float
+    max_tokens: int
+    messages_for_api: List[Dict[str, str]]
+    combined_context: str
+    is_checking_order: bool
+    intent: QueryIntent
+    chroma_service: Any
+    redis_svc: AsyncRedisChatService
+    context_report: Dict[str, Any] = field(default_factory=dict)  # section giữ/cắt/bỏ theo token budget
+    cache_key: Optional[str] = None  # response cache key (None = lượt chat có dữ liệu cá nhân)
+    retrieval: Optional[ChatRetrievalResult] = None  # kết quả retrieval trước LLM (catalog, discounts, orders)
+
+
+async def prepare_chat_turn(request: ChatRequest, authorization: Optional[str]) -> ChatTurn:
+    """
+    Giai đoạn trước LLM của /chat và /chat/stream:
+    xác thực user, retrieval context, lưu tin nhắn user, build system prompt + messages
+    
+    Args:
+        request: ChatRequest
+        authorization: Authorization header value
+        
+    Returns:
+        ChatTurn sẵn sàng để gọi Groq
+    """
+    # Validate JWT token and get authenticated user
+    auth_user = get_authenticated_user(authorization)
+    print(f"[CHAT] Authorization header present: {authorization is not None}")
+    if authorization:
+        print(f"[CHAT] Authorization header starts with: {authorization[:20]}...")
+    print(f"[CHAT] Auth user: {auth_user}")
+    
+    # Generate or use provided session_id
+    session_id = request.session_id or f"session-{datetime.now().timestamp()}"
+    
+    # Determine user_id: use authenticated user if available, otherwise from request or anonymous
+    if auth_user:
+        authenticated_user_id = auth_user["user_id"]
+        print(f"[CHAT] Authenticated user ID: {authenticated_user_id} (type: {type(authenticated_user_id)})")
+        # Always use user_X format for ChromaDB
+        user_id = f"user_{authenticated_user_id}"
+        print(f"[CHAT] Final user_id for ChromaDB: {user_id}")
+        
+        # If request.user_id is provided and doesn't match authenticated user, reject
+        if request.user_id and str(request.user_id) != str(authenticated_user_id):
+            raise HTTPException(
+                status_code=403,
+                detail=f"User ID mismatch. Cannot access data for other users."
+            )
+    else:
+        print("[CHAT] No authentication - using anonymous")
+        # No authentication - use provided user_id or anonymous
+        user_id = request.user_id or f"anonymous-{datetime.now().timestamp()}"
+        print(f"[CHAT] Anonymous user_id: {user_id}")
+    
+    # Phân tích query MỘT lần (category, giá, thương hiệu, đơn hàng, giỏ hàng...) - dùng lại
+    # cho retrieval, action detection và suggestions
+    intent = analyze_query(request.message)
+    # Detect order intent early - quyết định có cần lookup đơn hàng song song hay không
+    is_checking_order = intent.is_checking_order
+    # Nếu hỏi về đơn hàng CỤ THỂ (có số) → query trực tiếp từ DB, nếu không → lấy list compact
+    specific_order_id = intent.order_id
+    # Query embedding tính MỘT lần (lười, thread-safe), dùng chung cho mọi collection.query của lượt chat
+    embedding = EmbeddingContext(request.message)
+    
+    # Get comprehensive context from ChromaDB (modal config + products + knowledge + discounts
+    # + user data + cart + orders) - all lookups run concurrently, off the event loop
+    print(f"[CHAT] Getting context for user_id: {user_id}")
+    chroma_service = get_chat_ai_rag_service()
+    retrieval = await gather_chat_context(
+        chroma_service,
+        user_id=user_id,
+        query=request.message,  # Use current message as query for relevant context
+        top_k_knowledge=2,
+        top_k_user=2,
+        top_k_discounts=3,  # Include discount context
+        include_orders=is_checking_order,
+        order_id=specific_order_id,
+        cart_fallback=lambda: get_real_cart_context(authorization),
+        intent=intent,
+        embedding=embedding
+    )
+    active_config = retrieval.active_config
+    if is_checking_order:
+        if specific_order_id:
+            print(f"[CHAT] Added specific order #{specific_order_id} detail for user {user_id}")
+        elif retrieval.orders_context:
+            print(f"[CHAT] Added orders context for user {user_id} (compact: 3 orders)")
+        else:
+            print(f"[CHAT] No orders found for user {user_id}")
+    
+    # Use admin config if available, otherwise fallback to request model
+    if active_config:
+        model_to_use = active_config.get('model', request.model)
+        temperature = active_config.get('temperature', 0.7)
+        max_tokens = active_config.get('max_tokens', 1024)
+        system_prompt = active_config.get('system_prompt')
+    else:
+        model_to_use = request.model
+        temperature = 0.7
+        max_tokens = 1024
+        system_prompt = None
+    
+    # Get Redis service
+    redis_svc = get_redis()
+    
+    # Save user message to Redis with user association
+    user_msg_time = datetime.now().isoformat()
+    await redis_svc.save_message(
+        session_id=session_id,
+        user_id=user_id,
+        role="user",
+        content=request.message,
+        model=model_to_use,
+        timestamp=user_msg_time
+    )
+    
+    # Conversation memory: rolling summary + lượt gần nhất trong CHAT_MEMORY_HISTORY_TOKENS
+    # (session dài được tóm tắt ở background, giữ dưới giới hạn 8000 tokens của Groq)
+    memory = await get_chat_memory().load(redis_svc, session_id, user_id)
+    print(f"[CHAT] History: {memory.to_dict()}")
+    
+    # TOKEN-BUDGETED CONTEXT: giữ section theo priority (profile > cart > orders > discounts
+    # > product summary > product detail > knowledge) cho vừa phần window còn lại của model
+    context_budget = context_token_budget(
+        max_context_tokens=CHAT_AGENT_CONFIG.max_context_tokens,
+        max_tokens=max_tokens,
+        prompt_tokens=CHAT_PERSONALIZED_PROMPT.tokens + memory.tokens,
+        model=model_to_use
+    )
+    assembled = retrieval.build_assembler(chroma_service, context_budget).assemble()
+    combined_context = assembled.text
+    print(f"[CHAT] Context assembled: {assembled.used_tokens}/{context_budget} tokens, kept: {assembled.kept}")
+    if assembled.truncated or assembled.dropped:
+        print(f"[CHAT] Context over budget - truncated: {assembled.truncated}, dropped: {assembled.dropped}")
+    print(f"[CHAT] Combined context preview: {combined_context[:200] if combined_context else 'None'}")
+    
+    # RESPONSE CACHE: chỉ cache câu hỏi catalog - không có profile/cart/orders trong context và
+    # không có history / summary (lượt đầu của session): câu hỏi nối tiếp ("cái nào rẻ hơn?")
+    # phụ thuộc hội thoại nên không dùng chung câu trả lời giữa các user được
+    cache_key = None
+    if (not is_checking_order and not USER_SPECIFIC_SECTIONS.intersection(assembled.kept)
+            and memory.size <= 1 and not memory.summary):
+        cache_key = get_response_cache().make_key(request.message, model_to_use, temperature, retrieval.catalog_version)
+
+    # Check if we have user-specific context
+    has_user_context = combined_context and combined_context != "No relevant context found.No user-specific context found."
+
+    if has_user_context:
+        # Extract user name for personalization
+        user_name = "bạn"
+        if "Tên:" in combined_context:
+            # Try to extract name from new format
+            name_start = combined_context.find("Tên:") + 4
+            name_end = combined_context.find("\n", name_start)
+            if name_end == -1:  # section cuối của context (assembler đã strip newline)
+                name_end = len(combined_context)
+            if name_end > name_start:
+                extracted_name = combined_context[name_start:name_end].strip()
+                print(f"[CHAT] Extracted user name: '{extracted_name}'")
+                if extracted_name and extracted_name != "N/A" and extracted_name != "":
+                    user_name = extracted_name
+        elif "Name:" in combined_context:
+            # Fallback to old format
+            name_start = combined_context.find("Name:") + 6
+            name_end = combined_context.find("\n", name_start)
+            if name_end == -1:
+                name_end = len(combined_context)
+            if name_end > name_start:
+                extracted_name = combined_context[name_start:name_end].strip()
+                if extracted_name and extracted_name != "N/A" and extracted_name != "":
+                    user_name = extracted_name
+
+        context_message = build_context_message(combined_context, user_name)
+        chat_prompt = CHAT_PERSONALIZED_PROMPT
+    else:
+        context_message = None
+        chat_prompt = CHAT_ANONYMOUS_PROMPT
+    
+    # Static-first / dynamic-last: prompt tĩnh (dùng chung mọi user) -> dữ liệu user -> summary -> history
+    messages_for_api = build_chat_messages(chat_prompt, memory.messages, context_message, memory.summary)
+    get_prompt_metrics().record_request(chat_prompt, estimate_tokens(context_message or ""))
+    
+    return ChatTurn(
+        session_id=session_id,
+        user_id=user_id,
+        model=model_to_use,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        messages_for_api=messages_for_api,
+        combined_context=combined_context,
+        is_checking_order=is_checking_order,
+        intent=intent,
+        chroma_service=chroma_service,
+        redis_svc=redis_svc,
+        context_report=assembled.to_dict(),
+        cache_key=cache_key,
+        retrieval=retrieval
+    )
+
+
+def build_chat_extras(turn: ChatTurn, message: str, response_message: str) -> Dict[str, Any]:
+    """
+    Giai đoạn sau LLM: gợi ý, action buttons, inline products và danh sách đơn hàng
+    
+    Args:
+        turn: ChatTurn của lượt chat
+        message: Tin nhắn của user
+        response_message: Response của AI
+        
+    Returns:
+        Dict với suggestions, actions, products, orders (đúng field của ChatResponse)
+    """
+    is_checking_order = turn.is_checking_order
+    # Post-processing chỉ dùng dữ liệu đã retrieve trước LLM - không query lại ChromaDB
+    retrieval = turn.retrieval or ChatRetrievalResult()
+    products_for_action = []
+    
+    # Generate smart suggestions based on context (QueryIntent của lượt chat)
+    intent = turn.intent
+    suggestions = []
+    
+    # Category-based suggestions
+    if intent.category == 'điện thoại':
+        suggestions = [
+            "So sánh điện thoại giá rẻ và cao cấp",
+            "Điện thoại chơi game tốt nhất",
+            "Điện thoại chụp ảnh đẹp dưới 15 triệu",
+            "Xem mã giảm giá điện thoại"
+        ]
+    elif intent.category == 'laptop':
+        suggestions = [
+            "Laptop văn phòng giá rẻ",
+            "So sánh MacBook và laptop Windows",
+            "Laptop gaming dưới 25 triệu",
+            "Xem khuyến mãi laptop"
+        ]
+    elif intent.category == 'tai nghe':
+        suggestions = [
+            "Tai nghe chống ồn tốt nhất",
+            "So sánh AirPods và Sony",
+            "Tai nghe bluetooth giá rẻ",
+            "Xem tất cả tai nghe"
+        ]
+    elif 'apple' in intent.brands:
+        suggestions = [
+            "So sánh các sản phẩm Apple",
+            "Phụ kiện Apple chính hãng",
+            "Chương trình trade-in Apple",
+            "Xem mã giảm giá Apple"
+        ]
+    elif intent.is_low_price:
+        suggestions = [
+            "Xem thêm sản phẩm giá rẻ",
+            "Sản phẩm dưới 5 triệu",
+            "Khuyến mãi hot hôm nay",
+            "Tư vấn theo ngân sách cụ thể"
+        ]
+    elif intent.is_high_price:
+        suggestions = [
+            "Sản phẩm flagship mới nhất",
+            "So sánh các dòng cao cấp",
+            "Chính sách bảo hành VIP",
+            "Xem ưu đãi premium"
+        ]
+    else:
+        # Default suggestions
+        suggestions = [
+            "Xem điện thoại hot nhất",
+            "Laptop bán chạy",
+            "Tai nghe được yêu thích",
+            "Khuyến mãi đang có"
+        ]
+    
+    # Detect action intents from user message AND AI response
+    actions = []
+    try:
+        import re
+        # Products cho action detection: cùng catalog snapshot đã render context cho AI (+ khoảng giá khách hỏi)
+        products_for_action = retrieval.action_products(limit=50, price_range=intent.price_range)
+        discounts_for_action = []
+        
+        # Extract discount codes from AI response OR context (discount đã retrieve trước LLM)
+        discount_codes_in_response = re.findall(r'(?:GADGET|SAVE|BLACK|WELCOME|LOYAL|FLASH|HOT|VIP)\w*', response_message.upper())
+        discount_codes_in_context = retrieval.discount_codes()
+        
+        # Combine and deduplicate
+        all_discount_codes = list(set(discount_codes_in_response + discount_codes_in_context))
+        
+        for code in all_discount_codes[:4]:  # Max 4 discount buttons
+            discounts_for_action.append({
+                'code': code,
+                'description': f'Áp dụng mã {code}'
+            })
+        
+        # Detect user intent actions
+        actions = detect_action_intent(message, products_for_action, discounts_for_action, response_message,
+                                       intent=intent)
+        
+        # Also detect products mentioned in AI response and add cart buttons
+        response_lower = response_message.lower()
+        
+        # Keywords indicating AI is suggesting to add to cart
+        suggesting_buy = any(kw in response_lower for kw in ['thêm vào giỏ', 'muốn mua', 'muốn đặt', 'đặt hàng', 'mua ngay'])
+        
+        # Sản phẩm (toàn bộ catalog) được nhắc trong response: một lượt quét qua mention index
+        # (>= 2 từ có nghĩa của tên, hoặc nguyên tên với tên ngắn)
+        cart_candidates = retrieval.mentioned_products(response_message)
+        if suggesting_buy and len(products_for_action) <= 3:
+            cart_candidates += products_for_action
+        
+        for product in cart_candidates:
+            if len(product.get('name', '')) >= 3:
+                # Check if we already have this product action
+                already_added = any(a.get('productId') == product.get('id') for a in actions)
+                if not already_added:
+                    actions.append({
+                        "type": "ADD_TO_CART",
+                        "productId": product.get('id'),
+                        "productName": product.get('name'),
+                        "price": product.get('price'),
+                        "quantity": 1,
+                        "label": f"🛒 Thêm {product.get('name')} vào giỏ"
+                    })
+        
+        # If discounts were shown in response, add discount buttons
+        # But SKIP if checking order history (to avoid confusion with past orders)
+        if discounts_for_action and ('mã giảm' in response_lower or 'khuyến mãi' in response_lower or 'giảm giá' in response_lower) and not is_checking_order:
+            # SPECIAL CASE: Detect if AI is asking about applying discount AFTER confirming quantity
+            # Pattern: "Số lượng: X chiếc" OR "x2" OR "2 chiếc" + has product in response
+            import re
+            
+            # Try multiple patterns to extract quantity
+            quantity_match = (
+                re.search(r'(?:số lượng|quantity)[:\s]*(\d+)', response_lower) or
+                re.search(r'x\s*(\d+)', response_lower) or
+                re.search(r'(\d+)\s*(?:chiếc|cái|sản phẩm)', response_lower)
+            )
+            
+            pending_product_id = None
+            pending_product_info = None
+            pending_quantity = 1
+            
+            print(f"[CHAT] Discount detection - quantity_match: {quantity_match}, products: {len(products_for_action)}")
+            print(f"[CHAT] Response snippet: {response_lower[:200]}")
+            
+            # If we found quantity and have products, try to match product
+            if quantity_match and products_for_action:
+                pending_quantity = int(quantity_match.group(1))
+                print(f"[CHAT] Extracted quantity: {pending_quantity}")
+                
+                # Strategy 1: Find product mentioned in response (nguyên tên, toàn bộ catalog)
+                for product in retrieval.named_products(response_message)[:1]:
+                    pending_product_id = product.get('id')
+                    pending_product_info = product  # Store full product info
+                    print(f"[CHAT] Found pending product by name match: {product.get('name')} (ID: {pending_product_id}, Price: {product.get('price')})")
+                
+                # Strategy 2: If only 1 product in context, use it
+                if not pending_product_id and len(products_for_action) == 1:
+                    pending_product_id = products_for_action[0].get('id')
+                    pending_product_info = products_for_action[0]  # Store full product info
+                    print(f"[CHAT] Using single product in context: {products_for_action[0].get('name')} (ID: {pending_product_id}, Price: {products_for_action[0].get('price')})")
+            
+            for discount in discounts_for_action:
+                # Check if we already have this discount action
+                already_added = any(a.get('discountCode') == discount.get('code') for a in actions)
+                if not already_added:
+                    discount_action = {
+                        "type": "APPLY_DISCOUNT",
+                        "discountCode": discount.get('code'),
+                        "description": discount.get('description'),
+                        "label": f"🎫 Áp mã {discount.get('code')}"
+                    }
+                    # Add pending product context if detected
+                    if pending_product_id and pending_product_info:
+                        discount_action["pendingProductId"] = pending_product_id
+                        discount_action["pendingQuantity"] = pending_quantity
+                        discount_action["pendingProductInfo"] = {
+                            "id": pending_product_info.get('id'),
+                            "name": pending_product_info.get('name'),
+                            "price": pending_product_info.get('price'),
+                            "imageUrl": pending_product_info.get('imageUrl')
+                        }
+                        print(f"[CHAT] Added pending context to discount button: productId={pending_product_id}, quantity={pending_quantity}, price={pending_product_info.get('price')}")
+                    else:
+                        print(f"[CHAT] No pending product detected for discount {discount.get('code')}")
+                    actions.append(discount_action)
+        
+        print(f"[CHAT] Detected {len(actions)} actions: {[a.get('type') for a in actions]}")
+    except Exception as action_error:
+        print(f"[CHAT] Action detection error: {action_error}")
+        actions = []
+    
+    # Extract inline products for display in chat
+    inline_products = extract_inline_products(products_for_action, message, intent=intent)
+    print(f"[CHAT] Extracted {len(inline_products)} inline products")
+    
+    # Orders list if checking orders (lấy cùng lookup đơn hàng trước LLM)
+    orders_list = []
+    if is_checking_order:
+        orders_list = retrieval.orders
+        print(f"[CHAT] Extracted {len(orders_list)} orders for display")
+    
+    return {
+        "suggestions": suggestions,
+        "actions": actions if actions else None,
+        "products": inline_products if inline_products else None,
+        "orders": orders_list if orders_list else None
+    }
+
+
+def verify_chat_answer(turn: ChatTurn, response_message: str) -> Optional[VerificationResult]:
+    """
+    Verify response của AI với catalog snapshot của lượt chat (local, không gọi LLM):
+    sửa giá sai, ghi chú thứ tự giá, phát hiện thương hiệu / khoảng giá sai
+    
+    Returns:
+        VerificationResult hoặc None nếu verifier tắt / lượt chat không có catalog
+    """
+    catalog = turn.retrieval.catalog if turn.retrieval else None
+    if not ANSWER_VERIFIER_ENABLED or catalog is None:
+        return None
+    result = AnswerVerifier(catalog).verify(response_message, turn.intent)
+    get_answer_verifier_metrics().record(result)
+    if result.issues:
+        print(f"[VERIFIER] {len(result.issues)} issues (patched: {result.patched}, "
+              f"annotated: {result.annotated}): {[issue.detail for issue in result.issues]}")
+    return result
+
+
+@dataclass
+class ChatCompletionOutcome:
+    """Câu trả lời đã verify của một lượt chat (dùng chung giữa các lượt chat được gộp)"""
+    message: str
+    finish_reason: Optional[str] = None
+    tokens_used: Optional[int] = None
+    valid: bool = True
+
+
+async def cached_completion(cache_key: str) -> Optional[ChatCompletionOutcome]:
+    """Câu trả lời trong response cache dạng ChatCompletionOutcome (None nếu chưa có)"""
+    cached = await get_response_cache().get(cache_key)
+    if not cached:
+        return None
+    return ChatCompletionOutcome(cached["message"], cached.get("finish_reason"))
+
+
+async def complete_chat_turn(llm: AsyncLLMProvider, turn: ChatTurn) -> ChatCompletionOutcome:
+    """
+    Gọi Groq cho một lượt chat + verify với catalog snapshot (re-generate trong retry budget),
+    cache câu trả lời hợp lệ của câu hỏi catalog
+    """
+    completion = await llm.groq_chat_completion(
+        model=turn.model,
+        messages=turn.messages_for_api,
+        max_tokens=turn.max_tokens,
+        temperature=turn.temperature
+    )
+    get_prompt_metrics().record_usage(getattr(completion, 'usage', None))
+    
+    # Extract response
+    response_message = completion.choices[0].message.content
+    
+    # VERIFICATION: kiểm tra local với catalog snapshot; lỗi nhỏ được sửa tại chỗ, chỉ lỗi
+    # nghiêm trọng ở câu hỏi về giá mới re-generate (trong retry budget, correction prompt ngắn)
+    # Verifier chạy trong thread (CPU) như /chat/stream
+    verification = await asyncio.to_thread(verify_chat_answer, turn, response_message)
+    verifier_metrics = get_answer_verifier_metrics()
+    retries = 0
+    while (verification is not None and not verification.valid and is_price_sensitive(turn.intent)
+           and retries < ANSWER_VERIFIER_MAX_RETRIES and verifier_metrics.try_acquire_retry()):
+        retries += 1
+        correction = AnswerVerifier(turn.retrieval.catalog).correction_prompt(verification, turn.intent)
+        print(f"[VERIFIER] Re-generating response (retry {retries}/{ANSWER_VERIFIER_MAX_RETRIES})")
+        try:
+            completion = await llm.groq_chat_completion(
+                model=turn.model,
+                messages=turn.messages_for_api + [
+                    {"role": "assistant", "content": response_message},
+                    {"role": "system", "content": correction}
+                ],
+                max_tokens=turn.max_tokens,
+                temperature=0.1  # Lower temperature for stricter adherence
+            )
+        except LLMOverloadedError:
+            # Quá tải: giữ câu trả lời đầu (đã sửa giá), không cache vì còn lỗi
+            print("[VERIFIER] Retry skipped - LLM scheduler overloaded")
+            break
+        get_prompt_metrics().record_usage(getattr(completion, 'usage', None))
+        response_message = completion.choices[0].message.content
+        verification = await asyncio.to_thread(verify_chat_answer, turn, response_message)
+        verifier_metrics.record_retry_outcome(verification)
+    if verification is not None:
+        response_message = verification.text
+    
+    finish_reason = completion.choices[0].finish_reason if hasattr(completion.choices[0], 'finish_reason') else None
+    valid = verification is None or verification.valid
+    if turn.cache_key and finish_reason == "stop" and valid:
+        await get_response_cache().set(turn.cache_key, response_message, turn.model, finish_reason)
+    
+    return ChatCompletionOutcome(
+        message=response_message,
+        finish_reason=finish_reason,
+        tokens_used=completion.usage.total_tokens if hasattr(completion, 'usage') else None,
+        valid=valid
+    )
+
+
+async def save_assistant_message(redis_svc: AsyncRedisChatService, session_id: str, user_id: str,
+                                 content: str, model: str) -> str:
+    """Lưu response của AI vào Redis, trả về timestamp của response"""
+    response_time = datetime.now().isoformat()
+    await redis_svc.save_message(
+        session_id=session_id,
+        user_id=user_id,
+        role="assistant",
+        content=content,
+        model=model,
+        timestamp=response_time
+    )
+    return response_time
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format một Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_chat_events(
+    llm: AsyncLLMProvider,
+    model: str,
+    messages: List[Dict[str, str]],
+    max_tokens: int,
+    temperature: float,
+    finalize: Callable[[str, Optional[str], Optional[int]], Awaitable[ChatResponse]]
+) -> AsyncIterator[str]:
+    """
+    Gọi Groq với stream=True và phát token dưới dạng SSE
+    
+    Events:
+        token: {"content": "..."} cho mỗi delta
+        done: ChatResponse đầy đủ (actions, suggestions...) sau khi đã lưu Redis
+        error: {"detail": "..."} nếu Groq lỗi giữa chừng
+               (+ "retry_after" nếu LLM scheduler từ chối vì quá tải)
+    
+    Args:
+        finalize: Async callback (response_message, finish_reason, tokens_used) -> ChatResponse,
+                  await sau khi stream kết thúc (lưu Redis + post-processing trong thread pool)
+    """
+    chunks = []
+    finish_reason = None
+    tokens_used = None
+    try:
+        async for chunk in llm.groq_chat_stream(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        ):
+            # Groq gửi usage ở chunk cuối qua x_groq
+            x_groq = getattr(chunk, 'x_groq', None)
+            if x_groq is not None and getattr(x_groq, 'usage', None) is not None:
+                tokens_used = x_groq.usage.total_tokens
+                get_prompt_metrics().record_usage(x_groq.usage)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta.content if choice.delta else None
+            if delta:
+                chunks.append(delta)
+                yield _sse_event("token", {"content": delta})
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+    except LLMOverloadedError as e:
+        print(f"[CHAT STREAM ERROR] {e}")
+        yield _sse_event("error", {"detail": "Hệ thống đang quá tải, vui lòng thử lại sau.",
+                                   "retry_after": e.retry_after})
+        return
+    except Exception as e:
+        print(f"[CHAT STREAM ERROR] {e}")
+        yield _sse_event("error", {"detail": f"Error calling Groq API: {str(e)}"})
+        return
+    
+    try:
+        response = await finalize("".join(chunks), finish_reason, tokens_used)
+        yield _sse_event("done", response.model_dump())
+    except Exception as e:
+        print(f"[CHAT STREAM ERROR] Post-processing failed: {e}")
+        yield _sse_event("error", {"detail": f"Error finalizing response: {str(e)}"})
+
+
+async def cached_chat_events(
+    cached: Dict[str, Any],
+    finalize: Callable[[str, Optional[str], Optional[int]], Awaitable[ChatResponse]]
+) -> AsyncIterator[str]:
+    """Phát câu trả lời từ response cache theo cùng format SSE với stream_chat_events"""
+    yield _sse_event("token", {"content": cached["message"]})
+    try:
+        response = await finalize(cached["message"], cached.get("finish_reason"), None)
+        yield _sse_event("done", response.model_dump())
+    except Exception as e:
+        print(f"[CHAT STREAM ERROR] Post-processing failed: {e}")
+        yield _sse_event("error", {"detail": f"Error finalizing response: {str(e)}"})
+
+
+async def shared_chat_events(
+    flight_key: str,
+    stream_events: Callable[[], AsyncIterator[str]],
+    respond: Callable[[str, Optional[str], Optional[int]], Awaitable[ChatResponse]],
+    outcomes: List[ChatCompletionOutcome]
+) -> AsyncIterator[str]:
+    """
+    Stream câu hỏi catalog qua single-flight: nếu câu trả lời giống hệt đang được tạo
+    (stream hoặc /chat khác) thì chờ và phát như cache hit, nếu không thì stream và
+    chia sẻ câu trả lời (đã verify, lấy từ `outcomes`) cho các lượt chat đến sau
+    """
+    single_flight = get_single_flight()
+    future = single_flight.inflight(flight_key)
+    if future is not None:
+        try:
+            outcome = await single_flight.follow(flight_key, future)
+        except Exception as e:
+            print(f"[CHAT STREAM ERROR] {e}")
+            yield _sse_event("error", {"detail": f"Error calling Groq API: {str(e)}"})
+            return
+        if outcome is not None:
+            print("[CHAT STREAM] Coalesced with in-flight completion")
+            async for event in cached_chat_events({"message": outcome.message, "finish_reason": outcome.finish_reason}, respond):
+                yield event
+            return
+    
+    # Đăng ký leader khi generator thực sự chạy -> finally luôn trả kết quả cho follower
+    future = single_flight.begin(flight_key)
+    try:
+        async for event in stream_events():
+            yield event
+    finally:
+        single_flight.finish(flight_key, future, outcomes[-1] if outcomes else None)
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # Tắt buffering của nginx để token tới client ngay
+}
+
+
+@router.post("/chat", tags=["Groq Chat"], dependencies=[Depends(user_rate_limit(GROUP_CHAT))])
 async def chat(
     request: ChatRequest,
     authorization: Optional[str] = Header(None, alias="Authorization"),
-    client: Groq = Depends(get_groq_client)
+    llm: AsyncLLMProvider = Depends(get_llm)
 ) -> ChatResponse:
     """
     Send a message to Groq AI and get response with Redis persistence linked to user
@@ -580,766 +1309,59 @@ async def chat(
         ```
     """
     try:
-        # Validate JWT token and get authenticated user
-        auth_user = get_authenticated_user(authorization)
-        print(f"[CHAT] Authorization header present: {authorization is not None}")
-        if authorization:
-            print(f"[CHAT] Authorization header starts with: {authorization[:20]}...")
-        print(f"[CHAT] Auth user: {auth_user}")
-        
-        # Generate or use provided session_id
-        session_id = request.session_id or f"session-{datetime.now().timestamp()}"
-        
-        # Determine user_id: use authenticated user if available, otherwise from request or anonymous
-        if auth_user:
-            authenticated_user_id = auth_user["user_id"]
-            print(f"[CHAT] Authenticated user ID: {authenticated_user_id} (type: {type(authenticated_user_id)})")
-            # Always use user_X format for ChromaDB
-            user_id = f"user_{authenticated_user_id}"
-            print(f"[CHAT] Final user_id for ChromaDB: {user_id}")
-            
-            # If request.user_id is provided and doesn't match authenticated user, reject
-            if request.user_id and str(request.user_id) != str(authenticated_user_id):
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"User ID mismatch. Cannot access data for other users."
-                )
-        else:
-            print("[CHAT] No authentication - using anonymous")
-            # No authentication - use provided user_id or anonymous
-            user_id = request.user_id or f"anonymous-{datetime.now().timestamp()}"
-            print(f"[CHAT] Anonymous user_id: {user_id}")
-        
-        # Get active modal config from admin
-        chroma_service = get_chat_ai_rag_service()
-        active_config = chroma_service.get_active_modal_config()
-        
-        # Use admin config if available, otherwise fallback to request model
-        if active_config:
-            model_to_use = active_config.get('model', request.model)
-            temperature = active_config.get('temperature', 0.7)
-            max_tokens = active_config.get('max_tokens', 1024)
-            system_prompt = active_config.get('system_prompt')
-        else:
-            model_to_use = request.model
-            temperature = 0.7
-            max_tokens = 1024
-            system_prompt = None
-        
-        # Get Redis service
-        redis_svc = get_redis()
-        
-        # Save user message to Redis with user association
-        user_msg_time = datetime.now().isoformat()
-        redis_svc.save_message(
-            session_id=session_id,
-            user_id=user_id,
-            role="user",
-            content=request.message,
-            model=model_to_use,
-            timestamp=user_msg_time
-        )
-        
-        # Get conversation context (last 4 messages only to stay under 8000 token limit)
-        context_messages = redis_svc.get_session_context(
-            session_id=session_id,
-            user_id=user_id,
-            limit=4  # Reduced to 4 to stay under 8000 token limit
-        )
+        turn = await prepare_chat_turn(request, authorization)
+        session_id = turn.session_id
+        user_id = turn.user_id
+        model_to_use = turn.model
+        redis_svc = turn.redis_svc
+        
+        # RESPONSE CACHE: câu hỏi catalog không có dữ liệu cá nhân -> bỏ qua lượt gọi Groq
+        cached = await get_response_cache().get(turn.cache_key) if turn.cache_key else None
+        if cached:
+            print(f"[CHAT] Response cache HIT for '{request.message[:50]}'")
+            response_message = cached["message"]
+            response_time = await save_assistant_message(redis_svc, session_id, user_id, response_message, model_to_use)
+            extras = await asyncio.to_thread(build_chat_extras, turn, request.message, response_message)
+            return ChatResponse(
+                message=response_message,
+                model=model_to_use,
+                timestamp=response_time,
+                tokens_used=None,
+                finish_reason=cached.get("finish_reason"),
+                **extras
+            )
         
-        # Get comprehensive context from ChromaDB (products + knowledge + user data + discounts)
-        print(f"[CHAT] Getting context for user_id: {user_id}")
-        combined_context = chroma_service.retrieve_combined_context_with_user(
-            user_id=user_id,
-            query=request.message,  # Use current message as query for relevant context
-            top_k_products=3,
-            top_k_knowledge=2,
-            top_k_user=2,
-            top_k_discounts=3  # Include discount context
-        )
-
-        # Get real cart data - Try ChromaDB first (synced data), fallback to Spring API
-        cart_context = chroma_service.get_user_cart_context(user_id)
-        if not cart_context:
-            # Fallback: Try to get directly from Spring API
-            cart_context = await get_real_cart_context(authorization)
-        if cart_context:
-            combined_context += cart_context
-        
-        # Get user orders if checking order intent
-        check_order_keywords = [
-            # Vietnamese with diacritics
-            'kiểm tra đơn hàng', 'đơn hàng của tôi', 'tra cứu đơn',
-            'xem đơn hàng', 'order của tôi', 'check order', 'my orders',
-            # Vietnamese without diacritics (common in typing)
-            'kiem tra don hang', 'don hang cua toi', 'tra cuu don',
-            'xem don hang', 'don hang cua minh', 'co don hang nao'
-        ]
-        # Also check for specific order number patterns: "don hang 30", "đơn hàng #30", "order 30"
-        import re
-        order_pattern = re.compile(r'(don\s*hang|đơn\s*hàng|order)\s*#?\s*(\d+)', re.IGNORECASE)
-        order_match = order_pattern.search(request.message.lower())
-        is_checking_order = any(kw in request.message.lower() for kw in check_order_keywords) or bool(order_match)
-        
-        if is_checking_order:
-            # Nếu hỏi về đơn hàng CỤ THỂ (có số) → query trực tiếp từ DB
-            if order_match:
-                specific_order_id = order_match.group(2)  # Extract order number
-                order_detail = chroma_service.get_order_by_id(specific_order_id, user_id)
-                combined_context += order_detail
-                print(f"[CHAT] Added specific order #{specific_order_id} detail for user {user_id}")
-            else:
-                # Hỏi chung về đơn hàng → lấy list compact
-                orders_context = chroma_service.get_user_orders(user_id, max_orders=3)
-                if orders_context:
-                    combined_context += orders_context
-                    print(f"[CHAT] Added orders context for user {user_id} (compact: 3 orders)")
-                else:
-                    print(f"[CHAT] No orders found for user {user_id}")
-        
-        # SMART TRUNCATE: Keep discounts and user info, truncate product details if needed
-        MAX_CONTEXT_CHARS = 6000  # Increased to preserve image URLs
-        if combined_context and len(combined_context) > MAX_CONTEXT_CHARS:
-            print(f"[CHAT] Context too long ({len(combined_context)} chars), smart truncating...")
-            
-            # Split context into sections
-            sections = combined_context.split('\n\n')
-            
-            # Identify important sections to keep
-            kept_sections = []
-            product_sections = []
-            
-            for section in sections:
-                section_lower = section.lower()
-                # Always keep: discounts, user info, analysis, user name, CART, ORDERS, IMAGE URLS
-                if any(kw in section_lower for kw in ['khuyến mãi', 'giảm giá', 'mã:', 'discount', 'thông tin người dùng', 'thông tin cá nhân', 'user', 'tên:', 'email:', 'phân tích yêu cầu', 'hướng dẫn tư vấn', 'giỏ hàng', 'cart', 'đơn hàng', 'order', 'lịch sử đơn']):
-                    kept_sections.append(section)
-                elif '🖼️' in section:
-                    # ALWAYS keep image URLs
-                    kept_sections.append(section)
-                elif 'sản phẩm' in section_lower or 'chi tiết' in section_lower:
-                    product_sections.append(section)
-                else:
-                    kept_sections.append(section)
-            
-            # Combine: important sections first, then as many product sections as fit
-            important_text = '\n\n'.join(kept_sections)
-            remaining_chars = MAX_CONTEXT_CHARS - len(important_text) - 100
-            
-            product_text = ''
-            for section in product_sections:
-                if len(product_text) + len(section) < remaining_chars:
-                    product_text += '\n\n' + section
-                else:
-                    break
-            
-            combined_context = important_text + product_text + "\n\n[... Đã rút gọn để tối ưu ...]"
-            print(f"[CHAT] Smart truncated to {len(combined_context)} chars")
-        print(f"[CHAT] Combined context length: {len(combined_context) if combined_context else 0}")
-        print(f"[CHAT] Combined context preview: {combined_context[:200] if combined_context else 'None'}")
-        
-        # Build enhanced system prompt with comprehensive context
-        base_system_prompt = """BẠN LÀ AI TƯ VẤN SẢN PHẨM THÔNG MINH CỦA BIZOPS AGENT
-
-═══════════════════════════════════════════════════════════════════
-🚨 QUY TẮC TUYỆT ĐỐI - VI PHẠM = RESPONSE BỊ TỪ CHỐI
-═══════════════════════════════════════════════════════════════════
-
-📋 BƯỚC 1: ĐỌC KỸ "🎯 PHÂN TÍCH YÊU CẦU KHÁCH HÀNG"
-- Xác định DANH MỤC khách cần (điện thoại, laptop, tai nghe...)
-- Xác định MỤC ĐÍCH sử dụng (gaming, văn phòng, chụp ảnh...)
-- Xác định NGÂN SÁCH (giá rẻ, cao cấp, tầm trung, khoảng giá cụ thể)
-
-📋 BƯỚC 2: TUÂN THEO "🤖 HƯỚNG DẪN TƯ VẤN CHO AI"
-- Nếu có "📌 Khách muốn GIÁ RẺ" → ĐỀ XUẤT SẢN PHẨM CÓ GIÁ THẤP NHẤT trong danh sách
-- Nếu có "📌 Khách muốn CAO CẤP" → ĐỀ XUẤT SẢN PHẨM CÓ GIÁ CAO NHẤT trong danh sách
-- Nếu có "📌 Khoảng giá X-Y" → CHỈ ĐỀ XUẤT sản phẩm trong khoảng giá đó
-- Nếu có "📌 Mục đích: gaming" → Ưu tiên sản phẩm có cấu hình mạnh, hiệu năng cao
-
-📋 BƯỚC 3: CHỌN SẢN PHẨM TỪ DANH SÁCH ĐÃ ĐƯỢC SORT
-- Danh sách sản phẩm đã được sắp xếp theo yêu cầu của khách
-- Sản phẩm đầu tiên thường là PHÙ HỢP NHẤT
-- Chọn 2-3 sản phẩm đầu để đề xuất
-
-✅ VÍ DỤ ĐÚNG:
-Query: "điện thoại giá rẻ"
-→ Đề xuất: Redmi Note 13 Pro (7.99M), Samsung Galaxy A54 (9.99M) - đây là 2 điện thoại RẺ NHẤT
-
-Query: "điện thoại cao cấp"  
-→ Đề xuất: iPhone 15 Pro Max (29.99M), Samsung S24 Ultra (27.99M) - đây là 2 điện thoại ĐẮT NHẤT
-
-❌ VÍ DỤ SAI:
-Query: "điện thoại giá rẻ"
-→ SAI: Đề xuất iPhone 15 Pro Max (29.99M) - vì đây là điện thoại ĐẮT, không phải rẻ!
-
-═══════════════════════════════════════════════════════════════════
-📌 CÁC QUY TẮC BỔ SUNG
-═══════════════════════════════════════════════════════════════════
-- CHỈ sử dụng sản phẩm có trong context, KHÔNG bịa ra sản phẩm
-- HIỂN THỊ HÌNH ẢNH sản phẩm bằng format: ![Tên](URL)
-
-📌 **QUY TẮC SO SÁNH SẢN PHẨM**:
-  🔴 KHI SO SÁNH 2+ SẢN PHẨM, sử dụng bảng markdown với FORMAT SAU:
-  
-  | Thông số | Sản phẩm 1 | Sản phẩm 2 | Sản phẩm 3 |
-  |----------|-----------|-----------|-----------|
-  | **📱 Tên** | [Tên SP1] | [Tên SP2] | [Tên SP3] |
-  | **💰 Giá** | X,XXX,XXX VNĐ | X,XXX,XXX VNĐ | X,XXX,XXX VNĐ |
-  | **💻 Chip** | [Chip info] | [Chip info] | [Chip info] |
-  | **🖥️ Màn hình** | [Display] | [Display] | [Display] |
-  | **📸 Camera** | [Camera] | [Camera] | [Camera] |
-  | **🔋 Pin** | [Battery] | [Battery] | [Battery] |
-  | **📦 Còn hàng** | XX chiếc | XX chiếc | XX chiếc |
-  | **🖼️ Ảnh** | ![](URL) | ![](URL) | ![](URL) |
-  
-  🔴 **BẮT BUỘC SAU BẢNG SO SÁNH:**
-  
-  ### 📊 Nhận xét & Đề xuất
-  
-  **Ưu điểm từng sản phẩm:**
-  - 🟢 **[Tên SP1]**: [2-3 ưu điểm nổi bật]
-  - 🟢 **[Tên SP2]**: [2-3 ưu điểm nổi bật]
-  
-  **Nhược điểm cần lưu ý:**
-  - 🔴 **[Tên SP1]**: [Nhược điểm so với SP2]
-  - 🔴 **[Tên SP2]**: [Nhược điểm so với SP1]
-  
-  **💡 Đề xuất của mình:**
-  - 👉 **Nếu [nhu cầu X]**: Nên chọn [SP Y] vì [lý do cụ thể]
-  - 👉 **Nếu [nhu cầu Z]**: Nên chọn [SP W] vì [lý do cụ thể]
-  - 👉 **Nếu [ngân sách ưu tiên]**: [SP rẻ hơn] tiết kiệm được [số tiền]đ
-  
-  ✅ ƯU ĐIỂM FORMAT NÀY:
-  - Dễ đọc, so sánh trực tiếp từng thông số
-  - Mỗi dòng = 1 thông số cụ thể
-  - Có nhận xét ưu/nhược điểm rõ ràng
-  - Đề xuất dựa trên nhu cầu khách hàng
-  
-  ❌ KHÔNG chỉ hiển thị bảng rồi kết thúc - phải có phần NHẬN XÉT & ĐỀ XUẤT
-
-📌 **QUY TẮC HIỂN THỊ THÔNG SỐ KỸ THUẬT**:
-  🔴 KHI HỎI "thông số chi tiết", "cấu hình", "specs":
-  1. Hiển thị ảnh: ![Tên](URL) - lấy URL sau 🖼️ trong context
-  2. Hiển thị BẢNG 2 cột với TẤT CẢ thông số từ "THÔNG SỐ KỸ THUẬT:" trong context:
-  
-  | 📋 Thông số | 📊 Chi tiết |
-  |------------|-------------|
-  | 💻 **Chip** | [processor] |
-  | 💾 **Bộ nhớ** | [storage] |
-  | 📱 **HĐH** | [os] |
-  | 🖥️ **Màn hình** | [Màn hình] |
-  | 📸 **Camera** | [Camera] |
-  | 🔋 **Pin** | [battery] |
-  | 🎨 **Màu** | [color] |
-  | 🌍 **Xuất xứ** | [origin] |
-  | 🛡️ **Bảo hành** | [warranty] |
-  
-  3. SAU BẢNG THÔNG SỐ, BẮT BUỘC THÊM:
-  
-  **💡 Đánh giá & Đề xuất:**
-  - **Điểm mạnh**: [2-3 ưu điểm nổi bật của sản phẩm này]
-  - **Phù hợp với**: [Đối tượng khách hàng phù hợp - gaming/văn phòng/chụp ảnh...]
-  
-  **🔄 Sản phẩm tương tự cùng phân khúc:**
-  - [Tên SP 1] - [Giá] - [1 điểm khác biệt]
-  - [Tên SP 2] - [Giá] - [1 điểm khác biệt]
-  - [Tên SP 3] - [Giá] - [1 điểm khác biệt]
-  
-  ⚠️ CHỈ GỢI Ý sản phẩm CÓ TRONG context, cùng danh mục, khoảng giá ±30%
-
-- ⚠️ **BẮT BUỘC HIỂN THỊ ẢNH TRONG BẢNG SO SÁNH**:
-  CÁCH LÀM (4 BƯỚC):
-  1. Tìm sản phẩm trong context
-  2. Tìm dòng có 🖼️ ngay bên dưới tên sản phẩm
-  3. COPY CHÍNH XÁC URL sau 🖼️
-  4. Dán vào cột Ảnh: ![](URL)
-  
-  VÍ DỤ: Context có "iPhone 15 Pro Max" và dòng "🖼️ https://storage.../iphone.jpg"
-  → Table: | iPhone 15 Pro Max | ... | ![](https://storage.../iphone.jpg) |
-  
-  LỖI: Bỏ qua ảnh hoặc dùng URL không có trong context
-- KẾT THÚC bằng đề xuất cuối cùng và lời hỏi thêm
-
-═══════════════════════════════════════════════════════════════════
-🛍️ FLOW MUA HÀNG HOÀN CHỈNH - TUÂN THỦ TUYỆT ĐỐI
-═══════════════════════════════════════════════════════════════════
-
-📌 **BƯỚC 1: KHÁCH NÓI MUA SẢN PHẨM**
-Khi khách nói: "mua [sản phẩm]", "cho tôi xem [sản phẩm]", "tôi muốn mua [sản phẩm]"
-
-✅ RESPONSE:
-```
-Tôi sẽ giúp [tên khách] mua [Tên sản phẩm đầy đủ] nhé!
-
-📦 **Sản phẩm**: [Tên đầy đủ]
-💰 **Giá**: [Giá]đ
-🖼️ ![Ảnh sản phẩm](URL)
-
-🔍 **Thông số nổi bật:**
-- [Spec 1]
-- [Spec 2]
-- [Spec 3]
-
-❓ [Tên khách] muốn mua bao nhiêu chiếc?
-```
-
-📌 **BƯỚC 2: KHÁCH TRẢ LỜI SỐ LƯỢNG**
-Khi khách nói: "2 chiếc", "3 cái", "1 máy", "5"
-
-✅ RESPONSE:
-```
-Tuyệt vời! Để tôi tính toán cho [tên khách]:
-
-📦 **Sản phẩm**: [Tên sản phẩm]
-🔢 **Số lượng**: [X] chiếc
-💰 **Đơn giá**: [Giá]đ/chiếc
-💵 **Tổng tiền**: [Tổng]đ
-
-🎁 [Tên khách] có muốn sử dụng mã giảm giá không?
-Chúng tôi có các mã sau:
-[Hệ thống sẽ tự động hiển thị nút 🎫 Áp mã cho từng mã]
-```
-
-📌 **BƯỚC 3A: KHÁCH CHỌN MÃ GIẢM GIÁ**
-✅ RESPONSE:
-```
-Tuyệt vời! Mã [CODE] đã được áp dụng:
-
-📦 **Sản phẩm**: [Tên] x [SL]
-💰 **Tổng tiền gốc**: [Tổng gốc]đ
-🎫 **Mã giảm giá**: [CODE] (-[%]%)
-💵 **Giảm giá**: -[Số tiền]đ
-━━━━━━━━━━━━━━━━━━━━
-✅ **Tổng thanh toán**: [Tổng sau giảm]đ
-
-💳 [Tên khách] có muốn thanh toán ngay không?
-```
-
-📌 **BƯỚC 3B: KHÁCH BỎ QUA MÃ**
-✅ RESPONSE:
-```
-Được rồi! Tổng đơn hàng của [tên khách]:
-
-📦 **Sản phẩm**: [Tên] x [SL]
-💵 **Tổng thanh toán**: [Tổng]đ
-
-💳 [Tên khách] có muốn thanh toán ngay không?
-```
-
-📌 **BƯỚC 4: KHÁCH XÁC NHẬN THANH TOÁN**
-Khi khách nói: "có", "thanh toán", "đồng ý", hoặc click nút "💳 Thanh toán ngay"
-
-✅ RESPONSE:
-```
-Đã thêm [X] [Tên sản phẩm] vào giỏ hàng[với mã giảm giá CODE]!
-
-📦 **Sản phẩm**: [Tên] x [SL]
-[🎫 **Mã giảm giá**: CODE]
-💵 **Tổng thanh toán**: [Tổng]đ
-
-👇 Vui lòng nhấn nút bên dưới để hoàn tất đơn hàng.
-[Hệ thống sẽ hiển thị nút: 💳 Đi tới trang thanh toán]
-```
-
-⚠️ **LƯU Ý QUAN TRỌNG:**
-- KHÔNG tự động thêm vào giỏ cho đến khi khách XÁC NHẬN thanh toán
-- LUÔN HỎI số lượng trước khi tính tiền
-- LUÔN TÍNH TOÁN và hiển thị tổng tiền trước khi hỏi thanh toán
-- LUÔN ĐỀ XUẤT mã giảm giá nếu có
-- CHỈ nói "đã thêm vào giỏ" KHI KHÁCH XÁC NHẬN thanh toán
-
-🛒 HỆ THỐNG HỖ TRỢ CÁC HÀNH ĐỘNG SAU:
-- Khi khách muốn THÊM VÀO GIỎ HÀNG → Hệ thống sẽ hiển thị nút action để thêm
-- Khi khách hỏi MÃ GIẢM GIÁ → Hệ thống sẽ hiển thị nút áp mã
-- Khi khách muốn ĐẶT HÀNG → Hệ thống sẽ hiển thị popup xác nhận
-
-⚠️ QUY TẮC TUYỆT ĐỐI VỀ ĐẶT HÀNG:
-❌ KHÔNG BAO GIỜ nói: "Đơn hàng đã được xác nhận", "Đang xử lý thanh toán", "Đã đặt hàng thành công"
-❌ KHÔNG BAO GIỜ nói: "Hệ thống đang tiến hành...", "Đơn hàng đã hoàn tất"
-✅ CHỈ ĐƯỢC nói: "Vui lòng nhấn nút 'Tạo đơn hàng' bên dưới để xác nhận"
-✅ CHỈ ĐƯỢC nói: "Hãy click vào nút đặt hàng xuất hiện bên dưới"
-
-⚠️ ĐẶC BIỆT CHÚ Ý VỀ GIỎ HÀNG:
-- Chỉ trả lời về nội dung giỏ hàng DỰA TRÊN thông tin "=== GIỎ HÀNG THỰC TẾ CỦA KHÁCH ===".
-- Nếu không có thông tin này, nói rằng bạn không thể xem giỏ hàng của khách.
-- KHÔNG BAO GIỜ tự bịa ra sản phẩm đang có trong giỏ.
-
-═══════════════════════════════════════════════════════════════════
-📦 XEM CHI TIẾT ĐƠN HÀNG
-═══════════════════════════════════════════════════════════════════
-
-🔴 KHI KHÁCH HỎI "đơn hàng #X", "xem đơn X", "kiểm tra đơn X":
-✅ CHỈ HIỂN THỊ thông tin đơn hàng, KHÔNG đề xuất sản phẩm khác
-✅ CHỈ HIỂN THỊ trạng thái, sản phẩm, tổng tiền, ngày đặt
-**Format ngắn gọn:**
-```
-📦 Đơn hàng #[ID]
-- Trạng thái: [Status emoji + text]
-- Sản phẩm: [Tên] (x[SL])
-- Tổng tiền: [Amount]đ
-- Ngày đặt: [Date]
-
-[Nếu PENDING/SHIPPING]: Đơn đang được xử lý, bạn cần hỗ trợ gì thêm?
-[Nếu DELIVERED]: Đơn đã giao thành công!
-[Nếu CANCELLED]: Đơn đã bị hủy.
-```
-
-═══════════════════════════════════════════════════════════════════
-⚠️ EDGE CASES CẦN XỬ LÝ
-═══════════════════════════════════════════════════════════════════
-
-🔴 **SẢN PHẨM HẾT HÀNG:**
-```
-Rất tiếc, [Tên sản phẩm] hiện đang hết hàng.
-📦 Tồn kho: 0 chiếc
-
-🔄 Bạn có muốn xem sản phẩm tương tự không?
-```
-
-🔴 **SỐ LƯỢNG VƯỢT QUÁ TỒN KHO:**
-```
-Xin lỗi, chúng tôi chỉ còn [X] chiếc [Tên sản phẩm].
-❓ Bạn có muốn mua [X] chiếc không?
-```
-
-🔴 **MÃ GIẢM GIÁ HẾT HẠN:**
-```
-Mã [CODE] đã hết hạn sử dụng.
-🎁 Bạn có muốn xem các mã khác không?
-```"""
-
-        # Check if we have user-specific context
-        has_user_context = combined_context and combined_context != "No relevant context found.No user-specific context found."
-
-        if has_user_context:
-            # Extract user name for personalization
-            user_name = "bạn"
-            if "Tên:" in combined_context:
-                # Try to extract name from new format
-                name_start = combined_context.find("Tên:") + 4
-                name_end = combined_context.find("\n", name_start)
-                if name_end > name_start:
-                    extracted_name = combined_context[name_start:name_end].strip()
-                    print(f"[CHAT] Extracted user name: '{extracted_name}'")
-                    if extracted_name and extracted_name != "N/A" and extracted_name != "":
-                        user_name = extracted_name
-            elif "Name:" in combined_context:
-                # Fallback to old format
-                name_start = combined_context.find("Name:") + 6
-                name_end = combined_context.find("\n", name_start)
-                if name_end > name_start:
-                    extracted_name = combined_context[name_start:name_end].strip()
-                    if extracted_name and extracted_name != "N/A" and extracted_name != "":
-                        user_name = extracted_name
-
-            enhanced_system_prompt = f"""{base_system_prompt}
-
-TƯ VẤN CHO: {user_name}
-
-DỮ LIỆU:
-{combined_context}
-
-QUY TẮC BẮT BUỘC:
-1. LUÔN BẮT ĐẦU bằng: "Xin chào {user_name}! 👋 Giới thiểụ bản thân và nhiệm vụ"
-2. LUÔN GỌI TÊN "{user_name}" trong mọi tin nhắn, KHÔNG dùng từ "bạn"
-3. Đề xuất 2-3 sản phẩm PHÙ HỢP NHẤT từ danh sách đã được sort
-4. Hiển thị ảnh: ![Tên](URL) - CHỈ dùng URL có trong dữ liệu
-5. ⚠️ **CHÍNH XÁC TÊN SẢN PHẨM**: Khi đề xuất, PHẢI COPY CHÍNH XÁC tên từ context
-   - VÍ DỤ: Context có "Lenovo IdeaPad 3" → Viết "Lenovo IdeaPad 3" (KHÔNG viết "IdeaPad 15" hay thêm số khác)
-   - TUYỆT ĐỐI KHÔNG được tự bịa, sửa, hay thêm bớt tên sản phẩm
-6. ⚠️ BẢNG PHẢI CÓ ẢNH: Format | Sản phẩm | Giá | Sẵn có | Khả năng | Ảnh | - Mỗi dòngl phải có ![](URL) ở cột Ảnh. Tìm URL trong context sau icon 🖼️
-7. KHÔNG bịa sản phẩm hoặc mã giảm giá
-8. Kết thúc ngắn gọn, KHÔNG gợi ý thêm (hệ thống tự động hiển thị gợi ý)"""
+        # Call Groq API with full conversation context - câu hỏi catalog giống hệt đang chạy
+        # đồng thời (cùng cache key) dùng chung một call LLM qua single-flight; cache key chỉ có
+        # ở lượt không có history / summary nên không gộp completion của các hội thoại khác nhau
+        if turn.cache_key:
+            completion = await get_single_flight().do(
+                make_key("completion", turn.cache_key),
+                lambda: complete_chat_turn(llm, turn),
+                remote_result=lambda: cached_completion(turn.cache_key)
+            )
         else:
-            enhanced_system_prompt = f"""{base_system_prompt}
-
-Bạn đang tư vấn cho khách hàng chưa có thông tin cá nhân. Hãy tập trung vào tư vấn sản phẩm dựa trên thông tin có sẵn và hỏi thêm về nhu cầu của họ để tư vấn tốt hơn.
-
-**Phong cách tư vấn:**
-- Lịch sự, chuyên nghiệp, thân thiện
-- Cung cấp thông tin chính xác về sản phẩm
-- Hỏi về nhu cầu cụ thể để tư vấn phù hợp
-- Hướng dẫn quy trình mua hàng rõ ràng"""
-        
-        # Build messages list with full context
-        messages_for_api = []
-        
-        # Add enhanced system prompt
-        messages_for_api.append({
-            "role": "system",
-            "content": enhanced_system_prompt
-        })
-        
-        # Add previous messages as context
-        for msg in context_messages:
-            messages_for_api.append({
-                "role": msg.get('role', 'user'),
-                "content": msg.get('content', '')
-            })
-        
-        # Call Groq API with full conversation context
-        completion = client.chat.completions.create(
-            model=model_to_use,
-            messages=messages_for_api,
-            max_tokens=max_tokens,
-            temperature=temperature
-        )
-        
-        # Extract response
-        response_message = completion.choices[0].message.content
-        response_time = datetime.now().isoformat()
-        
-        # VALIDATION: Check if response follows filtering rules
-        if request.message.lower().find("giá rẻ") != -1 or request.message.lower().find("rẻ") != -1:
-            validation_result = validate_price_filtering_response(response_message, combined_context)
-            if not validation_result["valid"]:
-                print(f"[VALIDATION FAILED] {validation_result['reason']}")
-                # Force regenerate with stricter prompt
-                messages_for_api.append({
-                    "role": "system", 
-                    "content": "CANH BAO: Response truoc do VI PHAM QUY TAC. CHI SU DUNG CAC SAN PHAM TRONG CONTEXT DUOI DAY:\n" + combined_context
-                })
-                # Retry with validation override
-                completion = client.chat.completions.create(
-                    model=model_to_use,
-                    messages=messages_for_api,
-                    max_tokens=max_tokens,
-                    temperature=0.1  # Lower temperature for stricter adherence
-                )
-                response_message = completion.choices[0].message.content
+            completion = await complete_chat_turn(llm, turn)
+        response_message = completion.message
+        finish_reason = completion.finish_reason
         
         # Save assistant response to Redis with user association
-        redis_svc.save_message(
-            session_id=session_id,
-            user_id=user_id,
-            role="assistant",
-            content=response_message,
-            model=model_to_use,
-            timestamp=response_time
-        )
-
-        # Generate smart suggestions based on context
-        suggestions = []
-        query_lower = request.message.lower()
-        
-        # Category-based suggestions
-        if 'điện thoại' in query_lower or 'phone' in query_lower:
-            suggestions = [
-                "So sánh điện thoại giá rẻ và cao cấp",
-                "Điện thoại chơi game tốt nhất",
-                "Điện thoại chụp ảnh đẹp dưới 15 triệu",
-                "Xem mã giảm giá điện thoại"
-            ]
-        elif 'laptop' in query_lower or 'macbook' in query_lower:
-            suggestions = [
-                "Laptop văn phòng giá rẻ",
-                "So sánh MacBook và laptop Windows",
-                "Laptop gaming dưới 25 triệu",
-                "Xem khuyến mãi laptop"
-            ]
-        elif 'tai nghe' in query_lower or 'headphone' in query_lower or 'airpods' in query_lower:
-            suggestions = [
-                "Tai nghe chống ồn tốt nhất",
-                "So sánh AirPods và Sony",
-                "Tai nghe bluetooth giá rẻ",
-                "Xem tất cả tai nghe"
-            ]
-        elif 'apple' in query_lower:
-            suggestions = [
-                "So sánh các sản phẩm Apple",
-                "Phụ kiện Apple chính hãng",
-                "Chương trình trade-in Apple",
-                "Xem mã giảm giá Apple"
-            ]
-        elif 'giá rẻ' in query_lower or 'rẻ' in query_lower:
-            suggestions = [
-                "Xem thêm sản phẩm giá rẻ",
-                "Sản phẩm dưới 5 triệu",
-                "Khuyến mãi hot hôm nay",
-                "Tư vấn theo ngân sách cụ thể"
-            ]
-        elif 'cao cấp' in query_lower or 'premium' in query_lower:
-            suggestions = [
-                "Sản phẩm flagship mới nhất",
-                "So sánh các dòng cao cấp",
-                "Chính sách bảo hành VIP",
-                "Xem ưu đãi premium"
-            ]
-        else:
-            # Default suggestions
-            suggestions = [
-                "Xem điện thoại hot nhất",
-                "Laptop bán chạy",
-                "Tai nghe được yêu thích",
-                "Khuyến mãi đang có"
-            ]
+        response_time = await save_assistant_message(redis_svc, session_id, user_id, response_message, model_to_use)
         
-        # Detect action intents from user message AND AI response
-        actions = []
-        try:
-            import re
-            # Get products list for action detection
-            chroma_service = get_chat_ai_rag_service()
-            products_for_action = []
-            discounts_for_action = []
-            
-            # Get products from ChromaDB
-            product_collection = chroma_service._get_or_create_product_collection()
-            all_products = product_collection.get(limit=50, include=['metadatas'])
-            if all_products and all_products.get('metadatas'):
-                for meta in all_products['metadatas']:
-                    products_for_action.append({
-                        'id': int(meta.get('product_id', 0)),
-                        'name': meta.get('product_name', ''),
-                        'price': meta.get('price', 0)
-                    })
-            
-            # Get discounts mentioned in AI response
-            discount_context = chroma_service.retrieve_discount_context(request.message, top_k=5)
-            
-            # Extract discount codes from AI response OR context
-            discount_codes_in_response = re.findall(r'(?:GADGET|SAVE|BLACK|WELCOME|LOYAL|FLASH|HOT|VIP)\w*', response_message.upper())
-            discount_codes_in_context = re.findall(r'MÃ: (\w+)', discount_context) if discount_context else []
-            
-            # Combine and deduplicate
-            all_discount_codes = list(set(discount_codes_in_response + discount_codes_in_context))
-            
-            for code in all_discount_codes[:4]:  # Max 4 discount buttons
-                discounts_for_action.append({
-                    'code': code,
-                    'description': f'Áp dụng mã {code}'
-                })
-            
-            # Detect user intent actions
-            actions = detect_action_intent(request.message, products_for_action, discounts_for_action, response_message)
-            
-            # Also detect products mentioned in AI response and add cart buttons
-            response_lower = response_message.lower()
-            
-            # Keywords indicating AI is suggesting to add to cart
-            suggesting_buy = any(kw in response_lower for kw in ['thêm vào giỏ', 'muốn mua', 'muốn đặt', 'đặt hàng', 'mua ngay'])
-            
-            for product in products_for_action:
-                product_name = product.get('name', '').lower()
-                if not product_name or len(product_name) < 3:
-                    continue
-                    
-                # Check if product name words appear in response
-                name_words = product_name.split()
-                # Match if at least 2 significant words match (for multi-word names)
-                significant_words = [w for w in name_words if len(w) > 2]
-                if significant_words:
-                    matches = sum(1 for w in significant_words if w in response_lower)
-                    is_mentioned = matches >= min(2, len(significant_words))
-                else:
-                    is_mentioned = product_name in response_lower
-                
-                if is_mentioned or (suggesting_buy and len(products_for_action) <= 3):
-                    # Check if we already have this product action
-                    already_added = any(a.get('productId') == product.get('id') for a in actions)
-                    if not already_added:
-                        actions.append({
-                            "type": "ADD_TO_CART",
-                            "productId": product.get('id'),
-                            "productName": product.get('name'),
-                            "price": product.get('price'),
-                            "quantity": 1,
-                            "label": f"🛒 Thêm {product.get('name')} vào giỏ"
-                        })
-            
-            # If discounts were shown in response, add discount buttons
-            # But SKIP if checking order history (to avoid confusion with past orders)
-            if discounts_for_action and ('mã giảm' in response_lower or 'khuyến mãi' in response_lower or 'giảm giá' in response_lower) and not is_checking_order:
-                # SPECIAL CASE: Detect if AI is asking about applying discount AFTER confirming quantity
-                # Pattern: "Số lượng: X chiếc" OR "x2" OR "2 chiếc" + has product in response
-                import re
-                
-                # Try multiple patterns to extract quantity
-                quantity_match = (
-                    re.search(r'(?:số lượng|quantity)[:\s]*(\d+)', response_lower) or
-                    re.search(r'x\s*(\d+)', response_lower) or
-                    re.search(r'(\d+)\s*(?:chiếc|cái|sản phẩm)', response_lower)
-                )
-                
-                pending_product_id = None
-                pending_product_info = None
-                pending_quantity = 1
-                
-                print(f"[CHAT] Discount detection - quantity_match: {quantity_match}, products: {len(products_for_action)}")
-                print(f"[CHAT] Response snippet: {response_lower[:200]}")
-                
-                # If we found quantity and have products, try to match product
-                if quantity_match and products_for_action:
-                    pending_quantity = int(quantity_match.group(1))
-                    print(f"[CHAT] Extracted quantity: {pending_quantity}")
-                    
-                    # Strategy 1: Find product mentioned in response
-                    for product in products_for_action:
-                        product_name_lower = product.get('name', '').lower()
-                        if product_name_lower and product_name_lower in response_lower:
-                            pending_product_id = product.get('id')
-                            pending_product_info = product  # Store full product info
-                            print(f"[CHAT] Found pending product by name match: {product.get('name')} (ID: {pending_product_id}, Price: {product.get('price')})")
-                            break
-                    
-                    # Strategy 2: If only 1 product in context, use it
-                    if not pending_product_id and len(products_for_action) == 1:
-                        pending_product_id = products_for_action[0].get('id')
-                        pending_product_info = products_for_action[0]  # Store full product info
-                        print(f"[CHAT] Using single product in context: {products_for_action[0].get('name')} (ID: {pending_product_id}, Price: {products_for_action[0].get('price')})")
-                
-                for discount in discounts_for_action:
-                    # Check if we already have this discount action
-                    already_added = any(a.get('discountCode') == discount.get('code') for a in actions)
-                    if not already_added:
-                        discount_action = {
-                            "type": "APPLY_DISCOUNT",
-                            "discountCode": discount.get('code'),
-                            "description": discount.get('description'),
-                            "label": f"🎫 Áp mã {discount.get('code')}"
-                        }
-                        # Add pending product context if detected
-                        if pending_product_id and pending_product_info:
-                            discount_action["pendingProductId"] = pending_product_id
-                            discount_action["pendingQuantity"] = pending_quantity
-                            discount_action["pendingProductInfo"] = {
-                                "id": pending_product_info.get('id'),
-                                "name": pending_product_info.get('name'),
-                                "price": pending_product_info.get('price'),
-                                "imageUrl": pending_product_info.get('imageUrl')
-                            }
-                            print(f"[CHAT] Added pending context to discount button: productId={pending_product_id}, quantity={pending_quantity}, price={pending_product_info.get('price')}")
-                        else:
-                            print(f"[CHAT] No pending product detected for discount {discount.get('code')}")
-                        actions.append(discount_action)
-            
-            print(f"[CHAT] Detected {len(actions)} actions: {[a.get('type') for a in actions]}")
-        except Exception as action_error:
-            print(f"[CHAT] Action detection error: {action_error}")
-            actions = []
-        
-        # Extract inline products for display in chat
-        inline_products = extract_inline_products(products_for_action, request.message)
-        print(f"[CHAT] Extracted {len(inline_products)} inline products")
-        
-        # Extract orders list if checking orders
-        orders_list = []
-        if is_checking_order:
-            orders_list = chroma_service.get_user_orders_list(user_id, max_orders=10)
-            print(f"[CHAT] Extracted {len(orders_list)} orders for display")
+        # Suggestions, action buttons, inline products, orders (CPU, chạy trong thread như /chat/stream)
+        extras = await asyncio.to_thread(build_chat_extras, turn, request.message, response_message)
         
         return ChatResponse(
             message=response_message,
             model=model_to_use,
             timestamp=response_time,
-            tokens_used=completion.usage.total_tokens if hasattr(completion, 'usage') else None,
-            finish_reason=completion.choices[0].finish_reason if hasattr(completion.choices[0], 'finish_reason') else None,
-            suggestions=suggestions,
-            actions=actions if actions else None,
-            products=inline_products if inline_products else None,
-            orders=orders_list if orders_list else None
+            tokens_used=completion.tokens_used,
+            finish_reason=finish_reason,
+            **extras
         )
         
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         error_msg = str(e)
         print(f"[CHAT ERROR] {error_msg}")
@@ -1357,14 +1379,130 @@ Bạn đang tư vấn cho khách hàng chưa có thông tin cá nhân. Hãy tậ
         )
 
 
+@router.post("/chat/stream", tags=["Groq Chat"], dependencies=[Depends(user_rate_limit(GROUP_CHAT))])
+async def chat_stream(
+    request: ChatRequest,
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    llm: AsyncLLMProvider = Depends(get_llm)
+):
+    """
+    Streaming variant of /chat - trả token về client dưới dạng Server-Sent Events
+    
+    Retrieval và build prompt giống hệt /chat. Khi stream kết thúc, response được lưu
+    vào Redis và event cuối cùng `done` chứa ChatResponse đầy đủ (actions, suggestions...).
+    
+    Events: `token` ({"content"}), `done` (ChatResponse), `error` ({"detail"})
+    
+    Note: /chat có thể re-generate khi verifier phát hiện lỗi nghiêm trọng; với stream thì
+    token đã gửi tới client nên chỉ sửa response trong event `done` / Redis (giá sai, ghi chú
+    thứ tự giá) và không cache response còn lỗi.
+    """
+    try:
+        turn = await prepare_chat_turn(request, authorization)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"[CHAT STREAM ERROR] {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error preparing chat context: {str(e)}"
+        )
+    
+    cached = await get_response_cache().get(turn.cache_key) if turn.cache_key else None
+    outcomes: List[ChatCompletionOutcome] = []
+    
+    async def respond(response_message: str, finish_reason: Optional[str], tokens_used: Optional[int]) -> ChatResponse:
+        response_time = await save_assistant_message(turn.redis_svc, turn.session_id, turn.user_id, response_message, turn.model)
+        extras = await asyncio.to_thread(build_chat_extras, turn, request.message, response_message)
+        return ChatResponse(
+            message=response_message,
+            model=turn.model,
+            timestamp=response_time,
+            tokens_used=tokens_used,
+            finish_reason=finish_reason,
+            **extras
+        )
+    
+    def verify_response(response_message: str) -> Tuple[str, bool]:
+        # Response mới từ Groq: verify với catalog snapshot (CPU, chạy trong thread)
+        verification = verify_chat_answer(turn, response_message)
+        if verification is None:
+            return response_message, True
+        return verification.text, verification.valid
+    
+    async def finalize(response_message: str, finish_reason: Optional[str], tokens_used: Optional[int]) -> ChatResponse:
+        response_message, is_valid = await asyncio.to_thread(verify_response, response_message)
+        # Chỉ cache response hoàn chỉnh và qua verification
+        if turn.cache_key and is_valid and finish_reason == "stop":
+            await get_response_cache().set(turn.cache_key, response_message, turn.model, finish_reason)
+        outcomes.append(ChatCompletionOutcome(response_message, finish_reason, tokens_used, is_valid))
+        return await respond(response_message, finish_reason, tokens_used)
+    
+    def stream_events() -> AsyncIterator[str]:
+        return stream_chat_events(llm, turn.model, turn.messages_for_api, turn.max_tokens, turn.temperature, finalize)
+    
+    if cached:
+        print(f"[CHAT STREAM] Response cache HIT for '{request.message[:50]}'")
+        events = cached_chat_events(cached, respond)
+    elif turn.cache_key:
+        # Chỉ lượt không có history (cache key) - prompt giống hệt nhau giữa các user được gộp
+        flight_key = make_key("completion", turn.cache_key)
+        if get_single_flight().inflight(flight_key) is None:
+            # Từ chối trước khi mở stream (còn trả được 503 + Retry-After thay vì event lỗi)
+            get_llm_scheduler().check_admission(PROVIDER_GROQ, turn.model, PRIORITY_CHAT)
+        events = shared_chat_events(flight_key, stream_events, respond, outcomes)
+    else:
+        get_llm_scheduler().check_admission(PROVIDER_GROQ, turn.model, PRIORITY_CHAT)
+        events = stream_events()
+    
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
 
+SIMPLE_CHAT_MODEL = "openai/gpt-oss-20b"
 
-@router.post("/simple-chat", tags=["Groq Chat"])
+
+async def prepare_simple_chat(message: str, session_id: Optional[str], user_id: Optional[str]):
+    """
+    Giai đoạn trước LLM của /simple-chat và /simple-chat/stream
+    
+    Returns:
+        Tuple (session_id, user_id, redis_svc, messages_for_api)
+    """
+    # Generate or use provided session_id and user_id
+    session_id = session_id or f"session-{datetime.now().timestamp()}"
+    user_id = user_id or f"anonymous-{datetime.now().timestamp()}"
+    
+    # Get Redis service
+    redis_svc = get_redis()
+    
+    # Save user message to Redis with user association
+    user_msg_time = datetime.now().isoformat()
+    await redis_svc.save_message(
+        session_id=session_id,
+        user_id=user_id,
+        role="user",
+        content=message,
+        model=SIMPLE_CHAT_MODEL,
+        timestamp=user_msg_time
+    )
+    
+    # Conversation memory: rolling summary + lượt gần nhất trong CHAT_MEMORY_HISTORY_TOKENS
+    memory = await get_chat_memory().load(redis_svc, session_id, user_id)
+    messages_for_api = build_chat_messages(None, memory.messages, summary=memory.summary)
+    
+    return session_id, user_id, redis_svc, messages_for_api
+
+
+@router.post("/simple-chat", tags=["Groq Chat"], dependencies=[Depends(user_rate_limit(GROUP_CHAT))])
 async def simple_chat(
-    message: str,
+    message: str = Query(..., max_length=CHAT_AGENT_CONFIG.max_input_length),
     session_id: Optional[str] = None,
     user_id: Optional[str] = None,
-    client: Groq = Depends(get_groq_client)
+    llm: AsyncLLMProvider = Depends(get_llm)
 ) -> ChatResponse:
     """
     Simple chat endpoint with Redis persistence linked to user
@@ -1381,70 +1519,31 @@ async def simple_chat(
         POST /api/groq-chat/simple-chat?message=Hello&session_id=user-123&user_id=user-001
     """
     try:
-        # Generate or use provided session_id and user_id
-        session_id = session_id or f"session-{datetime.now().timestamp()}"
-        user_id = user_id or f"anonymous-{datetime.now().timestamp()}"
-        
-        # Get Redis service
-        redis_svc = get_redis()
-        
-        # Save user message to Redis with user association
-        user_msg_time = datetime.now().isoformat()
-        redis_svc.save_message(
-            session_id=session_id,
-            user_id=user_id,
-            role="user",
-            content=message,
-            model="openai/gpt-oss-20b",
-            timestamp=user_msg_time
-        )
-        
-        # Get conversation context (last 10 messages for context window)
-        context_messages = redis_svc.get_session_context(
-            session_id=session_id,
-            user_id=user_id,
-            limit=10
-        )
-        
-        # Build messages list with full context
-        messages_for_api = []
-        
-        # Add previous messages as context
-        for msg in context_messages:
-            messages_for_api.append({
-                "role": msg.get('role', 'user'),
-                "content": msg.get('content', '')
-            })
+        session_id, user_id, redis_svc, messages_for_api = await prepare_simple_chat(message, session_id, user_id)
         
         # Call Groq API with full conversation context
-        completion = client.chat.completions.create(
-            model="openai/gpt-oss-20b",
+        completion = await llm.groq_chat_completion(
+            model=SIMPLE_CHAT_MODEL,
             messages=messages_for_api,
             max_tokens=1024,
             temperature=0.7
         )
         
         response_message = completion.choices[0].message.content
-        response_time = datetime.now().isoformat()
         
         # Save assistant response to Redis with user association
-        redis_svc.save_message(
-            session_id=session_id,
-            user_id=user_id,
-            role="assistant",
-            content=response_message,
-            model="openai/gpt-oss-20b",
-            timestamp=response_time
-        )
+        response_time = await save_assistant_message(redis_svc, session_id, user_id, response_message, SIMPLE_CHAT_MODEL)
         
         return ChatResponse(
             message=response_message,
-            model="openai/gpt-oss-20b",
+            model=SIMPLE_CHAT_MODEL,
             timestamp=response_time,
             tokens_used=completion.usage.total_tokens if hasattr(completion, 'usage') else None,
             finish_reason=completion.choices[0].finish_reason if hasattr(completion.choices[0], 'finish_reason') else None
         )
         
+    except LLMOverloadedError:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -1452,11 +1551,56 @@ async def simple_chat(
         )
 
 
+@router.post("/simple-chat/stream", tags=["Groq Chat"], dependencies=[Depends(user_rate_limit(GROUP_CHAT))])
+async def simple_chat_stream(
+    message: str = Query(..., max_length=CHAT_AGENT_CONFIG.max_input_length),
+    session_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    llm: AsyncLLMProvider = Depends(get_llm)
+):
+    """
+    Streaming variant of /simple-chat (Server-Sent Events)
+    
+    Events: `token` ({"content"}), `done` (ChatResponse), `error` ({"detail"})
+    
+    Example:
+        POST /api/groq-chat/simple-chat/stream?message=Hello&session_id=user-123&user_id=user-001
+    """
+    try:
+        session_id, user_id, redis_svc, messages_for_api = await prepare_simple_chat(message, session_id, user_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error preparing chat context: {str(e)}"
+        )
+    
+    async def finalize(response_message: str, finish_reason: Optional[str], tokens_used: Optional[int]) -> ChatResponse:
+        response_time = await save_assistant_message(redis_svc, session_id, user_id, response_message, SIMPLE_CHAT_MODEL)
+        return ChatResponse(
+            message=response_message,
+            model=SIMPLE_CHAT_MODEL,
+            timestamp=response_time,
+            tokens_used=tokens_used,
+            finish_reason=finish_reason
+        )
+    
+    get_llm_scheduler().check_admission(PROVIDER_GROQ, SIMPLE_CHAT_MODEL, PRIORITY_CHAT)
+    return StreamingResponse(
+        stream_chat_events(llm, SIMPLE_CHAT_MODEL, messages_for_api, 1024, 0.7, finalize),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+
 @router.get("/user/{user_id}/history/{session_id}", tags=["Groq Chat"])
 async def get_session_history_isolated(
     user_id: str, 
     session_id: str, 
-    auth_user_id: Optional[str] = None
+    auth_user_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE),
+    newest_first: bool = False
 ) -> ChatHistoryResponse:
     """
     Get chat history for a specific user's session (ISOLATED BY USER)
@@ -1465,12 +1609,16 @@ async def get_session_history_isolated(
         user_id: User ID (path parameter)
         session_id: Session ID (path parameter)
         auth_user_id: Authenticated user ID (query param for validation) - REQUIRED
+        cursor: next_cursor của trang trước (phân trang)
+        limit: Số message mỗi trang - có cursor hoặc limit thì trả về một trang + next_cursor
+        newest_first: Trang đầu là các message mới nhất (lướt ngược lên)
     
     Returns:
         ChatHistoryResponse with messages from this user only
     
     Example:
         GET /api/groq-chat/user/user-001/history/session-123?auth_user_id=user-001
+        GET /api/groq-chat/user/user-001/history/session-123?auth_user_id=user-001&limit=50&newest_first=true
     """
     try:
         # REQUIRED: auth_user_id must be provided
@@ -1489,8 +1637,17 @@ async def get_session_history_isolated(
         
         redis_svc = get_redis()
         
-        # Get ONLY this user's messages from this session
-        messages = redis_svc.get_session_history(session_id, user_id)
+        # Get ONLY this user's messages from this session (một trang nếu có cursor / limit)
+        next_cursor = None
+        if cursor or limit:
+            try:
+                messages, next_cursor = await redis_svc.get_session_history_page(
+                    session_id, user_id, cursor, limit or CHAT_HISTORY_PAGE_SIZE, reverse=newest_first
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        else:
+            messages = await redis_svc.get_session_history(session_id, user_id)
         
         # Convert to response format
         history_messages = [
@@ -1507,7 +1664,8 @@ async def get_session_history_isolated(
             session_id=session_id,
             messages=history_messages,
             message_count=len(history_messages),
-            last_message_time=history_messages[-1].timestamp if history_messages else None
+            last_message_time=history_messages[-1].timestamp if history_messages else None,
+            next_cursor=next_cursor
         )
         
     except HTTPException:
@@ -1534,7 +1692,7 @@ async def get_active_sessions() -> SessionListResponse:
         redis_svc = get_redis()
         
         # Get all active sessions
-        sessions = redis_svc.get_all_sessions()
+        sessions = await redis_svc.get_all_sessions()
         
         return SessionListResponse(
             sessions=sessions,
@@ -1549,22 +1707,23 @@ async def get_active_sessions() -> SessionListResponse:
 
 
 @router.get("/user/{user_id}/sessions", tags=["Groq Chat"])
-async def get_user_sessions(user_id: str):
+async def get_user_sessions(user_id: str, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
     """
-    Get all session IDs for a specific user
+    Get session IDs for a specific user, most recent activity first
     
     Args:
         user_id: The user ID to retrieve sessions for
+        offset / limit: Phân trang (mặc định: tất cả)
     
     Returns:
         List of session IDs for the user
     
     Example:
-        GET /api/groq-chat/user/user-001/sessions
+        GET /api/groq-chat/user/user-001/sessions?limit=20
     """
     try:
         redis_svc = get_redis()
-        sessions = redis_svc.get_user_sessions(user_id)
+        sessions = await redis_svc.get_user_sessions(user_id, offset, limit)
         
         return {
             "user_id": user_id,
@@ -1578,6 +1737,36 @@ async def get_user_sessions(user_id: str):
         )
 
 
+async def stream_user_history(redis_svc: AsyncRedisChatService, user_id: str, sessions: List[str]) -> AsyncIterator[str]:
+    """
+    JSON của toàn bộ history (cùng format với get_user_full_history) ghi dần theo từng trang:
+    {"user_id", "sessions": [{"session_id", "message_count", "messages"}], "total_sessions", "total_messages"}
+    """
+    yield f'{{"user_id": {json.dumps(user_id, ensure_ascii=False)}, "sessions": ['
+    current_session = None
+    first_message = True
+    total_messages = 0
+    try:
+        async for session_id, message_count, messages in redis_svc.iter_user_history(user_id, sessions):
+            if session_id != current_session:
+                prefix = "]}, " if current_session is not None else ""
+                yield (f'{prefix}{{"session_id": {json.dumps(session_id, ensure_ascii=False)}, '
+                       f'"message_count": {message_count}, "messages": [')
+                current_session = session_id
+                first_message = True
+            if messages:
+                body = ", ".join(json.dumps(message, ensure_ascii=False) for message in messages)
+                yield body if first_message else f", {body}"
+                first_message = False
+                total_messages += len(messages)
+    except Exception as e:
+        # Header 200 đã gửi: kết thúc JSON hợp lệ với phần đã stream, ghi log lỗi
+        print(f"[Redis Error] User history stream interrupted for {user_id}: {e}")
+    if current_session is not None:
+        yield "]}"
+    yield f'], "total_sessions": {len(sessions)}, "total_messages": {total_messages}}}'
+
+
 @router.get("/user/{user_id}/history", tags=["Groq Chat"])
 async def get_user_full_history(user_id: str, auth_user_id: Optional[str] = None):
     """
@@ -1588,7 +1777,8 @@ async def get_user_full_history(user_id: str, auth_user_id: Optional[str] = None
         auth_user_id: The authenticated user's ID (via query param for security) - REQUIRED
     
     Returns:
-        Full history with all sessions and messages
+        Full history with all sessions and messages - JSON được stream theo từng trang message
+        (bộ nhớ server giữ ở mức một trang, kể cả với user có rất nhiều session)
     
     Example:
         GET /api/groq-chat/user/user-001/history?auth_user_id=user-001
@@ -1609,17 +1799,12 @@ async def get_user_full_history(user_id: str, auth_user_id: Optional[str] = None
             )
         
         redis_svc = get_redis()
-        history = redis_svc.get_user_full_history(user_id)
-        
-        if not history:
-            return {
-                "user_id": user_id,
-                "sessions": [],
-                "total_sessions": 0,
-                "total_messages": 0
-            }
+        sessions = await redis_svc.get_user_sessions(user_id)
         
-        return history
+        return StreamingResponse(
+            stream_user_history(redis_svc, user_id, sessions),
+            media_type="application/json"
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -1662,7 +1847,7 @@ async def get_session_context(user_id: str, session_id: str, limit: int = 20, au
             )
         
         redis_svc = get_redis()
-        messages = redis_svc.get_session_context(session_id, user_id, limit)
+        messages = await redis_svc.get_session_context(session_id, user_id, limit)
         
         return {
             "user_id": user_id,
@@ -1710,7 +1895,7 @@ async def clear_user_history(user_id: str, auth_user_id: Optional[str] = None):
             )
         
         redis_svc = get_redis()
-        redis_svc.clear_user_history(user_id)
+        await redis_svc.clear_user_history(user_id)
         
         return {
             "status": "success",
@@ -1763,7 +1948,7 @@ async def delete_session_history_isolated(
         redis_svc = get_redis()
         
         # Clear session (will use user-specific key internally)
-        redis_svc.clear_session(session_id, user_id)
+        await redis_svc.clear_session(session_id, user_id)
         
         return {
             "status": "success",
@@ -1783,42 +1968,9 @@ async def delete_session_history_isolated(
 
 @router.get("/admin/chat-stats")
 async def get_chat_stats():
-    """Get overall chat statistics for all users"""
+    """Get overall chat statistics for all users (counter duy trì khi ghi, không quét key)"""
     try:
-        redis_service = get_redis()
-        
-        # Get all user sessions
-        all_keys = redis_service.client.keys("chat:user:*:session:*")
-        
-        # Parse unique users and sessions
-        users_set = set()
-        total_messages = 0
-        active_sessions = 0
-        
-        for key in all_keys:
-            # Extract user_id from key: chat:user:{user_id}:session:{session_id}
-            parts = key.split(":")
-            if len(parts) >= 4:
-                user_id = parts[2]
-                users_set.add(user_id)
-                
-                # Check if session has recent activity (within last 24 hours)
-                try:
-                    session_data = redis_service.client.hgetall(key)
-                    if session_data:
-                        active_sessions += 1
-                        # Count messages in this session (keys like chat:user:{user_id}:session:{session_id}:message:{index})
-                        message_keys = redis_service.client.keys(f"{key}:message:*")
-                        total_messages += len(message_keys)
-                except:
-                    pass
-        
-        return {
-            "total_users": len(users_set),
-            "total_sessions": len(all_keys),
-            "total_messages": total_messages,
-            "active_sessions": active_sessions
-        }
+        return await get_redis().get_chat_stats()
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -1827,56 +1979,10 @@ async def get_chat_stats():
 
 
 @router.get("/admin/users-chat-history")
-async def get_all_users_chat_history():
-    """Get chat history for all users - Admin only"""
+async def get_all_users_chat_history(offset: int = 0, limit: Optional[int] = None):
+    """Get chat history for all users - Admin only (user hoạt động gần nhất trước, phân trang)"""
     try:
-        redis_service = get_redis()
-        
-        # Get all user sessions from Redis
-        all_keys = redis_service.client.keys("chat:user:*:session:*")
-        
-        users_dict = {}
-        
-        for key in all_keys:
-            # Extract user_id from key: chat:user:{user_id}:session:{session_id}
-            parts = key.split(":")
-            if len(parts) >= 6:
-                user_id = parts[2]
-                session_id = parts[4]
-                
-                if user_id not in users_dict:
-                    users_dict[user_id] = {
-                        "user_id": user_id,
-                        "total_sessions": 0,
-                        "total_messages": 0,
-                        "sessions": []
-                    }
-                
-                # Get session messages
-                message_keys = redis_service.client.keys(f"{key}:message:*")
-                message_count = len(message_keys)
-                
-                # Get session creation time
-                created_at = None
-                try:
-                    session_data = redis_service.client.hgetall(key)
-                    if "created_at" in session_data:
-                        created_at = session_data["created_at"]
-                except:
-                    created_at = None
-                
-                session_info = {
-                    "session_id": session_id,
-                    "message_count": message_count,
-                    "created_at": created_at or datetime.now().isoformat(),
-                    "last_activity": datetime.now().isoformat()
-                }
-                
-                users_dict[user_id]["sessions"].append(session_info)
-                users_dict[user_id]["total_sessions"] += 1
-                users_dict[user_id]["total_messages"] += message_count
-        
-        return list(users_dict.values())
+        return await get_redis().get_users_chat_history(offset, limit)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -1888,20 +1994,7 @@ async def get_all_users_chat_history():
 async def delete_user_all_sessions(user_id: str):
     """Delete all chat sessions for a specific user"""
     try:
-        redis_service = get_redis()
-        
-        # Get all sessions for this user
-        user_sessions = redis_service.client.keys(f"chat:user:{user_id}:session:*")
-        
-        deleted_count = 0
-        for session_key in user_sessions:
-            # Delete session hash
-            redis_service.client.delete(session_key)
-            # Delete session messages
-            message_keys = redis_service.client.keys(f"{session_key}:message:*")
-            for msg_key in message_keys:
-                redis_service.client.delete(msg_key)
-            deleted_count += 1
+        deleted_count = await get_redis().delete_user_sessions(user_id)
         
         return {
             "status": "success",
@@ -1920,15 +2013,7 @@ async def delete_user_all_sessions(user_id: str):
 async def delete_user_session(user_id: str, session_id: str):
     """Delete a specific session for a user"""
     try:
-        redis_service = get_redis()
-        session_key = f"chat:user:{user_id}:session:{session_id}"
-        
-        # Delete session hash
-        redis_service.client.delete(session_key)
-        # Delete session messages
-        message_keys = redis_service.client.keys(f"{session_key}:message:*")
-        for msg_key in message_keys:
-            redis_service.client.delete(msg_key)
+        await get_redis().clear_session(session_id, user_id)
         
         return {
             "status": "success",
@@ -1947,20 +2032,7 @@ async def delete_user_session(user_id: str, session_id: str):
 async def clear_all_chat_data():
     """Clear ALL chat data from Redis - DANGEROUS OPERATION"""
     try:
-        redis_service = get_redis()
-        
-        # Get all chat keys
-        all_keys = redis_service.client.keys("chat:user:*")
-        
-        deleted_count = len(all_keys)
-        for key in all_keys:
-            redis_service.client.delete(key)
-        
-        # Also delete message keys
-        all_message_keys = redis_service.client.keys("chat:*:message:*")
-        deleted_count += len(all_message_keys)
-        for key in all_message_keys:
-            redis_service.client.delete(key)
+        deleted_count = await get_redis().clear_all_chat_data()
         
         return {
             "status": "success",
@@ -1972,4 +2044,3 @@ async def clear_all_chat_data():
             status_code=500,
             detail=f"Error clearing all chat data: {str(e)}"
         )
-
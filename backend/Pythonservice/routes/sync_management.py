@@ -8,6 +8,8 @@ from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 import json
+from services.catalog_version_service import bump_catalog_version
+from services.product_metadata_service import build_product_metadata, first_image_url
 
 router = APIRouter()
 
@@ -166,6 +168,10 @@ async def handle_webhook(payload: WebhookPayload):
             # Delete from ChromaDB
             await delete_from_chroma(chroma_service, table, data.get("id"))
         
+        # Products/discounts thay đổi -> invalidate cache phụ thuộc catalog (response cache...)
+        if table in ("products", "discounts"):
+            bump_catalog_version(f"webhook {table} {operation}")
+        
         # Update sync stats
         sync_configs[table]["last_sync"] = datetime.now().isoformat()
         sync_configs[table]["sync_count"] += 1
@@ -191,16 +197,23 @@ async def sync_product(chroma_service, data: Dict):
         # Get or create products collection
         collection = chroma_service._get_or_create_product_collection()
         
-        # Prepare metadata
-        metadata = {
-            "product_id": str(product_id),
-            "product_name": product_name,
-            "price": float(data.get('price', 0)),
-            "category": data.get('category', ''),
-            "stock": int(data.get('stock', 0)),
-            "img_url": data.get('img_url', data.get('imageUrl', '')),
-            "status": data.get('status', 'ACTIVE')
-        }
+        # Prepare typed metadata (price:int, category_norm, brand, stock:int, img_url)
+        details = data.get('details')
+        if isinstance(details, str):
+            try:
+                details = json.loads(details)
+            except ValueError:
+                details = None
+        metadata = build_product_metadata(
+            product_id,
+            product_name,
+            price=data.get('price', 0),
+            category=data.get('category', data.get('categoryName', '')),
+            brand=data.get('brand') or (details.get('brand') if isinstance(details, dict) else ''),
+            stock=data.get('stock', data.get('quantity', 0)),
+            img_url=data.get('img_url', data.get('imageUrl', '')) or first_image_url(data.get('imageUrls')),
+            status=data.get('status', 'ACTIVE')
+        )
         
         # Create document text for embedding
         description = data.get('description', '')
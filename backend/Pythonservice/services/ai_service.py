@@ -9,6 +9,8 @@ from groq import Groq
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 
+from services.llm_scheduler_service import LLMOverloadedError, PRIORITY_CHAT
+
 
 class AIService:
     """Shared AI service for both customer chat and business analytics"""
@@ -177,6 +179,40 @@ class AIService:
             messages.append({"role": "user", "content": prompt})
             
             return self.generate_with_groq(model_id, messages, temperature)
+    
+    async def generate_async(self, model_id: str, prompt: str, system_instruction: Optional[str] = None,
+                             temperature: float = 0.7, priority: int = PRIORITY_CHAT) -> str:
+        """
+        Async version of generate() - dùng AsyncLLMProvider (shared connection pool),
+        không block event loop trong lúc chờ LLM
+        
+        Args:
+            model_id: Model ID (from any provider)
+            prompt: User prompt
+            system_instruction: System instruction (optional)
+            temperature: Temperature for generation
+            priority: Priority class của LLM scheduler (chat / analytics)
+            
+        Returns:
+            Generated text
+
+        Raises:
+            LLMOverloadedError: LLM scheduler từ chối (giữ nguyên để route trả 503)
+        """
+        from services.llm_provider_service import get_llm_provider
+        
+        provider = 'Gemini' if 'gemini' in model_id.lower() else 'Groq'
+        try:
+            return await get_llm_provider().generate(
+                model_id, prompt,
+                system_instruction=system_instruction,
+                temperature=temperature,
+                priority=priority
+            )
+        except LLMOverloadedError:
+            raise
+        except Exception as e:
+            raise Exception(f"{provider} generation error: {str(e)}")
 
 
 # Global singleton instance
@@ -10,6 +10,8 @@ import chromadb
 import hashlib
 import json
 
+from services.embedding_cache_service import get_embedding_function
+
 
 class AnalyticsRAGService:
     """RAG service specifically for business analytics with caching"""
@@ -22,6 +24,8 @@ class AnalyticsRAGService:
             chroma_path: Path to analytics ChromaDB storage
         """
         self.chroma_client = chromadb.PersistentClient(path=chroma_path)
+        # Embedding function có cache (LRU + disk), dùng chung với chat service
+        self.embedding_function = get_embedding_function()
         self.business_data_collection_name = "business_data"
         self.orders_analytics_collection_name = "orders_analytics"
         self.trends_collection_name = "trends"
@@ -84,22 +88,26 @@ class AnalyticsRAGService:
         """Initialize analytics-specific collections"""
         self.business_data_collection = self.chroma_client.get_or_create_collection(
             name=self.business_data_collection_name,
-            metadata={"description": "Business data for analytics"}
+            metadata={"description": "Business data for analytics"},
+            embedding_function=self.embedding_function,
         )
         
         self.orders_analytics_collection = self.chroma_client.get_or_create_collection(
             name=self.orders_analytics_collection_name,
-            metadata={"description": "Order data for analytics"}
+            metadata={"description": "Order data for analytics"},
+            embedding_function=self.embedding_function,
         )
         
         self.trends_collection = self.chroma_client.get_or_create_collection(
             name=self.trends_collection_name,
-            metadata={"description": "Business trends and insights"}
+            metadata={"description": "Business trends and insights"},
+            embedding_function=self.embedding_function,
         )
         
         self.business_documents_collection = self.chroma_client.get_or_create_collection(
             name=self.business_documents_collection_name,
-            metadata={"description": "Business documents for AI search"}
+            metadata={"description": "Business documents for AI search"},
+            embedding_function=self.embedding_function,
         )
         
         print(f"[Analytics RAG] Collections initialized: {self.business_data_collection_name}, {self.orders_analytics_collection_name}, {self.trends_collection_name}, {self.business_documents_collection_name}")
@@ -727,7 +735,7 @@ Daily Revenue: {overview.get('daily_revenue', 0)} VND
                 try:
                     # Check if collection exists
                     try:
-                        collection = self.chroma_client.get_collection(name=collection_name)
+                        collection = self.chroma_client.get_collection(name=collection_name, embedding_function=self.embedding_function)
                     except Exception as e:
                         print(f"[Analytics RAG] Collection '{collection_name}' not found, skipping")
                         continue
@@ -812,7 +820,7 @@ Daily Revenue: {overview.get('daily_revenue', 0)} VND
         """
         try:
             # Search in actual orders collection
-            orders_collection = self.chroma_client.get_collection(name="orders")
+            orders_collection = self.chroma_client.get_collection(name="orders", embedding_function=self.embedding_function)
             
             results = orders_collection.query(
                 query_texts=[query],
@@ -896,7 +904,7 @@ Daily Revenue: {overview.get('daily_revenue', 0)} VND
             
             for collection_name in collection_names:
                 try:
-                    collection = self.chroma_client.get_collection(name=collection_name)
+                    collection = self.chroma_client.get_collection(name=collection_name, embedding_function=self.embedding_function)
                     data = collection.get()
                     
                     if data['ids']:
@@ -934,7 +942,7 @@ Daily Revenue: {overview.get('daily_revenue', 0)} VND
             
             for collection_name in collection_names:
                 try:
-                    collection = self.chroma_client.get_collection(name=collection_name)
+                    collection = self.chroma_client.get_collection(name=collection_name, embedding_function=self.embedding_function)
                     count = collection.count()
                     if count > 0:  # Only include non-empty collections
                         stats[collection_name] = count
@@ -0,0 +1,294 @@
+"""
+Answer Verifier Service
+Kiểm tra response của AI với catalog snapshot (dữ liệu có cấu trúc) - chạy local, không gọi LLM
+- Thương hiệu được nhắc tới phải có trong catalog (thay cho validate_price_filtering_response)
+- Giá trích dẫn cạnh tên sản phẩm phải khớp giá trong catalog -> sửa ngay trong response
+- Thứ tự giá khớp nhu cầu (giá rẻ: tăng dần, cao cấp: giảm dần) -> thêm ghi chú sắp xếp đúng
+- Sản phẩm ngoài khoảng giá khách hỏi / thương hiệu không bán -> lỗi nghiêm trọng, chỉ khi đó
+  mới được re-generate (trong giới hạn retry budget, với correction prompt ngắn thay vì gửi lại
+  toàn bộ context)
+"""
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+
+from services.catalog_snapshot_service import CatalogSnapshot
+from services.product_mention_service import ProductMentionIndex, get_mention_index
+from services.query_intent_service import QueryIntent, find_brands
+
+# === CONFIG (env) ===
+ANSWER_VERIFIER_ENABLED = os.getenv('ANSWER_VERIFIER_ENABLED', 'true').lower() == 'true'
+# Số lần re-generate tối đa cho một lượt chat (0 = không bao giờ gọi lại LLM)
+ANSWER_VERIFIER_MAX_RETRIES = int(os.getenv('ANSWER_VERIFIER_MAX_RETRIES', 1))
+# Retry budget toàn process: tối đa RATIO * số lượt đã verify (+ BURST) lần re-generate
+ANSWER_VERIFIER_RETRY_RATIO = float(os.getenv('ANSWER_VERIFIER_RETRY_RATIO', 0.1))
+ANSWER_VERIFIER_RETRY_BURST = int(os.getenv('ANSWER_VERIFIER_RETRY_BURST', 3))
+# Số sản phẩm đưa vào correction prompt
+CORRECTION_PRODUCT_LIMIT = int(os.getenv('ANSWER_VERIFIER_CORRECTION_PRODUCTS', 8))
+
+# Sai số cho phép khi so giá: giá đầy đủ ("20,990,000đ") và giá làm tròn ("21 triệu")
+EXACT_PRICE_TOLERANCE = 0.005
+ROUNDED_PRICE_TOLERANCE = 0.05
+
+ISSUE_UNKNOWN_BRAND = 'unknown_brand'
+ISSUE_PRICE_MISMATCH = 'price_mismatch'
+ISSUE_PRICE_ORDER = 'price_order'
+ISSUE_OUT_OF_RANGE = 'out_of_range'
+
+# Lỗi không sửa local được -> cần re-generate
+SERIOUS_ISSUES = {ISSUE_UNKNOWN_BRAND, ISSUE_OUT_OF_RANGE}
+
+# "20,990,000 VNĐ", "20.990.000đ", "20990000 ₫"
+_EXACT_PRICE_RE = re.compile(r'(\d{1,3}(?:[.,]\d{3})+|\d{4,})\s*(?:vnđ|vnd|đồng|đ|₫)', re.IGNORECASE)
+# "21 triệu", "20.5tr", "20,5 triệu"
+_ROUNDED_PRICE_RE = re.compile(r'(\d{1,3}(?:[.,]\d{1,2})?)\s*(?:triệu|tr)(?![a-zà-ỹ])', re.IGNORECASE)
+
+
+@dataclass
+class VerificationIssue:
+    """Một lỗi phát hiện trong response"""
+    kind: str
+    detail: str
+    product_index: Optional[int] = None  # index trong catalog snapshot (nếu liên quan sản phẩm)
+
+
+@dataclass
+class VerificationResult:
+    """Kết quả verify: response đã sửa + danh sách lỗi"""
+    text: str
+    issues: List[VerificationIssue] = field(default_factory=list)
+    patched: bool = False  # đã sửa giá trong response
+    annotated: bool = False  # đã thêm ghi chú (thứ tự giá)
+
+    @property
+    def serious_issues(self) -> List[VerificationIssue]:
+        return [issue for issue in self.issues if issue.kind in SERIOUS_ISSUES]
+
+    @property
+    def valid(self) -> bool:
+        """Không còn lỗi nghiêm trọng (lỗi nhỏ đã được sửa/ghi chú)"""
+        return not self.serious_issues
+
+
+def _parse_exact_price(raw: str) -> int:
+    return int(re.sub(r'[.,]', '', raw))
+
+
+def _parse_rounded_price(raw: str) -> int:
+    return int(round(float(raw.replace(',', '.')) * 1_000_000))
+
+
+def _format_price(price: int) -> str:
+    return f"{price:,} VNĐ"
+
+
+class AnswerVerifier:
+    """Verify response của AI với catalog snapshot của lượt chat"""
+
+    def __init__(self, snapshot: CatalogSnapshot, index: Optional[ProductMentionIndex] = None):
+        self.snapshot = snapshot
+        self.index = index or get_mention_index(snapshot)
+
+    def _line_product(self, line: str) -> Optional[int]:
+        """Sản phẩm được nêu tên trên một dòng (tên dài nhất - cụ thể nhất), None nếu không có/mơ hồ"""
+        named = self.index.named_indices(line)
+        if not named:
+            return None
+        longest = max(len(self.snapshot.names[idx]) for idx in named)
+        candidates = [idx for idx in named if len(self.snapshot.names[idx]) == longest]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def _verify_line_price(self, line: str, idx: int, issues: List[VerificationIssue]) -> str:
+        """So giá đầu tiên sau tên sản phẩm trên dòng với giá catalog, sửa nếu lệch"""
+        actual = self.snapshot.price_of(idx)
+        if actual is None:
+            return line
+        name_end = line.lower().find(self.snapshot.names_lower[idx])
+        name_end = name_end + len(self.snapshot.names_lower[idx]) if name_end >= 0 else 0
+
+        candidates = []
+        for regex, parse, tolerance in ((_EXACT_PRICE_RE, _parse_exact_price, EXACT_PRICE_TOLERANCE),
+                                        (_ROUNDED_PRICE_RE, _parse_rounded_price, ROUNDED_PRICE_TOLERANCE)):
+            match = regex.search(line, name_end)
+            if match:
+                candidates.append((match, parse, tolerance))
+        if not candidates:
+            return line
+        match, parse, tolerance = min(candidates, key=lambda c: c[0].start())
+        try:
+            quoted = parse(match.group(1))
+        except ValueError:
+            return line
+        if abs(quoted - actual) <= actual * tolerance:
+            return line
+
+        issues.append(VerificationIssue(
+            ISSUE_PRICE_MISMATCH,
+            f"{self.snapshot.names[idx]}: response ghi {match.group(0).strip()}, catalog {_format_price(actual)}",
+            idx
+        ))
+        return line[:match.start()] + _format_price(actual) + line[match.end():]
+
+    def verify(self, response: str, intent: QueryIntent) -> VerificationResult:
+        """
+        Verify + sửa response
+
+        Args:
+            response: Response của AI
+            intent: QueryIntent của câu hỏi (price band / khoảng giá)
+
+        Returns:
+            VerificationResult với text đã sửa giá / thêm ghi chú
+        """
+        issues: List[VerificationIssue] = []
+        if not response:
+            return VerificationResult(text=response or "")
+
+        # 1. Thương hiệu được nhắc tới phải có trong catalog
+        for group in find_brands(response + " "):
+            if group not in self.index.brand_groups:
+                issues.append(VerificationIssue(ISSUE_UNKNOWN_BRAND, f"Shop không bán sản phẩm '{group}'"))
+
+        # 2. Giá cạnh tên sản phẩm khớp catalog (sửa tại chỗ)
+        lines = response.split('\n')
+        listed: List[int] = []  # sản phẩm theo thứ tự xuất hiện trong response
+        for i, line in enumerate(lines):
+            idx = self._line_product(line)
+            if idx is None:
+                continue
+            lines[i] = self._verify_line_price(line, idx, issues)
+            if idx not in listed:
+                listed.append(idx)
+        text = '\n'.join(lines)
+        patched = any(issue.kind == ISSUE_PRICE_MISMATCH for issue in issues)
+
+        priced = [idx for idx in listed if self.snapshot.price_of(idx) is not None]
+
+        # 3. Sản phẩm ngoài khoảng giá khách hỏi
+        if intent.price_range:
+            low, high = intent.price_range
+            for idx in priced:
+                price = self.snapshot.price_of(idx)
+                if not low <= price <= high:
+                    issues.append(VerificationIssue(
+                        ISSUE_OUT_OF_RANGE,
+                        f"{self.snapshot.names[idx]} ({_format_price(price)}) ngoài khoảng "
+                        f"{_format_price(low)} - {_format_price(high)}",
+                        idx
+                    ))
+
+        # 4. Thứ tự giá theo nhu cầu (rẻ: tăng dần, cao cấp: giảm dần) -> ghi chú thứ tự đúng
+        annotated = False
+        band = intent.price_band
+        if band in ('low', 'high') and len(priced) >= 2:
+            prices = [self.snapshot.price_of(idx) for idx in priced]
+            expected = sorted(prices, reverse=(band == 'high'))
+            if prices != expected:
+                ordered = sorted(priced, key=self.snapshot.price_of, reverse=(band == 'high'))
+                direction = "thấp đến cao" if band == 'low' else "cao đến thấp"
+                issues.append(VerificationIssue(ISSUE_PRICE_ORDER, f"Sản phẩm không xếp theo giá {direction}"))
+                text += f"\n\n💡 Theo giá từ {direction}: " + ", ".join(
+                    f"{self.snapshot.names[idx]} ({_format_price(self.snapshot.price_of(idx))})" for idx in ordered
+                )
+                annotated = True
+
+        return VerificationResult(text=text, issues=issues, patched=patched, annotated=annotated)
+
+    def correction_prompt(self, result: VerificationResult, intent: QueryIntent) -> str:
+        """
+        Correction prompt ngắn cho lần re-generate: chỉ liệt kê lỗi + sản phẩm hợp lệ liên quan
+        (thay vì gửi lại toàn bộ combined_context)
+        """
+        if intent.price_range:
+            # Lát cắt bisect trên price index (sản phẩm ACTIVE của category)
+            indices = self.snapshot.price_slice(intent.price_range, intent.category)
+        else:
+            indices = self.snapshot.active_indices()
+            if intent.category:
+                indices = self.snapshot.in_category(indices, intent.category)
+        indices = self.snapshot.sort_indices(indices, intent.price_band or 'low')
+
+        lines = ["LỖI TRONG CÂU TRẢ LỜI TRƯỚC:"]
+        lines += [f"- {issue.detail}" for issue in result.serious_issues]
+        lines.append("CHỈ DÙNG CÁC SẢN PHẨM SAU (giá chính xác):")
+        for idx in indices[:CORRECTION_PRODUCT_LIMIT]:
+            idx = int(idx)
+            price = self.snapshot.price_of(idx)
+            lines.append(f"- {self.snapshot.names[idx]}: {_format_price(price) if price else 'Liên hệ'}")
+        lines.append("Viết lại câu trả lời, sửa các lỗi trên, giữ nguyên giọng văn.")
+        return "\n".join(lines)
+
+
+class AnswerVerifierMetrics:
+    """Counter in-process cho verifier + retry budget (thread-safe)"""
+
+    def __init__(self, retry_ratio: float = ANSWER_VERIFIER_RETRY_RATIO,
+                 retry_burst: int = ANSWER_VERIFIER_RETRY_BURST):
+        self._lock = threading.Lock()
+        self.retry_ratio = retry_ratio
+        self.retry_burst = retry_burst
+        self.verified = 0
+        self.passed = 0  # không có lỗi nào
+        self.patched = 0
+        self.annotated = 0
+        self.retries = 0
+        self.retries_fixed = 0  # re-generate xong không còn lỗi nghiêm trọng
+        self.retries_denied = 0  # cần re-generate nhưng hết budget
+        self.issues_by_kind: Dict[str, int] = {}
+
+    def record(self, result: VerificationResult) -> None:
+        """Ghi nhận kết quả verify một response"""
+        with self._lock:
+            self.verified += 1
+            if not result.issues:
+                self.passed += 1
+            self.patched += int(result.patched)
+            self.annotated += int(result.annotated)
+            for issue in result.issues:
+                self.issues_by_kind[issue.kind] = self.issues_by_kind.get(issue.kind, 0) + 1
+
+    def try_acquire_retry(self) -> bool:
+        """Lấy một lượt re-generate từ budget toàn process"""
+        with self._lock:
+            if self.retries < self.retry_ratio * self.verified + self.retry_burst:
+                self.retries += 1
+                return True
+            self.retries_denied += 1
+            return False
+
+    def record_retry_outcome(self, result: VerificationResult) -> None:
+        with self._lock:
+            self.retries_fixed += int(result.valid)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Số liệu hiện tại"""
+        with self._lock:
+            return {
+                'verified': self.verified,
+                'passed': self.passed,
+                'patched': self.patched,
+                'annotated': self.annotated,
+                'retries': self.retries,
+                'retry_rate': round(self.retries / self.verified, 3) if self.verified else 0.0,
+                'retries_fixed': self.retries_fixed,
+                'retries_denied': self.retries_denied,
+                'issues_by_kind': dict(self.issues_by_kind),
+            }
+
+
+def is_price_sensitive(intent: QueryIntent) -> bool:
+    """Câu hỏi có yêu cầu về giá -> lỗi nghiêm trọng mới đáng re-generate"""
+    return intent.price_band is not None or intent.price_range is not None
+
+
+# Global singleton instance
+_verifier_metrics: Optional[AnswerVerifierMetrics] = None
+
+def get_answer_verifier_metrics() -> AnswerVerifierMetrics:
+    """Get global answer verifier metrics instance"""
+    global _verifier_metrics
+    if _verifier_metrics is None:
+        _verifier_metrics = AnswerVerifierMetrics()
+    return _verifier_metrics
@@ -0,0 +1,655 @@
+"""
+Async Redis Chat History Service
+Cùng public API với RedisChatService nhưng trên redis.asyncio - route chat / history / admin
+await trực tiếp, ZRANGE / HGETALL không còn chặn event loop (độ trễ Redis của các request
+đồng thời chồng lên nhau thay vì cộng dồn)
+- BlockingConnectionPool giới hạn REDIS_MAX_CONNECTIONS: hết connection thì request chờ
+  connection rảnh (tối đa REDIS_POOL_TIMEOUT giây) thay vì mở thêm connection tới Redis
+- health_check_interval: connection idle quá lâu được PING trước khi dùng, connection chết
+  (Redis restart, idle timeout của proxy) được mở lại thay vì trả lỗi cho request
+- Retry với exponential backoff cho ConnectionError / TimeoutError
+- Connection mở lười ở lần gọi đầu tiên (trong event loop của app), kiểm tra bằng is_connected()
+- Service sync (RedisChatService) vẫn dùng cho code chạy trong thread (cache, catalog version...)
+- Thống kê admin đọc thẳng counter / sorted set được cập nhật khi ghi (không KEYS); dựng lại
+  bằng SCAN theo trang + pipeline khi chưa có (lần đầu sau nâng cấp) hoặc admin yêu cầu
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import redis
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+
+from services.redis_chat_service import (
+    RedisChatKeys, SAVE_MESSAGES_LUA, CHAT_STATS_KEY, CHAT_STATS_USERS_KEY,
+    CHAT_STATS_SESSIONS_KEY, CHAT_STATS_SESSION_COUNTS_KEY, CHAT_HISTORY_PAGE_SIZE
+)
+
+# === CONFIG (env) ===
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+# Số giây chờ connection rảnh khi pool đã dùng hết
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5))
+# Connection idle quá số giây này được PING (và reconnect nếu chết) trước khi dùng
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 5))
+REDIS_RETRY_ATTEMPTS = int(os.getenv('REDIS_RETRY_ATTEMPTS', 3))
+# Số key mỗi trang SCAN / số session mỗi lượt prune khi dựng lại / dọn thống kê
+CHAT_STATS_PAGE_SIZE = int(os.getenv('CHAT_STATS_PAGE_SIZE', 500))
+
+
+class AsyncRedisChatService(RedisChatKeys):
+    """Service for managing chat history in Redis (asyncio, bounded connection pool)"""
+
+    def __init__(self, host: str = None, port: int = None, db: int = None,
+                 password: str = None, ttl: int = None, max_connections: int = REDIS_MAX_CONNECTIONS):
+        """Tạo connection pool (chưa mở connection nào)
+
+        Args:
+            host: Redis host (default from REDIS_HOST env var)
+            port: Redis port (default from REDIS_PORT env var)
+            db: Redis database (default from REDIS_DB env var)
+            password: Redis password (default from REDIS_PASSWORD env var)
+            ttl: Time to live in seconds (default from CHAT_HISTORY_TTL env var)
+            max_connections: Số connection tối đa của pool
+        """
+        self.redis_host = host or os.getenv('REDIS_HOST', 'localhost')
+        self.redis_port = port or int(os.getenv('REDIS_PORT', 6379))
+        self.redis_db = db or int(os.getenv('REDIS_DB', 0))
+        self.redis_password = password or os.getenv('REDIS_PASSWORD', None)
+        self.ttl = ttl or int(os.getenv('CHAT_HISTORY_TTL', 86400))  # 24 hours default
+
+        self.pool = aioredis.BlockingConnectionPool(
+            max_connections=max_connections,
+            timeout=REDIS_POOL_TIMEOUT,
+            host=self.redis_host,
+            port=self.redis_port,
+            db=self.redis_db,
+            password=self.redis_password if self.redis_password else None,
+            decode_responses=True,
+            socket_connect_timeout=5,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), REDIS_RETRY_ATTEMPTS),
+            retry_on_error=[redis.exceptions.ConnectionError, redis.exceptions.TimeoutError]
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+        self._save_script = self.client.register_script(SAVE_MESSAGES_LUA)
+        self._lua_supported = True  # False -> server không chạy được EVAL, ghi bằng MULTI pipeline
+        self._rebuild_lock = asyncio.Lock()
+
+    async def aclose(self) -> None:
+        """Đóng mọi connection của pool (app shutdown)"""
+        await self.client.aclose()
+        await self.pool.disconnect()
+
+    async def save_message(self, session_id: str, user_id: str, role: str, content: str, model: str, timestamp: str) -> bool:
+        """Save single message to Redis with user association and isolation
+
+        Args:
+            session_id: Chat session ID
+            user_id: User ID (for linking sessions to users)
+            role: Message role ('user' or 'assistant')
+            content: Message content
+            model: Model used (for tracking)
+            timestamp: ISO format timestamp
+
+        Returns:
+            True if message saved successfully
+        """
+        message = {"role": role, "content": content, "model": model, "timestamp": timestamp}
+        return await self.save_messages(session_id, user_id, [message]) == 1
+
+    async def save_messages(self, session_id: str, user_id: str, messages: List[Dict[str, Any]]) -> int:
+        """Save nhiều message của MỘT session (một round trip cho mỗi CHAT_SAVE_BATCH_SIZE message)"""
+        return await self.import_messages(
+            {**message, "session_id": session_id, "user_id": user_id} for message in messages
+        )
+
+    async def import_messages(self, messages: Iterable[Dict[str, Any]]) -> int:
+        """Batch import message của nhiều session - script của mọi session đi chung một pipeline
+
+        Returns:
+            Số message đã lưu (0 nếu lỗi - batch là một pipeline)
+        """
+        try:
+            sessions = self._group_by_session(messages)
+            if not sessions:
+                return 0
+            if self._lua_supported:
+                try:
+                    return await self._save_with_script(sessions)
+                except redis.exceptions.ResponseError as e:
+                    if 'unknown command' not in str(e).lower():
+                        raise
+                    print(f"[Redis] EVAL not supported, saving messages with MULTI pipeline: {e}")
+                    self._lua_supported = False
+            return await self._save_with_pipeline(sessions)
+        except Exception as e:
+            print(f"[Redis Error] Failed to save message: {str(e)}")
+            return 0
+
+    async def _save_with_script(self, sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]]) -> int:
+        """Một call -> EVALSHA trực tiếp, nhiều call -> chung một pipeline"""
+        calls = self._script_calls(sessions)
+        if len(calls) == 1:
+            keys, args, _ = calls[0]
+            await self._save_script(keys=keys, args=args)
+        else:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for keys, args, _ in calls:
+                    await self._save_script(keys=keys, args=args, client=pipe)
+                await pipe.execute()
+        return sum(count for _, _, count in calls)
+
+    async def _save_with_pipeline(self, sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]]) -> int:
+        """Fallback khi server không có Lua: MULTI pipeline, message_count ghi ở round trip thứ hai"""
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._queue_multi_save(pipe, sessions)
+            results = await pipe.execute()
+        async with self.client.pipeline(transaction=False) as pipe:
+            self._queue_message_counts(pipe, sessions, results)
+            await pipe.execute()
+        return sum(len(entries) for entries in sessions.values())
+
+    async def get_session_history(self, session_id: str, user_id: str = None) -> List[dict]:
+        """Get all messages from a session (user_id -> user-specific key, recommended)"""
+        try:
+            if user_id:
+                session_key = self.get_user_session_key(user_id, session_id)
+            else:
+                # Fallback to session_key (for backward compatibility)
+                session_key = self.get_session_key(session_id)
+            return self._parse_messages(await self.client.zrange(session_key, 0, -1))
+        except Exception as e:
+            print(f"[Redis Error] Failed to get session history: {str(e)}")
+            return []
+
+    async def clear_session(self, session_id: str, user_id: str = None) -> bool:
+        """Clear all messages from a session (user_id -> xoá cả metadata + gỡ khỏi thống kê)"""
+        try:
+            if user_id:
+                await self._drop_sessions(user_id, [session_id])
+            else:
+                await self.client.delete(self.get_session_key(session_id))
+            return True
+        except Exception as e:
+            print(f"[Redis Error] Failed to clear session: {str(e)}")
+            return False
+
+    async def _drop_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """Xoá session (messages + meta + summary) của user và trừ khỏi thống kê, trả về số session đã gỡ"""
+        if not session_ids:
+            return 0
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._queue_drop_sessions(pipe, user_id, session_ids)
+            results = await pipe.execute()
+        async with self.client.pipeline(transaction=False) as pipe:
+            dropped = self._queue_drop_counts(pipe, len(session_ids), results)
+            await pipe.execute()
+        return dropped
+
+    async def get_session_size(self, session_id: str, user_id: str = None) -> int:
+        """Get number of messages in session"""
+        try:
+            if user_id:
+                session_key = self.get_user_session_key(user_id, session_id)
+            else:
+                session_key = self.get_session_key(session_id)
+            return await self.client.zcard(session_key)
+        except Exception as e:
+            print(f"[Redis Error] Failed to get session size: {str(e)}")
+            return 0
+
+    async def get_all_sessions(self) -> List[str]:
+        """Get all active chat sessions (SCAN, không chặn Redis như KEYS)"""
+        try:
+            keys = [key async for key in self.client.scan_iter(match="chat:session:*", count=CHAT_STATS_PAGE_SIZE)]
+            return [key.replace("chat:session:", "") for key in keys]
+        except Exception as e:
+            print(f"[Redis Error] Failed to get sessions: {str(e)}")
+            return []
+
+    async def get_session_info(self, session_id: str) -> dict:
+        """Get session metadata (ZCARD + TTL trong một round trip)"""
+        try:
+            session_key = self.get_session_key(session_id)
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.zcard(session_key)
+                pipe.ttl(session_key)
+                size, ttl = await pipe.execute()
+            return {
+                "session_id": session_id,
+                "message_count": size,
+                "ttl_seconds": ttl if ttl > 0 else None,
+                "exists": size > 0
+            }
+        except Exception as e:
+            print(f"[Redis Error] Failed to get session info: {str(e)}")
+            return {}
+
+    async def is_connected(self) -> bool:
+        """Check if Redis is connected"""
+        try:
+            return bool(await self.client.ping())
+        except Exception:
+            return False
+
+    async def get_user_sessions(self, user_id: str, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Get session IDs for a user, most recent activity first (offset / limit để phân trang)"""
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.zrevrange(self.get_user_activity_key(user_id), 0, -1)
+                pipe.smembers(self.get_user_sessions_key(user_id))
+                recent, members = await pipe.execute()
+            sessions = self._order_sessions(recent, members)
+            return sessions[offset:offset + limit] if limit else sessions[offset:]
+        except Exception as e:
+            print(f"[Redis Error] Failed to get user sessions: {str(e)}")
+            return []
+
+    async def get_session_history_page(self, session_id: str, user_id: str, cursor: Optional[str] = None,
+                                       limit: int = CHAT_HISTORY_PAGE_SIZE, reverse: bool = False) -> Tuple[List[dict], Optional[str]]:
+        """Một trang history của session: ZRANGEBYSCORE theo cursor (score = timestamp) + LIMIT
+
+        Args:
+            cursor: Cursor trả về từ trang trước (None = trang đầu)
+            limit: Số message tối đa của trang
+            reverse: True -> mới nhất trước
+
+        Returns:
+            (messages, next_cursor) - next_cursor None khi hết
+
+        Raises:
+            ValueError: cursor không hợp lệ
+        """
+        start, end, skip = self._history_range(cursor, reverse)
+        session_key = self.get_user_session_key(user_id, session_id)
+        if reverse:
+            rows = await self.client.zrevrangebyscore(session_key, start, end, start=skip, num=limit + 1, withscores=True)
+        else:
+            rows = await self.client.zrangebyscore(session_key, start, end, start=skip, num=limit + 1, withscores=True)
+        return self._history_page(rows, limit, cursor)
+
+    async def iter_user_history(self, user_id: str, sessions: Optional[List[str]] = None,
+                                page_size: int = CHAT_HISTORY_PAGE_SIZE) -> AsyncIterator[Tuple[str, int, List[dict]]]:
+        """
+        Toàn bộ history của user theo từng trang (session gần nhất trước) - export stream
+        giữ bộ nhớ ở mức một trang thay vì mọi message của mọi session
+
+        Args:
+            sessions: Session IDs đã lấy sẵn (None = get_user_sessions)
+
+        Yields:
+            (session_id, message_count của session, messages của trang); bỏ session rỗng
+        """
+        if sessions is None:
+            sessions = await self.get_user_sessions(user_id)
+        for session_id in sessions:
+            count = await self.client.zcard(self.get_user_session_key(user_id, session_id))
+            if not count:
+                continue
+            cursor = None
+            while True:
+                messages, cursor = await self.get_session_history_page(session_id, user_id, cursor, page_size)
+                yield session_id, count, messages
+                if cursor is None:
+                    break
+
+    async def get_user_full_history(self, user_id: str) -> dict:
+        """Get full chat history for a user across all sessions - ZRANGE của mọi session chung một pipeline"""
+        try:
+            sessions = await self.get_user_sessions(user_id)
+            user_history = {
+                "user_id": user_id,
+                "sessions": [],
+                "total_sessions": len(sessions),
+                "total_messages": 0
+            }
+            if not sessions:
+                return user_history
+
+            async with self.client.pipeline(transaction=False) as pipe:
+                for session_id in sessions:
+                    pipe.zrange(self.get_user_session_key(user_id, session_id), 0, -1)
+                results = await pipe.execute()
+
+            for session_id, messages_json in zip(sessions, results):
+                session_messages = self._parse_messages(messages_json)
+                if session_messages:
+                    user_history["sessions"].append({
+                        "session_id": session_id,
+                        "message_count": len(session_messages),
+                        "messages": session_messages
+                    })
+                    user_history["total_messages"] += len(session_messages)
+            return user_history
+        except Exception as e:
+            print(f"[Redis Error] Failed to get user full history: {str(e)}")
+            return {}
+
+    async def get_session_context(self, session_id: str, user_id: str, limit: int = 20) -> List[dict]:
+        """Get recent messages from a session for context (chỉ message của user_id này)"""
+        try:
+            session_key = self.get_user_session_key(user_id, session_id)
+            return self._parse_messages(await self.client.zrange(session_key, -limit, -1), user_id)
+        except Exception as e:
+            print(f"[Redis Error] Failed to get session context: {str(e)}")
+            return []
+
+    async def get_session_memory(self, session_id: str, user_id: str, window: int) -> Dict[str, Any]:
+        """Rolling summary + các message chưa tóm tắt trong `window` message cuối (một round trip)
+
+        Returns:
+            {"summary", "covered", "size", "messages"} - summary None nếu session chưa được tóm tắt
+        """
+        try:
+            summary_key = self.get_session_summary_key(user_id, session_id)
+            session_key = self.get_user_session_key(user_id, session_id)
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.hgetall(summary_key)
+                pipe.zcard(session_key)
+                pipe.zrange(session_key, -window, -1)
+                pipe.expire(summary_key, self.ttl)  # Summary sống cùng session đang hoạt động
+                summary, size, rows, _ = await pipe.execute()
+            return self._session_memory(summary, size, rows, user_id)
+        except Exception as e:
+            print(f"[Redis Error] Failed to get session memory: {str(e)}")
+            return {"summary": None, "covered": 0, "size": 0, "messages": []}
+
+    async def get_session_summary(self, session_id: str, user_id: str) -> Dict[str, Any]:
+        """Rolling summary của session: {"summary", "covered", "size"}"""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self.get_session_summary_key(user_id, session_id))
+            pipe.zcard(self.get_user_session_key(user_id, session_id))
+            summary, size = await pipe.execute()
+        return self._session_summary(summary, size)
+
+    async def get_session_slice(self, session_id: str, user_id: str, start: int, stop: int) -> List[dict]:
+        """Message thứ start .. stop - 1 của session (theo thứ tự thời gian)"""
+        if stop <= start:
+            return []
+        rows = await self.client.zrange(self.get_user_session_key(user_id, session_id), start, stop - 1)
+        return self._parse_messages(rows, user_id)
+
+    async def save_session_summary(self, session_id: str, user_id: str, summary: str, covered: int) -> bool:
+        """Lưu rolling summary đã gộp `covered` message đầu session (cùng TTL với session)"""
+        summary_key = self.get_session_summary_key(user_id, session_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hset(summary_key, mapping={"summary": summary, "covered": covered,
+                                            "updated_at": datetime.now().isoformat()})
+            pipe.expire(summary_key, self.ttl)
+            await pipe.execute()
+        return True
+
+    async def clear_user_history(self, user_id: str) -> bool:
+        """Clear all chat history for a user"""
+        try:
+            await self.delete_user_sessions(user_id)
+            return True
+        except Exception as e:
+            print(f"[Redis Error] Failed to clear user history: {str(e)}")
+            return False
+
+    async def delete_user_sessions(self, user_id: str) -> int:
+        """Xoá mọi session của user (session index + activity index) và gỡ user khỏi thống kê
+
+        Returns:
+            Số session đã xoá
+        """
+        activity_key = self.get_user_activity_key(user_id)
+        sessions_key = self.get_user_sessions_key(user_id)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.smembers(sessions_key)
+            pipe.zrange(activity_key, 0, -1)
+            members, active = await pipe.execute()
+        session_ids = sorted(set(members) | set(active))
+        await self._drop_sessions(user_id, session_ids)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(sessions_key, activity_key)
+            pipe.zrem(CHAT_STATS_USERS_KEY, user_id)
+            await pipe.execute()
+        return len(session_ids)
+
+    # === ADMIN STATS (counter + sorted set cập nhật khi ghi, không KEYS) ===
+
+    async def ensure_stats(self) -> None:
+        """Dựng lại thống kê bằng SCAN nếu chưa từng dựng (dữ liệu ghi trước khi có counter)"""
+        if await self.client.hexists(CHAT_STATS_KEY, "rebuilt_at"):
+            return
+        async with self._rebuild_lock:
+            if not await self.client.hexists(CHAT_STATS_KEY, "rebuilt_at"):
+                await self.rebuild_stats()
+
+    async def prune_stats(self) -> int:
+        """Gỡ khỏi thống kê các session đã hết TTL (hoạt động cuối cũ hơn ttl), trả về số session gỡ"""
+        cutoff = time.time() - self.ttl
+        pruned = 0
+        while True:
+            expired = await self.client.zrangebyscore(CHAT_STATS_SESSIONS_KEY, "-inf", cutoff,
+                                                      start=0, num=CHAT_STATS_PAGE_SIZE)
+            if not expired:
+                break
+            async with self.client.pipeline(transaction=True) as pipe:
+                for key in expired:
+                    pipe.zrem(CHAT_STATS_SESSIONS_KEY, key)
+                    pipe.hget(CHAT_STATS_SESSION_COUNTS_KEY, key)
+                    pipe.hdel(CHAT_STATS_SESSION_COUNTS_KEY, key)
+                results = await pipe.execute()
+            removed = [position for position in range(len(expired)) if results[position * 3]]
+            if removed:
+                messages = sum(int(results[position * 3 + 1] or 0) for position in removed)
+                async with self.client.pipeline(transaction=False) as pipe:
+                    pipe.hincrby(CHAT_STATS_KEY, "sessions", -len(removed))
+                    pipe.hincrby(CHAT_STATS_KEY, "messages", -messages)
+                    await pipe.execute()
+            pruned += len(removed)
+            if len(expired) < CHAT_STATS_PAGE_SIZE:
+                break
+        await self.client.zremrangebyscore(CHAT_STATS_USERS_KEY, "-inf", cutoff)
+        return pruned
+
+    async def rebuild_stats(self, page_size: int = CHAT_STATS_PAGE_SIZE) -> Dict[str, int]:
+        """
+        Dựng lại thống kê từ dữ liệu session: SCAN theo trang (không chặn Redis như KEYS),
+        mỗi trang một pipeline đọc ZCARD + TTL và một MULTI ghi index. Counter cập nhật theo
+        phần chênh nên message ghi đồng thời trong lúc dựng không bị đếm hai lần
+        """
+        started = time.perf_counter()
+        await self.client.delete(CHAT_STATS_KEY, CHAT_STATS_USERS_KEY,
+                                 CHAT_STATS_SESSIONS_KEY, CHAT_STATS_SESSION_COUNTS_KEY)
+        now = time.time()
+        cursor, pages, indexed = 0, 0, 0
+        while True:
+            cursor, keys = await self.client.scan(cursor, match="chat:user:*:session:*", count=page_size)
+            sessions = []
+            for key in keys:
+                parsed = self.parse_user_session_key(key)
+                if parsed is not None:
+                    sessions.append((key, *parsed))
+            indexed += await self._index_sessions(sessions, now)
+            pages += 1
+            if cursor == 0:
+                break
+        await self.client.hset(CHAT_STATS_KEY, "rebuilt_at", now)
+        print(f"[Redis Stats] Rebuilt chat stats: {indexed} sessions, {pages} SCAN pages "
+              f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+        return {"sessions": indexed, "pages": pages}
+
+    async def _index_sessions(self, sessions: List[Tuple[str, str, str]], now: float) -> int:
+        """Đưa một trang session (key, user_id, session_id) vào thống kê, trả về số session hợp lệ"""
+        if not sessions:
+            return 0
+        users = sorted({user_id for _, user_id, _ in sessions})
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, _, _ in sessions:
+                pipe.zcard(key)
+                pipe.ttl(key)
+            for user_id in users:
+                pipe.zscore(CHAT_STATS_USERS_KEY, user_id)
+            results = await pipe.execute(raise_on_error=False)
+
+        # Lần hoạt động cuối = lúc TTL được làm mới (mỗi lần ghi đặt lại TTL đầy đủ)
+        entries, last_activity = [], {}
+        for position, (key, user_id, session_id) in enumerate(sessions):
+            count, ttl = results[position * 2], results[position * 2 + 1]
+            if isinstance(count, Exception) or not count:
+                continue  # Không phải sorted set message (key cũ) hoặc đã hết hạn
+            activity = now - self.ttl + ttl if isinstance(ttl, int) and ttl > 0 else now
+            entries.append((key, user_id, session_id, count, activity))
+            last_activity[user_id] = max(last_activity.get(user_id, 0.0), activity)
+        for position, user_id in enumerate(users):
+            score = results[len(sessions) * 2 + position]
+            if user_id in last_activity and isinstance(score, float):
+                last_activity[user_id] = max(last_activity[user_id], score)
+        if not entries:
+            return 0
+
+        async with self.client.pipeline(transaction=True) as pipe:
+            for key, user_id, session_id, count, activity in entries:
+                pipe.zadd(CHAT_STATS_SESSIONS_KEY, {key: activity})
+                pipe.hget(CHAT_STATS_SESSION_COUNTS_KEY, key)
+                pipe.hset(CHAT_STATS_SESSION_COUNTS_KEY, key, count)
+                activity_key = self.get_user_activity_key(user_id)
+                pipe.zadd(activity_key, {session_id: activity})
+                pipe.expire(activity_key, self.ttl)
+            if last_activity:
+                pipe.zadd(CHAT_STATS_USERS_KEY, last_activity)
+            results = await pipe.execute()
+        new_sessions = sum(1 for position in range(len(entries)) if results[position * 5])
+        messages = sum(count - int(results[position * 5 + 1] or 0)
+                       for position, (_, _, _, count, _) in enumerate(entries))
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(CHAT_STATS_KEY, "sessions", new_sessions)
+            pipe.hincrby(CHAT_STATS_KEY, "messages", messages)
+            await pipe.execute()
+        return len(entries)
+
+    async def get_chat_stats(self) -> Dict[str, int]:
+        """Tổng user / session / message đang còn trong Redis - O(1) sau khi prune session hết hạn"""
+        await self.ensure_stats()
+        await self.prune_stats()
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hmget(CHAT_STATS_KEY, "sessions", "messages")
+            pipe.zcard(CHAT_STATS_USERS_KEY)
+            pipe.zcard(CHAT_STATS_SESSIONS_KEY)
+            (sessions, messages), users, active_sessions = await pipe.execute()
+        return {
+            "total_users": users,
+            "total_sessions": int(sessions or 0),
+            "total_messages": int(messages or 0),
+            "active_sessions": active_sessions
+        }
+
+    async def get_users_chat_history(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Tóm tắt chat của các user, hoạt động gần nhất trước (phân trang theo offset / limit)"""
+        await self.ensure_stats()
+        await self.prune_stats()
+        stop = offset + limit - 1 if limit else -1
+        user_ids = await self.client.zrevrange(CHAT_STATS_USERS_KEY, offset, stop)
+        return [summary for summary in await self._user_summaries(user_ids) if summary["total_sessions"]]
+
+    async def get_user_chat_summary(self, user_id: str) -> Dict[str, Any]:
+        """Tóm tắt chat của một user (session theo hoạt động gần nhất)"""
+        await self.ensure_stats()
+        return (await self._user_summaries([user_id]))[0]
+
+    async def _user_summaries(self, user_ids: List[str]) -> List[Dict[str, Any]]:
+        """Session còn hạn của từng user + created_at / số message - hai pipeline cho cả trang"""
+        if not user_ids:
+            return []
+        cutoff = time.time() - self.ttl
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zrevrangebyscore(self.get_user_activity_key(user_id), "+inf", f"({cutoff}", withscores=True)
+            activities = await pipe.execute()
+
+        async with self.client.pipeline(transaction=False) as pipe:
+            for user_id, sessions in zip(user_ids, activities):
+                for session_id, _ in sessions:
+                    pipe.hget(self.get_session_meta_key(user_id, session_id), "created_at")
+                    pipe.hget(CHAT_STATS_SESSION_COUNTS_KEY, self.get_user_session_key(user_id, session_id))
+            details = iter(await pipe.execute())
+
+        summaries = []
+        for user_id, sessions in zip(user_ids, activities):
+            summary = {"user_id": user_id, "total_sessions": 0, "total_messages": 0, "sessions": []}
+            for session_id, activity in sessions:
+                created_at, message_count = next(details), int(next(details) or 0)
+                summary["sessions"].append({
+                    "session_id": session_id,
+                    "message_count": message_count,
+                    "created_at": created_at or "N/A",
+                    "last_activity": datetime.fromtimestamp(activity).isoformat()
+                })
+                summary["total_sessions"] += 1
+                summary["total_messages"] += message_count
+            summaries.append(summary)
+        return summaries
+
+    async def get_recent_sessions(self, offset: int = 0, limit: int = 20,
+                                  include_messages: bool = False) -> List[Dict[str, Any]]:
+        """Session hoạt động gần nhất trên toàn hệ thống (debug), kèm messages nếu cần"""
+        await self.ensure_stats()
+        keys = await self.client.zrevrange(CHAT_STATS_SESSIONS_KEY, offset, offset + limit - 1, withscores=True)
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, _ in keys:
+                if include_messages:
+                    pipe.zrange(key, 0, -1)
+                else:
+                    pipe.zcard(key)
+            results = await pipe.execute()
+
+        sessions = []
+        for (key, activity), result in zip(keys, results):
+            parsed = self.parse_user_session_key(key)
+            if parsed is None:
+                continue
+            session = {
+                "key": key,
+                "user_id": parsed[0],
+                "session_id": parsed[1],
+                "message_count": len(result) if include_messages else result,
+                "last_activity": datetime.fromtimestamp(activity).isoformat()
+            }
+            if include_messages:
+                session["messages"] = self._parse_messages(result)
+            sessions.append(session)
+        return sessions
+
+    async def clear_all_chat_data(self, page_size: int = CHAT_STATS_PAGE_SIZE) -> int:
+        """Xoá toàn bộ chat history (SCAN theo trang + UNLINK) và reset thống kê, trả về số key đã xoá"""
+        deleted = 0
+        cursor = 0
+        while True:
+            cursor, keys = await self.client.scan(cursor, match="chat:user:*", count=page_size)
+            if keys:
+                deleted += await self.client.unlink(*keys)
+            if cursor == 0:
+                break
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(CHAT_STATS_USERS_KEY, CHAT_STATS_SESSIONS_KEY, CHAT_STATS_SESSION_COUNTS_KEY)
+            pipe.delete(CHAT_STATS_KEY)
+            pipe.hset(CHAT_STATS_KEY, mapping={"sessions": 0, "messages": 0, "rebuilt_at": time.time()})
+            await pipe.execute()
+        return deleted
+
+
+# Global instance (set during app startup)
+_async_redis_service: Optional[AsyncRedisChatService] = None
+
+def get_async_redis_service() -> AsyncRedisChatService:
+    """Get or create async Redis service instance"""
+    global _async_redis_service
+    if _async_redis_service is None:
+        _async_redis_service = AsyncRedisChatService()
+    return _async_redis_service
+
+def set_async_redis_service(service: AsyncRedisChatService) -> None:
+    """Set async Redis service instance"""
+    global _async_redis_service
+    _async_redis_service = service
@@ -0,0 +1,175 @@
+"""
+Catalog Fragment Service
+Text context sản phẩm cho AI được render sẵn theo từng danh mục và cache theo catalog snapshot
+- Fragment "📊 THỐNG KÊ" của một danh mục và fragment "CHI TIẾT" theo
+  (danh mục, nhóm lọc, thứ tự sort, khoảng giá, chế độ specs/compact) chỉ render MỘT lần
+  cho mỗi catalog version; lượt chat chỉ chọn và join các fragment cần dùng
+- Dòng compact của từng sản phẩm (tên, giá, brand, tồn kho, ảnh) cũng render một lần
+- Snapshot reload (catalog version đổi) -> dựng cache mới, cache cũ bị bỏ
+- Top-k theo câu hỏi (catalog lớn, hybrid retrieval) render theo thứ tự xếp hạng, không cache
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from services.catalog_snapshot_service import CatalogSnapshot
+
+# === CONFIG (env) ===
+CATALOG_FRAGMENT_MAX_ENTRIES = int(os.getenv('CATALOG_FRAGMENT_MAX_ENTRIES', 1024))
+
+# Nhóm lọc của products_by_category (key fragment): toàn bộ sản phẩm active / laptop gaming / thương hiệu
+GROUP_ALL = 'all'
+GROUP_GAMING = 'gaming'
+
+SPECS_SEPARATOR = '=' * 70
+
+
+def brand_group(brand: str) -> str:
+    """Key nhóm lọc theo sản phẩm/thương hiệu cụ thể"""
+    return f"brand:{brand}"
+
+
+class CatalogFragments:
+    """Fragment context đã render của một catalog snapshot (LRU, thread-safe)"""
+
+    def __init__(self, snapshot: CatalogSnapshot, max_entries: int = CATALOG_FRAGMENT_MAX_ENTRIES):
+        self.snapshot = snapshot
+        self.max_entries = max_entries
+        self._fragments: "OrderedDict[Hashable, str]" = OrderedDict()
+        self._lines: Dict[int, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key: Hashable, render: Callable[[], str]) -> str:
+        with self._lock:
+            text = self._fragments.get(key)
+            if text is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+        # Render ngoài lock (render trùng giữa 2 thread chỉ tốn công, kết quả như nhau)
+        text = render()
+        with self._lock:
+            self._fragments[key] = text
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+        return text
+
+    def _product_line(self, row: int) -> Tuple[str, str]:
+        """(phần sau tên + giá, dòng ảnh) của một sản phẩm ở chế độ compact"""
+        parts = self._lines.get(row)
+        if parts is None:
+            snapshot = self.snapshot
+            brand = snapshot.brand_of(row)
+            stock = int(snapshot.stocks[row])
+            img_url = snapshot.img_urls[row]
+            brand_str = f" | {brand}" if brand and brand != "N/A" else ""
+            stock_str = f" | SL:{stock}" if stock else ""
+            img_line = f"   🖼️ {img_url}\n" if img_url and img_url != "N/A" else ""
+            parts = self._lines[row] = (f"{brand_str}{stock_str}\n", img_line)
+        return parts
+
+    def stats_fragment(self, group: str, category: str, prods: np.ndarray) -> str:
+        """Fragment thống kê giá + sản phẩm nổi bật của một danh mục ("" nếu không có giá)"""
+        def render() -> str:
+            snapshot = self.snapshot
+            stats = snapshot.category_stats(prods)
+            if stats is None:
+                return ""
+            best_stock = int(snapshot.stocks[stats.best_stock])
+            lines = [
+                f"━━━ {category.upper()} ({len(prods)} sản phẩm) ━━━\n",
+                f"💰 Giá: {stats.min_price:,} - {stats.max_price:,} VNĐ (TB: {stats.avg_price:,} VNĐ)\n",
+                f"⭐ RẺ NHẤT: {snapshot.names[stats.cheapest]} - {snapshot.price_of(stats.cheapest):,} VNĐ\n",
+                f"👑 CAO CẤP NHẤT: {snapshot.names[stats.most_expensive]} - {snapshot.price_of(stats.most_expensive):,} VNĐ\n",
+            ]
+            if best_stock > 0:
+                lines.append(f"📦 TỒN KHO NHIỀU: {snapshot.names[stats.best_stock]} ({best_stock} chiếc)\n")
+            lines.append("\n")
+            return "".join(lines)
+
+        return self._cached(('stats', group, category), render)
+
+    def detail_fragment(self, group: str, category: str, prods: np.ndarray, sort_band: Optional[str],
+                        price_range: Optional[Tuple[int, int]], specs: bool, highlight: bool) -> str:
+        """
+        Fragment chi tiết sản phẩm của một danh mục: lọc theo khoảng giá, sort theo yêu cầu,
+        chế độ specs (FULL document) hoặc compact (một dòng + ảnh)
+        """
+        def render() -> str:
+            snapshot = self.snapshot
+            if price_range and group == GROUP_ALL:
+                # Toàn bộ sản phẩm ACTIVE của danh mục -> lát cắt bisect trên price index
+                filtered = snapshot.price_slice(price_range, category)
+            else:
+                filtered = snapshot.in_price_range(prods, price_range) if price_range else prods
+            return self._render_detail(category, prods, snapshot.sort_indices(filtered, sort_band), specs, highlight)
+
+        key = ('detail', group, category, sort_band, tuple(price_range) if price_range else None, specs, highlight)
+        return self._cached(key, render)
+
+    def ranked_fragment(self, category: str, prods: np.ndarray, rows: np.ndarray, specs: bool, highlight: bool) -> str:
+        """
+        Fragment chi tiết cho các sản phẩm đã xếp hạng theo câu hỏi (hybrid top-k) - giữ thứ tự rows,
+        không cache (tập sản phẩm phụ thuộc từng câu hỏi); prods = toàn bộ danh mục để gắn tag
+        """
+        return self._render_detail(category, prods, rows, specs, highlight)
+
+    def _render_detail(self, category: str, prods: np.ndarray, rows: np.ndarray, specs: bool, highlight: bool) -> str:
+        snapshot = self.snapshot
+        mark = "⭐" if highlight else ""
+        parts = [f"\n{mark}━━━ {category.upper()} ({len(rows)} sản phẩm) ━━━{mark}\n"]
+
+        if specs:
+            # FULL document text từ ChromaDB (có THÔNG SỐ KỸ THUẬT đầy đủ)
+            for idx, row in enumerate(rows, 1):
+                parts.append(f"\n{SPECS_SEPARATOR}\n📱 SẢN PHẨM {idx}: {snapshot.names[row]}\n"
+                             f"{SPECS_SEPARATOR}\n{snapshot.contents[row]}\n{SPECS_SEPARATOR}\n\n")
+            return "".join(parts)
+
+        # Sản phẩm rẻ nhất / cao cấp nhất của danh mục: tính một lần cho cả danh mục
+        cheapest = snapshot.cheapest_index(prods) if len(prods) else -1
+        most_expensive = snapshot.most_expensive_index(prods) if len(prods) else -1
+        for idx, row in enumerate(rows, 1):
+            price = snapshot.price_of(row)
+            price_str = f"{price:,}" if price else "?"
+            tags = []
+            if row == cheapest:
+                tags.append("💰RẺ NHẤT")
+            if row == most_expensive:
+                tags.append("👑CAO CẤP")
+            tag_str = f" [{', '.join(tags)}]" if tags else ""
+            tail, img_line = self._product_line(int(row))
+            # Format compact: số. Tên - Giá [tags] | Brand | Stock
+            parts.append(f"{idx}. {snapshot.names[row]} - {price_str} VNĐ{tag_str}{tail}{img_line}")
+        return "".join(parts)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "version": self.snapshot.version,
+                "fragments": len(self._fragments),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Global fragments của snapshot hiện tại (dựng lại khi catalog snapshot đổi)
+_fragments: Optional[CatalogFragments] = None
+_fragments_lock = threading.Lock()
+
+def get_catalog_fragments(snapshot: CatalogSnapshot) -> CatalogFragments:
+    """Fragment cache của catalog snapshot (dựng mới khi snapshot được reload)"""
+    global _fragments
+    fragments = _fragments
+    if fragments is None or fragments.snapshot is not snapshot:
+        with _fragments_lock:
+            fragments = _fragments
+            if fragments is None or fragments.snapshot is not snapshot:
+                fragments = _fragments = CatalogFragments(snapshot)
+    return fragments
@@ -0,0 +1,314 @@
+"""
+Catalog Snapshot Service
+Snapshot dạng cột (columnar) của toàn bộ catalog sản phẩm trong ChromaDB chat
+- Parse document MỘT LẦN khi load: price/stock thành mảng NumPy, category/brand/status
+  mã hoá kiểu dictionary (mảng code + bảng giá trị), tên sản phẩm được intern
+- Chỉ reload khi catalog version đổi (webhook, sync, admin clear...) hoặc snapshot quá cũ
+- Filter / sort / thống kê min-max-avg theo category là phép toán vector trên index,
+  không dựng lại list of dict cho mỗi câu hỏi
+- Price index: mảng giá đã sort của sản phẩm ACTIVE theo từng category (dựng một lần cho
+  mỗi snapshot) -> khoảng giá bất kỳ là một lát cắt bisect O(log n)
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+# === CONFIG (env) ===
+# Reload định kỳ kể cả khi version không đổi (ghi Chroma từ process khác không qua bump)
+CATALOG_SNAPSHOT_MAX_AGE = int(os.getenv('CATALOG_SNAPSHOT_MAX_AGE', 300))
+
+# Giá trị sentinel giống logic cũ: sản phẩm không có giá xếp cuối khi tìm rẻ nhất
+MISSING_PRICE_SORT_KEY = 999999999
+
+GAMING_NAME_KEYWORDS = ('rog', 'legion', 'gaming', 'tuf')
+ACTIVE_STATUSES = ('ACTIVE', '')
+
+
+def _encode(values: Iterable[str]) -> Tuple[np.ndarray, List[str]]:
+    """Dictionary encoding: trả về (mảng code, bảng giá trị theo thứ tự xuất hiện)"""
+    table: List[str] = []
+    lookup: Dict[str, int] = {}
+    codes = []
+    for value in values:
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(table)
+            table.append(value)
+        codes.append(code)
+    return np.asarray(codes, dtype=np.int32), table
+
+
+@dataclass
+class CategoryStats:
+    """Thống kê giá của một nhóm sản phẩm (chỉ tính sản phẩm có giá)"""
+    min_price: int
+    max_price: int
+    avg_price: int
+    cheapest: int  # index trong snapshot
+    most_expensive: int
+    best_stock: int
+
+
+@dataclass
+class PriceIndex:
+    """Giá tăng dần của một nhóm sản phẩm có giá + index snapshot tương ứng (cùng thứ tự)"""
+    prices: List[int]
+    rows: np.ndarray
+
+    def bounds(self, price_range: Tuple[int, int]) -> Tuple[int, int]:
+        """Vị trí [start, end) của các giá nằm trong [min, max]"""
+        return bisect_left(self.prices, price_range[0]), bisect_right(self.prices, price_range[1])
+
+    def count(self, price_range: Tuple[int, int]) -> int:
+        start, end = self.bounds(price_range)
+        return max(end - start, 0)
+
+    def slice(self, price_range: Tuple[int, int]) -> np.ndarray:
+        """Index snapshot của các sản phẩm trong khoảng giá, theo giá tăng dần"""
+        start, end = self.bounds(price_range)
+        return self.rows[start:max(end, start)]
+
+
+@dataclass
+class CatalogSnapshot:
+    """Catalog dạng cột; mọi thao tác làm việc trên mảng index (np.ndarray int)"""
+    version: int
+    ids: List[str]
+    names: List[str]
+    contents: List[str]
+    img_urls: List[str]
+    prices: np.ndarray  # int64, 0 = không có giá
+    stocks: np.ndarray  # int64
+    category_codes: np.ndarray
+    categories: List[str]
+    brand_codes: np.ndarray
+    brands: List[str]
+    status_codes: np.ndarray
+    statuses: List[str]
+    loaded_at: float = field(default_factory=time.time)
+
+    def __post_init__(self):
+        self.names_lower = [name.lower() for name in self.names]
+        self._brands_lower = [brand.lower() for brand in self.brands]
+        self._rows: Dict[str, int] = {product_id: row for row, product_id in enumerate(self.ids)}
+        self._price_indices: Optional[Dict[Optional[str], PriceIndex]] = None
+        self._price_lock = threading.Lock()
+
+    @classmethod
+    def from_products(cls, version: int, products: Iterable[Dict[str, Any]]) -> "CatalogSnapshot":
+        """
+        Dựng snapshot từ các product dict đã parse
+        (keys: id, name, price, category, brand, stock, img_url, status, content)
+        """
+        products = list(products)
+        category_codes, categories = _encode(p['category'] for p in products)
+        brand_codes, brands = _encode(p['brand'] or '' for p in products)
+        status_codes, statuses = _encode(p['status'] for p in products)
+        return cls(
+            version=version,
+            ids=[p['id'] for p in products],
+            names=[sys.intern(p['name']) for p in products],
+            contents=[p['content'] for p in products],
+            img_urls=[p['img_url'] for p in products],
+            prices=np.fromiter((p['price'] or 0 for p in products), dtype=np.int64, count=len(products)),
+            stocks=np.fromiter((p['stock'] or 0 for p in products), dtype=np.int64, count=len(products)),
+            category_codes=category_codes,
+            categories=categories,
+            brand_codes=brand_codes,
+            brands=brands,
+            status_codes=status_codes,
+            statuses=statuses,
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def is_stale(self, version: int, max_age: int = CATALOG_SNAPSHOT_MAX_AGE) -> bool:
+        """Cần reload nếu version đổi hoặc snapshot đã quá max_age giây"""
+        return self.version != version or (max_age > 0 and time.time() - self.loaded_at > max_age)
+
+    # === INDEX SELECTION ===
+
+    def all_indices(self) -> np.ndarray:
+        return np.arange(len(self), dtype=np.int64)
+
+    def active_indices(self) -> np.ndarray:
+        """Index các sản phẩm ACTIVE (status rỗng coi như ACTIVE)"""
+        codes = [i for i, status in enumerate(self.statuses) if status in ACTIVE_STATUSES]
+        return np.flatnonzero(np.isin(self.status_codes, codes))
+
+    def rows_of(self, product_ids: Iterable[str]) -> np.ndarray:
+        """Index snapshot của các product id (giữ thứ tự, bỏ id không có trong snapshot)"""
+        rows = [self._rows[pid] for pid in product_ids if pid in self._rows]
+        return np.asarray(rows, dtype=np.int64)
+
+    def category_of(self, idx: int) -> str:
+        return self.categories[self.category_codes[idx]]
+
+    def brand_of(self, idx: int) -> str:
+        return self.brands[self.brand_codes[idx]]
+
+    def _category_code_mask(self, predicate) -> np.ndarray:
+        """Mask theo category: đánh giá predicate một lần cho mỗi giá trị trong bảng"""
+        table = np.fromiter((bool(predicate(c)) for c in self.categories), dtype=bool, count=len(self.categories))
+        return table[self.category_codes] if len(self) else np.zeros(0, dtype=bool)
+
+    def gaming_laptop_indices(self, indices: np.ndarray) -> np.ndarray:
+        """Laptop có tên chứa keyword gaming (ROG, Legion, TUF...)"""
+        laptop = self._category_code_mask(lambda c: 'laptop' in (c or '').lower())[indices]
+        gaming = np.fromiter(
+            (any(kw in self.names_lower[i] for kw in GAMING_NAME_KEYWORDS) for i in indices),
+            dtype=bool, count=len(indices)
+        )
+        return indices[laptop & gaming]
+
+    def matching_indices(self, indices: np.ndarray, keywords: Iterable[str]) -> np.ndarray:
+        """Sản phẩm có tên HOẶC thương hiệu chứa một trong các keyword"""
+        keywords = tuple(keywords)
+        brand_table = np.fromiter(
+            (any(kw in brand for kw in keywords) for brand in self._brands_lower),
+            dtype=bool, count=len(self.brands)
+        )
+        brand_match = brand_table[self.brand_codes[indices]]
+        name_match = np.fromiter(
+            (any(kw in self.names_lower[i] for kw in keywords) for i in indices),
+            dtype=bool, count=len(indices)
+        )
+        return indices[brand_match | name_match]
+
+    def in_category(self, indices: np.ndarray, category: str) -> np.ndarray:
+        """Sản phẩm thuộc category (category chuẩn hoá)"""
+        return indices[self._category_code_mask(lambda c: c == category)[indices]]
+
+    def in_price_range(self, indices: np.ndarray, price_range: Tuple[int, int]) -> np.ndarray:
+        """Sản phẩm có giá nằm trong [min, max]"""
+        prices = self.prices[indices]
+        mask = (prices > 0) & (prices >= price_range[0]) & (prices <= price_range[1])
+        return indices[mask]
+
+    def price_index(self, category: Optional[str] = None) -> PriceIndex:
+        """
+        Price index của sản phẩm ACTIVE có giá: toàn catalog (category=None) hoặc một category
+        Dựng MỘT lần cho mọi category khi dùng lần đầu
+        """
+        indices = self._price_indices
+        if indices is None:
+            with self._price_lock:
+                indices = self._price_indices
+                if indices is None:
+                    indices = self._price_indices = self._build_price_indices()
+        index = indices.get(category)
+        return index if index is not None else PriceIndex([], np.zeros(0, dtype=np.int64))
+
+    def _build_price_indices(self) -> Dict[Optional[str], PriceIndex]:
+        active = self.active_indices()
+        priced = active[self.prices[active] > 0]
+        rows = priced[np.argsort(self.prices[priced], kind='stable')]
+        codes = self.category_codes[rows]
+        indices: Dict[Optional[str], PriceIndex] = {None: PriceIndex(self.prices[rows].tolist(), rows)}
+        for code in np.unique(codes):
+            category_rows = rows[codes == code]
+            indices[self.categories[code]] = PriceIndex(self.prices[category_rows].tolist(), category_rows)
+        return indices
+
+    def price_slice(self, price_range: Tuple[int, int], category: Optional[str] = None) -> np.ndarray:
+        """
+        Sản phẩm ACTIVE (của category) có giá trong [min, max] - bisect trên price index,
+        trả về theo thứ tự catalog (giống in_price_range trên active_indices)
+        """
+        return np.sort(self.price_index(category).slice(price_range))
+
+    def group_by_category(self, indices: np.ndarray) -> Dict[str, np.ndarray]:
+        """Nhóm index theo category, giữ thứ tự xuất hiện đầu tiên (giống dict của logic cũ)"""
+        if len(indices) == 0:
+            return {}
+        codes = self.category_codes[indices]
+        unique_codes, first_pos = np.unique(codes, return_index=True)
+        groups: Dict[str, np.ndarray] = {}
+        for code in unique_codes[np.argsort(first_pos)]:
+            groups[self.categories[code]] = indices[codes == code]
+        return groups
+
+    # === SORT / STATS ===
+
+    def sort_indices(self, indices: np.ndarray, price_band: Optional[str] = None) -> np.ndarray:
+        """
+        Sort ổn định: 'low' theo giá tăng dần, 'high' theo giá giảm dần,
+        mặc định theo tồn kho giảm dần
+        """
+        if price_band == 'low':
+            prices = self.prices[indices]
+            keys = np.where(prices > 0, prices, MISSING_PRICE_SORT_KEY)
+        elif price_band == 'high':
+            keys = -self.prices[indices]
+        else:
+            keys = -self.stocks[indices]
+        return indices[np.argsort(keys, kind='stable')]
+
+    def cheapest_index(self, indices: np.ndarray) -> int:
+        prices = self.prices[indices]
+        return int(indices[np.argmin(np.where(prices > 0, prices, MISSING_PRICE_SORT_KEY))])
+
+    def most_expensive_index(self, indices: np.ndarray) -> int:
+        return int(indices[np.argmax(self.prices[indices])])
+
+    def category_stats(self, indices: np.ndarray) -> Optional[CategoryStats]:
+        """min / max / avg (floor) + sản phẩm nổi bật; None nếu không có sản phẩm nào có giá"""
+        prices = self.prices[indices]
+        priced = prices[prices > 0]
+        if priced.size == 0:
+            return None
+        return CategoryStats(
+            min_price=int(priced.min()),
+            max_price=int(priced.max()),
+            avg_price=int(priced.sum() // priced.size),
+            cheapest=self.cheapest_index(indices),
+            most_expensive=self.most_expensive_index(indices),
+            best_stock=int(indices[np.argmax(self.stocks[indices])]),
+        )
+
+    # === ROW ACCESS ===
+
+    def price_of(self, idx: int) -> Optional[int]:
+        price = int(self.prices[idx])
+        return price or None
+
+    def to_product(self, idx: int) -> Dict[str, Any]:
+        """Product dict cùng format với logic cũ (id, name, price, category, brand, stock, ...)"""
+        return {
+            "id": self.ids[idx],
+            "name": self.names[idx],
+            "price": self.price_of(idx),
+            "category": self.category_of(idx),
+            "brand": self.brand_of(idx),
+            "stock": int(self.stocks[idx]),
+            "img_url": self.img_urls[idx],
+            "status": self.statuses[self.status_codes[idx]],
+            "content": self.contents[idx],
+        }
+
+    def action_product(self, idx: int) -> Dict[str, Any]:
+        """{id, name, price} của một sản phẩm - format của action detection sau LLM"""
+        product_id = self.ids[idx]
+        return {
+            'id': int(product_id) if product_id.isdigit() else product_id,
+            'name': self.names[idx],
+            'price': int(self.prices[idx]),
+        }
+
+    def action_products(self, limit: int = 50, price_range: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+        """
+        action_product của `limit` sản phẩm đầu catalog
+        (có price_range: sản phẩm ACTIVE trong khoảng giá qua price index, nếu có)
+        """
+        if price_range:
+            rows = self.price_slice(price_range)[:limit]
+            if len(rows):
+                return [self.action_product(int(idx)) for idx in rows]
+        return [self.action_product(idx) for idx in range(min(limit, len(self)))]
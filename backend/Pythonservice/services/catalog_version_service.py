@@ -0,0 +1,100 @@
+"""
+Catalog Version Service
+Version stamp của dữ liệu catalog (products, discounts, knowledge) trong ChromaDB chat
+- Tăng mỗi khi sync/ghi dữ liệu catalog (webhook, manual sync, sync-system-data, admin clear...)
+- Lưu trong Redis (INCR) để mọi worker dùng chung; fallback counter in-process khi không có Redis
+- Các cache phụ thuộc catalog (response cache, ...) đưa version vào key -> tự invalid khi sync
+- Route async (lượt chat) đọc version qua async connection pool: get_catalog_version_async()
+"""
+import threading
+from typing import Optional
+
+from services.redis_chat_service import get_redis_service
+from services.async_redis_chat_service import get_async_redis_service
+
+CATALOG_VERSION_KEY = "chat:catalog:version"
+
+
+class CatalogVersionService:
+    """Đọc / tăng version stamp của catalog"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local_version = 0
+
+    def _redis(self):
+        """Redis client nếu đang kết nối, None nếu không"""
+        try:
+            return get_redis_service().client
+        except Exception:
+            return None
+
+    def get_version(self) -> int:
+        """Version hiện tại (0 nếu chưa sync lần nào)"""
+        client = self._redis()
+        if client is not None:
+            try:
+                value = client.get(CATALOG_VERSION_KEY)
+                return int(value) if value else 0
+            except Exception as e:
+                print(f"[CatalogVersion] Redis read failed, using local version: {e}")
+        return self._local_version
+
+    async def get_version_async(self) -> int:
+        """Như get_version nhưng qua async connection pool (không chặn event loop)"""
+        try:
+            value = await get_async_redis_service().client.get(CATALOG_VERSION_KEY)
+            return int(value) if value else 0
+        except Exception as e:
+            print(f"[CatalogVersion] Redis read failed, using local version: {e}")
+        return self._local_version
+
+    def bump(self, reason: str = "") -> int:
+        """
+        Tăng version sau khi dữ liệu catalog thay đổi
+
+        Args:
+            reason: Nguồn thay đổi (để log)
+
+        Returns:
+            Version mới
+        """
+        with self._lock:
+            self._local_version += 1
+            version = self._local_version
+
+        client = self._redis()
+        if client is not None:
+            try:
+                version = int(client.incr(CATALOG_VERSION_KEY))
+            except Exception as e:
+                print(f"[CatalogVersion] Redis bump failed, using local version: {e}")
+
+        print(f"[CatalogVersion] Catalog version -> {version}" + (f" ({reason})" if reason else ""))
+        return version
+
+
+# Global singleton instance
+_catalog_version_service: Optional[CatalogVersionService] = None
+
+def get_catalog_version_service() -> CatalogVersionService:
+    """Get global catalog version service instance"""
+    global _catalog_version_service
+    if _catalog_version_service is None:
+        _catalog_version_service = CatalogVersionService()
+    return _catalog_version_service
+
+
+def get_catalog_version() -> int:
+    """Shortcut: version hiện tại của catalog"""
+    return get_catalog_version_service().get_version()
+
+
+async def get_catalog_version_async() -> int:
+    """Shortcut: version hiện tại của catalog (async)"""
+    return await get_catalog_version_service().get_version_async()
+
+
+def bump_catalog_version(reason: str = "") -> int:
+    """Shortcut: tăng version catalog"""
+    return get_catalog_version_service().bump(reason)
@@ -5,12 +5,39 @@ Session thì lưu ở Redis (đã có sẵn)
 """
 
 import chromadb
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import os
 from pathlib import Path
 import json
+import threading
 from datetime import datetime
 
+import numpy as np
+
+from services.catalog_version_service import bump_catalog_version, get_catalog_version
+from services.catalog_snapshot_service import CatalogSnapshot
+from services.catalog_fragment_service import GROUP_ALL, GROUP_GAMING, brand_group, get_catalog_fragments
+from services.embedding_cache_service import get_embedding_function
+from services.query_embedding_service import (
+    EmbeddingContext, embedding_for, get_query_embedder,
+    PROBE_ORDER_HISTORY, PROBE_USER_PROFILE, PROBE_ACTIVE_MODAL_CONFIG, PROBE_MODAL_CONFIG
+)
+from services.product_metadata_service import (
+    build_product_metadata, build_product_where, first_image_url, is_typed_metadata,
+    normalize_category, product_fields
+)
+from services.query_intent_service import QueryIntent, analyze_query, BRAND_KEYWORDS
+from services.product_search_service import get_product_lexical_index, reciprocal_rank_fusion
+
+# === CONFIG (env) ===
+# Catalog ACTIVE lớn hơn ngưỡng này -> chat chỉ gửi top-k sản phẩm (BM25 + vector, RRF) thay vì toàn bộ
+CHAT_FULL_CATALOG_MAX_PRODUCTS = int(os.getenv('CHAT_FULL_CATALOG_MAX_PRODUCTS', 150))
+CHAT_HYBRID_TOP_K = int(os.getenv('CHAT_HYBRID_TOP_K', 12))
+
+# Marker phân tách các phần trong output của get_all_products_for_ai
+PRODUCT_DETAIL_MARKER = "\n📱 CHI TIẾT TẤT CẢ SẢN PHẨM:\n"
+PRODUCT_GUIDE_MARKER = "\n\n🤖 HƯỚNG DẪN TƯ VẤN CHO AI:\n"
+
 class ChatAIRAGChromaService:
     """
     Service quản lý Chroma DB cho Chat AI RAG
@@ -46,6 +73,9 @@ class ChatAIRAGChromaService:
             )
             self.client = chromadb.Client(settings)
         
+        # Embedding function có cache (LRU + disk) dùng chung cho mọi collection
+        self.embedding_function = get_embedding_function()
+        
         # Collections
         self.product_collection = None
         self.knowledge_collection = None
@@ -56,6 +86,11 @@ class ChatAIRAGChromaService:
         self.orders_collection = None  # Orders collection for sync
         self.discounts_collection = None  # Discounts collection for sync
         
+        # Snapshot columnar của catalog sản phẩm (reload khi catalog version đổi)
+        self._catalog_snapshot: Optional[CatalogSnapshot] = None
+        self._catalog_snapshot_lock = threading.Lock()
+        self._product_metadata_checked = False  # Đã kiểm tra / migrate metadata có kiểu
+        
         # Remove automatic initialization
         # self._initialize_collections()
     
@@ -65,6 +100,7 @@ class ChatAIRAGChromaService:
             self.product_collection = self.client.get_or_create_collection(
                 name="chat_ai_products",
                 metadata={"description": "Product data for AI Chat RAG"},
+                embedding_function=self.embedding_function,
             )
         return self.product_collection
     
@@ -74,6 +110,7 @@ class ChatAIRAGChromaService:
             self.knowledge_collection = self.client.get_or_create_collection(
                 name="chat_ai_knowledge",
                 metadata={"description": "Knowledge base for AI Chat"},
+                embedding_function=self.embedding_function,
             )
         return self.knowledge_collection
     
@@ -83,6 +120,7 @@ class ChatAIRAGChromaService:
             self.context_collection = self.client.get_or_create_collection(
                 name="chat_ai_context",
                 metadata={"description": "Context data for Chat responses"},
+                embedding_function=self.embedding_function,
             )
         return self.context_collection
     
@@ -92,6 +130,7 @@ class ChatAIRAGChromaService:
             self.modal_config_collection = self.client.get_or_create_collection(
                 name="chat_ai_modal_config",
                 metadata={"description": "Modal configuration for AI Chat"},
+                embedding_function=self.embedding_function,
             )
         return self.modal_config_collection
     
@@ -101,6 +140,7 @@ class ChatAIRAGChromaService:
             self.users_collection = self.client.get_or_create_collection(
                 name="chat_ai_users",
                 metadata={"description": "User profile information for AI Chat"},
+                embedding_function=self.embedding_function,
             )
         return self.users_collection
     
@@ -110,6 +150,7 @@ class ChatAIRAGChromaService:
             self.carts_collection = self.client.get_or_create_collection(
                 name="chat_ai_carts",
                 metadata={"description": "Cart data for AI Chat context"},
+                embedding_function=self.embedding_function,
             )
         return self.carts_collection
     
@@ -119,6 +160,7 @@ class ChatAIRAGChromaService:
             self.orders_collection = self.client.get_or_create_collection(
                 name="chat_ai_orders",
                 metadata={"description": "Order data for AI Chat RAG"},
+                embedding_function=self.embedding_function,
             )
         return self.orders_collection
     
@@ -128,6 +170,7 @@ class ChatAIRAGChromaService:
             self.discounts_collection = self.client.get_or_create_collection(
                 name="chat_ai_discounts",
                 metadata={"description": "Discount codes for AI Chat"},
+                embedding_function=self.embedding_function,
             )
         return self.discounts_collection
         """Khởi tạo các collections cho Chat AI RAG"""
@@ -136,18 +179,21 @@ class ChatAIRAGChromaService:
             self.product_collection = self.client.get_or_create_collection(
                 name="chat_ai_products",
                 metadata={"description": "Product data for AI Chat RAG"},
+                embedding_function=self.embedding_function,
             )
             
             # Collection cho knowledge base
             self.knowledge_collection = self.client.get_or_create_collection(
                 name="chat_ai_knowledge",
                 metadata={"description": "Knowledge base for AI Chat"},
+                embedding_function=self.embedding_function,
             )
             
             # Collection cho context retrieval
             self.context_collection = self.client.get_or_create_collection(
                 name="chat_ai_context",
                 metadata={"description": "Context data for Chat responses"},
+                embedding_function=self.embedding_function,
             )
             
             print("[ChatAIRAGChromaService] Collections initialized successfully")
@@ -157,13 +203,14 @@ class ChatAIRAGChromaService:
     
     # === PRODUCT DATA OPERATIONS ===
     
-    def add_product(self, product_id: int, product_data: Dict[str, Any]) -> bool:
+    def add_product(self, product_id: int, product_data: Dict[str, Any], bump_version: bool = True) -> bool:
         """
         Thêm product vào Chroma
         
         Args:
             product_id: ID của product
             product_data: Dữ liệu product (name, price, description, etc.)
+            bump_version: Tăng catalog version sau khi thêm (batch tự tăng một lần)
             
         Returns:
             True nếu thành công
@@ -174,20 +221,34 @@ class ChatAIRAGChromaService:
             # Tạo text để embedding từ product data
             text_content = self._format_product_text(product_data)
             
+            # Metadata có kiểu (price:int, category_norm, brand, stock:int, img_url) - retrieval đọc trực tiếp
+            details = product_data.get("details")
+            if isinstance(details, str):
+                try:
+                    details = json.loads(details)
+                except ValueError:
+                    details = None
+            brand = product_data.get("brand") or (details.get("brand") if isinstance(details, dict) else "")
+            
             self._get_or_create_product_collection().add(
                 ids=[doc_id],
                 documents=[text_content],
-                metadatas=[{
-                    "product_id": str(product_id),
-                    "product_name": product_data.get("name", ""),
-                    "price": str(product_data.get("price", 0)),
-                    "category": product_data.get("category", ""),
-                    "status": product_data.get("status", "ACTIVE"),
-                    "timestamp": datetime.now().isoformat(),
-                }]
+                metadatas=[build_product_metadata(
+                    product_id,
+                    product_data.get("name", ""),
+                    price=product_data.get("price", 0),
+                    category=product_data.get("category", product_data.get("categoryName", "")),
+                    brand=brand,
+                    stock=product_data.get("stock", product_data.get("quantity", 0)),
+                    img_url=product_data.get("img_url") or first_image_url(product_data.get("imageUrls")),
+                    status=product_data.get("status", "ACTIVE"),
+                    timestamp=datetime.now().isoformat(),
+                )]
             )
             
             print(f"[ChatAIRAGChromaService] Product {product_id} added successfully")
+            if bump_version:
+                bump_catalog_version(f"product {product_id} added")
             return True
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error adding product {product_id}: {e}")
@@ -199,6 +260,7 @@ class ChatAIRAGChromaService:
             doc_id = f"product_{product_id}"
             self._get_or_create_product_collection().delete(ids=[doc_id])
             print(f"[ChatAIRAGChromaService] Product {product_id} deleted")
+            bump_catalog_version(f"product {product_id} deleted")
             return True
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error deleting product {product_id}: {e}")
@@ -216,8 +278,10 @@ class ChatAIRAGChromaService:
         """
         success_count = 0
         for product in products:
-            if self.add_product(product.get("id"), product):
+            if self.add_product(product.get("id"), product, bump_version=False):
                 success_count += 1
+        if success_count:
+            bump_catalog_version(f"{success_count} products added")
         return success_count
     
     # === KNOWLEDGE BASE OPERATIONS ===
@@ -248,6 +312,7 @@ class ChatAIRAGChromaService:
             )
             
             print(f"[ChatAIRAGChromaService] Knowledge {knowledge_id} added")
+            bump_catalog_version(f"knowledge {knowledge_id} added")
             return True
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error adding knowledge: {e}")
@@ -258,6 +323,7 @@ class ChatAIRAGChromaService:
         try:
             doc_id = f"knowledge_{knowledge_id}"
             self._get_or_create_knowledge_collection().delete(ids=[doc_id])
+            bump_catalog_version(f"knowledge {knowledge_id} deleted")
             return True
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error deleting knowledge: {e}")
@@ -318,7 +384,7 @@ class ChatAIRAGChromaService:
         """
         try:
             results = self._get_or_create_modal_config_collection().query(
-                query_texts=["active modal config"],
+                **get_query_embedder().probe_query_args(PROBE_ACTIVE_MODAL_CONFIG),
                 where={"is_active": True},
                 n_results=1
             )
@@ -347,7 +413,7 @@ class ChatAIRAGChromaService:
         """
         try:
             results = self._get_or_create_modal_config_collection().query(
-                query_texts=["modal config"],
+                **get_query_embedder().probe_query_args(PROBE_MODAL_CONFIG),
                 n_results=100
             )
             
@@ -379,7 +445,142 @@ class ChatAIRAGChromaService:
             print(f"[ChatAIRAGChromaService] Error deleting modal config {modal_name}: {e}")
             return False
     
-    def get_all_products_for_ai(self, query: str = "") -> str:
+    def get_catalog_snapshot(self, force_reload: bool = False) -> CatalogSnapshot:
+        """
+        Snapshot columnar của catalog sản phẩm
+        Load một lần, chỉ reload khi catalog version đổi (sync/webhook) hoặc snapshot quá cũ
+        """
+        version = get_catalog_version()
+        snapshot = self._catalog_snapshot
+        if snapshot is not None and not force_reload and not snapshot.is_stale(version):
+            return snapshot
+        
+        with self._catalog_snapshot_lock:
+            snapshot = self._catalog_snapshot
+            if snapshot is None or force_reload or snapshot.is_stale(version):
+                snapshot = self._load_catalog_snapshot(version)
+                self._catalog_snapshot = snapshot
+        return snapshot
+    
+    def _load_catalog_snapshot(self, version: int) -> CatalogSnapshot:
+        """Đọc toàn bộ product collection (metadata có kiểu, không parse document) và dựng snapshot"""
+        collection = self._get_or_create_product_collection()
+        total_count = collection.count()
+        results = collection.get(
+            limit=total_count,
+            include=["documents", "metadatas"]
+        ) if total_count else {}
+        
+        ids = (results or {}).get("ids") or []
+        documents = (results or {}).get("documents") or []
+        metadatas = (results or {}).get("metadatas") or []
+        metadatas = self._migrate_product_rows(collection, ids, documents, metadatas)
+        
+        products = []
+        for i, doc in enumerate(documents):
+            product = product_fields(metadatas[i])
+            product["name"] = product["name"] or f"Sản phẩm {i+1}"
+            product["content"] = doc
+            products.append(product)
+        
+        snapshot = CatalogSnapshot.from_products(version, products)
+        print(f"[ChatAIRAGChromaService] Catalog snapshot loaded: {len(snapshot)} products, "
+              f"{len(snapshot.categories)} categories (catalog version {version})")
+        return snapshot
+    
+    # === PRODUCT METADATA MIGRATION ===
+    
+    def _typed_metadata_from_document(self, doc: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Metadata có kiểu cho document ingest theo format cũ:
+        parse text ("Giá: ... VNĐ", "Danh mục:", "Thương hiệu:"...) MỘT LẦN, fallback về metadata cũ
+        """
+        doc = doc or ""
+        stock = self._extract_field_from_content(doc, "Số lượng tồn kho:")
+        category = self._extract_field_from_content(doc, "Danh mục:") or metadata.get("category", "")
+        img_url = (self._extract_field_from_content(doc, "URL ảnh chính:")
+                   or metadata.get("img_url")
+                   or first_image_url(metadata.get("image_urls")))
+        extra = {k: v for k, v in metadata.items()
+                 if k not in ("product_id", "product_name", "price", "category", "brand", "stock", "img_url", "status")}
+        return build_product_metadata(
+            metadata.get("product_id", ""),
+            metadata.get("product_name", ""),
+            price=self._extract_price_from_content(doc) or metadata.get("price", 0),
+            category=category,
+            brand=self._extract_field_from_content(doc, "Thương hiệu:") or metadata.get("brand", ""),
+            stock=stock if stock.isdigit() else metadata.get("stock", metadata.get("quantity", 0)),
+            img_url=img_url if img_url != "N/A" else "",
+            status=metadata.get("status", "ACTIVE"),
+            **extra
+        )
+    
+    def _migrate_product_rows(self, collection, ids: List[str], documents: List[str],
+                              metadatas: List[Optional[Dict[str, Any]]], batch_size: int = 200) -> List[Dict[str, Any]]:
+        """
+        Chuyển các row còn metadata kiểu cũ sang schema có kiểu (collection.update, không embed lại)
+        
+        Returns:
+            List metadata có kiểu, cùng thứ tự với input
+        """
+        typed = []
+        legacy_ids, legacy_metas = [], []
+        for i, doc in enumerate(documents):
+            metadata = (metadatas[i] if i < len(metadatas) else None) or {}
+            if is_typed_metadata(metadata):
+                typed.append(metadata)
+                continue
+            converted = self._typed_metadata_from_document(doc, metadata)
+            typed.append(converted)
+            if i < len(ids):
+                legacy_ids.append(ids[i])
+                legacy_metas.append(converted)
+        
+        if legacy_ids:
+            for start in range(0, len(legacy_ids), batch_size):
+                collection.update(
+                    ids=legacy_ids[start:start + batch_size],
+                    metadatas=legacy_metas[start:start + batch_size]
+                )
+            print(f"[ChatAIRAGChromaService] Migrated {len(legacy_ids)} products to typed metadata")
+        self._product_metadata_checked = True
+        return typed
+    
+    def migrate_product_metadata(self) -> Dict[str, int]:
+        """
+        Migration một lần: ghi metadata có kiểu (price:int, category_norm, brand, stock:int, img_url)
+        cho các product document ingest trước khi có schema mới
+        
+        Returns:
+            {"total": ..., "migrated": ...}
+        """
+        collection = self._get_or_create_product_collection()
+        total_count = collection.count()
+        if total_count == 0:
+            self._product_metadata_checked = True
+            return {"total": 0, "migrated": 0}
+        
+        results = collection.get(limit=total_count, include=["documents", "metadatas"])
+        metadatas = results.get("metadatas") or []
+        legacy_count = sum(1 for m in metadatas if not is_typed_metadata(m))
+        self._migrate_product_rows(collection, results.get("ids") or [], results.get("documents") or [], metadatas)
+        if legacy_count:
+            # Snapshot đang cache đọc từ metadata -> buộc reload
+            self._catalog_snapshot = None
+        return {"total": total_count, "migrated": legacy_count}
+    
+    def _ensure_product_metadata(self) -> None:
+        """Chạy migration metadata lần đầu nếu chưa kiểm tra (where filter cần metadata có kiểu)"""
+        if self._product_metadata_checked:
+            return
+        try:
+            self.migrate_product_metadata()
+        except Exception as e:
+            print(f"[ChatAIRAGChromaService] Product metadata migration failed: {e}")
+    
+    def get_all_products_for_ai(self, query: str = "", intent: Optional[QueryIntent] = None,
+                                snapshot: Optional[CatalogSnapshot] = None,
+                                embedding: Optional[EmbeddingContext] = None) -> str:
         """
         Lấy TOÀN BỘ sản phẩm từ ChromaDB với đề xuất thông minh
         
@@ -389,370 +590,179 @@ class ChatAIRAGChromaService:
         - Highlight sản phẩm nổi bật cho mỗi category
         - Gợi ý thông minh dựa trên query
         
+        Dữ liệu đọc từ catalog snapshot (columnar, cache theo catalog version),
+        filter / sort / thống kê chạy trên mảng index thay vì parse lại toàn bộ document;
+        fragment thống kê / chi tiết của từng danh mục render sẵn một lần cho mỗi catalog version
+        
+        Catalog ACTIVE lớn hơn CHAT_FULL_CATALOG_MAX_PRODUCTS: phần chi tiết chỉ gồm
+        CHAT_HYBRID_TOP_K sản phẩm liên quan nhất (BM25 + vector, RRF) thay vì toàn bộ catalog
+        
         Args:
             query: Query từ user
+            intent: QueryIntent đã phân tích sẵn (None -> analyze_query(query))
+            snapshot: Catalog snapshot của lượt chat (None -> get_catalog_snapshot())
+            embedding: EmbeddingContext của lượt chat (vector search của chế độ top-k)
             
         Returns:
             Formatted string với đề xuất thông minh
         """
         try:
-            collection = self._get_or_create_product_collection()
-            total_count = collection.count()
+            if snapshot is None:
+                snapshot = self.get_catalog_snapshot()
+            total_count = len(snapshot)
             
             if total_count == 0:
                 return "Hiện tại shop chưa có sản phẩm nào."
             
             print(f"[ChatAIRAGChromaService] Getting ALL {total_count} products for AI with smart recommendations")
             
-            # Lấy TẤT CẢ sản phẩm từ collection
-            all_results = collection.get(
-                limit=total_count,
-                include=["documents", "metadatas"]
-            )
-            
-            if not all_results or not all_results.get("documents"):
-                return "Không thể lấy dữ liệu sản phẩm."
-            
-            # Parse và tổ chức sản phẩm theo category
-            products_by_category = {}
-            all_products = []
-            
-            for i, doc in enumerate(all_results["documents"]):
-                metadata = all_results["metadatas"][i] if all_results.get("metadatas") else {}
-                
-                # Extract thông tin
-                price = self._extract_price_from_content(doc)
-                category = self._extract_category_from_content(doc)
-                product_name = metadata.get("product_name", f"Sản phẩm {i+1}")
-                
-                # Extract thêm thông tin cho đề xuất thông minh
-                brand = self._extract_field_from_content(doc, "Thương hiệu:")
-                stock = self._extract_field_from_content(doc, "Số lượng tồn kho:")
-                img_url = self._extract_field_from_content(doc, "URL ảnh chính:")
-                
-                product_info = {
-                    "id": metadata.get("product_id", ""),
-                    "name": product_name,
-                    "price": price,
-                    "category": category,
-                    "brand": brand,
-                    "stock": int(stock) if stock and stock.isdigit() else 0,
-                    "img_url": img_url,
-                    "status": metadata.get("status", "ACTIVE"),
-                    "content": doc
-                }
-                
-                all_products.append(product_info)
-                
-                # Tổ chức theo category
-                if category not in products_by_category:
-                    products_by_category[category] = []
-                products_by_category[category].append(product_info)
-            
             # === FILTER CHỈ LẤY SẢN PHẨM ACTIVE ===
             # Lọc bỏ sản phẩm không hoạt động trước khi đề xuất
-            active_products = []
-            active_by_category = {}
-            for p in all_products:
-                status = p.get('status', 'ACTIVE')
-                if status == 'ACTIVE' or status == '':
-                    active_products.append(p)
-                    cat = p.get('category', 'Khác')
-                    if cat not in active_by_category:
-                        active_by_category[cat] = []
-                    active_by_category[cat].append(p)
-            
-            all_products = active_products
-            products_by_category = active_by_category
-            print(f"[ChatAIRAGChromaService] Filtered to {len(all_products)} ACTIVE products")
+            selected = snapshot.active_indices()
+            products_by_category = snapshot.group_by_category(selected)
+            print(f"[ChatAIRAGChromaService] Filtered to {len(selected)} ACTIVE products")
+            
+            # === PHÂN TÍCH QUERY (một lượt quét, dùng chung QueryIntent) ===
+            if intent is None:
+                intent = analyze_query(query)
+            
+            # Nhóm lọc của products_by_category -> key của fragment đã render sẵn
+            group = GROUP_ALL
             
             # === FILTER GAMING LAPTOPS ===
-            is_gaming_query = any(kw in query.lower() for kw in [
-                'gaming', 'game', 'choi game', 'chơi game', 'rog', 'legion'
-            ])
-            if is_gaming_query and 'laptop' in query.lower():
+            if intent.is_gaming and intent.category == 'laptop':
                 # Filter for gaming laptops only
-                gaming_laptops = [
-                    p for p in all_products
-                    if 'laptop' in (p.get('category') or '').lower() and
-                       any(gaming_kw in (p.get('name') or '').lower() for gaming_kw in ['rog', 'legion', 'gaming', 'tuf'])
-                ]
-                if gaming_laptops:
-                    all_products = gaming_laptops
-                    # Update category dict
-                    products_by_category = {'Laptop': gaming_laptops}
+                gaming_laptops = snapshot.gaming_laptop_indices(selected)
+                if len(gaming_laptops):
+                    selected = gaming_laptops
+                    # Update category dict (key = category đã chuẩn hoá của snapshot, như ranked_by_category)
+                    products_by_category = snapshot.group_by_category(gaming_laptops)
+                    group = GROUP_GAMING
                     print(f"[ChatAIRAGChromaService] Gaming filter applied: {len(gaming_laptops)} gaming laptops")
             
-            # === PHÂN TÍCH QUERY THÔNG MINH ===
-            query_lower = query.lower()
-            
-            # 1. Detect mục đích sử dụng
-            purpose_keywords = {
-                'gaming': ['gaming', 'game', 'chơi game', 'fps', 'pubg', 'lol', 'liên quân'],
-                'văn phòng': ['văn phòng', 'làm việc', 'office', 'word', 'excel', 'công việc'],
-                'chụp ảnh': ['chụp ảnh', 'camera', 'photography', 'quay phim', 'selfie', 'chụp hình'],
-                'học tập': ['học tập', 'sinh viên', 'học sinh', 'học online', 'học trực tuyến'],
-                'giải trí': ['giải trí', 'xem phim', 'nghe nhạc', 'youtube', 'netflix', 'tiktok']
-            }
-            
-            detected_purpose = None
-            for purpose, keywords in purpose_keywords.items():
-                if any(kw in query_lower for kw in keywords):
-                    detected_purpose = purpose
-                    break
-            
-            # 2. Detect yêu cầu về giá
-            is_low_price = any(kw in query_lower for kw in ['giá rẻ', 'rẻ', 'cheap', 'budget', 'thấp', 'tiết kiệm', 'sinh viên'])
-            is_high_price = any(kw in query_lower for kw in ['cao cấp', 'premium', 'flagship', 'đắt', 'xịn', 'tốt nhất', 'pro', 'ultra'])
-            is_mid_price = any(kw in query_lower for kw in ['tầm trung', 'vừa phải', 'không quá đắt', 'mid-range'])
-            
-            # 3. Detect khoảng giá cụ thể
-            price_range = None
-            if 'dưới 5 triệu' in query_lower or 'duoi 5 trieu' in query_lower:
-                price_range = (0, 5000000)
-            elif 'dưới 10 triệu' in query_lower or 'duoi 10 trieu' in query_lower:
-                price_range = (0, 10000000)
-            elif 'dưới 15 triệu' in query_lower or 'duoi 15 trieu' in query_lower:
-                price_range = (0, 15000000)
-            elif 'dưới 20 triệu' in query_lower or 'duoi 20 trieu' in query_lower:
-                price_range = (0, 20000000)
-            elif '10 đến 20 triệu' in query_lower or '10-20 triệu' in query_lower:
-                price_range = (10000000, 20000000)
-            elif '20 đến 30 triệu' in query_lower or '20-30 triệu' in query_lower:
-                price_range = (20000000, 30000000)
-            elif 'trên 30 triệu' in query_lower or 'tren 30 trieu' in query_lower:
-                price_range = (30000000, 999999999)
-            
-            # 4. Detect category từ query
-            target_category = None
-            category_keywords = {
-                'điện thoại': ['điện thoại', 'phone', 'smartphone', 'mobile', 'dien thoai', 'iphone', 'samsung', 'xiaomi'],
-                'laptop': ['laptop', 'máy tính', 'notebook', 'macbook', 'pc'],
-                'tai nghe': ['tai nghe', 'headphone', 'earphone', 'airpods', 'earbuds'],
-                'đồng hồ thông minh': ['đồng hồ', 'smartwatch', 'apple watch', 'galaxy watch']
-            }
-            
-            for cat, keywords in category_keywords.items():
-                if any(kw in query_lower for kw in keywords):
-                    target_category = cat
-                    break
-            
-            # 4.5. Detect QUERY VỀ THÔNG SỐ CHI TIẾT - Cần trả về FULL document text
-            is_specs_query = any(kw in query_lower for kw in [
-                'thông số chi tiết', 'thong so chi tiet', 'cấu hình', 'cau hinh',
-                'specifications', 'specs', 'chi tiết kỹ thuật', 'chi tiet ky thuat',
-                'thông số kỹ thuật', 'thong so ky thuat'
-            ])
-            
-            # 5. Detect SẢN PHẨM/THƯƠNG HIỆU CỤ THỂ từ query
-            specific_product_keywords = {
-                # Apple ecosystem - phải đặt trước để ưu tiên
-                'apple': ['apple', 'táo', 'hệ sinh thái apple'],
-                # Laptop brands/products
-                'macbook': ['macbook', 'mac book'],
-                'dell': ['dell', 'xps'],
-                'hp': ['hp ', 'hp pavilion', 'hp probook'],
-                'lenovo': ['lenovo', 'thinkpad', 'ideapad', 'legion'],
-                'asus': ['asus', 'vivobook', 'zenbook', 'rog'],
-                'acer': ['acer', 'aspire', 'swift'],
-                # Phone brands/products
-                'iphone': ['iphone', 'ip '],
-                'samsung': ['samsung', 'galaxy'],
-                'xiaomi': ['xiaomi', 'redmi', 'poco', 'mi '],
-                'oppo': ['oppo', 'find x'],
-                'vivo': ['vivo'],
-                'realme': ['realme'],
-                'oneplus': ['oneplus', 'one plus'],
-                'google': ['google', 'pixel'],
-                'nothing': ['nothing phone'],
-                # Headphones
-                'airpods': ['airpods', 'air pods'],
-                'sony headphone': ['sony wf', 'sony wh', 'xm4', 'xm5'],
-                'bose': ['bose', 'quietcomfort'],
-                'jabra': ['jabra'],
-                'jbl': ['jbl'],
-                'edifier': ['edifier'],
-                'anker': ['anker', 'soundcore'],
-                'sennheiser': ['sennheiser'],
-                # Smartwatch
-                'apple watch': ['apple watch', 'iwatch'],
-            }
-            
-            detected_specific_product = None
-            for product_name, keywords in specific_product_keywords.items():
-                if any(kw in query_lower for kw in keywords):
-                    detected_specific_product = product_name
-                    break
-            
-            # Detect comparison query (so sánh nhiều sản phẩm)
-            is_comparison = any(kw in query_lower for kw in [
-                'so sánh', 'so sanh', 'so với', 'so voi', 'với', 'voi', 
-                'hay', 'hoặc', 'hoac', 'vs', 'versus', 'compare'
-            ])
-            
-            # Filter sản phẩm theo sản phẩm/thương hiệu cụ thể
+            # === KẾT QUẢ PHÂN TÍCH QUERY ===
+            detected_purpose = intent.purpose  # 1. Mục đích sử dụng
+            is_low_price = intent.is_low_price  # 2. Yêu cầu về giá
+            is_high_price = intent.is_high_price
+            is_mid_price = intent.is_mid_price
+            price_range = intent.price_range  # 3. Khoảng giá cụ thể
+            target_category = intent.category  # 4. Category
+            is_specs_query = intent.is_specs_query  # 4.5. Query về THÔNG SỐ CHI TIẾT -> FULL document text
+            detected_specific_product = intent.specific_product  # 5. Sản phẩm/thương hiệu cụ thể
+            is_comparison = intent.is_comparison  # So sánh nhiều sản phẩm
+            
+            # Filter sản phẩm theo sản phẩm/thương hiệu cụ thể (tên hoặc thương hiệu chứa keyword)
             # SKIP nếu là comparison query để trả về tất cả products liên quan
             if detected_specific_product and not is_comparison:
-                keywords_to_match = specific_product_keywords[detected_specific_product]
-                filtered_products = []
-                for prod in all_products:
-                    product_name_lower = prod['name'].lower()
-                    brand_lower = (prod['brand'] or '').lower()
-                    # Kiểm tra tên sản phẩm hoặc thương hiệu có match không
-                    if any(kw in product_name_lower or kw in brand_lower for kw in keywords_to_match):
-                        filtered_products.append(prod)
+                filtered_products = snapshot.matching_indices(selected, BRAND_KEYWORDS[detected_specific_product])
                 
-                if filtered_products:
+                if len(filtered_products):
                     # Tạo products_by_category mới chỉ chứa sản phẩm matching
-                    products_by_category = {}
-                    for prod in filtered_products:
-                        cat = prod['category']
-                        if cat not in products_by_category:
-                            products_by_category[cat] = []
-                        products_by_category[cat].append(prod)
-                    
-                    all_products = filtered_products
+                    products_by_category = snapshot.group_by_category(filtered_products)
+                    selected = filtered_products
                     total_count = len(filtered_products)
+                    group = f"{group}+{brand_group(detected_specific_product)}"
                     print(f"[ChatAIRAGChromaService] Filtered to {total_count} products matching '{detected_specific_product}'")
             
+            # Fragment theo danh mục được render một lần cho mỗi catalog version, ở đây chỉ chọn + join
+            fragments = get_catalog_fragments(snapshot)
+            
+            # === CATALOG LỚN: TOP-K SẢN PHẨM LIÊN QUAN (BM25 + VECTOR, RRF) ===
+            ranked_by_category = None
+            if query.strip() and len(snapshot.active_indices()) > CHAT_FULL_CATALOG_MAX_PRODUCTS:
+                ranked = self._hybrid_product_rows(query, intent, snapshot, selected, group, embedding)
+                if len(ranked):
+                    ranked_by_category = snapshot.group_by_category(ranked)
+                    print(f"[ChatAIRAGChromaService] Hybrid retrieval: top {len(ranked)} of {len(selected)} products")
+            
             # === FORMAT OUTPUT VỚI ĐỀ XUẤT THÔNG MINH ===
-            context_text = f"=== TOÀN BỘ SẢN PHẨM CỦA SHOP ({total_count} sản phẩm) ===\n\n"
+            if ranked_by_category is not None:
+                ranked_count = sum(len(rows) for rows in ranked_by_category.values())
+                parts = [f"=== {ranked_count} SẢN PHẨM PHÙ HỢP NHẤT / {total_count} SẢN PHẨM CỦA SHOP ===\n\n"]
+            else:
+                parts = [f"=== TOÀN BỘ SẢN PHẨM CỦA SHOP ({total_count} sản phẩm) ===\n\n"]
             
             # Phân tích yêu cầu của khách hàng
-            context_text += "🎯 PHÂN TÍCH YÊU CẦU KHÁCH HÀNG:\n"
+            parts.append("🎯 PHÂN TÍCH YÊU CẦU KHÁCH HÀNG:\n")
             if detected_specific_product:
-                context_text += f"  • ⭐ SẢN PHẨM CỤ THỂ: {detected_specific_product.upper()} ({total_count} sản phẩm tìm thấy)\n"
+                parts.append(f"  • ⭐ SẢN PHẨM CỤ THỂ: {detected_specific_product.upper()} ({total_count} sản phẩm tìm thấy)\n")
             if target_category:
-                context_text += f"  • Danh mục quan tâm: {target_category.upper()}\n"
+                parts.append(f"  • Danh mục quan tâm: {target_category.upper()}\n")
             if detected_purpose:
-                context_text += f"  • Mục đích sử dụng: {detected_purpose.upper()}\n"
+                parts.append(f"  • Mục đích sử dụng: {detected_purpose.upper()}\n")
             if is_low_price:
-                context_text += f"  • Ngân sách: GIÁ RẺ / TIẾT KIỆM\n"
+                parts.append("  • Ngân sách: GIÁ RẺ / TIẾT KIỆM\n")
             elif is_high_price:
-                context_text += f"  • Ngân sách: CAO CẤP / PREMIUM\n"
+                parts.append("  • Ngân sách: CAO CẤP / PREMIUM\n")
             elif is_mid_price:
-                context_text += f"  • Ngân sách: TẦM TRUNG\n"
+                parts.append("  • Ngân sách: TẦM TRUNG\n")
             if price_range:
-                context_text += f"  • Khoảng giá: {price_range[0]:,} - {price_range[1]:,} VNĐ\n"
-            context_text += "\n"
+                parts.append(f"  • Khoảng giá: {price_range[0]:,} - {price_range[1]:,} VNĐ\n")
+            parts.append("\n")
             
-            # Thống kê theo category với sản phẩm nổi bật
-            context_text += "📊 THỐNG KÊ VÀ ĐỀ XUẤT THEO DANH MỤC:\n\n"
+            # Thống kê theo category với sản phẩm nổi bật (min/max/avg vectorized)
+            parts.append("📊 THỐNG KÊ VÀ ĐỀ XUẤT THEO DANH MỤC:\n\n")
+            # Danh mục của top-k luôn nằm trong products_by_category (cùng tập selected); .get phòng hờ
+            for cat, rows in (ranked_by_category or products_by_category).items():
+                parts.append(fragments.stats_fragment(group, cat, products_by_category.get(cat, rows)))
             
-            for cat, prods in products_by_category.items():
-                prices = [p['price'] for p in prods if p['price']]
-                if not prices:
-                    continue
-                
-                min_price = min(prices)
-                max_price = max(prices)
-                avg_price = sum(prices) // len(prices)
-                
-                # Tìm sản phẩm nổi bật cho category này
-                cheapest = min(prods, key=lambda x: x['price'] if x['price'] else 999999999)
-                most_expensive = max(prods, key=lambda x: x['price'] if x['price'] else 0)
-                best_stock = max(prods, key=lambda x: x['stock'] if x['stock'] else 0)
-                
-                context_text += f"━━━ {cat.upper()} ({len(prods)} sản phẩm) ━━━\n"
-                context_text += f"💰 Giá: {min_price:,} - {max_price:,} VNĐ (TB: {avg_price:,} VNĐ)\n"
-                context_text += f"⭐ RẺ NHẤT: {cheapest['name']} - {cheapest['price']:,} VNĐ\n"
-                context_text += f"👑 CAO CẤP NHẤT: {most_expensive['name']} - {most_expensive['price']:,} VNĐ\n"
-                if best_stock['stock'] > 0:
-                    context_text += f"📦 TỒN KHO NHIỀU: {best_stock['name']} ({best_stock['stock']} chiếc)\n"
-                context_text += "\n"
-            
-            # Filter sản phẩm theo yêu cầu
-            def filter_products(prods):
-                filtered = prods.copy()
-                
-                # Filter theo price range
-                if price_range:
-                    filtered = [p for p in filtered if p['price'] and price_range[0] <= p['price'] <= price_range[1]]
-                
-                # Sort theo yêu cầu
-                if is_low_price:
-                    filtered.sort(key=lambda x: x['price'] if x['price'] else 999999999)
-                elif is_high_price:
-                    filtered.sort(key=lambda x: -(x['price'] if x['price'] else 0))
-                else:
-                    # Mặc định sort theo tồn kho (phổ biến)
-                    filtered.sort(key=lambda x: -x['stock'])
-                
-                return filtered
+            # Sort theo yêu cầu: giá rẻ -> giá tăng dần, cao cấp -> giá giảm dần, mặc định theo tồn kho
+            sort_band = 'low' if is_low_price else ('high' if is_high_price else None)
             
             # Chi tiết sản phẩm theo category
-            context_text += "\n📱 CHI TIẾT TẤT CẢ SẢN PHẨM:\n"
+            parts.append(PRODUCT_DETAIL_MARKER)
             
             # Nếu có target_category, ưu tiên hiển thị category đó trước
-            categories_order = list(products_by_category.keys())
+            categories_order = list((ranked_by_category or products_by_category).keys())
             if target_category and target_category in categories_order:
                 categories_order.remove(target_category)
                 categories_order.insert(0, target_category)
             
             for cat in categories_order:
-                prods = products_by_category[cat]
-                filtered_prods = filter_products(prods)
-                
-                is_target = cat == target_category
-                highlight = "⭐" if is_target else ""
-                
-                context_text += f"\n{highlight}━━━ {cat.upper()} ({len(filtered_prods)} sản phẩm) ━━━{highlight}\n"
-                
-                for idx, prod in enumerate(filtered_prods, 1):
-                    price_str = f"{prod['price']:,}" if prod['price'] else "?"
-                    
-                    # ===  QUAN TRỌNG: NẾU LÀ SPECS QUERY, HIỂN THỊ FULL DOCUMENT TEXT ===
-                    if is_specs_query:
-                        # Hiển thị TOÀN BỘ document text từ ChromaDB (có THÔNG SỐ KỸ THUẬT đầy đủ)
-                        context_text += f"\n{'='*70}\n"
-                        context_text += f"📱 SẢN PHẨM {idx}: {prod['name']}\n"
-                        context_text += f"{'='*70}\n"
-                        context_text += prod['content']  # FULL document text
-                        context_text += f"\n{'='*70}\n\n"
-                        continue  # Skip summary format below
-                    
-                    # Đánh dấu sản phẩm đặc biệt (rút gọn tags)
-                    tags = []
-                    if prod == min(prods, key=lambda x: x['price'] if x['price'] else 999999999):
-                        tags.append("💰RẺ NHẤT")
-                    if prod == max(prods, key=lambda x: x['price'] if x['price'] else 0):
-                        tags.append("👑CAO CẤP")
-                    
-                    tag_str = f" [{', '.join(tags)}]" if tags else ""
-                    brand_str = f" | {prod['brand']}" if prod['brand'] and prod['brand'] != "N/A" else ""
-                    stock_str = f" | SL:{prod['stock']}" if prod['stock'] else ""
-                    
-                    # Format compact: số. Tên - Giá [tags] | Brand | Stock
-                    context_text += f"{idx}. {prod['name']} - {price_str} VNĐ{tag_str}{brand_str}{stock_str}\n"
-                    
-                    # Hiển thị ảnh cho TẤT CẢ sản phẩm
-                    if prod['img_url'] and prod['img_url'] != "N/A":
-                        context_text += f"   🖼️ {prod['img_url']}\n"
+                if ranked_by_category is not None:
+                    # Giữ thứ tự xếp hạng, trừ khi khách muốn sort theo giá
+                    rows = ranked_by_category[cat]
+                    parts.append(fragments.ranked_fragment(
+                        cat, products_by_category.get(cat, rows), snapshot.sort_indices(rows, sort_band) if sort_band else rows,
+                        specs=is_specs_query, highlight=cat == target_category
+                    ))
+                    continue
+                parts.append(fragments.detail_fragment(
+                    group, cat, products_by_category[cat], sort_band, price_range,
+                    specs=is_specs_query, highlight=cat == target_category
+                ))
             
             # Gợi ý thông minh cho AI
-            context_text += "\n\n🤖 HƯỚNG DẪN TƯ VẤN CHO AI:\n"
-            context_text += f"📌 Tổng: {total_count} sản phẩm trong {len(products_by_category)} danh mục\n"
+            parts.append(PRODUCT_GUIDE_MARKER)
+            parts.append(f"📌 Tổng: {total_count} sản phẩm trong {len(products_by_category)} danh mục\n")
+            if ranked_by_category is not None:
+                parts.append("📌 Chi tiết ở trên là các sản phẩm khớp câu hỏi nhất (theo tên model, thông số và ngữ nghĩa)"
+                             " - chỉ tư vấn trong danh sách này\n")
             
             if target_category:
                 target_prods = products_by_category.get(target_category, [])
-                context_text += f"📌 Khách đang tìm {target_category.upper()}: {len(target_prods)} sản phẩm\n"
+                parts.append(f"📌 Khách đang tìm {target_category.upper()}: {len(target_prods)} sản phẩm\n")
             
             if detected_purpose:
-                context_text += f"📌 Mục đích: {detected_purpose} - Hãy đề xuất sản phẩm phù hợp với nhu cầu này\n"
+                parts.append(f"📌 Mục đích: {detected_purpose} - Hãy đề xuất sản phẩm phù hợp với nhu cầu này\n")
             
             if is_low_price:
-                context_text += "📌 Khách muốn GIÁ RẺ → Ưu tiên đề xuất sản phẩm có giá THẤP NHẤT trong danh mục\n"
+                parts.append("📌 Khách muốn GIÁ RẺ → Ưu tiên đề xuất sản phẩm có giá THẤP NHẤT trong danh mục\n")
             elif is_high_price:
-                context_text += "📌 Khách muốn CAO CẤP → Ưu tiên đề xuất sản phẩm PREMIUM, flagship\n"
+                parts.append("📌 Khách muốn CAO CẤP → Ưu tiên đề xuất sản phẩm PREMIUM, flagship\n")
             elif is_mid_price:
-                context_text += "📌 Khách muốn TẦM TRUNG → Đề xuất sản phẩm cân bằng giá-hiệu năng\n"
+                parts.append("📌 Khách muốn TẦM TRUNG → Đề xuất sản phẩm cân bằng giá-hiệu năng\n")
             
             if price_range:
-                # Đếm sản phẩm trong khoảng giá
-                in_range = [p for p in all_products if p['price'] and price_range[0] <= p['price'] <= price_range[1]]
-                context_text += f"📌 Trong khoảng giá {price_range[0]:,}-{price_range[1]:,}: {len(in_range)} sản phẩm phù hợp\n"
+                # Đếm sản phẩm trong khoảng giá (toàn bộ sản phẩm ACTIVE: bisect trên price index)
+                if group == GROUP_ALL:
+                    in_range_count = snapshot.price_index().count(price_range)
+                else:
+                    in_range_count = len(snapshot.in_price_range(selected, price_range))
+                parts.append(f"📌 Trong khoảng giá {price_range[0]:,}-{price_range[1]:,}: {in_range_count} sản phẩm phù hợp\n")
             
-            context_text += "\n📌 Luôn so sánh 2-3 sản phẩm, nêu ưu/nhược điểm, và đưa ra đề xuất cuối cùng!"
+            parts.append("\n📌 Luôn so sánh 2-3 sản phẩm, nêu ưu/nhược điểm, và đưa ra đề xuất cuối cùng!")
+            context_text = "".join(parts)
             
             print(f"[ChatAIRAGChromaService] Formatted {total_count} products with smart recommendations, context length: {len(context_text)}")
             return context_text
@@ -774,68 +784,68 @@ class ChatAIRAGChromaService:
                 return content[start:end].strip()
         return ""
     
-    def retrieve_product_context(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+    def retrieve_product_context(self, query: str, top_k: int = 5,
+                                 intent: Optional[QueryIntent] = None,
+                                 embedding: Optional[EmbeddingContext] = None) -> List[Dict[str, Any]]:
         """
         Retrieve product context dựa trên query với logic filtering thông minh
+        Vector search (Chroma) + BM25 (tên model, thông số) được fuse bằng RRF, mỗi bảng xếp hạng
+        chỉ lấy 2 x top_k ứng viên
         
         Args:
             query: Câu query từ user
             top_k: Số lượng kết quả tối đa
+            intent: QueryIntent đã phân tích sẵn (None -> analyze_query(query))
+            embedding: EmbeddingContext của lượt chat (query embedding dùng chung)
             
         Returns:
             List of relevant products
         """
-        # Kiểm tra category từ query
-        category_keywords = {
-            'điện thoại': ['điện thoại', 'phone', 'smartphone', 'mobile', 'dien thoai'],
-            'laptop': ['laptop', 'laptop', 'computer', 'pc'],
-            'tablet': ['tablet', 'ipad', 'tab'],
-            'tai nghe': ['tai nghe', 'headphone', 'earphone', 'airpods'],
-            'phụ kiện': ['phụ kiện', 'accessory', 'charger', 'case']
-        }
-        
-        target_category = None
-        query_lower = query.lower()
-        for cat, keywords in category_keywords.items():
-            if any(keyword in query_lower for keyword in keywords):
-                target_category = cat
-                break
-        
-        # Kiểm tra nếu query chứa từ khóa về giá
-        price_keywords_low = ['giá rẻ', 'rẻ', 'cheap', 'budget', 'thấp', 'low price', 'affordable', 'giá mềm', 'gia re', 're']
-        price_keywords_high = ['cao cấp', 'premium', 'high-end', 'flagship', 'đỉnh cao', 'xịn', 'mạnh']
-        is_low_price = any(keyword in query_lower for keyword in price_keywords_low)
-        is_high_price = any(keyword in query_lower for keyword in price_keywords_high)
+        # Category + yêu cầu về giá từ QueryIntent (một lượt quét)
+        if intent is None:
+            intent = analyze_query(query)
+        target_category = intent.category
+        is_low_price = intent.is_low_price
+        is_high_price = intent.is_high_price
         
         try:
-            # Lấy nhiều kết quả hơn để có thể filter
-            initial_results = self._get_or_create_product_collection().query(
-                query_texts=[query],
-                n_results=min(top_k * 4, 25)  # Lấy nhiều hơn để filter
-            )
+            # Filter status / category / khoảng giá được đẩy xuống Chroma (where trên metadata có kiểu)
+            self._ensure_product_metadata()
+            embedding = embedding_for(query, embedding)  # embed một lần cho mọi query bên dưới
+            n_results = top_k * 2  # ứng viên của mỗi bảng xếp hạng (vector, BM25) trước RRF
+            snapshot = self.get_catalog_snapshot()
+            price_range = intent.price_range
+            if price_range and snapshot.price_index().count(price_range) == 0:
+                # Price index (bisect): không sản phẩm nào trong khoảng giá -> bỏ filter giá ngay,
+                # không query ChromaDB một lượt chắc chắn rỗng
+                price_range = None
+            
+            def query_candidates(price_filter):
+                if not target_category:
+                    return self._query_product_candidates(embedding, n_results, build_product_where(price_range=price_filter))
+                found = self._query_product_candidates(embedding, n_results, build_product_where(target_category, price_filter))
+                if len(found) < top_k:
+                    # Bổ sung sản phẩm category khác khi category mục tiêu không đủ
+                    found += self._query_product_candidates(
+                        embedding, n_results, build_product_where(target_category, price_filter, exclude_category=True)
+                    )
+                return found
             
-            if not initial_results or not initial_results["documents"] or len(initial_results["documents"]) == 0:
-                return []
+            vector_candidates = query_candidates(price_range)
             
-            # Parse và filter results
+            # BM25 trên cùng phạm vi (sản phẩm ACTIVE trong khoảng giá) rồi fuse với vector search;
+            # score của ứng viên = RRF score
+            allowed = snapshot.price_slice(price_range) if price_range else None
+            fused = self._hybrid_rank(query, snapshot, [c["product_id"] for c in vector_candidates], n_results, allowed)
+            by_id = {c["product_id"]: c for c in vector_candidates}
             candidates = []
-            for i, doc in enumerate(initial_results["documents"][0]):
-                metadata = initial_results["metadatas"][0][i] if initial_results["metadatas"] else {}
-                distance = initial_results["distances"][0][i] if initial_results["distances"] else 0
-                
-                # Extract price và category
-                price = self._extract_price_from_content(doc)
-                category = self._extract_category_from_content(doc)
-                
-                candidates.append({
-                    "product_id": metadata.get("product_id", ""),
-                    "product_name": metadata.get("product_name", ""),
-                    "content": doc,
-                    "score": 1 - distance,
-                    "price": price,
-                    "category": category,
-                    "metadata": metadata
-                })
+            for product_id, score in fused:
+                candidate = by_id.get(product_id) or self._snapshot_candidate(snapshot, product_id)
+                if candidate is not None:
+                    candidates.append({**candidate, "score": score})
+            
+            if not candidates:
+                return []
             
             # Filter theo category và giá
             if target_category:
@@ -876,6 +886,100 @@ class ChatAIRAGChromaService:
             print(f"[ChatAIRAGChromaService] Error retrieving product context: {e}")
             return []
     
+    def _hybrid_rank(self, query: str, snapshot: CatalogSnapshot, vector_ids: List[str], n_results: int,
+                     allowed_rows: Optional[np.ndarray] = None) -> List[Tuple[str, float]]:
+        """
+        RRF của BM25 (lexical index đồng bộ với snapshot) và thứ hạng vector search
+        
+        Args:
+            vector_ids: product_id theo thứ tự của vector search
+            n_results: Số ứng viên BM25
+            allowed_rows: Chỉ xét các sản phẩm này (None = mọi sản phẩm ACTIVE)
+        
+        Returns:
+            [(product_id, rrf_score)] giảm dần
+        """
+        allowed = {snapshot.ids[row] for row in allowed_rows} if allowed_rows is not None else None
+        lexical = get_product_lexical_index(snapshot).search(query, n_results, allowed)
+        if allowed is not None:
+            vector_ids = [product_id for product_id in vector_ids if product_id in allowed]
+        return reciprocal_rank_fusion([[product_id for product_id, _ in lexical], vector_ids])
+    
+    def _hybrid_product_rows(self, query: str, intent: QueryIntent, snapshot: CatalogSnapshot,
+                             selected: np.ndarray, group: str,
+                             embedding: Optional[EmbeddingContext] = None) -> np.ndarray:
+        """
+        Top CHAT_HYBRID_TOP_K sản phẩm (trong selected, ưu tiên khoảng giá khách hỏi)
+        theo RRF của BM25 + vector search - index snapshot theo thứ tự xếp hạng
+        """
+        self._ensure_product_metadata()
+        top_k = CHAT_HYBRID_TOP_K
+        rows = selected
+        price_range = intent.price_range
+        if price_range:
+            in_range = snapshot.price_slice(price_range) if group == GROUP_ALL else snapshot.in_price_range(selected, price_range)
+            if len(in_range):
+                rows = in_range
+            else:
+                price_range = None  # không sản phẩm nào trong khoảng giá -> xếp hạng trên toàn bộ
+        vector = self._query_product_candidates(embedding_for(query, embedding), top_k * 2,
+                                                build_product_where(price_range=price_range))
+        # selected = toàn bộ sản phẩm ACTIVE (đúng phạm vi của lexical index) -> không cần lọc thêm
+        allowed = None if rows is selected and group == GROUP_ALL else rows
+        ranked = self._hybrid_rank(query, snapshot, [c["product_id"] for c in vector], top_k * 2, allowed)
+        return snapshot.rows_of(product_id for product_id, _ in ranked[:top_k])
+    
+    def _snapshot_candidate(self, snapshot: CatalogSnapshot, product_id: str) -> Optional[Dict[str, Any]]:
+        """Ứng viên (cùng format _query_product_candidates) của sản phẩm chỉ BM25 tìm thấy"""
+        rows = snapshot.rows_of([product_id])
+        if not len(rows):
+            return None
+        product = snapshot.to_product(int(rows[0]))
+        return {
+            "product_id": product_id,
+            "product_name": product["name"],
+            "content": product["content"],
+            "score": 0,
+            "price": product["price"],
+            "category": product["category"],
+            "metadata": build_product_metadata(
+                product_id, product["name"], price=product["price"] or 0, category=product["category"],
+                brand=product["brand"], stock=product["stock"], img_url=product["img_url"], status=product["status"]
+            ),
+        }
+    
+    def _query_product_candidates(self, embedding: EmbeddingContext, n_results: int,
+                                  where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Query product collection với where filter, đọc price/category từ metadata có kiểu"""
+        try:
+            results = self._get_or_create_product_collection().query(
+                **embedding.query_args(),
+                n_results=n_results,
+                where=where
+            )
+        except Exception as e:
+            print(f"[ChatAIRAGChromaService] Product query failed (where={where}): {e}")
+            return []
+        
+        if not results or not results.get("documents") or not results["documents"][0]:
+            return []
+        
+        candidates = []
+        for i, doc in enumerate(results["documents"][0]):
+            metadata = (results["metadatas"][0][i] if results.get("metadatas") else None) or {}
+            distance = results["distances"][0][i] if results.get("distances") else 0
+            fields = product_fields(metadata)
+            candidates.append({
+                "product_id": fields["id"],
+                "product_name": fields["name"],
+                "content": doc,
+                "score": 1 - distance,
+                "price": fields["price"],
+                "category": fields["category"],
+                "metadata": metadata
+            })
+        return candidates
+    
     def _extract_price_from_content(self, content: str) -> Optional[int]:
         """Extract price từ content text"""
         try:
@@ -895,36 +999,25 @@ class ChatAIRAGChromaService:
             cat_start = content.find("Danh mục:") + 10
             cat_end = content.find("\n", cat_start)
             if cat_end > cat_start:
-                category = content[cat_start:cat_end].strip().lower()
-                # Normalize category
-                if 'điện thoại' in category:
-                    return 'điện thoại'
-                elif 'laptop' in category:
-                    return 'laptop'
-                elif 'tablet' in category or 'tab' in category:
-                    return 'tablet'
-                elif 'tai nghe' in category or 'headphone' in category:
-                    return 'tai nghe'
-                elif 'phụ kiện' in category:
-                    return 'phụ kiện'
-                else:
-                    return category
+                return normalize_category(content[cat_start:cat_end])
         return 'unknown'
     
-    def retrieve_knowledge_context(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+    def retrieve_knowledge_context(self, query: str, top_k: int = 3,
+                                   embedding: Optional[EmbeddingContext] = None) -> List[Dict[str, Any]]:
         """
         Retrieve knowledge base context
         
         Args:
             query: Query string
             top_k: Max results
+            embedding: EmbeddingContext của lượt chat (query embedding dùng chung)
             
         Returns:
             List of relevant knowledge items
         """
         try:
             results = self._get_or_create_knowledge_collection().query(
-                query_texts=[query],
+                **embedding_for(query, embedding).query_args(),
                 n_results=top_k
             )
             
@@ -948,7 +1041,8 @@ class ChatAIRAGChromaService:
             print(f"[ChatAIRAGChromaService] Error retrieving knowledge context: {e}")
             return []
     
-    def retrieve_combined_context(self, query: str, top_k_products: int = 3, top_k_knowledge: int = 2) -> str:
+    def retrieve_combined_context(self, query: str, top_k_products: int = 3, top_k_knowledge: int = 2,
+                                  embedding: Optional[EmbeddingContext] = None) -> str:
         """
         Retrieve kết hợp product + knowledge context để dùng cho AI response
         
@@ -958,6 +1052,7 @@ class ChatAIRAGChromaService:
             query: User query
             top_k_products: IGNORED - giờ lấy tất cả sản phẩm
             top_k_knowledge: Max knowledge items
+            embedding: EmbeddingContext của lượt chat (query embedding dùng chung)
             
         Returns:
             Formatted context string với TOÀN BỘ sản phẩm
@@ -966,19 +1061,57 @@ class ChatAIRAGChromaService:
         all_products_context = self.get_all_products_for_ai(query)
         
         # Lấy knowledge context
-        knowledge_context = self.retrieve_knowledge_context(query, top_k_knowledge)
+        knowledge_context = self.retrieve_knowledge_context(query, top_k_knowledge, embedding=embedding)
+        
+        return self.format_general_context(all_products_context, knowledge_context)
+    
+    def format_general_context(self, all_products_context: str, knowledge_context: List[Dict[str, Any]]) -> str:
+        """
+        Ghép product context + knowledge context theo đúng format của retrieve_combined_context
         
-        context_text = all_products_context + "\n"
+        Args:
+            all_products_context: Output của get_all_products_for_ai
+            knowledge_context: Output của retrieve_knowledge_context
+            
+        Returns:
+            Formatted general context string
+        """
+        context_text = (all_products_context or "") + "\n"
         
         # Add knowledge context
         if knowledge_context:
-            context_text += "\n=== KIẾN THỨC LIÊN QUAN ===\n"
-            for item in knowledge_context:
-                context_text += f"📚 Kiến thức (Độ liên quan: {item['score']:.2f})\n"
-                context_text += f"   {item['content'][:300]}...\n\n"
+            context_text += "\n" + self.format_knowledge_context(knowledge_context)
         
         return context_text if context_text else "Không tìm thấy thông tin liên quan."
     
+    def format_knowledge_context(self, knowledge_context: List[Dict[str, Any]]) -> str:
+        """Format knowledge items (output của retrieve_knowledge_context)"""
+        if not knowledge_context:
+            return ""
+        context_text = "=== KIẾN THỨC LIÊN QUAN ===\n"
+        for item in knowledge_context:
+            context_text += f"📚 Kiến thức (Độ liên quan: {item['score']:.2f})\n"
+            context_text += f"   {item['content'][:300]}...\n\n"
+        return context_text
+    
+    def split_products_context(self, all_products_context: str) -> Tuple[str, str, str]:
+        """
+        Tách output của get_all_products_for_ai thành (summary, detail, guide)
+        - summary: phân tích yêu cầu + thống kê theo danh mục
+        - detail: danh sách chi tiết từng sản phẩm (kèm ảnh)
+        - guide: hướng dẫn tư vấn cho AI
+        Output không có marker (thông báo lỗi/rỗng) -> toàn bộ là summary
+        """
+        text = all_products_context or ""
+        summary, detail, guide = text, "", ""
+        if PRODUCT_DETAIL_MARKER in summary:
+            summary, detail = summary.split(PRODUCT_DETAIL_MARKER, 1)
+            detail = PRODUCT_DETAIL_MARKER.strip() + "\n" + detail
+        if PRODUCT_GUIDE_MARKER in detail:
+            detail, guide = detail.split(PRODUCT_GUIDE_MARKER, 1)
+            guide = PRODUCT_GUIDE_MARKER.strip() + "\n" + guide
+        return summary, detail, guide
+    
     # === USER-SPECIFIC DATA METHODS ===
     
     def store_user_order(self, user_id: str, order_data: Dict[str, Any]) -> bool:
@@ -1013,7 +1146,8 @@ class ChatAIRAGChromaService:
         print(f"[ChatAIRAGChromaService] store_user_data is deprecated. User data comes from chat_ai_users collection via Spring Service sync.")
         return True
     
-    def retrieve_user_context(self, user_id: str, query: str, top_k_orders: int = 3, top_k_data: int = 1) -> str:
+    def retrieve_user_context(self, user_id: str, query: str, top_k_orders: int = 3, top_k_data: int = 1,
+                              embedding: Optional[EmbeddingContext] = None) -> str:
         """
         Retrieve user-specific context từ chat_ai_users và chat_ai_orders collections
         
@@ -1022,6 +1156,7 @@ class ChatAIRAGChromaService:
             query: User query để tìm context relevant
             top_k_orders: Max orders to retrieve
             top_k_data: Max user data items (deprecated - now uses users collection)
+            embedding: EmbeddingContext của lượt chat (query embedding dùng chung)
             
         Returns:
             Formatted user context string với đầy đủ thông tin cá nhân
@@ -1062,7 +1197,7 @@ class ChatAIRAGChromaService:
             if not users_results or not users_results.get("documents"):
                 print(f"[ChatAIRAGChromaService] No results from get(), trying query")
                 users_results = users_collection.query(
-                    query_texts=[f"user profile information"],
+                    **get_query_embedder().probe_query_args(PROBE_USER_PROFILE),
                     where={"user_id": numeric_user_id},
                     n_results=1
                 )
@@ -1101,13 +1236,14 @@ class ChatAIRAGChromaService:
             # 2. Retrieve user orders từ chat_ai_orders collection (không phải user_orders)
             orders_collection = self.client.get_or_create_collection(
                 name="chat_ai_orders",
-                metadata={"description": "Order data for AI Chat RAG"}
+                metadata={"description": "Order data for AI Chat RAG"},
+                embedding_function=self.embedding_function,
             )
             
             # Query orders by customer_id (from user profile)
             customer_id = metadata.get("user_id")  # This is the numeric ID like "5"
             orders_results = orders_collection.query(
-                query_texts=[query],
+                **embedding_for(query, embedding).query_args(),
                 where={"customer_id": customer_id},  # Query theo customer_id từ user profile
                 n_results=top_k_orders
             )
@@ -1160,91 +1296,115 @@ class ChatAIRAGChromaService:
             print(f"[ChatAIRAGChromaService] Error retrieving user context: {e}")
             return "Error retrieving user context."
     
-    def retrieve_discount_context(self, query: str, top_k: int = 3) -> str:
+    def retrieve_discounts(self, query: str, top_k: int = 3,
+                           embedding: Optional[EmbeddingContext] = None) -> List[Dict[str, Any]]:
         """
-        Retrieve discount/promotion context từ chat_ai_discounts collection
+        Retrieve discount đang hiệu lực từ chat_ai_discounts collection (dữ liệu có cấu trúc)
         
         Args:
             query: User query để tìm discount relevant
             top_k: Max discounts to retrieve
+            embedding: EmbeddingContext của lượt chat (query embedding dùng chung)
             
         Returns:
-            Formatted discount context string
+            List dict {code, document, metadata, distance} theo độ liên quan
         """
         try:
             discounts_collection = self.client.get_or_create_collection(
                 name="chat_ai_discounts",
-                metadata={"description": "Discount codes for AI Chat"}
+                metadata={"description": "Discount codes for AI Chat"},
+                embedding_function=self.embedding_function,
             )
             
             results = discounts_collection.query(
-                query_texts=[query],
+                **embedding_for(query, embedding).query_args(),
                 n_results=top_k
             )
             
-            # Filter results manually for active discounts
-            if results and results["documents"] and len(results["documents"]) > 0:
-                filtered_docs = []
-                filtered_metadatas = []
-                filtered_distances = []
-                
-                for i, doc in enumerate(results["documents"][0]):
-                    metadata = results["metadatas"][0][i] if results["metadatas"] else {}
-                    
-                    # Check if discount is active and valid
-                    if (metadata.get("status") == "ACTIVE" and 
-                        metadata.get("is_valid", True) and 
-                        not metadata.get("is_expired", False)):
-                        filtered_docs.append(doc)
-                        filtered_metadatas.append(metadata)
-                        filtered_distances.append(results["distances"][0][i] if results["distances"] else 0)
-                
-                # Replace with filtered results
-                results["documents"] = [filtered_docs[:top_k]]
-                results["metadatas"] = [filtered_metadatas[:top_k]]
-                results["distances"] = [filtered_distances[:top_k]]
-            
             if not results or not results["documents"] or len(results["documents"]) == 0:
-                return ""
-            
-            context_text = "=== CHƯƠNG TRÌNH KHUYẾN MÃI HIỆN CÓ ===\n"
+                return []
             
+            # Filter results manually for active discounts
+            discounts = []
             for i, doc in enumerate(results["documents"][0]):
                 metadata = results["metadatas"][0][i] if results["metadatas"] else {}
-                score = results["distances"][0][i] if results["distances"] else 0
-                
-                discount_code = metadata.get("discount_code", "N/A")
-                discount_value = metadata.get("discount_value", 0)
-                discount_type = metadata.get("discount_type", "PERCENTAGE")
-                min_order = metadata.get("min_order_value", 0)
-                max_discount = metadata.get("max_discount_amount", 0)
-                usage_limit = metadata.get("usage_limit", 0)
-                used_count = metadata.get("used_count", 0)
-                
-                context_text += f"🎫 MÃ: {discount_code} (Độ liên quan: {1-score:.2f})\n"
-                
-                if discount_type == "PERCENTAGE":
-                    context_text += f"   Giảm: {discount_value}%"
-                    if max_discount > 0:
-                        context_text += f" (tối đa {max_discount:,.0f} VNĐ)"
-                else:
-                    context_text += f"   Giảm: {discount_value:,.0f} VNĐ"
                 
-                context_text += f"\n   Đơn tối thiểu: {min_order:,.0f} VNĐ\n"
-                context_text += f"   Còn lại: {usage_limit - used_count}/{usage_limit} lượt\n"
-                
-                # Extract description from document
-                if "Mô tả:" in doc:
-                    desc_start = doc.find("Mô tả:") + 7
-                    desc_end = doc.find("\n", desc_start)
-                    if desc_end > desc_start:
-                        desc = doc[desc_start:desc_end].strip()
-                        context_text += f"   Mô tả: {desc}\n"
-                
-                context_text += "\n"
+                # Check if discount is active and valid
+                if (metadata.get("status") == "ACTIVE" and 
+                    metadata.get("is_valid", True) and 
+                    not metadata.get("is_expired", False)):
+                    discounts.append({
+                        "code": metadata.get("discount_code", "N/A"),
+                        "document": doc,
+                        "metadata": metadata,
+                        "distance": results["distances"][0][i] if results["distances"] else 0,
+                    })
             
-            return context_text
+            return discounts[:top_k]
+            
+        except Exception as e:
+            print(f"[ChatAIRAGChromaService] Error retrieving discount context: {e}")
+            return []
+    
+    def format_discount_context(self, discounts: List[Dict[str, Any]]) -> str:
+        """Discount context cho AI từ kết quả retrieve_discounts (rỗng nếu không có mã nào)"""
+        if not discounts:
+            return ""
+        
+        context_text = "=== CHƯƠNG TRÌNH KHUYẾN MÃI HIỆN CÓ ===\n"
+        
+        for discount in discounts:
+            doc = discount["document"]
+            metadata = discount["metadata"]
+            score = discount["distance"]
+            
+            discount_code = discount["code"]
+            discount_value = metadata.get("discount_value", 0)
+            discount_type = metadata.get("discount_type", "PERCENTAGE")
+            min_order = metadata.get("min_order_value", 0)
+            max_discount = metadata.get("max_discount_amount", 0)
+            usage_limit = metadata.get("usage_limit", 0)
+            used_count = metadata.get("used_count", 0)
             
+            context_text += f"🎫 MÃ: {discount_code} (Độ liên quan: {1-score:.2f})\n"
+            
+            if discount_type == "PERCENTAGE":
+                context_text += f"   Giảm: {discount_value}%"
+                if max_discount > 0:
+                    context_text += f" (tối đa {max_discount:,.0f} VNĐ)"
+            else:
+                context_text += f"   Giảm: {discount_value:,.0f} VNĐ"
+            
+            context_text += f"\n   Đơn tối thiểu: {min_order:,.0f} VNĐ\n"
+            context_text += f"   Còn lại: {usage_limit - used_count}/{usage_limit} lượt\n"
+            
+            # Extract description from document
+            if "Mô tả:" in doc:
+                desc_start = doc.find("Mô tả:") + 7
+                desc_end = doc.find("\n", desc_start)
+                if desc_end > desc_start:
+                    desc = doc[desc_start:desc_end].strip()
+                    context_text += f"   Mô tả: {desc}\n"
+            
+            context_text += "\n"
+        
+        return context_text
+    
+    def retrieve_discount_context(self, query: str, top_k: int = 3,
+                                  embedding: Optional[EmbeddingContext] = None) -> str:
+        """
+        Retrieve discount/promotion context từ chat_ai_discounts collection
+        
+        Args:
+            query: User query để tìm discount relevant
+            top_k: Max discounts to retrieve
+            embedding: EmbeddingContext của lượt chat (query embedding dùng chung)
+            
+        Returns:
+            Formatted discount context string
+        """
+        try:
+            return self.format_discount_context(self.retrieve_discounts(query, top_k, embedding=embedding))
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error retrieving discount context: {e}")
             return ""
@@ -1268,16 +1428,25 @@ class ChatAIRAGChromaService:
         Returns:
             Formatted context string với bảo mật user data
         """
+        # Query embedding tính một lần, dùng chung cho knowledge / discounts / orders
+        embedding = EmbeddingContext(query)
+        
         # Get general context
-        general_context = self.retrieve_combined_context(query, top_k_products, top_k_knowledge)
+        general_context = self.retrieve_combined_context(query, top_k_products, top_k_knowledge, embedding=embedding)
         
         # Get discount context
-        discount_context = self.retrieve_discount_context(query, top_k_discounts)
+        discount_context = self.retrieve_discount_context(query, top_k_discounts, embedding=embedding)
         
         # Get user-specific context (bảo mật - chỉ data của user hiện tại)
-        user_context = self.retrieve_user_context(user_id, query, top_k_user, 1)
+        user_context = self.retrieve_user_context(user_id, query, top_k_user, 1, embedding=embedding)
         
-        # Combine contexts
+        return self.merge_combined_context(general_context, discount_context, user_context)
+    
+    def merge_combined_context(self, general_context: str, discount_context: str, user_context: str) -> str:
+        """
+        Ghép general + discount + user context theo thứ tự cố định
+        (dùng chung cho retrieval tuần tự và retrieval song song)
+        """
         full_context = general_context
         if discount_context:
             full_context += "\n\n" + discount_context
@@ -1438,6 +1607,7 @@ class ChatAIRAGChromaService:
             self.client.reset()
             self._initialize_collections()
             print("[ChatAIRAGChromaService] All collections cleared and reinitialized")
+            bump_catalog_version("all collections cleared")
             return True
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error clearing collections: {e}")
@@ -1666,6 +1836,122 @@ class ChatAIRAGChromaService:
             print(f"[ChatAIRAGChromaService] Error getting user cart context: {e}")
             return ""
     
+    def _query_user_orders(self, user_id: str, n_results: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Query đơn hàng của user (probe "order history", lọc theo customer_id)
+        
+        Returns:
+            List (document, metadata) theo thứ tự độ liên quan của Chroma
+        """
+        # Normalize user_id to numeric
+        if user_id.startswith("user_"):
+            numeric_id = user_id.replace("user_", "")
+        else:
+            numeric_id = user_id
+        
+        # Get orders collection
+        orders_collection = self.client.get_or_create_collection(
+            name="chat_ai_orders",
+            metadata={"description": "Order data for AI Chat RAG"},
+            embedding_function=self.embedding_function,
+        )
+        
+        orders_results = orders_collection.query(
+            **get_query_embedder().probe_query_args(PROBE_ORDER_HISTORY),
+            where={"customer_id": numeric_id},
+            n_results=n_results
+        )
+        
+        if not orders_results or not orders_results.get("documents") or len(orders_results["documents"][0]) == 0:
+            return []
+        
+        rows = []
+        for i, doc in enumerate(orders_results["documents"][0]):
+            metadata = orders_results["metadatas"][0][i] if orders_results.get("metadatas") and orders_results["metadatas"][0] and len(orders_results["metadatas"][0]) > i else {}
+            rows.append((doc, metadata or {}))
+        return rows
+    
+    def _format_orders_context(self, rows: List[Tuple[str, Dict[str, Any]]]) -> str:
+        """Orders context COMPACT cho AI (đơn đang xử lý + 3 đơn hoàn thành gần nhất)"""
+        # Combine documents with metadata for sorting
+        orders_list = []
+        for i, (doc, metadata) in enumerate(rows):
+            orders_list.append({
+                'doc': doc,
+                'metadata': metadata,
+                'order_id': metadata.get('order_id', f'Order {i+1}'),
+                'status': metadata.get('status', 'Unknown'),
+                'total_amount': metadata.get('total_amount', 'N/A'),
+                'created_at': metadata.get('created_at', 'N/A')
+            })
+        
+        # Sort orders: Priority by status (pending/shipping first), then by date (newest first)
+        def order_priority(order):
+            status = order['status']
+            status_priority = {
+                'PENDING': 1, 'PROCESSING': 2, 'CONFIRMED': 3,
+                'SHIPPING': 4, 'DELIVERED': 5, 'CANCELLED': 6
+            }.get(status, 99)
+            return (status_priority, order['created_at'])
+        
+        orders_list.sort(key=order_priority)
+        orders_list.reverse()
+        
+        # SPLIT: Đơn active và đơn completed
+        active_orders = [
+            order for order in orders_list 
+            if order['status'] not in ['DELIVERED', 'CANCELLED']
+        ]
+        completed_orders = [
+            order for order in orders_list 
+            if order['status'] in ['DELIVERED', 'CANCELLED']
+        ]
+        
+        # COMPACT FORMAT
+        orders_text = ""
+        
+        # 1. Hiển thị đơn đang xử lý (nếu có)
+        if active_orders:
+            orders_text += f"\n\n=== ĐƠN HÀNG ĐANG XỬ LÝ ({len(active_orders)}) ===\n"
+            for order in active_orders:
+                order_id = order['order_id']
+                status = order['status']
+                total_amount = order['total_amount']
+                
+                status_map = {
+                    'PENDING': '⏳ Chờ', 
+                    'PROCESSING': '⚙️ Xử lý', 
+                    'CONFIRMED': '✅ XN',
+                    'SHIPPING': '🚚 Giao'
+                }
+                status_short = status_map.get(status, status)
+                amount_str = f"{total_amount:,.0f}đ" if isinstance(total_amount, (int, float)) else str(total_amount)
+                orders_text += f"#{order_id} {status_short} {amount_str}\n"
+        
+        # 2. Hiển thị 2-3 đơn đã hoàn thành gần nhất (cho AI tham khảo)
+        if completed_orders:
+            recent_completed = completed_orders[:3]  # Chỉ lấy 3 đơn gần nhất
+            orders_text += f"\n=== ĐÃ HOÀN THÀNH ({len(recent_completed)}/{len(completed_orders)}) ===\n"
+            for order in recent_completed:
+                order_id = order['order_id']
+                status = order['status']
+                total_amount = order['total_amount']
+                
+                status_map = {
+                    'DELIVERED': '✔️ Giao', 
+                    'CANCELLED': '❌ Hủy'
+                }
+                status_short = status_map.get(status, status)
+                amount_str = f"{total_amount:,.0f}đ" if isinstance(total_amount, (int, float)) else str(total_amount)
+                orders_text += f"#{order_id} {status_short} {amount_str}\n"
+        
+        # Nếu không có đơn nào, trả về rỗng
+        if not orders_text:
+            return ""
+        
+        print(f"[ChatAIRAGChromaService] Found {len(active_orders)} active + {len(completed_orders[:3])} recent completed orders")
+        return orders_text
+    
     def get_user_orders(self, user_id: str, max_orders: int = 10) -> str:
         """
         Lấy order history của user từ ChromaDB để đưa vào AI chat
@@ -1679,113 +1965,45 @@ class ChatAIRAGChromaService:
             Formatted orders context string (COMPACT)
         """
         try:
-            # Normalize user_id to numeric
-            if user_id.startswith("user_"):
-                numeric_id = user_id.replace("user_", "")
-            else:
-                numeric_id = user_id
-            
-            # Get orders collection
-            orders_collection = self.client.get_or_create_collection(
-                name="chat_ai_orders",
-                metadata={"description": "Order data for AI Chat RAG"}
-            )
-            
-            # Query orders by customer_id - CHỈ LẤY 5 ĐƠN GẦN NHẤT
-            orders_results = orders_collection.query(
-                query_texts=["order history"],
-                where={"customer_id": numeric_id},
-                n_results=min(max_orders, 5)  # Giới hạn tối đa 5 đơn
-            )
-            
-            if not orders_results or not orders_results.get("documents") or len(orders_results["documents"][0]) == 0:
-                return ""  # Trả về rỗng thay vì message dài
-            
-            # Combine documents with metadata for sorting
-            orders_list = []
-            if orders_results.get("documents") and orders_results["documents"][0]:
-                for i, doc in enumerate(orders_results["documents"][0]):
-                    metadata = orders_results["metadatas"][0][i] if orders_results.get("metadatas") and orders_results["metadatas"][0] and len(orders_results["metadatas"][0]) > i else {}
-                    orders_list.append({
-                        'doc': doc,
-                        'metadata': metadata,
-                        'order_id': metadata.get('order_id', f'Order {i+1}'),
-                        'status': metadata.get('status', 'Unknown'),
-                        'total_amount': metadata.get('total_amount', 'N/A'),
-                        'created_at': metadata.get('created_at', 'N/A')
-                    })
-            
-            # Sort orders: Priority by status (pending/shipping first), then by date (newest first)
-            def order_priority(order):
-                status = order['status']
-                status_priority = {
-                    'PENDING': 1, 'PROCESSING': 2, 'CONFIRMED': 3,
-                    'SHIPPING': 4, 'DELIVERED': 5, 'CANCELLED': 6
-                }.get(status, 99)
-                return (status_priority, order['created_at'])
-            
-            orders_list.sort(key=order_priority)
-            orders_list.reverse()
-            
-            # SPLIT: Đơn active và đơn completed
-            active_orders = [
-                order for order in orders_list 
-                if order['status'] not in ['DELIVERED', 'CANCELLED']
-            ]
-            completed_orders = [
-                order for order in orders_list 
-                if order['status'] in ['DELIVERED', 'CANCELLED']
-            ]
-            
-            # COMPACT FORMAT
-            orders_text = ""
-            
-            # 1. Hiển thị đơn đang xử lý (nếu có)
-            if active_orders:
-                orders_text += f"\n\n=== ĐƠN HÀNG ĐANG XỬ LÝ ({len(active_orders)}) ===\n"
-                for order in active_orders:
-                    order_id = order['order_id']
-                    status = order['status']
-                    total_amount = order['total_amount']
-                    
-                    status_map = {
-                        'PENDING': '⏳ Chờ', 
-                        'PROCESSING': '⚙️ Xử lý', 
-                        'CONFIRMED': '✅ XN',
-                        'SHIPPING': '🚚 Giao'
-                    }
-                    status_short = status_map.get(status, status)
-                    amount_str = f"{total_amount:,.0f}đ" if isinstance(total_amount, (int, float)) else str(total_amount)
-                    orders_text += f"#{order_id} {status_short} {amount_str}\n"
-            
-            # 2. Hiển thị 2-3 đơn đã hoàn thành gần nhất (cho AI tham khảo)
-            if completed_orders:
-                recent_completed = completed_orders[:3]  # Chỉ lấy 3 đơn gần nhất
-                orders_text += f"\n=== ĐÃ HOÀN THÀNH ({len(recent_completed)}/{len(completed_orders)}) ===\n"
-                for order in recent_completed:
-                    order_id = order['order_id']
-                    status = order['status']
-                    total_amount = order['total_amount']
-                    
-                    status_map = {
-                        'DELIVERED': '✔️ Giao', 
-                        'CANCELLED': '❌ Hủy'
-                    }
-                    status_short = status_map.get(status, status)
-                    amount_str = f"{total_amount:,.0f}đ" if isinstance(total_amount, (int, float)) else str(total_amount)
-                    orders_text += f"#{order_id} {status_short} {amount_str}\n"
-            
-            # Nếu không có đơn nào, trả về rỗng
-            if not orders_text:
-                return ""
-            
-            print(f"[ChatAIRAGChromaService] Found {len(active_orders)} active + {len(completed_orders[:3])} recent completed orders")
-            return orders_text
-            
+            # CHỈ LẤY 5 ĐƠN GẦN NHẤT
+            rows = self._query_user_orders(user_id, min(max_orders, 5))
+            return self._format_orders_context(rows) if rows else ""
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error getting orders: {e}")
             return "\n\n=== ĐƠN HÀNG ===\nKhông thể lấy thông tin đơn hàng lúc này."
     
+    def retrieve_user_orders(self, user_id: str, max_context_orders: int = 3,
+                             max_list_orders: int = 10) -> Tuple[str, List[Dict]]:
+        """
+        MỘT query đơn hàng cho cả orders context (đưa vào prompt) và danh sách đơn cho frontend
+        (thay cho get_user_orders + get_user_orders_list gọi riêng)
+        
+        Args:
+            user_id: ID của user (dạng 'user_5' hoặc '5')
+            max_context_orders: Số đơn tối đa trong context (như get_user_orders, tối đa 5)
+            max_list_orders: Số đơn tối đa của danh sách (như get_user_orders_list)
+            
+        Returns:
+            (orders context, orders list) - cùng kết quả với hai method riêng lẻ
+        """
+        context_orders = min(max_context_orders, 5)
+        try:
+            # Kết quả query sắp theo độ liên quan -> prefix của query lớn = kết quả của query nhỏ
+            rows = self._query_user_orders(user_id, max(context_orders, max_list_orders))
+            if not rows:
+                return "", []
+            orders_context = self._format_orders_context(rows[:context_orders])
+        except Exception as e:
+            print(f"[ChatAIRAGChromaService] Error getting orders: {e}")
+            return "\n\n=== ĐƠN HÀNG ===\nKhông thể lấy thông tin đơn hàng lúc này.", []
+        
+        try:
+            orders_list = self._build_orders_list(rows[:max_list_orders])
+        except Exception as e:
+            print(f"[ChatAIRAGChromaService] Error getting orders list: {e}")
+            orders_list = []
+        return orders_context, orders_list
+    
     def get_order_by_id(self, order_id: str, user_id: str = None) -> str:
         """
         Query trực tiếp đơn hàng cụ thể từ ChromaDB by order_id
@@ -1804,7 +2022,8 @@ class ChatAIRAGChromaService:
             # Get orders collection
             orders_collection = self.client.get_or_create_collection(
                 name="chat_ai_orders",
-                metadata={"description": "Order data for AI Chat RAG"}
+                metadata={"description": "Order data for AI Chat RAG"},
+                embedding_function=self.embedding_function,
             )
             
             # Build where filter
@@ -1903,6 +2122,43 @@ class ChatAIRAGChromaService:
             traceback.print_exc()
             return f"\n\n❌ Lỗi khi truy vấn đơn hàng #{order_id}"
     
+    def _build_orders_list(self, rows: List[Tuple[str, Dict[str, Any]]]) -> List[Dict]:
+        """Danh sách đơn đang xử lý (bỏ DELIVERED/CANCELLED) cho frontend"""
+        # Build orders list
+        orders_list = []
+        for i, (doc, metadata) in enumerate(rows):
+            total_amount = metadata.get('total_amount', 0)
+            # Heuristic fix for incorrect data (missing 3 zeros)
+            # If amount < 1,000,000 and looks like truncated millions
+            if total_amount < 1000000 and total_amount > 1000:
+                total_amount *= 1000
+            
+            order_status = metadata.get('status', 'Unknown')
+            
+            # FILTER: Chỉ lấy đơn đang xử lý (bỏ DELIVERED và CANCELLED)
+            if order_status in ['DELIVERED', 'CANCELLED']:
+                continue
+            
+            orders_list.append({
+                'id': metadata.get('order_id', f'Order {i+1}'),
+                'status': order_status,
+                'totalAmount': total_amount,
+                'createdAt': metadata.get('created_at', 'N/A')
+            })
+        
+        # Sort by status priority + date
+        def order_priority(order):
+            status_priority = {
+                'PENDING': 1, 'PROCESSING': 2, 'CONFIRMED': 3,
+                'SHIPPING': 4, 'DELIVERED': 5, 'CANCELLED': 6
+            }.get(order['status'], 99)
+            return (status_priority, order['createdAt'])
+        
+        orders_list.sort(key=order_priority, reverse=True)
+        
+        print(f"[ChatAIRAGChromaService] Filtered to {len(orders_list)} active orders for display")
+        return orders_list
+    
     def get_user_orders_list(self, user_id: str, max_orders: int = 10) -> List[Dict]:
         """
         Get user orders as structured list for frontend display
@@ -1915,65 +2171,7 @@ class ChatAIRAGChromaService:
             List of order dictionaries
         """
         try:
-            # Normalize user_id
-            if user_id.startswith("user_"):
-                numeric_id = user_id.replace("user_", "")
-            else:
-                numeric_id = user_id
-            
-            # Get orders collection
-            orders_collection = self.client.get_or_create_collection(
-                name="chat_ai_orders",
-                metadata={"description": "Order data for AI Chat RAG"}
-            )
-            
-            # Query orders
-            orders_results = orders_collection.query(
-                query_texts=["order history"],
-                where={"customer_id": numeric_id},
-                n_results=max_orders
-            )
-            
-            if not orders_results or not orders_results.get("documents") or len(orders_results["documents"][0]) == 0:
-                return []
-            
-            # Build orders list
-            orders_list = []
-            for i, doc in enumerate(orders_results["documents"][0]):
-                metadata = orders_results["metadatas"][0][i] if orders_results.get("metadatas") else {}
-                
-                total_amount = metadata.get('total_amount', 0)
-                # Heuristic fix for incorrect data (missing 3 zeros)
-                # If amount < 1,000,000 and looks like truncated millions
-                if total_amount < 1000000 and total_amount > 1000:
-                    total_amount *= 1000
-                
-                order_status = metadata.get('status', 'Unknown')
-                
-                # FILTER: Chỉ lấy đơn đang xử lý (bỏ DELIVERED và CANCELLED)
-                if order_status in ['DELIVERED', 'CANCELLED']:
-                    continue
-                
-                orders_list.append({
-                    'id': metadata.get('order_id', f'Order {i+1}'),
-                    'status': order_status,
-                    'totalAmount': total_amount,
-                    'createdAt': metadata.get('created_at', 'N/A')
-                })
-            
-            # Sort by status priority + date
-            def order_priority(order):
-                status_priority = {
-                    'PENDING': 1, 'PROCESSING': 2, 'CONFIRMED': 3,
-                    'SHIPPING': 4, 'DELIVERED': 5, 'CANCELLED': 6
-                }.get(order['status'], 99)
-                return (status_priority, order['createdAt'])
-            
-            orders_list.sort(key=order_priority, reverse=True)
-            
-            print(f"[ChatAIRAGChromaService] Filtered to {len(orders_list)} active orders for display")
-            return orders_list
-            
+            return self._build_orders_list(self._query_user_orders(user_id, max_orders))
         except Exception as e:
             print(f"[ChatAIRAGChromaService] Error getting orders list: {e}")
             return []
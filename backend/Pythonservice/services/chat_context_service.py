@@ -0,0 +1,223 @@
+"""
+Chat Context Retrieval Service
+Chạy song song các lookup độc lập (ChromaDB + Spring API) cho một lượt chat,
+ngoài event loop, rồi ghép kết quả theo đúng thứ tự section hiện tại:
+products -> knowledge -> discounts -> user profile/orders -> cart -> order detail
+Kết quả có cấu trúc (catalog snapshot, discounts, orders) được giữ lại cho giai đoạn
+sau LLM (action buttons, danh sách đơn) - không query lại ChromaDB
+Lookup không phụ thuộc user (products, knowledge, discounts) đi qua single-flight:
+các lượt chat cùng câu hỏi đang chạy đồng thời dùng chung một lần retrieval
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+
+from services.catalog_snapshot_service import CatalogSnapshot
+from services.catalog_version_service import get_catalog_version_async
+from services.response_cache_service import normalize_query
+from services.single_flight_service import get_single_flight, make_key
+from services.product_mention_service import get_mention_index
+from services.query_intent_service import QueryIntent
+from services.query_embedding_service import EmbeddingContext
+from services.context_assembler_service import (
+    ContextAssembler,
+    SECTION_PROFILE, SECTION_CART, SECTION_ORDERS, SECTION_DISCOUNTS,
+    SECTION_PRODUCT_SUMMARY, SECTION_PRODUCT_DETAIL, SECTION_KNOWLEDGE,
+)
+
+# Timeout cho mỗi lookup (giây) - một lookup chậm không được kéo cả request
+RETRIEVAL_TIMEOUT = float(os.getenv('CHAT_RETRIEVAL_TIMEOUT', 15))
+
+
+@dataclass
+class ChatRetrievalResult:
+    """Kết quả retrieval của một lượt chat, mỗi lookup một field"""
+    active_config: Optional[Dict[str, Any]] = None
+    products_context: str = ""
+    knowledge_items: List[Dict[str, Any]] = field(default_factory=list)
+    discount_context: str = ""
+    user_context: str = ""
+    cart_context: str = ""
+    orders_context: str = ""
+    catalog: Optional[CatalogSnapshot] = None  # snapshot mà products context được render từ đó
+    discounts: List[Dict[str, Any]] = field(default_factory=list)  # discount đã retrieve (retrieve_discounts)
+    orders: List[Dict[str, Any]] = field(default_factory=list)  # danh sách đơn cho frontend
+    catalog_version: int = 0  # catalog version lúc retrieval (key single-flight / response cache)
+    errors: Dict[str, str] = field(default_factory=dict)  # lookup -> lỗi (partial failure)
+    timings: Dict[str, float] = field(default_factory=dict)  # lookup -> ms
+
+    def action_products(self, limit: int = 50, price_range: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+        """Sản phẩm cho action detection - cùng catalog snapshot mà AI đã thấy (lọc theo khoảng giá khách hỏi)"""
+        return self.catalog.action_products(limit, price_range) if self.catalog is not None else []
+
+    def mentioned_products(self, text: str) -> List[Dict[str, Any]]:
+        """Sản phẩm (toàn bộ catalog) được nhắc tới trong text, ví dụ response của AI"""
+        return get_mention_index(self.catalog).mentioned_products(text) if self.catalog is not None else []
+
+    def named_products(self, text: str) -> List[Dict[str, Any]]:
+        """Sản phẩm có nguyên tên xuất hiện trong text"""
+        return get_mention_index(self.catalog).named_products(text) if self.catalog is not None else []
+
+    def discount_codes(self) -> List[str]:
+        """Mã giảm giá đã đưa vào context của lượt chat"""
+        return [discount["code"] for discount in self.discounts if discount["code"] != "N/A"]
+
+    def combined_context(self, chroma_service) -> str:
+        """Ghép context giống hệt luồng tuần tự cũ (retrieve_combined_context_with_user + cart + orders)"""
+        general_context = chroma_service.format_general_context(self.products_context, self.knowledge_items)
+        combined = chroma_service.merge_combined_context(general_context, self.discount_context, self.user_context)
+        if self.cart_context:
+            combined += self.cart_context
+        if self.orders_context:
+            combined += self.orders_context
+        return combined
+
+    def build_assembler(self, chroma_service, token_budget: int) -> ContextAssembler:
+        """
+        Tạo ContextAssembler với các section có kiểu, thứ tự render giống combined_context()
+        (products -> knowledge -> discounts -> user profile/orders -> cart -> order detail)
+        """
+        summary, detail, guide = chroma_service.split_products_context(self.products_context)
+        user_context = self.user_context if self.user_context != "No user-specific context found." else ""
+
+        assembler = ContextAssembler(token_budget)
+        assembler.add(SECTION_PRODUCT_SUMMARY, summary)
+        assembler.add(SECTION_PRODUCT_DETAIL, detail, truncatable=True)
+        assembler.add(SECTION_PRODUCT_SUMMARY, guide, name="product_guide")
+        assembler.add(SECTION_KNOWLEDGE, chroma_service.format_knowledge_context(self.knowledge_items),
+                      truncatable=True)
+        assembler.add(SECTION_DISCOUNTS, self.discount_context)
+        assembler.add(SECTION_PROFILE, user_context)
+        assembler.add(SECTION_CART, self.cart_context)
+        assembler.add(SECTION_ORDERS, self.orders_context)
+        return assembler
+
+
+async def _run_lookup(name: str, result: ChatRetrievalResult, awaitable: Awaitable, default: Any,
+                      timeout: float = RETRIEVAL_TIMEOUT) -> Any:
+    """Chạy một lookup, ghi timing; lỗi/timeout -> trả default và ghi vào result.errors"""
+    start = time.perf_counter()
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        result.errors[name] = f"timeout after {timeout}s"
+        print(f"[ChatContext] Lookup '{name}' timed out after {timeout}s")
+        return default
+    except Exception as e:
+        result.errors[name] = str(e)
+        print(f"[ChatContext] Lookup '{name}' failed: {e}")
+        return default
+    finally:
+        result.timings[name] = round((time.perf_counter() - start) * 1000, 1)
+
+
+def _in_thread(func: Callable, *args, **kwargs) -> Awaitable:
+    """Đẩy một call ChromaDB (blocking) sang thread pool"""
+    return asyncio.to_thread(partial(func, *args, **kwargs))
+
+
+async def gather_chat_context(
+    chroma_service,
+    user_id: str,
+    query: str,
+    top_k_knowledge: int = 2,
+    top_k_user: int = 2,
+    top_k_discounts: int = 3,
+    include_orders: bool = False,
+    max_listed_orders: int = 10,
+    order_id: Optional[str] = None,
+    cart_fallback: Optional[Callable[[], Awaitable[str]]] = None,
+    intent: Optional[QueryIntent] = None,
+    embedding: Optional[EmbeddingContext] = None,
+) -> ChatRetrievalResult:
+    """
+    Chạy đồng thời tất cả lookup độc lập của một lượt chat
+
+    Args:
+        chroma_service: ChatAIRAGChromaService instance
+        user_id: User ID (format user_X hoặc anonymous-...)
+        query: Tin nhắn của user
+        top_k_knowledge: Max knowledge items
+        top_k_user: Max user orders trong user context
+        top_k_discounts: Max discounts
+        include_orders: True nếu user đang hỏi về đơn hàng
+        max_listed_orders: Max đơn trong danh sách đơn cho frontend (khi include_orders)
+        order_id: ID đơn hàng cụ thể (nếu có) - ưu tiên hơn danh sách đơn
+        cart_fallback: Coroutine factory lấy giỏ hàng từ Spring khi ChromaDB không có
+        intent: QueryIntent của query (phân tích một lần, dùng lại cho product analysis)
+        embedding: EmbeddingContext của query (embed một lần, dùng chung cho knowledge/discounts/orders)
+
+    Returns:
+        ChatRetrievalResult - latency ~ lookup chậm nhất thay vì tổng các lookup
+    """
+    result = ChatRetrievalResult()
+    start = time.perf_counter()
+    if embedding is None:
+        embedding = EmbeddingContext(query)
+
+    async def cart_lookup() -> str:
+        # Ưu tiên data đã sync trong ChromaDB, fallback sang Spring API
+        cart_context = await _in_thread(chroma_service.get_user_cart_context, user_id)
+        if not cart_context and cart_fallback is not None:
+            cart_context = await cart_fallback()
+        return cart_context or ""
+
+    async def orders_lookup() -> Tuple[str, List[Dict[str, Any]]]:
+        if order_id:
+            return await asyncio.gather(
+                _in_thread(chroma_service.get_order_by_id, order_id, user_id),
+                _in_thread(chroma_service.get_user_orders_list, user_id, max_orders=max_listed_orders),
+            )
+        # Một query cho cả orders context và danh sách đơn
+        return await _in_thread(chroma_service.retrieve_user_orders, user_id,
+                                max_context_orders=3, max_list_orders=max_listed_orders)
+
+    def load_products() -> Tuple[CatalogSnapshot, str]:
+        # Giữ lại snapshot đã render context -> action detection dùng đúng catalog AI đã thấy
+        snapshot = chroma_service.get_catalog_snapshot()
+        return snapshot, chroma_service.get_all_products_for_ai(query, intent, snapshot=snapshot, embedding=embedding)
+
+    async def products_lookup() -> str:
+        result.catalog, products_context = await single_flight.do(
+            make_key("products", shared_query, catalog_version), lambda: _in_thread(load_products))
+        return products_context
+
+    # Lookup không phụ thuộc user: gộp các lượt chat trùng câu hỏi + catalog version đang chạy
+    single_flight = get_single_flight()
+    shared_query = normalize_query(query)
+    catalog_version = result.catalog_version = await get_catalog_version_async()
+
+    lookups = [
+        _run_lookup("active_config", result, _in_thread(chroma_service.get_active_modal_config), None),
+        _run_lookup("products", result, products_lookup(), ""),
+        _run_lookup("knowledge", result, single_flight.do(
+            make_key("knowledge", shared_query, catalog_version, top_k_knowledge),
+            lambda: _in_thread(chroma_service.retrieve_knowledge_context, query, top_k_knowledge, embedding=embedding)), []),
+        _run_lookup("discounts", result, single_flight.do(
+            make_key("discounts", shared_query, catalog_version, top_k_discounts),
+            lambda: _in_thread(chroma_service.retrieve_discounts, query, top_k_discounts, embedding=embedding)), []),
+        _run_lookup("user", result, _in_thread(chroma_service.retrieve_user_context, user_id, query, top_k_user, 1, embedding=embedding), ""),
+        _run_lookup("cart", result, cart_lookup(), ""),
+    ]
+    if include_orders:
+        lookups.append(_run_lookup("orders", result, orders_lookup(), ("", [])))
+
+    values = await asyncio.gather(*lookups)
+
+    (result.active_config, result.products_context, result.knowledge_items,
+     result.discounts, result.user_context, result.cart_context) = values[:6]
+    result.discount_context = chroma_service.format_discount_context(result.discounts)
+    if include_orders:
+        orders_context, orders = values[6]
+        result.orders_context = orders_context or ""
+        result.orders = orders or []
+
+    total_ms = round((time.perf_counter() - start) * 1000, 1)
+    print(f"[ChatContext] Retrieval finished in {total_ms}ms (per lookup: {result.timings})")
+    if result.errors:
+        print(f"[ChatContext] Partial failures: {result.errors}")
+
+    return result
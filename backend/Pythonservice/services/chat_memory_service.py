@@ -0,0 +1,219 @@
+"""
+Chat Memory Service
+Bộ nhớ hội thoại của session: rolling summary + các lượt gần nhất trong một token budget cố định
+- History của prompt = summary (nếu có) + các message chưa được tóm tắt, lấy từ mới nhất về cũ
+  cho đến khi hết CHAT_MEMORY_HISTORY_TOKENS (message mới nhất - tin nhắn hiện tại - luôn được giữ)
+- Session có >= CHAT_MEMORY_SUMMARY_TRIGGER message chưa tóm tắt -> các message cũ (trừ
+  CHAT_MEMORY_KEEP_RECENT message cuối) được gộp vào summary bằng LLM trong background task
+  (priority analytics của LLMScheduler), không nằm trên đường đi của request
+- Summary lưu cạnh session trong Redis (chat:user:{user_id}:session:{session_id}:summary, cùng TTL),
+  "covered" = số message đầu session đã nằm trong summary
+- Mỗi session chỉ có một lần refresh đang chạy trong worker
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from services.async_redis_chat_service import AsyncRedisChatService
+from services.context_assembler_service import estimate_tokens
+from services.llm_provider_service import AsyncLLMProvider, get_llm_provider
+from services.llm_scheduler_service import LLMOverloadedError, PRIORITY_ANALYTICS
+from services.prompt_registry_service import CHAT_MEMORY_SUMMARY_PROMPT, build_summary_message
+
+# === CONFIG (env) ===
+# Ngân sách token cho summary + history của mỗi lượt chat
+CHAT_MEMORY_HISTORY_TOKENS = int(os.getenv('CHAT_MEMORY_HISTORY_TOKENS', 1500))
+# Số message chưa tóm tắt để bắt đầu tóm tắt / số message cuối giữ nguyên văn sau khi tóm tắt
+CHAT_MEMORY_SUMMARY_TRIGGER = int(os.getenv('CHAT_MEMORY_SUMMARY_TRIGGER', 12))
+CHAT_MEMORY_KEEP_RECENT = int(os.getenv('CHAT_MEMORY_KEEP_RECENT', 6))
+CHAT_MEMORY_SUMMARY_MODEL = os.getenv('CHAT_MEMORY_SUMMARY_MODEL', 'llama-3.1-8b-instant')
+CHAT_MEMORY_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_MEMORY_SUMMARY_MAX_TOKENS', 400))
+# Cắt mỗi message khi đưa vào prompt tóm tắt (response có bảng sản phẩm rất dài)
+CHAT_MEMORY_MESSAGE_CHARS = int(os.getenv('CHAT_MEMORY_MESSAGE_CHARS', 1200))
+
+
+@dataclass
+class SessionMemory:
+    """History của một lượt chat: summary + message gần nhất vừa token budget"""
+    summary: Optional[str]
+    messages: List[dict]
+    covered: int  # số message đầu session đã nằm trong summary
+    size: int  # số message của session
+    tokens: int  # token ước lượng của summary + messages
+    trimmed: int = 0  # message chưa tóm tắt bị bỏ vì vượt budget
+
+    @property
+    def pending(self) -> int:
+        """Số message chưa được tóm tắt"""
+        return self.size - self.covered
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "has_summary": bool(self.summary),
+            "messages": len(self.messages),
+            "covered": self.covered,
+            "size": self.size,
+            "tokens": self.tokens,
+            "trimmed": self.trimmed,
+        }
+
+
+class ChatMemoryService:
+    """Load history theo token budget + refresh rolling summary ở background (một event loop)"""
+
+    def __init__(self, history_tokens: int = CHAT_MEMORY_HISTORY_TOKENS, trigger: int = CHAT_MEMORY_SUMMARY_TRIGGER,
+                 keep_recent: int = CHAT_MEMORY_KEEP_RECENT, model: str = CHAT_MEMORY_SUMMARY_MODEL):
+        self.history_tokens = history_tokens
+        self.trigger = max(trigger, keep_recent + 1)
+        self.keep_recent = keep_recent
+        self.model = model
+        # Đọc tối đa 2 lần ngưỡng: đủ cho mọi message chưa tóm tắt khi summary chạy chậm hơn hội thoại
+        self.window = self.trigger * 2
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self.loads = 0
+        self.summary_hits = 0
+        self.trimmed_messages = 0
+        self.refreshes = 0
+        self.refresh_skipped = 0
+        self.refresh_errors = 0
+        self.summarized_messages = 0
+
+    async def load(self, redis_svc: AsyncRedisChatService, session_id: str, user_id: str,
+                   token_budget: Optional[int] = None) -> SessionMemory:
+        """
+        Summary + các message chưa tóm tắt mới nhất vừa token budget (một round trip Redis);
+        lên lịch refresh summary nếu session đã vượt ngưỡng
+
+        Args:
+            token_budget: Ngân sách token cho summary + history (None = CHAT_MEMORY_HISTORY_TOKENS)
+        """
+        state = await redis_svc.get_session_memory(session_id, user_id, self.window)
+        budget = token_budget or self.history_tokens
+        summary = state["summary"]
+        used = estimate_tokens(build_summary_message(summary)) if summary else 0
+        kept: List[dict] = []
+        for message in reversed(state["messages"]):
+            cost = estimate_tokens(message.get('content', ''))
+            if kept and used + cost > budget:
+                break
+            kept.append(message)
+            used += cost
+        kept.reverse()
+
+        memory = SessionMemory(
+            summary=summary,
+            messages=kept,
+            covered=state["covered"],
+            size=state["size"],
+            tokens=used,
+            trimmed=len(state["messages"]) - len(kept)
+        )
+        self.loads += 1
+        self.summary_hits += 1 if summary else 0
+        self.trimmed_messages += memory.trimmed
+        if memory.pending >= self.trigger:
+            self.schedule_refresh(redis_svc, session_id, user_id)
+        return memory
+
+    def schedule_refresh(self, redis_svc: AsyncRedisChatService, session_id: str, user_id: str) -> bool:
+        """Chạy refresh ở background task; False nếu session đang được refresh"""
+        key = f"{user_id}:{session_id}"
+        if key in self._refreshing:
+            self.refresh_skipped += 1
+            return False
+        task = asyncio.get_running_loop().create_task(self.refresh(redis_svc, session_id, user_id))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return True
+
+    async def refresh(self, redis_svc: AsyncRedisChatService, session_id: str, user_id: str,
+                      llm: Optional[AsyncLLMProvider] = None) -> bool:
+        """
+        Gộp các message cũ (trừ keep_recent message cuối) vào summary
+
+        Returns:
+            True nếu summary được cập nhật
+        """
+        try:
+            llm = llm or get_llm_provider()
+            if not llm.groq_configured:
+                return False
+            state = await redis_svc.get_session_summary(session_id, user_id)
+            if state["size"] - state["covered"] < self.trigger:
+                return False  # Worker khác đã cập nhật
+            covered = state["size"] - self.keep_recent
+            messages = await redis_svc.get_session_slice(session_id, user_id, state["covered"], covered)
+            if not messages:
+                return False
+            start = time.perf_counter()
+            summary = await self.summarize(llm, state["summary"], messages)
+            if not summary:
+                return False
+            await redis_svc.save_session_summary(session_id, user_id, summary, covered)
+            self.refreshes += 1
+            self.summarized_messages += len(messages)
+            print(f"[ChatMemory] Session {session_id}: summarized {len(messages)} messages "
+                  f"(covered {covered}/{state['size']}) in {(time.perf_counter() - start) * 1000:.0f}ms")
+            return True
+        except LLMOverloadedError as e:
+            # LLM đang quá tải: bỏ lượt này, lượt chat sau sẽ lên lịch lại
+            self.refresh_skipped += 1
+            print(f"[ChatMemory] Summary skipped for session {session_id}: {e}")
+            return False
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"[ChatMemory Error] Failed to summarize session {session_id}: {str(e)}")
+            return False
+
+    async def summarize(self, llm: AsyncLLMProvider, previous: Optional[str], messages: List[dict]) -> str:
+        """Summary mới = summary cũ + các message mới (LLM, priority analytics)"""
+        lines = []
+        for message in messages:
+            role = "Khách" if message.get('role') == 'user' else "Trợ lý"
+            content = (message.get('content') or '').strip()
+            if len(content) > CHAT_MEMORY_MESSAGE_CHARS:
+                content = content[:CHAT_MEMORY_MESSAGE_CHARS] + " ..."
+            lines.append(f"{role}: {content}")
+        parts = [f"TÓM TẮT HIỆN TẠI:\n{previous}"] if previous else []
+        parts.append("HỘI THOẠI MỚI:\n" + "\n".join(lines))
+
+        completion = await llm.groq_chat_completion(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": CHAT_MEMORY_SUMMARY_PROMPT.text},
+                {"role": "user", "content": "\n\n".join(parts)}
+            ],
+            max_tokens=CHAT_MEMORY_SUMMARY_MAX_TOKENS,
+            temperature=0.2,
+            priority=PRIORITY_ANALYTICS
+        )
+        return (completion.choices[0].message.content or "").strip()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "history_tokens": self.history_tokens,
+            "summary_trigger": self.trigger,
+            "keep_recent": self.keep_recent,
+            "model": self.model,
+            "loads": self.loads,
+            "summary_hits": self.summary_hits,
+            "trimmed_messages": self.trimmed_messages,
+            "refreshes": self.refreshes,
+            "refreshing": len(self._refreshing),
+            "refresh_skipped": self.refresh_skipped,
+            "refresh_errors": self.refresh_errors,
+            "summarized_messages": self.summarized_messages,
+        }
+
+
+# Global singleton instance
+_chat_memory: Optional[ChatMemoryService] = None
+
+def get_chat_memory() -> ChatMemoryService:
+    """Get global chat memory instance"""
+    global _chat_memory
+    if _chat_memory is None:
+        _chat_memory = ChatMemoryService()
+    return _chat_memory
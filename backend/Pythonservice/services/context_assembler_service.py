@@ -0,0 +1,205 @@
+"""
+Token-Budgeted Context Assembler
+Ghép context cho system prompt từ các section có kiểu (profile, cart, orders, discounts,
+product summary, product detail, knowledge) theo ngân sách token thay vì cắt theo ký tự
+- Mỗi section có priority + ước lượng token cost
+- Section quan trọng được giữ trước, section truncatable (chi tiết sản phẩm, kiến thức)
+  được cắt theo từng dòng/sản phẩm cho vừa phần ngân sách còn lại
+- Trả về report những gì đã giữ / cắt / bỏ để theo dõi prompt tokens bị lãng phí
+"""
+import math
+import os
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+
+# === CONFIG (env) ===
+# Ước lượng ~3 ký tự / token cho text tiếng Việt có dấu + emoji
+CHARS_PER_TOKEN = float(os.getenv('CONTEXT_CHARS_PER_TOKEN', 3.0))
+# Context window mặc định cho model không có trong MODEL_CONTEXT_WINDOWS
+MODEL_CONTEXT_WINDOW = int(os.getenv('CHAT_MODEL_CONTEXT_WINDOW', 8192))
+# Window thực tế theo model: window gốc của các model Groq là 128k nhưng giới hạn
+# tokens/phút của Groq mới là trần của một request (prompt + response)
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "openai/gpt-oss-20b": 8000,
+    "llama-3.3-70b-versatile": 12000,
+    "llama-3.1-8b-instant": 6000,
+}
+# Ngân sách tối thiểu cho context kể cả khi prompt + history đã chiếm gần hết window
+MIN_CONTEXT_TOKENS = int(os.getenv('CHAT_MIN_CONTEXT_TOKENS', 512))
+
+TRUNCATED_NOTE = "[... Đã rút gọn để tối ưu ...]"
+
+# === SECTION KINDS ===
+SECTION_PROFILE = "profile"
+SECTION_CART = "cart"
+SECTION_ORDERS = "orders"
+SECTION_DISCOUNTS = "discounts"
+SECTION_PRODUCT_SUMMARY = "product_summary"
+SECTION_PRODUCT_DETAIL = "product_detail"
+SECTION_KNOWLEDGE = "knowledge"
+
+# Priority mặc định (nhỏ hơn = quan trọng hơn, được giữ trước)
+DEFAULT_PRIORITIES: Dict[str, int] = {
+    SECTION_PROFILE: 10,
+    SECTION_CART: 20,
+    SECTION_ORDERS: 30,
+    SECTION_DISCOUNTS: 40,
+    SECTION_PRODUCT_SUMMARY: 50,
+    SECTION_PRODUCT_DETAIL: 60,
+    SECTION_KNOWLEDGE: 70,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token của một đoạn text (heuristic theo số ký tự)"""
+    if not text:
+        return 0
+    return int(math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def model_context_window(model: Optional[str]) -> int:
+    """Context window của model (MODEL_CONTEXT_WINDOW nếu model không có trong bảng)"""
+    return MODEL_CONTEXT_WINDOWS.get(model or "", MODEL_CONTEXT_WINDOW)
+
+
+def context_token_budget(max_context_tokens: int, max_tokens: int, prompt_tokens: int = 0,
+                         model: Optional[str] = None, window: Optional[int] = None) -> int:
+    """
+    Tính ngân sách token cho context của một lượt chat
+
+    Args:
+        max_context_tokens: Trần từ ChatAgentRAGConfig.max_context_tokens
+        max_tokens: Số token dành cho response của model
+        prompt_tokens: Token đã dùng cho system prompt tĩnh + history
+        model: Model của request, dùng để tra context window
+        window: Context window cụ thể (ưu tiên hơn model)
+
+    Returns:
+        min(max_context_tokens, phần window còn lại), không nhỏ hơn MIN_CONTEXT_TOKENS
+    """
+    window = window or model_context_window(model)
+    remaining = window - max_tokens - prompt_tokens
+    return max(MIN_CONTEXT_TOKENS, min(max_context_tokens, remaining))
+
+
+@dataclass
+class ContextSection:
+    """Một section context có kiểu, priority và token cost"""
+    kind: str
+    text: str
+    priority: Optional[int] = None
+    truncatable: bool = False
+    name: Optional[str] = None
+
+    def __post_init__(self):
+        self.text = (self.text or "").strip()
+        if self.priority is None:
+            self.priority = DEFAULT_PRIORITIES.get(self.kind, 100)
+        if self.name is None:
+            self.name = self.kind
+        self.tokens = estimate_tokens(self.text)
+
+    def units(self) -> List[str]:
+        """
+        Chia section thành các đơn vị không được cắt ngang:
+        mỗi dòng không thụt lề bắt đầu một unit, dòng thụt lề (vd: '   🖼️ URL') đi kèm dòng trước
+        """
+        units: List[str] = []
+        for line in self.text.split('\n'):
+            if units and line[:1].isspace():
+                units[-1] += '\n' + line
+            else:
+                units.append(line)
+        return units
+
+    def truncate(self, token_budget: int) -> Optional[str]:
+        """Giữ các unit đầu tiên vừa token_budget; None nếu chỉ giữ được header"""
+        note_tokens = estimate_tokens(TRUNCATED_NOTE) + 1
+        kept: List[str] = []
+        used = 0
+        for unit in self.units():
+            cost = estimate_tokens(unit) + 1  # +1 cho newline
+            if used + cost + note_tokens > token_budget:
+                break
+            kept.append(unit)
+            used += cost
+        if len(kept) < 2:
+            return None
+        return '\n'.join(kept).rstrip() + '\n' + TRUNCATED_NOTE
+
+
+@dataclass
+class AssembledContext:
+    """Kết quả assemble: text cuối cùng + report giữ/cắt/bỏ"""
+    text: str
+    budget: int
+    used_tokens: int
+    kept: List[str] = field(default_factory=list)
+    truncated: Dict[str, int] = field(default_factory=dict)  # section -> số token bị cắt
+    dropped: Dict[str, int] = field(default_factory=dict)  # section -> số token bị bỏ
+
+    @property
+    def dropped_tokens(self) -> int:
+        return sum(self.dropped.values()) + sum(self.truncated.values())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'budget': self.budget,
+            'used_tokens': self.used_tokens,
+            'kept': self.kept,
+            'truncated': self.truncated,
+            'dropped': self.dropped,
+            'dropped_tokens': self.dropped_tokens,
+        }
+
+
+class ContextAssembler:
+    """Chọn section theo priority cho vừa ngân sách, render lại theo thứ tự thêm vào"""
+
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+        self.sections: List[ContextSection] = []
+
+    def add(self, kind: str, text: str, priority: Optional[int] = None,
+            truncatable: bool = False, name: Optional[str] = None) -> None:
+        """Thêm một section (section rỗng bị bỏ qua)"""
+        section = ContextSection(kind=kind, text=text, priority=priority,
+                                 truncatable=truncatable, name=name)
+        if section.text:
+            self.sections.append(section)
+
+    def assemble(self, separator: str = "\n\n") -> AssembledContext:
+        """
+        Giữ section theo thứ tự priority cho đến khi hết ngân sách
+
+        Returns:
+            AssembledContext - text theo thứ tự section gốc + report
+        """
+        separator_tokens = estimate_tokens(separator)
+        remaining = self.token_budget
+        rendered: Dict[int, str] = {}
+        result = AssembledContext(text="", budget=self.token_budget, used_tokens=0)
+
+        order = sorted(range(len(self.sections)), key=lambda i: self.sections[i].priority)
+        for i in order:
+            section = self.sections[i]
+            cost = section.tokens + separator_tokens
+            if cost <= remaining:
+                rendered[i] = section.text
+                remaining -= cost
+                result.kept.append(section.name)
+                continue
+
+            trimmed = section.truncate(remaining - separator_tokens) if section.truncatable else None
+            if trimmed:
+                trimmed_tokens = estimate_tokens(trimmed)
+                rendered[i] = trimmed
+                remaining -= trimmed_tokens + separator_tokens
+                result.kept.append(section.name)
+                result.truncated[section.name] = section.tokens - trimmed_tokens
+            else:
+                result.dropped[section.name] = section.tokens
+
+        result.text = separator.join(rendered[i] for i in sorted(rendered))
+        result.used_tokens = estimate_tokens(result.text)
+        return result
@@ -0,0 +1,295 @@
+"""
+Embedding Cache Service
+Embedding function dùng chung, đặt trước embedding function mặc định của Chroma (ONNX MiniLM)
+- Batch + dedupe theo SHA-256 của text đã chuẩn hoá (NFC, gộp khoảng trắng)
+- Tier 1: LRU in-memory
+- Tier 2: disk - shard .npy bất biến (đọc qua mmap) + index append-only (hash -> shard, row),
+  dùng chung giữa các worker và giữa các lần chạy
+- Re-sync catalog không đổi -> không embed lại; câu hỏi chat lặp lại -> không chạy model
+Dùng chung cho ChatAIRAGChromaService, AnalyticsRAGService, RAGPromptService
+"""
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+# === CONFIG (env) ===
+EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', './embedding_cache')
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', 20000))
+# Số embedding mới gom lại trước khi ghi một shard xuống disk
+EMBEDDING_CACHE_FLUSH_SIZE = int(os.getenv('EMBEDDING_CACHE_FLUSH_SIZE', 64))
+# Số text tối đa mỗi lần gọi model
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+# Tên model nằm trong hash -> đổi model không dùng nhầm vector cũ
+EMBEDDING_MODEL_NAME = os.getenv('EMBEDDING_MODEL_NAME', 'all-MiniLM-L6-v2')
+
+INDEX_FILE = "index.tsv"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hoá text trước khi hash: NFC + gộp khoảng trắng (không đổi kết quả của tokenizer)"""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize('NFC', text or "")).strip()
+
+
+class EmbeddingCache:
+    """LRU in-memory + shard .npy trên disk, key = SHA-256(model + text chuẩn hoá)"""
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS,
+                 flush_size: int = EMBEDDING_CACHE_FLUSH_SIZE, model_name: str = EMBEDDING_MODEL_NAME):
+        self.cache_dir = cache_dir
+        self.memory_items = memory_items
+        self.flush_size = flush_size
+        self.model_name = model_name
+        self._lock = threading.RLock()
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: Dict[str, np.ndarray] = {}
+        self._index: Dict[str, Tuple[str, int]] = {}  # key -> (shard file, row)
+        self._index_offset = 0
+        self._shards: Dict[str, np.ndarray] = {}  # shard file -> mmap array
+        self._shard_seq = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shards_written = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._refresh_index()
+        print(f"[EmbeddingCache] Initialized at {cache_dir} ({len(self._index)} embeddings on disk, "
+              f"memory LRU: {memory_items})")
+
+    def key(self, text: str) -> str:
+        """Cache key của một text"""
+        raw = f"{self.model_name}\0{normalize_text(text)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # === DISK TIER ===
+
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, INDEX_FILE)
+
+    def _refresh_index(self) -> None:
+        """Đọc phần index mới được append (kể cả từ worker khác) từ offset đã đọc"""
+        path = self._index_path()
+        try:
+            if os.path.getsize(path) <= self._index_offset:
+                return
+        except OSError:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self._index_offset)
+            chunk = f.read()
+        # Chỉ nhận các dòng hoàn chỉnh (dòng cuối có thể đang được ghi dở)
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        for line in complete.decode('utf-8').splitlines():
+            parts = line.split('\t')
+            if len(parts) == 3:
+                self._index[parts[0]] = (parts[1], int(parts[2]))
+        self._index_offset += len(complete)
+
+    def _shard(self, name: str) -> Optional[np.ndarray]:
+        shard = self._shards.get(name)
+        if shard is None:
+            try:
+                shard = np.load(os.path.join(self.cache_dir, name), mmap_mode='r')
+            except (OSError, ValueError) as e:
+                print(f"[EmbeddingCache] Cannot open shard {name}: {e}")
+                return None
+            self._shards[name] = shard
+        return shard
+
+    def _read_disk(self, key: str) -> Optional[np.ndarray]:
+        location = self._index.get(key)
+        if location is None:
+            return None
+        shard = self._shard(location[0])
+        if shard is None or location[1] >= len(shard):
+            return None
+        return np.array(shard[location[1]], dtype=np.float32)
+
+    def flush(self) -> int:
+        """Ghi các embedding mới thành một shard .npy + append index; trả về số embedding đã ghi"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            keys = list(self._pending.keys())
+            matrix = np.stack([self._pending[k] for k in keys]).astype(np.float32)
+            self._shard_seq += 1
+            name = f"shard_{int(time.time() * 1000)}_{os.getpid()}_{self._shard_seq}.npy"
+            path = os.path.join(self.cache_dir, name)
+            try:
+                # Ghi file tạm rồi rename -> worker khác không bao giờ đọc shard ghi dở
+                tmp_path = path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, matrix)
+                os.replace(tmp_path, path)
+                lines = "".join(f"{key}\t{name}\t{row}\n" for row, key in enumerate(keys))
+                with open(self._index_path(), 'a', encoding='utf-8') as f:
+                    f.write(lines)
+            except OSError as e:
+                print(f"[EmbeddingCache] Flush failed, keeping embeddings in memory only: {e}")
+                return 0
+            self._pending.clear()
+            self.shards_written += 1
+            return len(keys)
+
+    # === LOOKUP ===
+
+    def _remember(self, key: str, embedding: np.ndarray) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Lấy các embedding đã có (memory -> disk), key không có thì bỏ qua"""
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            disk_keys = []
+            for key in keys:
+                embedding = self._memory.get(key)
+                if embedding is None:
+                    embedding = self._pending.get(key)
+                if embedding is not None:
+                    if key in self._memory:
+                        self._memory.move_to_end(key)
+                    found[key] = embedding
+                    self.memory_hits += 1
+                else:
+                    disk_keys.append(key)
+
+            if disk_keys and any(key not in self._index for key in disk_keys):
+                self._refresh_index()
+            for key in disk_keys:
+                embedding = self._read_disk(key)
+                if embedding is None:
+                    self.misses += 1
+                    continue
+                self._remember(key, embedding)
+                found[key] = embedding
+                self.disk_hits += 1
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        """Lưu embedding mới (memory + hàng đợi ghi disk)"""
+        with self._lock:
+            for key, embedding in items.items():
+                self._remember(key, embedding)
+                if key not in self._index:
+                    self._pending[key] = embedding
+            if len(self._pending) >= self.flush_size:
+                self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_items": len(self._memory),
+                "disk_items": len(self._index),
+                "pending_items": len(self._pending),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                "shards_written": self.shards_written,
+            }
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+    """
+    Embedding function cho Chroma (add/upsert/query): batch, dedupe, chỉ gọi model
+    cho text chưa có trong cache
+    """
+
+    def __init__(self, base_function=None, cache: Optional[EmbeddingCache] = None,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, enabled: bool = EMBEDDING_CACHE_ENABLED):
+        self._base_function = base_function
+        self._cache = cache
+        self._lock = threading.Lock()
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self.model_calls = 0
+        self.embedded_texts = 0
+
+    @property
+    def base_function(self):
+        """Embedding function mặc định của Chroma (ONNX MiniLM), load lười"""
+        if self._base_function is None:
+            with self._lock:
+                if self._base_function is None:
+                    self._base_function = embedding_functions.DefaultEmbeddingFunction()
+        return self._base_function
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        if self._cache is None:
+            self._cache = get_embedding_cache()
+        return self._cache
+
+    def _embed_batches(self, texts: List[str]) -> List[np.ndarray]:
+        embeddings: List[np.ndarray] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            self.model_calls += 1
+            self.embedded_texts += len(batch)
+            embeddings.extend(np.asarray(e, dtype=np.float32) for e in self.base_function(batch))
+        return embeddings
+
+    def __call__(self, input: Documents) -> Embeddings:
+        texts = list(input)
+        if not self.enabled:
+            return [e.tolist() for e in self._embed_batches(texts)]
+
+        cache = self.cache
+        keys = [cache.key(text) for text in texts]
+        unique: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+
+        found = cache.get_many(list(unique.keys()))
+        missing = [key for key in unique if key not in found]
+        if missing:
+            computed = dict(zip(missing, self._embed_batches([unique[key] for key in missing])))
+            cache.put_many(computed)
+            found.update(computed)
+
+        return [found[key].tolist() for key in keys]
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.cache.stats() if self.enabled else {}
+        stats.update({
+            "enabled": self.enabled,
+            "model_calls": self.model_calls,
+            "embedded_texts": self.embedded_texts,
+        })
+        return stats
+
+
+# Global singleton instances
+_embedding_cache: Optional[EmbeddingCache] = None
+_embedding_function: Optional[CachedEmbeddingFunction] = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get global embedding cache instance"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+def get_embedding_function() -> CachedEmbeddingFunction:
+    """Get global cached embedding function (truyền vào get_or_create_collection)"""
+    global _embedding_function
+    if _embedding_function is None:
+        _embedding_function = CachedEmbeddingFunction()
+    return _embedding_function
@@ -0,0 +1,191 @@
+"""
+Async LLM Provider Layer
+AsyncGroq + async Gemini wrapper dùng chung cho customer chat và business analytics
+- Mỗi provider dùng MỘT connection pool keep-alive dùng chung cho cả process
+- Slot đồng thời theo provider/model lấy từ LLMScheduler dùng chung (hàng đợi ưu tiên + backpressure)
+"""
+import os
+from typing import Optional, Dict, Any, List, AsyncIterator
+
+import httpx
+import google.generativeai as genai
+from groq import AsyncGroq
+
+from services.llm_scheduler_service import (
+    get_llm_scheduler, GROQ_MAX_CONCURRENCY, GEMINI_MAX_CONCURRENCY,
+    PROVIDER_GROQ, PROVIDER_GEMINI, PRIORITY_CHAT
+)
+
+# === CONFIG (env) ===
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', 32))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', 16))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', 60))
+
+
+class AsyncLLMProvider:
+    """Async client layer cho Groq và Gemini với shared connection pools"""
+
+    def __init__(self):
+        """Initialize provider (client được tạo lazy ở lần gọi đầu tiên)"""
+        self.groq_api_key = os.getenv('GROQ_API_KEY')
+        self.gemini_api_key = os.getenv('GOOGLE_API_KEY')
+
+        self._groq_http_client: Optional[httpx.AsyncClient] = None
+        self._groq_client: Optional[AsyncGroq] = None
+
+        # Gemini SDK giữ một async gRPC channel dùng chung cho cả process sau genai.configure()
+        if self.gemini_api_key:
+            genai.configure(api_key=self.gemini_api_key)
+
+        self.scheduler = get_llm_scheduler()
+
+        print(f"[LLM Provider] Initialized (Groq concurrency: {GROQ_MAX_CONCURRENCY}, "
+              f"Gemini concurrency: {GEMINI_MAX_CONCURRENCY}, pool: {LLM_MAX_CONNECTIONS} connections)")
+
+    @property
+    def groq_configured(self) -> bool:
+        return bool(self.groq_api_key)
+
+    @property
+    def gemini_configured(self) -> bool:
+        return bool(self.gemini_api_key)
+
+    @property
+    def groq_client(self) -> AsyncGroq:
+        """AsyncGroq client dùng chung một httpx pool keep-alive"""
+        if self._groq_client is None:
+            if not self.groq_api_key:
+                raise ValueError("Groq API key not configured")
+            self._groq_http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0)
+            )
+            self._groq_client = AsyncGroq(api_key=self.groq_api_key, http_client=self._groq_http_client)
+        return self._groq_client
+
+    # === GROQ ===
+
+    async def groq_chat_completion(self, model: str, messages: List[Dict[str, str]],
+                                   max_tokens: int = 1024, temperature: float = 0.7,
+                                   priority: int = PRIORITY_CHAT, **kwargs):
+        """
+        Groq chat completion (non-streaming)
+
+        Returns:
+            Groq ChatCompletion object
+
+        Raises:
+            LLMOverloadedError: scheduler từ chối (hàng đợi đầy / quá thời gian chờ)
+        """
+        async with self.scheduler.slot(PROVIDER_GROQ, model, priority):
+            return await self.groq_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                **kwargs
+            )
+
+    async def groq_chat_stream(self, model: str, messages: List[Dict[str, str]],
+                               max_tokens: int = 1024, temperature: float = 0.7,
+                               priority: int = PRIORITY_CHAT, **kwargs) -> AsyncIterator[Any]:
+        """
+        Groq chat completion với stream=True - yield từng chunk
+        Slot concurrency được giữ đến khi stream kết thúc
+        """
+        async with self.scheduler.slot(PROVIDER_GROQ, model, priority):
+            stream = await self.groq_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+                **kwargs
+            )
+            async for chunk in stream:
+                yield chunk
+
+    async def list_groq_models(self) -> List[Any]:
+        """Lấy danh sách models từ Groq API"""
+        models_response = await self.groq_client.models.list()
+        return list(models_response.data)
+
+    # === GEMINI ===
+
+    async def gemini_generate(self, model_id: str, prompt: str, priority: int = PRIORITY_CHAT) -> str:
+        """
+        Gemini generate content (async)
+
+        Returns:
+            Generated text
+        """
+        if not self.gemini_api_key:
+            raise ValueError("Gemini API key not configured")
+
+        async with self.scheduler.slot(PROVIDER_GEMINI, model_id, priority):
+            model = genai.GenerativeModel(model_name=model_id)
+            response = await model.generate_content_async(prompt)
+            return response.text
+
+    # === UNIVERSAL ===
+
+    async def generate(self, model_id: str, prompt: str, system_instruction: Optional[str] = None,
+                       temperature: float = 0.7, max_tokens: int = 4096,
+                       priority: int = PRIORITY_CHAT) -> str:
+        """
+        Universal generate - auto-detect provider theo model_id (giống AIService.generate)
+
+        Args:
+            model_id: Model ID (from any provider)
+            prompt: User prompt
+            system_instruction: System instruction (optional)
+            temperature: Temperature for generation (Groq only)
+            max_tokens: Max tokens (Groq only)
+            priority: Priority class của scheduler (PRIORITY_CHAT / PRIORITY_ANALYTICS)
+
+        Returns:
+            Generated text
+        """
+        if 'gemini' in model_id.lower():
+            # Gemini: gộp system instruction vào prompt
+            full_prompt = f"{system_instruction}\n\n{prompt}" if system_instruction else prompt
+            return await self.gemini_generate(model_id, full_prompt, priority=priority)
+
+        messages = []
+        if system_instruction:
+            messages.append({"role": "system", "content": system_instruction})
+        messages.append({"role": "user", "content": prompt})
+
+        completion = await self.groq_chat_completion(
+            model=model_id,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            priority=priority
+        )
+        return completion.choices[0].message.content
+
+    async def aclose(self) -> None:
+        """Đóng connection pools (gọi khi app shutdown)"""
+        if self._groq_client is not None:
+            await self._groq_client.close()
+            self._groq_client = None
+        if self._groq_http_client is not None:
+            await self._groq_http_client.aclose()
+            self._groq_http_client = None
+
+
+# Global singleton instance
+_llm_provider: Optional[AsyncLLMProvider] = None
+
+def get_llm_provider() -> AsyncLLMProvider:
+    """Get global async LLM provider instance"""
+    global _llm_provider
+    if _llm_provider is None:
+        _llm_provider = AsyncLLMProvider()
+    return _llm_provider
@@ -0,0 +1,288 @@
+"""
+LLM Scheduler Service
+Điều phối MỌI call LLM đi ra ngoài (Groq, Gemini) của process
+- Giới hạn đồng thời theo provider VÀ theo model (một model chậm không chiếm hết slot provider)
+- Hàng đợi có giới hạn, ưu tiên theo class: customer chat trước admin analytics
+- Admission theo deadline: ước lượng thời gian chờ từ hàng đợi + thời gian phục vụ trung bình,
+  từ chối ngay nếu không kịp deadline thay vì để request treo rồi timeout
+- Hàng đợi đầy / hết deadline -> LLMOverloadedError (route trả 503 + Retry-After)
+- Metrics: queue depth, in-flight, thời gian chờ, số request bị từ chối
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, List, AsyncIterator
+
+# === CONFIG (env) ===
+GROQ_MAX_CONCURRENCY = int(os.getenv('GROQ_MAX_CONCURRENCY', 16))
+GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 8))
+# Giới hạn mặc định cho mỗi model + override "model_a:4,model_b:2"
+LLM_MODEL_MAX_CONCURRENCY = int(os.getenv('LLM_MODEL_MAX_CONCURRENCY', 8))
+LLM_MODEL_CONCURRENCY = os.getenv('LLM_MODEL_CONCURRENCY', '')
+# Số request tối đa chờ trong hàng đợi của mỗi provider
+LLM_QUEUE_MAX_SIZE = int(os.getenv('LLM_QUEUE_MAX_SIZE', 64))
+# Thời gian chờ tối đa (giây) theo priority class
+LLM_CHAT_MAX_WAIT = float(os.getenv('LLM_CHAT_MAX_WAIT', 10))
+LLM_ANALYTICS_MAX_WAIT = float(os.getenv('LLM_ANALYTICS_MAX_WAIT', 30))
+# Thời gian phục vụ ước lượng ban đầu (giây) trước khi có số liệu thật
+LLM_INITIAL_SERVICE_TIME = float(os.getenv('LLM_INITIAL_SERVICE_TIME', 3))
+
+PROVIDER_GROQ = 'groq'
+PROVIDER_GEMINI = 'gemini'
+
+# Priority class: số nhỏ được phục vụ trước
+PRIORITY_CHAT = 0
+PRIORITY_ANALYTICS = 1
+PRIORITY_NAMES = {PRIORITY_CHAT: 'chat', PRIORITY_ANALYTICS: 'analytics'}
+PRIORITY_MAX_WAIT = {PRIORITY_CHAT: LLM_CHAT_MAX_WAIT, PRIORITY_ANALYTICS: LLM_ANALYTICS_MAX_WAIT}
+
+# Số mẫu thời gian chờ giữ lại để tính p95
+WAIT_SAMPLES = 512
+# Trọng số EWMA của thời gian phục vụ
+SERVICE_TIME_ALPHA = 0.2
+
+
+class LLMOverloadedError(Exception):
+    """LLM provider đang quá tải (hàng đợi đầy / không kịp deadline) - trả 503 + Retry-After"""
+
+    def __init__(self, provider: str, reason: str, retry_after: float):
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__(f"LLM provider '{provider}' overloaded ({reason}), retry after {self.retry_after}s")
+
+
+def _parse_model_limits(raw: str) -> Dict[str, int]:
+    """"model_a:4,model_b:2" -> {"model_a": 4, "model_b": 2} (bỏ qua mục sai format)"""
+    limits = {}
+    for item in raw.split(','):
+        model, _, value = item.strip().rpartition(':')
+        if model and value.isdigit():
+            limits[model] = int(value)
+    return limits
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    model: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued_at: float = field(compare=False)
+
+
+class _ProviderQueue:
+    """Slot + hàng đợi ưu tiên của một provider"""
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = capacity
+        self.in_flight = 0
+        self.model_in_flight: Dict[str, int] = {}
+        self.waiters: List[_Waiter] = []  # heap theo (priority, seq)
+        self.service_time = LLM_INITIAL_SERVICE_TIME  # EWMA (giây)
+        self.wait_samples: deque = deque(maxlen=WAIT_SAMPLES)
+        self.admitted = 0
+        self.completed = 0
+        self.rejected: Dict[str, int] = {}
+        self.max_queue_depth = 0
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        if priority is None:
+            return len(self.waiters)
+        return sum(1 for waiter in self.waiters if waiter.priority <= priority)
+
+
+class LLMScheduler:
+    """Scheduler dùng chung cho mọi call LLM của process (asyncio, một event loop)"""
+
+    def __init__(self, capacities: Optional[Dict[str, int]] = None, queue_size: int = LLM_QUEUE_MAX_SIZE,
+                 model_limit: int = LLM_MODEL_MAX_CONCURRENCY, model_limits: Optional[Dict[str, int]] = None):
+        capacities = capacities or {PROVIDER_GROQ: GROQ_MAX_CONCURRENCY, PROVIDER_GEMINI: GEMINI_MAX_CONCURRENCY}
+        self._queues = {name: _ProviderQueue(name, capacity) for name, capacity in capacities.items()}
+        self.queue_size = queue_size
+        self.default_model_limit = model_limit
+        self.model_limits = model_limits if model_limits is not None else _parse_model_limits(LLM_MODEL_CONCURRENCY)
+        self._seq = itertools.count()
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queue = self._queues.get(provider)
+        if queue is None:
+            queue = self._queues[provider] = _ProviderQueue(provider, GROQ_MAX_CONCURRENCY)
+        return queue
+
+    def model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.default_model_limit)
+
+    def _can_run(self, queue: _ProviderQueue, model: str) -> bool:
+        return (queue.in_flight < queue.capacity
+                and queue.model_in_flight.get(model, 0) < self.model_limit(model))
+
+    def _grant(self, queue: _ProviderQueue, model: str) -> None:
+        queue.in_flight += 1
+        queue.model_in_flight[model] = queue.model_in_flight.get(model, 0) + 1
+        queue.admitted += 1
+
+    def _reject(self, queue: _ProviderQueue, reason: str, retry_after: float) -> LLMOverloadedError:
+        queue.rejected[reason] = queue.rejected.get(reason, 0) + 1
+        print(f"[LLM Scheduler] Rejected {queue.name} request: {reason} "
+              f"(queue: {len(queue.waiters)}, in-flight: {queue.in_flight}/{queue.capacity})")
+        return LLMOverloadedError(queue.name, reason, retry_after)
+
+    def _remove(self, queue: _ProviderQueue, waiter: _Waiter) -> None:
+        """Bỏ waiter đã timeout / bị huỷ khỏi hàng đợi"""
+        if waiter in queue.waiters:
+            queue.waiters.remove(waiter)
+            heapq.heapify(queue.waiters)
+
+    def _dispatch(self, queue: _ProviderQueue) -> None:
+        """Cấp slot cho waiter ưu tiên cao nhất mà model còn slot (không bị chặn bởi model đầu hàng)"""
+        if not queue.waiters or queue.in_flight >= queue.capacity:
+            return
+        granted = False
+        for waiter in sorted(queue.waiters):
+            if queue.in_flight >= queue.capacity:
+                break
+            if not waiter.future.done() and self._can_run(queue, waiter.model):
+                self._grant(queue, waiter.model)
+                waiter.future.set_result(None)
+                granted = True
+        if granted:
+            queue.waiters = [waiter for waiter in queue.waiters if not waiter.future.done()]
+            heapq.heapify(queue.waiters)
+
+    def estimate_wait(self, provider: str, priority: int = PRIORITY_CHAT) -> float:
+        """Thời gian chờ ước lượng (giây) cho request mới với priority này"""
+        queue = self._queue(provider)
+        if queue.in_flight < queue.capacity and not queue.waiters:
+            return 0.0
+        ahead = queue.queue_depth(priority)
+        return (ahead + 1) / max(queue.capacity, 1) * queue.service_time
+
+    def check_admission(self, provider: str, model: str, priority: int = PRIORITY_CHAT,
+                        max_wait: Optional[float] = None) -> None:
+        """
+        Kiểm tra nhanh (không chiếm slot) - dùng trước khi mở stream SSE để còn trả được 503
+
+        Raises:
+            LLMOverloadedError: hàng đợi đầy hoặc thời gian chờ ước lượng vượt deadline
+        """
+        queue = self._queue(provider)
+        if self._can_run(queue, model) and not queue.waiters:
+            return
+        max_wait = PRIORITY_MAX_WAIT.get(priority, LLM_CHAT_MAX_WAIT) if max_wait is None else max_wait
+        estimate = self.estimate_wait(provider, priority)
+        if len(queue.waiters) >= self.queue_size:
+            raise self._reject(queue, 'queue_full', estimate)
+        if estimate > max_wait:
+            raise self._reject(queue, 'deadline', estimate)
+
+    async def acquire(self, provider: str, model: str, priority: int = PRIORITY_CHAT,
+                      max_wait: Optional[float] = None) -> float:
+        """
+        Chờ slot cho (provider, model)
+
+        Returns:
+            Thời gian đã chờ (giây)
+
+        Raises:
+            LLMOverloadedError: hàng đợi đầy, không kịp deadline, hoặc chờ quá max_wait
+        """
+        queue = self._queue(provider)
+        max_wait = PRIORITY_MAX_WAIT.get(priority, LLM_CHAT_MAX_WAIT) if max_wait is None else max_wait
+
+        if self._can_run(queue, model) and not queue.waiters:
+            self._grant(queue, model)
+            queue.wait_samples.append(0.0)
+            return 0.0
+
+        self.check_admission(provider, model, priority, max_wait)
+
+        start = time.monotonic()
+        waiter = _Waiter(priority, next(self._seq), model, asyncio.get_running_loop().create_future(), start)
+        heapq.heappush(queue.waiters, waiter)
+        queue.max_queue_depth = max(queue.max_queue_depth, len(queue.waiters))
+        # Có thể còn slot cho model này dù waiter khác đang chờ model hết slot
+        self._dispatch(queue)
+        try:
+            await asyncio.wait_for(waiter.future, timeout=max_wait)
+        except asyncio.TimeoutError:
+            self._remove(queue, waiter)
+            raise self._reject(queue, 'timeout', self.estimate_wait(provider, priority))
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(provider, model)  # đã được cấp slot đúng lúc client huỷ
+            self._remove(queue, waiter)
+            raise
+
+        waited = time.monotonic() - start
+        queue.wait_samples.append(waited)
+        return waited
+
+    def release(self, provider: str, model: str, service_time: Optional[float] = None) -> None:
+        """Trả slot + cập nhật thời gian phục vụ trung bình, rồi cấp slot cho waiter tiếp theo"""
+        queue = self._queue(provider)
+        queue.in_flight = max(queue.in_flight - 1, 0)
+        queue.model_in_flight[model] = max(queue.model_in_flight.get(model, 0) - 1, 0)
+        if service_time is not None:
+            queue.completed += 1
+            queue.service_time += SERVICE_TIME_ALPHA * (service_time - queue.service_time)
+        self._dispatch(queue)
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str, priority: int = PRIORITY_CHAT,
+                   max_wait: Optional[float] = None) -> AsyncIterator[None]:
+        """async with scheduler.slot(...): giữ slot trong suốt call LLM (kể cả stream)"""
+        await self.acquire(provider, model, priority, max_wait)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(provider, model, time.monotonic() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, in-flight, thời gian chờ (avg/p95/max), từ chối theo lý do"""
+        providers = {}
+        for name, queue in self._queues.items():
+            samples = sorted(queue.wait_samples)
+            providers[name] = {
+                "capacity": queue.capacity,
+                "in_flight": queue.in_flight,
+                "in_flight_by_model": {m: n for m, n in queue.model_in_flight.items() if n},
+                "queue_depth": len(queue.waiters),
+                "queue_depth_by_priority": {
+                    PRIORITY_NAMES.get(p, str(p)): sum(1 for w in queue.waiters if w.priority == p)
+                    for p in PRIORITY_NAMES
+                },
+                "max_queue_depth": queue.max_queue_depth,
+                "admitted": queue.admitted,
+                "completed": queue.completed,
+                "rejected": dict(queue.rejected),
+                "avg_wait_ms": round(sum(samples) / len(samples) * 1000, 1) if samples else 0.0,
+                "p95_wait_ms": round(samples[int(len(samples) * 0.95) - 1 if len(samples) > 1 else 0] * 1000, 1) if samples else 0.0,
+                "max_wait_ms": round(samples[-1] * 1000, 1) if samples else 0.0,
+                "avg_service_time_ms": round(queue.service_time * 1000, 1),
+            }
+        return {
+            "queue_size": self.queue_size,
+            "model_limit": self.default_model_limit,
+            "model_limits": dict(self.model_limits),
+            "providers": providers,
+        }
+
+
+# Global singleton instance
+_llm_scheduler: Optional[LLMScheduler] = None
+
+def get_llm_scheduler() -> LLMScheduler:
+    """Get global LLM scheduler instance"""
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        _llm_scheduler = LLMScheduler()
+    return _llm_scheduler
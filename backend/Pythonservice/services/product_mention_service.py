@@ -0,0 +1,115 @@
+"""
+Product Mention Service
+Tìm sản phẩm được nhắc tới trong response của AI (để hiện nút "🛒 Thêm ... vào giỏ")
+- Index dựng MỘT lần cho mỗi catalog snapshot (rebuild khi catalog version đổi):
+  postings từ (từ có nghĩa trong tên) -> danh sách sản phẩm + tên chuẩn/alias -> sản phẩm
+- Toàn bộ từ và tên được compile vào một automaton Aho-Corasick -> một lượt quét response
+  thay vì vòng lặp sản phẩm × từ × `w in response`
+- Phủ toàn bộ catalog (không chỉ 50 sản phẩm đầu)
+- Ngữ nghĩa giữ như logic cũ: khớp substring trên response đã lowercase; tên nhiều từ cần
+  khớp >= 2 từ có nghĩa (len > 2), tên không có từ có nghĩa cần khớp nguyên tên
+"""
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+from services.catalog_snapshot_service import CatalogSnapshot
+from services.query_intent_service import KeywordAutomaton, find_brands
+
+# Từ có nghĩa trong tên sản phẩm: dài hơn 2 ký tự (giống logic cũ)
+MIN_WORD_LENGTH = 3
+# Tên quá ngắn không dùng làm cụm khớp nguyên tên (tránh khớp nhầm)
+MIN_NAME_LENGTH = 3
+
+_WORD_LABEL = "w:"
+_NAME_LABEL = "n:"
+
+
+class ProductMentionIndex:
+    """Postings từ -> sản phẩm + automaton trên từ, tên chuẩn và alias của một catalog snapshot"""
+
+    def __init__(self, snapshot: CatalogSnapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self._postings: Dict[str, List[int]] = {}
+        self._required: List[int] = []  # số từ cần khớp để coi là được nhắc tới
+        self._automaton = KeywordAutomaton()
+
+        for idx, name in enumerate(snapshot.names_lower):
+            words = list(dict.fromkeys(w for w in name.split() if len(w) >= MIN_WORD_LENGTH))
+            for word in words:
+                self._postings.setdefault(word, []).append(idx)
+                self._automaton.add(word, _WORD_LABEL + word)
+            self._required.append(min(2, len(words)))
+
+            for phrase in self._phrases(idx, name):
+                self._automaton.add(phrase, f"{_NAME_LABEL}{idx}")
+        self._automaton.build()
+        # Nhóm thương hiệu có trong catalog (theo tên + brand) - để phát hiện thương hiệu không bán
+        self.brand_groups = frozenset(
+            group for idx, name in enumerate(snapshot.names_lower)
+            for group in find_brands(f"{name} {snapshot.brand_of(idx)} ")
+        )
+
+    def _phrases(self, idx: int, name: str) -> List[str]:
+        """Tên chuẩn + alias bỏ thương hiệu ("samsung galaxy s24" -> "galaxy s24")"""
+        phrases = []
+        if len(name) >= MIN_NAME_LENGTH:
+            phrases.append(name)
+        brand = self.snapshot.brand_of(idx).lower()
+        words = name.split()
+        if brand and len(words) > 2 and words[0] == brand:
+            phrases.append(" ".join(words[1:]))
+        return phrases
+
+    def mentioned_indices(self, text: str) -> List[int]:
+        """Index (theo thứ tự catalog) các sản phẩm được nhắc tới trong text - một lượt quét"""
+        if not text:
+            return []
+        labels = self._automaton.find(text.lower())
+        matched_words: Counter = Counter()
+        mentioned = set()
+        for label in labels:
+            if label.startswith(_WORD_LABEL):
+                for idx in self._postings.get(label[len(_WORD_LABEL):], ()):
+                    matched_words[idx] += 1
+            else:
+                mentioned.add(int(label[len(_NAME_LABEL):]))
+        for idx, count in matched_words.items():
+            if count >= self._required[idx] > 0:
+                mentioned.add(idx)
+        return sorted(mentioned)
+
+    def named_indices(self, text: str) -> List[int]:
+        """Index các sản phẩm có nguyên tên (hoặc alias) xuất hiện trong text"""
+        if not text:
+            return []
+        labels = self._automaton.find(text.lower())
+        return sorted(int(label[len(_NAME_LABEL):]) for label in labels if label.startswith(_NAME_LABEL))
+
+    def mentioned_products(self, text: str) -> List[Dict]:
+        """Sản phẩm được nhắc tới dạng {id, name, price} (format của action detection)"""
+        return [self.snapshot.action_product(idx) for idx in self.mentioned_indices(text)]
+
+    def named_products(self, text: str) -> List[Dict]:
+        """Sản phẩm có nguyên tên trong text dạng {id, name, price}"""
+        return [self.snapshot.action_product(idx) for idx in self.named_indices(text)]
+
+
+# Global index của snapshot hiện tại (rebuild khi catalog snapshot đổi)
+_mention_index: Optional[ProductMentionIndex] = None
+_mention_index_lock = threading.Lock()
+
+def get_mention_index(snapshot: CatalogSnapshot) -> ProductMentionIndex:
+    """Mention index của catalog snapshot (dựng lại khi snapshot được reload)"""
+    global _mention_index
+    index = _mention_index
+    if index is None or index.snapshot is not snapshot:
+        with _mention_index_lock:
+            index = _mention_index
+            if index is None or index.snapshot is not snapshot:
+                index = ProductMentionIndex(snapshot)
+                _mention_index = index
+                print(f"[ProductMention] Index built: {len(snapshot)} products, "
+                      f"{len(index._postings)} words (catalog version {snapshot.version})")
+    return index
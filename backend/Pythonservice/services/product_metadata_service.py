@@ -0,0 +1,145 @@
+"""
+Product Metadata Schema
+Metadata có kiểu cho collection chat_ai_products, chuẩn hoá MỘT LẦN lúc ingest
+(add_product, add_products_batch, webhook sync_product, sync-system-data)
+- price:int (0 = không có giá), stock:int, category_norm, brand, img_url, status
+- Retrieval đọc metadata thay vì str.find trên document text ("Giá: ... VNĐ", "Danh mục:"...)
+- Filter giá / category / status được đẩy xuống Chroma qua `where`
+- meta_version đánh dấu document đã theo schema mới (migration một lần cho collection cũ)
+"""
+import json
+from typing import Dict, Any, Optional, Tuple, List
+
+PRODUCT_METADATA_VERSION = 1
+
+# Status được coi là đang bán (status rỗng từ dữ liệu cũ coi như ACTIVE)
+ACTIVE_STATUSES = ["ACTIVE", ""]
+
+
+def normalize_category(raw: Optional[str]) -> str:
+    """Chuẩn hoá tên danh mục về các category mà QueryIntent dùng"""
+    category = (raw or "").strip().lower()
+    if not category:
+        return 'unknown'
+    if 'điện thoại' in category:
+        return 'điện thoại'
+    elif 'laptop' in category:
+        return 'laptop'
+    elif 'tablet' in category or 'tab' in category:
+        return 'tablet'
+    elif 'tai nghe' in category or 'headphone' in category:
+        return 'tai nghe'
+    elif 'phụ kiện' in category:
+        return 'phụ kiện'
+    return category
+
+
+def parse_price(value: Any) -> int:
+    """Giá -> int VNĐ; chấp nhận int/float/str có dấu phẩy ("25,990,000"); 0 nếu không hợp lệ"""
+    if value is None or isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return max(int(value), 0)
+    text = str(value).replace(',', '').replace(' ', '').replace('VNĐ', '').replace('đ', '')
+    try:
+        return max(int(float(text)), 0)
+    except ValueError:
+        return 0
+
+
+def parse_stock(value: Any) -> int:
+    """Số lượng tồn kho -> int (0 nếu không hợp lệ)"""
+    try:
+        return max(int(float(str(value).strip())), 0) if value not in (None, '') else 0
+    except ValueError:
+        return 0
+
+
+def first_image_url(image_urls: Any) -> str:
+    """Ảnh chính từ imageUrls (list hoặc JSON string)"""
+    if isinstance(image_urls, str):
+        try:
+            image_urls = json.loads(image_urls)
+        except ValueError:
+            return image_urls if image_urls.startswith('http') else ''
+    if isinstance(image_urls, list) and image_urls:
+        return str(image_urls[0])
+    return ''
+
+
+def build_product_metadata(product_id: Any, name: str, price: Any = 0, category: Optional[str] = "",
+                           brand: Optional[str] = "", stock: Any = 0, img_url: Optional[str] = "",
+                           status: Optional[str] = "ACTIVE", **extra: Any) -> Dict[str, Any]:
+    """
+    Metadata có kiểu cho một product document
+
+    Args:
+        product_id, name, price, category, brand, stock, img_url, status: Trường chuẩn
+        **extra: Trường bổ sung (timestamp, seller, specs...) - giá trị None bị bỏ qua
+
+    Returns:
+        Dict chỉ chứa str/int/float/bool (Chroma không nhận None)
+    """
+    metadata = {
+        "product_id": str(product_id if product_id is not None else ""),
+        "product_name": name or "",
+        "price": parse_price(price),
+        "category": category or "",
+        "category_norm": normalize_category(category),
+        "brand": brand or "",
+        "stock": parse_stock(stock),
+        "img_url": img_url or "",
+        "status": status if status is not None else "ACTIVE",
+        "meta_version": PRODUCT_METADATA_VERSION,
+    }
+    for key, value in extra.items():
+        if value is not None and key not in metadata:
+            metadata[key] = value
+    return metadata
+
+
+def is_typed_metadata(metadata: Optional[Dict[str, Any]]) -> bool:
+    """Document đã theo schema có kiểu (không cần migration)"""
+    return bool(metadata) and metadata.get("meta_version", 0) >= PRODUCT_METADATA_VERSION
+
+
+def product_fields(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Các trường chuẩn đọc từ metadata có kiểu (price None nếu không có giá)"""
+    return {
+        "id": metadata.get("product_id", ""),
+        "name": metadata.get("product_name", ""),
+        "price": int(metadata.get("price") or 0) or None,
+        "category": metadata.get("category_norm") or 'unknown',
+        "brand": metadata.get("brand", ""),
+        "stock": int(metadata.get("stock") or 0),
+        "img_url": metadata.get("img_url", ""),
+        "status": metadata.get("status", "ACTIVE"),
+    }
+
+
+def build_product_where(category: Optional[str] = None, price_range: Optional[Tuple[int, int]] = None,
+                        active_only: bool = True, exclude_category: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Where clause cho collection.query/get
+
+    Args:
+        category: category_norm cần lọc
+        price_range: (min, max) VNĐ
+        active_only: Chỉ lấy sản phẩm đang bán
+        exclude_category: True -> lấy sản phẩm KHÁC category
+
+    Returns:
+        Where dict hoặc None nếu không có điều kiện
+    """
+    clauses: List[Dict[str, Any]] = []
+    if active_only:
+        clauses.append({"status": {"$in": ACTIVE_STATUSES}})
+    if category:
+        clauses.append({"category_norm": {"$ne": category} if exclude_category else category})
+    if price_range:
+        # price 0 = không có giá -> luôn loại khỏi khoảng giá
+        clauses.append({"price": {"$gte": max(int(price_range[0]), 1)}})
+        clauses.append({"price": {"$lte": int(price_range[1])}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
@@ -0,0 +1,218 @@
+"""
+Product Search Service
+Tìm sản phẩm theo từ khoá (BM25) trong process, fuse với vector search bằng Reciprocal Rank Fusion
+- MiniLM hay bỏ sót tên model chính xác ("XM5", "S24 Ultra", "ThinkPad"); BM25 trên tên,
+  thương hiệu, danh mục và thông số bắt đúng các token này
+- Fold dấu tiếng Việt ("điện thoại" == "dien thoai"), tách token chữ/số ("wh-1000xm5" -> "xm5")
+- Index dựng từ catalog snapshot, cập nhật tăng dần khi snapshot reload sau sync: chỉ tokenize lại
+  sản phẩm thêm / sửa, bỏ sản phẩm đã xoá (so fingerprint từng sản phẩm)
+- RRF: score = sum(1 / (k + rank)) qua các bảng xếp hạng - không cần chuẩn hoá score BM25/cosine
+"""
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from services.catalog_snapshot_service import CatalogSnapshot
+
+# === CONFIG (env) ===
+PRODUCT_BM25_K1 = float(os.getenv('PRODUCT_BM25_K1', 1.2))
+PRODUCT_BM25_B = float(os.getenv('PRODUCT_BM25_B', 0.75))
+# Hằng số k của Reciprocal Rank Fusion (60 theo paper gốc)
+PRODUCT_RRF_K = int(os.getenv('PRODUCT_RRF_K', 60))
+
+# Trọng số field = số lần lặp token của field trong document BM25
+FIELD_WEIGHTS = (('name', 3), ('brand', 2), ('category', 1), ('content', 1))
+
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+_RUN_PATTERN = re.compile(r'[a-z]+|[0-9]+')
+
+
+def fold_diacritics(text: str) -> str:
+    """Lowercase + bỏ dấu tiếng Việt ("Điện thoại" -> "dien thoai")"""
+    decomposed = unicodedata.normalize('NFD', (text or "").lower())
+    stripped = ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+    return stripped.replace('đ', 'd')
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Token đã fold dấu; token lẫn chữ + số được thêm các đoạn chữ/số và các hậu tố
+    bắt đầu ở ranh giới chữ/số ("1000xm5" -> "1000xm5", "1000", "xm", "5", "xm5")
+    """
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(fold_diacritics(text)):
+        tokens.append(token)
+        runs = _RUN_PATTERN.findall(token)
+        if len(runs) > 1:
+            tokens.extend(runs)
+            for start in range(1, len(runs) - 1):
+                tokens.append(''.join(runs[start:]))
+    return tokens
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = PRODUCT_RRF_K) -> List[Tuple[str, float]]:
+    """
+    Gộp nhiều bảng xếp hạng (list id theo thứ tự giảm dần độ liên quan)
+
+    Returns:
+        [(id, rrf_score)] giảm dần; hoà điểm -> id xuất hiện trước ở bảng đầu tiên đứng trước
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+class ProductLexicalIndex:
+    """BM25 (Okapi) trên các sản phẩm ACTIVE của catalog snapshot (thread-safe)"""
+
+    def __init__(self, k1: float = PRODUCT_BM25_K1, b: float = PRODUCT_BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.version: Optional[int] = None  # catalog version của snapshot đã index
+        self._postings: Dict[str, Dict[str, int]] = {}  # token -> {product_id: tf}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._fingerprints: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        self.refreshes = 0
+        self.reindexed = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    # === INDEX UPDATES ===
+
+    def upsert(self, product_id: str, name: str, brand: str = "", category: str = "", content: str = "") -> None:
+        """Thêm / thay document của một sản phẩm"""
+        fields = {'name': name, 'brand': brand, 'category': category, 'content': content}
+        terms: Counter = Counter()
+        for field_name, weight in FIELD_WEIGHTS:
+            for token in tokenize(fields[field_name]):
+                terms[token] += weight
+        with self._lock:
+            self._remove_locked(product_id)
+            for token, tf in terms.items():
+                self._postings.setdefault(token, {})[product_id] = tf
+            length = sum(terms.values())
+            self._doc_terms[product_id] = terms
+            self._doc_lengths[product_id] = length
+            self._total_length += length
+
+    def remove(self, product_id: str) -> None:
+        with self._lock:
+            self._remove_locked(product_id)
+            self._fingerprints.pop(product_id, None)
+
+    def _remove_locked(self, product_id: str) -> None:
+        terms = self._doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for token in terms:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[token]
+        self._total_length -= self._doc_lengths.pop(product_id, 0)
+
+    def refresh(self, snapshot: CatalogSnapshot) -> None:
+        """
+        Đồng bộ index với snapshot (sản phẩm ACTIVE): chỉ tokenize lại sản phẩm có
+        fingerprint (tên, thương hiệu, danh mục, document) đổi, xoá sản phẩm không còn
+        """
+        if self.version == snapshot.version:
+            return
+        with self._lock:
+            if self.version == snapshot.version:
+                return
+            seen: Set[str] = set()
+            changed = 0
+            for row in snapshot.active_indices():
+                row = int(row)
+                product_id = snapshot.ids[row]
+                seen.add(product_id)
+                fields = (snapshot.names[row], snapshot.brand_of(row), snapshot.category_of(row), snapshot.contents[row])
+                fingerprint = hash(fields)
+                if self._fingerprints.get(product_id) == fingerprint and product_id in self._doc_terms:
+                    continue
+                self.upsert(product_id, *fields)
+                self._fingerprints[product_id] = fingerprint
+                changed += 1
+            removed = [product_id for product_id in self._doc_terms if product_id not in seen]
+            for product_id in removed:
+                self.remove(product_id)
+            self.version = snapshot.version
+            self.refreshes += 1
+            self.reindexed += changed
+        if changed or removed:
+            print(f"[ProductSearch] Lexical index -> catalog version {snapshot.version}: "
+                  f"{changed} reindexed, {len(removed)} removed, {len(self)} products")
+
+    # === SEARCH ===
+
+    def search(self, query: str, top_k: int = 10, allowed: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """
+        BM25 top-k
+
+        Args:
+            query: Câu hỏi (fold dấu như document)
+            top_k: Số kết quả tối đa
+            allowed: Chỉ xét các product_id này (lọc giá / thương hiệu); None = mọi sản phẩm
+
+        Returns:
+            [(product_id, score)] giảm dần theo score
+        """
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return []
+        scores: Dict[str, float] = {}
+        with self._lock:
+            count = len(self._doc_lengths)
+            if count == 0:
+                return []
+            avg_length = self._total_length / count
+            for token in query_terms:
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for product_id, tf in postings.items():
+                    if allowed is not None and product_id not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[product_id] / avg_length)
+                    scores[product_id] = scores.get(product_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        return ranked[:top_k]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.version,
+                "products": len(self._doc_lengths),
+                "terms": len(self._postings),
+                "refreshes": self.refreshes,
+                "reindexed": self.reindexed,
+            }
+
+
+# Global singleton instance (refresh theo catalog snapshot của lượt chat)
+_lexical_index: Optional[ProductLexicalIndex] = None
+_lexical_index_lock = threading.Lock()
+
+def get_product_lexical_index(snapshot: Optional[CatalogSnapshot] = None) -> ProductLexicalIndex:
+    """Get global lexical index (đồng bộ tăng dần với snapshot nếu truyền vào)"""
+    global _lexical_index
+    if _lexical_index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None:
+                _lexical_index = ProductLexicalIndex()
+    if snapshot is not None:
+        _lexical_index.refresh(snapshot)
+    return _lexical_index
@@ -0,0 +1,120 @@
+"""
+Query Embedding Service
+Embed câu hỏi của user MỘT lần cho mỗi lượt chat, dùng lại cho mọi collection.query
+(products, knowledge, discounts, orders) qua `query_embeddings=` thay vì `query_texts=`
+- EmbeddingContext: embedding theo request, tính lười + thread-safe (các lookup chạy song song
+  trong thread pool - lookup đầu tiên tính, các lookup khác chờ và dùng lại)
+- Bảng embedding precomputed cho các probe string cố định ("order history", "active modal config"...)
+- Cùng embedding function (có cache) với các collection của Chroma -> cùng không gian vector,
+  câu hỏi lặp lại lấy từ embedding cache, không chạy model
+"""
+import threading
+from typing import Optional, List, Dict, Any
+
+from services.embedding_cache_service import get_embedding_function
+
+# Probe string cố định dùng trong các query không phụ thuộc câu hỏi
+PROBE_ORDER_HISTORY = "order history"
+PROBE_USER_PROFILE = "user profile information"
+PROBE_ACTIVE_MODAL_CONFIG = "active modal config"
+PROBE_MODAL_CONFIG = "modal config"
+
+PROBE_TEXTS = (PROBE_ORDER_HISTORY, PROBE_USER_PROFILE, PROBE_ACTIVE_MODAL_CONFIG, PROBE_MODAL_CONFIG)
+
+
+class QueryEmbedder:
+    """Embedding function dùng chung + bảng embedding cho probe string cố định"""
+
+    def __init__(self, embedding_function=None):
+        self._embedding_function = embedding_function
+        self._lock = threading.Lock()
+        self._probes: Dict[str, List[float]] = {}
+        self.embed_calls = 0
+
+    @property
+    def embedding_function(self):
+        """Embedding function dùng chung có cache (CachedEmbeddingFunction)"""
+        if self._embedding_function is None:
+            self._embedding_function = get_embedding_function()
+        return self._embedding_function
+
+    def embed(self, text: str) -> List[float]:
+        """Embed một đoạn text"""
+        self.embed_calls += 1
+        embedding = self.embedding_function([text])[0]
+        return [float(x) for x in embedding]
+
+    def probe(self, text: str) -> List[float]:
+        """Embedding của probe string cố định (tính một lần cho cả process)"""
+        embedding = self._probes.get(text)
+        if embedding is None:
+            embedding = self.embed(text)
+            self._probes[text] = embedding
+        return embedding
+
+    def warm_up(self) -> None:
+        """Precompute bảng probe (gọi lúc startup để lượt chat đầu không phải chờ)"""
+        for text in PROBE_TEXTS:
+            self.probe(text)
+        print(f"[QueryEmbedding] Precomputed {len(self._probes)} probe embeddings")
+
+    def probe_query_args(self, text: str) -> Dict[str, Any]:
+        """kwargs cho collection.query với probe string ({query_embeddings} hoặc fallback {query_texts})"""
+        try:
+            return {"query_embeddings": [self.probe(text)]}
+        except Exception as e:
+            print(f"[QueryEmbedding] Probe embedding failed, falling back to query_texts: {e}")
+            return {"query_texts": [text]}
+
+
+class EmbeddingContext:
+    """Embedding của câu hỏi trong một lượt chat - tính tối đa một lần"""
+
+    def __init__(self, query: str, embedder: Optional[QueryEmbedder] = None):
+        self.query = query
+        self._embedder = embedder
+        self._lock = threading.Lock()
+        self._embedding: Optional[List[float]] = None
+        self._failed = False
+
+    @property
+    def embedder(self) -> QueryEmbedder:
+        return self._embedder or get_query_embedder()
+
+    def embedding(self) -> Optional[List[float]]:
+        """Embedding của query (None nếu embed lỗi)"""
+        if self._embedding is not None or self._failed:
+            return self._embedding
+        with self._lock:
+            if self._embedding is None and not self._failed:
+                try:
+                    self._embedding = self.embedder.embed(self.query)
+                except Exception as e:
+                    self._failed = True
+                    print(f"[QueryEmbedding] Query embedding failed, falling back to query_texts: {e}")
+        return self._embedding
+
+    def query_args(self) -> Dict[str, Any]:
+        """kwargs cho collection.query: {query_embeddings} hoặc fallback {query_texts}"""
+        embedding = self.embedding()
+        if embedding is None:
+            return {"query_texts": [self.query]}
+        return {"query_embeddings": [embedding]}
+
+
+def embedding_for(query: str, embedding: Optional[EmbeddingContext] = None) -> EmbeddingContext:
+    """EmbeddingContext của lượt chat nếu cùng query, nếu không tạo context mới"""
+    if embedding is not None and embedding.query == query:
+        return embedding
+    return EmbeddingContext(query)
+
+
+# Global singleton instance
+_query_embedder: Optional[QueryEmbedder] = None
+
+def get_query_embedder() -> QueryEmbedder:
+    """Get global query embedder instance"""
+    global _query_embedder
+    if _query_embedder is None:
+        _query_embedder = QueryEmbedder()
+    return _query_embedder
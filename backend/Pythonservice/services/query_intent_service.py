@@ -0,0 +1,430 @@
+"""
+Query Intent Service
+Phân tích câu hỏi của khách MỘT lần cho mọi bộ phân tích (get_all_products_for_ai,
+retrieve_product_context, detect_action_intent, suggestions, order intent...)
+- Toàn bộ từ khoá (danh mục, mục đích, giá, thương hiệu, so sánh, thông số, đơn hàng, giỏ hàng...)
+  được compile một lần vào một automaton Aho-Corasick
+- Một lượt quét câu hỏi trả về QueryIntent có kiểu; consumer dùng lại object này thay vì
+  tự lower() + any(kw in query) trên từng danh sách từ khoá
+- Ngữ nghĩa giữ nguyên như các danh sách cũ: khớp substring trên câu hỏi đã lowercase
+- Khoảng giá được parse từ cách nói tự do ("tầm 12tr", "từ 8 đến 11 triệu", "under 700k",
+  "khoảng 15 củ ±10%") thay vì một danh sách cụm từ cố định
+"""
+import os
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+# === CONFIG (env) ===
+# "tầm / khoảng X" không kèm ±N% -> X ± tỉ lệ này
+PRICE_APPROX_TOLERANCE = float(os.getenv('PRICE_APPROX_TOLERANCE', 0.1))
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: tìm tất cả từ khoá (kể cả chồng lấn) trong một lượt quét"""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[str, ...]] = [()]
+
+    def add(self, keyword: str, label: str) -> None:
+        """Thêm một từ khoá gắn với label"""
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+                self._goto[node][ch] = nxt
+            node = nxt
+        if label not in self._out[node]:
+            self._out[node] = self._out[node] + (label,)
+
+    def build(self) -> "KeywordAutomaton":
+        """Tính failure links (gọi sau khi add xong toàn bộ từ khoá)"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        return self
+
+    def find(self, text: str) -> Set[str]:
+        """Tập label của mọi từ khoá xuất hiện trong text"""
+        found: Set[str] = set()
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._out[node]:
+                found.update(self._out[node])
+        return found
+
+
+# === VOCABULARIES ===
+# Thứ tự trong mỗi dict là thứ tự ưu tiên khi nhiều nhóm cùng khớp
+
+CATEGORY_KEYWORDS: Dict[str, List[str]] = {
+    'điện thoại': ['điện thoại', 'phone', 'smartphone', 'mobile', 'dien thoai', 'iphone', 'samsung', 'xiaomi'],
+    'laptop': ['laptop', 'máy tính', 'may tinh', 'notebook', 'macbook', 'computer', 'pc'],
+    'tablet': ['tablet', 'ipad', 'tab'],
+    'tai nghe': ['tai nghe', 'headphone', 'earphone', 'airpods', 'earbuds'],
+    'đồng hồ thông minh': ['đồng hồ', 'dong ho', 'smartwatch', 'apple watch', 'galaxy watch'],
+    'phụ kiện': ['phụ kiện', 'accessory', 'charger', 'case'],
+}
+
+PURPOSE_KEYWORDS: Dict[str, List[str]] = {
+    'gaming': ['gaming', 'game', 'chơi game', 'fps', 'pubg', 'lol', 'liên quân'],
+    'văn phòng': ['văn phòng', 'làm việc', 'office', 'word', 'excel', 'công việc'],
+    'chụp ảnh': ['chụp ảnh', 'camera', 'photography', 'quay phim', 'selfie', 'chụp hình'],
+    'học tập': ['học tập', 'sinh viên', 'học sinh', 'học online', 'học trực tuyến'],
+    'giải trí': ['giải trí', 'xem phim', 'nghe nhạc', 'youtube', 'netflix', 'tiktok'],
+}
+
+PRICE_BAND_KEYWORDS: Dict[str, List[str]] = {
+    'low': ['giá rẻ', 'rẻ', 'cheap', 'budget', 'thấp', 'tiết kiệm', 'sinh viên',
+            'low price', 'affordable', 'giá mềm', 'gia re'],
+    'high': ['cao cấp', 'premium', 'flagship', 'đắt', 'xịn', 'tốt nhất', 'pro', 'ultra',
+             'high-end', 'đỉnh cao'],
+    'mid': ['tầm trung', 'vừa phải', 'không quá đắt', 'mid-range'],
+}
+
+BRAND_KEYWORDS: Dict[str, List[str]] = {
+    # Apple ecosystem - phải đặt trước để ưu tiên
+    'apple': ['apple', 'táo', 'hệ sinh thái apple'],
+    # Laptop brands/products
+    'macbook': ['macbook', 'mac book'],
+    'dell': ['dell', 'xps'],
+    'hp': ['hp ', 'hp pavilion', 'hp probook'],
+    'lenovo': ['lenovo', 'thinkpad', 'ideapad', 'legion'],
+    'asus': ['asus', 'vivobook', 'zenbook', 'rog'],
+    'acer': ['acer', 'aspire', 'swift'],
+    # Phone brands/products
+    'iphone': ['iphone', 'ip '],
+    'samsung': ['samsung', 'galaxy'],
+    'xiaomi': ['xiaomi', 'redmi', 'poco', 'mi '],
+    'oppo': ['oppo', 'find x'],
+    'vivo': ['vivo'],
+    'realme': ['realme'],
+    'oneplus': ['oneplus', 'one plus'],
+    'google': ['google', 'pixel'],
+    'nothing': ['nothing phone'],
+    # Headphones
+    'airpods': ['airpods', 'air pods'],
+    'sony headphone': ['sony wf', 'sony wh', 'xm4', 'xm5'],
+    'bose': ['bose', 'quietcomfort'],
+    'jabra': ['jabra'],
+    'jbl': ['jbl'],
+    'edifier': ['edifier'],
+    'anker': ['anker', 'soundcore'],
+    'sennheiser': ['sennheiser'],
+    # Smartwatch
+    'apple watch': ['apple watch', 'iwatch'],
+}
+
+FLAG_KEYWORDS: Dict[str, List[str]] = {
+    'gaming': ['gaming', 'game', 'choi game', 'chơi game', 'rog', 'legion'],
+    'comparison': ['so sánh', 'so sanh', 'so với', 'so voi', 'với', 'voi',
+                   'hay', 'hoặc', 'hoac', 'vs', 'versus', 'compare'],
+    'specs': ['thông số chi tiết', 'thong so chi tiet', 'cấu hình', 'cau hinh',
+              'specifications', 'specs', 'chi tiết kỹ thuật', 'chi tiet ky thuat',
+              'thông số kỹ thuật', 'thong so ky thuat'],
+    'check_order': ['kiểm tra đơn hàng', 'đơn hàng của tôi', 'tra cứu đơn', 'xem đơn hàng',
+                    'order của tôi', 'check order', 'my orders', 'đơn hàng của mình',
+                    'có đơn hàng nào', 'đơn đặt hàng',
+                    'kiem tra don hang', 'don hang cua toi', 'tra cuu don', 'xem don hang',
+                    'don hang cua minh', 'co don hang nao'],
+    'view_cart': ['giỏ hàng', 'trong giỏ', 'sản phẩm trong giỏ', 'cart', 'gio hang', 'có gì trong giỏ'],
+    'add_word': ['thêm'],
+    'add_to_cart': ['thêm vào giỏ', 'mua ngay', 'đặt mua', 'add to cart', 'thêm giỏ',
+                    'mua sản phẩm', 'cho vào giỏ', 'thêm giỏ hàng'],
+    'discount': ['mã giảm giá', 'khuyến mãi', 'voucher', 'coupon', 'giảm giá', 'apply'],
+    'create_order': ['đặt hàng', 'tạo đơn', 'checkout', 'thanh toán', 'mua luôn', 'order',
+                     'dat hang', 'tao don', 'thanh toan', 'mua luon', 'mua ngay'],
+}
+
+# "don hang 30", "đơn hàng #30", "order 30"
+ORDER_ID_PATTERN = re.compile(r'(don\s*hang|đơn\s*hàng|order)\s*#?\s*(\d+)', re.IGNORECASE)
+
+
+# === PRICE RANGE PARSER ===
+# Cận trên của khoảng giá mở ("trên 30 triệu") - giống giá trị của danh sách cụm từ cũ
+PRICE_RANGE_OPEN_MAX = 999999999
+# Số không có đơn vị chỉ được hiểu là VNĐ khi đủ lớn ("dưới 500000"), tránh "iphone 15", "8gb"
+MIN_BARE_PRICE = 10000
+
+# Đơn vị -> hệ số (dài trước ngắn để alternation của regex khớp đúng)
+PRICE_UNITS: List[Tuple[str, int]] = [
+    ('triệu', 1000000), ('trieu', 1000000), ('million', 1000000), ('củ', 1000000), ('cu', 1000000),
+    ('tr', 1000000), ('m', 1000000),
+    ('tỷ', 1000000000), ('tỉ', 1000000000), ('ty', 1000000000),
+    ('nghìn', 1000), ('nghin', 1000), ('ngàn', 1000), ('ngan', 1000), ('k', 1000),
+    ('vnđ', 1), ('vnd', 1), ('đồng', 1), ('dong', 1), ('đ', 1),
+]
+_UNIT_MULTIPLIERS = dict(PRICE_UNITS)
+_UNITS = '|'.join(re.escape(unit) for unit, _ in PRICE_UNITS)
+
+
+def _amount(name: str) -> str:
+    """Regex một số tiền: số + đơn vị tuỳ chọn + phần lẻ kiểu "2tr5" (= 2.5 triệu)"""
+    return (rf'(?<![\w.,])(?P<{name}>\d+(?:[.,]\d+)*)\s*'
+            rf'(?:(?P<{name}_unit>{_UNITS})(?P<{name}_frac>\d+)?)?(?!\w)')
+
+
+def _keywords(*words: str) -> str:
+    """Alternation các từ khoá, bắt đầu ở đầu một từ"""
+    return r'(?<!\w)(?:' + '|'.join(re.escape(word) for word in words) + ')'
+
+
+_RANGE_SEPARATOR = r'(?:-|–|~|->|' + _keywords('đến', 'den', 'tới', 'toi', 'to', 'and') + ')'
+_UPPER_PREFIX = _keywords('dưới', 'duoi', 'under', 'below', 'less than', 'không quá', 'khong qua',
+                          'ko quá', 'ko qua', 'tối đa', 'toi da', 'nhỏ hơn', 'nho hon', 'ngân sách',
+                          'ngan sach', 'budget', 'chưa tới', 'chua toi', 'chưa đến', 'chua den') + '|<=?'
+_UPPER_SUFFIX = _keywords('đổ lại', 'do lai', 'đổ xuống', 'do xuong', 'trở xuống', 'tro xuong',
+                          'trở lại', 'tro lai', 'or less')
+_LOWER_PREFIX = _keywords('trên', 'tren', 'over', 'above', 'more than', 'ít nhất', 'it nhat') + '|>=?'
+_LOWER_SUFFIX = _keywords('trở lên', 'tro len', 'đổ lên', 'do len', 'or more') + r'|\+(?!\s*[-/])'
+_APPROX_PREFIX = _keywords('tầm', 'tam', 'khoảng', 'khoang', 'cỡ', 'quanh', 'around', 'about',
+                           'approximately', 'xấp xỉ', 'xap xi') + '|~'
+_TOLERANCE = r'\s*,?\s*(?:±|\+/-|\+-|' + _keywords('cộng trừ', 'cong tru') + r')\s*(?P<pct>\d+(?:[.,]\d+)?)\s*%'
+
+# Mỗi pattern có nhóm 'value' (số tiền của cận / giá ước lượng)
+RANGE_PATTERN = re.compile(rf'{_amount("low")}\s*{_RANGE_SEPARATOR}\s*{_amount("high")}')
+UPPER_PATTERN = re.compile(rf'(?:{_UPPER_PREFIX})\s*{_amount("value")}')
+UPPER_SUFFIX_PATTERN = re.compile(rf'{_amount("value")}\s*(?:{_UPPER_SUFFIX})')
+LOWER_PATTERN = re.compile(rf'(?:{_LOWER_PREFIX})\s*{_amount("value")}')
+LOWER_SUFFIX_PATTERN = re.compile(rf'{_amount("value")}\s*(?:{_LOWER_SUFFIX})')
+APPROX_PATTERN = re.compile(rf'(?:{_APPROX_PREFIX})\s*{_amount("value")}(?:{_TOLERANCE})?')
+TOLERANCE_PATTERN = re.compile(rf'{_amount("value")}{_TOLERANCE}')
+
+
+def _amount_value(match: re.Match, name: str, default_multiplier: Optional[int] = None) -> Optional[int]:
+    """
+    Giá trị VNĐ của số tiền `name` trong match (None nếu không phải số tiền)
+    Số không có đơn vị dùng default_multiplier (đơn vị của vế kia: "10-20 triệu")
+    """
+    number = match.group(name)
+    if number is None:
+        return None
+    unit = match.group(f"{name}_unit")
+    multiplier = _UNIT_MULTIPLIERS[unit] if unit else default_multiplier
+    if multiplier is None or multiplier == 1:
+        # VNĐ: dấu chấm/phẩy là phân cách hàng nghìn ("10.000.000đ")
+        value = int(re.sub(r'[.,]', '', number))
+        return value if value >= MIN_BARE_PRICE or multiplier == 1 else None
+    if number.count('.') + number.count(',') == 1:
+        amount = float(number.replace(',', '.'))  # "1,5tr", "1.5 triệu"
+    else:
+        amount = float(re.sub(r'[.,]', '', number))
+    frac = match.group(f"{name}_frac") if unit else None
+    if frac:
+        amount += int(frac) / 10 ** len(frac)  # "2tr5" = 2.5 triệu, "12tr990" = 12.99 triệu
+    return int(round(amount * multiplier))
+
+
+def _unit_multiplier(match: re.Match, name: str) -> Optional[int]:
+    unit = match.group(f"{name}_unit")
+    return _UNIT_MULTIPLIERS[unit] if unit else None
+
+
+def _bound(text: str, *patterns: re.Pattern) -> Optional[int]:
+    """Số tiền của cận đầu tiên khớp (dạng tiền tố "dưới X" hoặc hậu tố "X đổ lại")"""
+    for pattern in patterns:
+        for match in pattern.finditer(text):
+            value = _amount_value(match, 'value')
+            if value:
+                return value
+    return None
+
+
+def parse_price_range(text: str) -> Optional[Tuple[int, int]]:
+    """
+    Khoảng giá (VNĐ) từ cách nói tự do trong câu hỏi đã lowercase
+
+    - "từ 8 đến 11 triệu", "10-20tr", "500k-1tr" -> (low, high)
+    - "dưới 5 triệu", "under 700k", "10tr đổ lại" -> (0, high)
+    - "trên 30 triệu", "từ 20tr trở lên" -> (low, PRICE_RANGE_OPEN_MAX)
+    - "trên 10tr dưới 15tr" -> (10tr, 15tr)
+    - "tầm 12tr", "khoảng 15 củ ±10%" -> giá ± tolerance (mặc định PRICE_APPROX_TOLERANCE)
+
+    Returns:
+        (min, max) hoặc None nếu câu hỏi không nói về ngân sách
+    """
+    if not text or not any(ch.isdigit() for ch in text):
+        return None
+
+    for match in RANGE_PATTERN.finditer(text):
+        # Vế thiếu đơn vị dùng đơn vị của vế kia; hai số trần nhỏ ("6-7 inch") không phải giá
+        low = _amount_value(match, 'low', _unit_multiplier(match, 'high'))
+        high = _amount_value(match, 'high', _unit_multiplier(match, 'low'))
+        if low is not None and high is not None:
+            return (low, high) if low <= high else (high, low)
+
+    upper = _bound(text, UPPER_PATTERN, UPPER_SUFFIX_PATTERN)
+    lower = _bound(text, LOWER_PATTERN, LOWER_SUFFIX_PATTERN)
+    if upper is not None and lower is not None and lower <= upper:
+        return lower, upper
+    if upper is not None:
+        return 0, upper
+    if lower is not None:
+        return lower, PRICE_RANGE_OPEN_MAX
+
+    for pattern in (APPROX_PATTERN, TOLERANCE_PATTERN):
+        for match in pattern.finditer(text):
+            value = _amount_value(match, 'value')
+            if value is None:
+                continue
+            pct = match.group('pct')
+            tolerance = float(pct.replace(',', '.')) / 100 if pct else PRICE_APPROX_TOLERANCE
+            return int(round(value * (1 - tolerance))), int(round(value * (1 + tolerance)))
+    return None
+
+
+def _compile_automaton() -> KeywordAutomaton:
+    """Compile toàn bộ vocabularies vào một automaton"""
+    automaton = KeywordAutomaton()
+    groups = [
+        ('category', CATEGORY_KEYWORDS),
+        ('purpose', PURPOSE_KEYWORDS),
+        ('price', PRICE_BAND_KEYWORDS),
+        ('brand', BRAND_KEYWORDS),
+        ('flag', FLAG_KEYWORDS),
+    ]
+    for prefix, vocabulary in groups:
+        for name, keywords in vocabulary.items():
+            for kw in keywords:
+                automaton.add(kw, f"{prefix}:{name}")
+    return automaton.build()
+
+
+_AUTOMATON = _compile_automaton()
+
+
+@dataclass(frozen=True)
+class QueryIntent:
+    """Kết quả phân tích một câu hỏi (immutable, dùng chung cho cả lượt chat)"""
+    text: str
+    labels: frozenset
+    category: Optional[str] = None
+    purpose: Optional[str] = None
+    price_range: Optional[Tuple[int, int]] = None
+    brands: Tuple[str, ...] = ()
+    order_id: Optional[str] = None
+
+    def has(self, label: str) -> bool:
+        return label in self.labels
+
+    @property
+    def is_low_price(self) -> bool:
+        return 'price:low' in self.labels
+
+    @property
+    def is_high_price(self) -> bool:
+        return 'price:high' in self.labels
+
+    @property
+    def is_mid_price(self) -> bool:
+        return 'price:mid' in self.labels
+
+    @property
+    def price_band(self) -> Optional[str]:
+        """'low' > 'high' > 'mid' (cùng thứ tự ưu tiên khi hiển thị)"""
+        if self.is_low_price:
+            return 'low'
+        if self.is_high_price:
+            return 'high'
+        if self.is_mid_price:
+            return 'mid'
+        return None
+
+    @property
+    def specific_product(self) -> Optional[str]:
+        """Thương hiệu/sản phẩm cụ thể ưu tiên cao nhất"""
+        return self.brands[0] if self.brands else None
+
+    @property
+    def is_gaming(self) -> bool:
+        return 'flag:gaming' in self.labels
+
+    @property
+    def is_comparison(self) -> bool:
+        return 'flag:comparison' in self.labels
+
+    @property
+    def is_specs_query(self) -> bool:
+        return 'flag:specs' in self.labels
+
+    @property
+    def is_checking_order(self) -> bool:
+        return 'flag:check_order' in self.labels or self.order_id is not None
+
+    @property
+    def is_viewing_cart(self) -> bool:
+        return 'flag:view_cart' in self.labels and 'flag:add_word' not in self.labels
+
+    @property
+    def wants_add_to_cart(self) -> bool:
+        return 'flag:add_to_cart' in self.labels
+
+    @property
+    def wants_discount(self) -> bool:
+        return 'flag:discount' in self.labels
+
+    @property
+    def wants_create_order(self) -> bool:
+        return 'flag:create_order' in self.labels
+
+
+def _first_match(labels: Set[str], prefix: str, vocabulary) -> Optional[str]:
+    """Tên nhóm đầu tiên (theo thứ tự vocabulary) có label trong tập đã khớp"""
+    for name in vocabulary:
+        if f"{prefix}:{name}" in labels:
+            return name
+    return None
+
+
+@lru_cache(maxsize=2048)
+def analyze_query(query: str) -> QueryIntent:
+    """
+    Phân tích câu hỏi trong một lượt quét automaton (+ regex số đơn hàng, khoảng giá)
+
+    Args:
+        query: Câu hỏi của khách
+
+    Returns:
+        QueryIntent (cache theo câu hỏi - gọi lại nhiều lần không quét lại)
+    """
+    text = unicodedata.normalize('NFC', query or "").lower()
+    labels = _AUTOMATON.find(text)
+
+    order_match = ORDER_ID_PATTERN.search(text)
+
+    return QueryIntent(
+        text=text,
+        labels=frozenset(labels),
+        category=_first_match(labels, 'category', CATEGORY_KEYWORDS),
+        purpose=_first_match(labels, 'purpose', PURPOSE_KEYWORDS),
+        price_range=parse_price_range(text),
+        brands=tuple(name for name in BRAND_KEYWORDS if f"brand:{name}" in labels),
+        order_id=order_match.group(2) if order_match else None,
+    )
+
+
+def find_brands(text: str) -> Tuple[str, ...]:
+    """
+    Các nhóm thương hiệu (theo BRAND_KEYWORDS) xuất hiện trong một đoạn text bất kỳ
+    (không cache như analyze_query - dùng cho response của AI, tên sản phẩm...)
+    """
+    labels = _AUTOMATON.find(unicodedata.normalize('NFC', text or "").lower())
+    return tuple(name for name in BRAND_KEYWORDS if f"brand:{name}" in labels)
@@ -6,6 +6,8 @@ import uuid
 from typing import List, Dict, Optional, Any
 from datetime import datetime
 
+from services.embedding_cache_service import get_embedding_function
+
 
 class RAGPromptService:
     def __init__(self, chroma_client):
@@ -23,7 +25,8 @@ class RAGPromptService:
         """Initialize or get the RAG prompts collection"""
         self.collection = self.chroma_client.get_or_create_collection(
             name=self.collection_name,
-            metadata={"description": "RAG prompts for AI responses"}
+            metadata={"description": "RAG prompts for AI responses"},
+            embedding_function=get_embedding_function(),
         )
     
     def push_prompt(
@@ -0,0 +1,343 @@
+"""
+Rate Limit Service
+Token bucket theo user và theo IP, lưu trên Redis -> dùng chung giữa các uvicorn worker / container
+- Mỗi lần kiểm tra là MỘT Lua script atomic: refill + kiểm tra + trừ token cho mọi bucket liên quan
+  (all-or-nothing: bị chặn ở bucket nào thì không bucket nào bị trừ)
+- Thời gian lấy từ Redis (TIME) -> không phụ thuộc đồng hồ của từng container
+- Bucket tách riêng cho chat / admin / sync: sync webhook hay admin dashboard không ăn quota chat
+- Bật/tắt và giới hạn chat lấy từ ChatAgentRAGConfig của profile đang chạy
+  (enable_rate_limiting, rate_limit_per_minute)
+- Redis lỗi / không kết nối được -> cho qua (fail-open), không chặn khách hàng vì lỗi hạ tầng
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple
+
+import redis
+from fastapi import Request
+
+from config.chat_agent_rag_config import get_config, ChatAgentRAGConfig
+
+# === CONFIG (env) ===
+# Profile của ChatAgentRAGConfig (giống routes/groq_chat.py) - production đặt CHAT_AGENT_PROFILE=production
+RATE_LIMIT_PROFILE = os.getenv('CHAT_AGENT_PROFILE', 'default')
+RATE_LIMIT_ADMIN_PER_MINUTE = int(os.getenv('RATE_LIMIT_ADMIN_PER_MINUTE', 120))
+RATE_LIMIT_SYNC_PER_MINUTE = int(os.getenv('RATE_LIMIT_SYNC_PER_MINUTE', 600))
+# Bucket theo IP = giới hạn theo user × hệ số (nhiều user có thể chung một NAT)
+RATE_LIMIT_IP_MULTIPLIER = float(os.getenv('RATE_LIMIT_IP_MULTIPLIER', 3))
+# Lấy IP client từ X-Forwarded-For (chỉ bật khi chạy sau reverse proxy tin cậy)
+RATE_LIMIT_TRUST_PROXY = os.getenv('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+RATE_LIMIT_KEY_PREFIX = os.getenv('RATE_LIMIT_KEY_PREFIX', 'ratelimit')
+RATE_LIMIT_REDIS_TIMEOUT = float(os.getenv('RATE_LIMIT_REDIS_TIMEOUT', 0.5))
+# Sau lỗi Redis, bỏ qua rate limit trong khoảng này (giây) thay vì chờ timeout ở mọi request
+RATE_LIMIT_ERROR_BACKOFF = float(os.getenv('RATE_LIMIT_ERROR_BACKOFF', 5))
+
+GROUP_CHAT = 'chat'
+GROUP_ADMIN = 'admin'
+GROUP_SYNC = 'sync'
+
+# Route -> bucket group (prefix dài/cụ thể đứng trước). Route không khớp (health, docs) không bị giới hạn
+ROUTE_GROUPS: List[Tuple[str, str]] = [
+    ('/api/sync', GROUP_SYNC),
+    ('/admin/analytics', GROUP_SYNC),
+    ('/api/agent/sync-carts', GROUP_SYNC),
+    ('/api/admin/sync-system-data', GROUP_SYNC),
+    ('/api/groq-chat/admin', GROUP_ADMIN),
+    ('/api/admin', GROUP_ADMIN),
+    ('/api/analytics', GROUP_ADMIN),
+    ('/api/business', GROUP_ADMIN),
+    ('/api/groq-chat', GROUP_CHAT),
+    ('/api/agent', GROUP_CHAT),
+]
+
+# KEYS: bucket keys | ARGV: cost, rồi từng cặp (capacity, refill/ms) theo thứ tự KEYS
+# Trả về {allowed, retry_after_ms, remaining}
+TOKEN_BUCKET_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local tokens = {}
+local wait = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local level = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if level == nil or ts == nil then
+        level = capacity
+        ts = now
+    end
+    level = math.min(capacity, level + math.max(0, now - ts) * rate)
+    tokens[i] = level
+    if level < cost then
+        wait = math.max(wait, (cost - level) / rate)
+    end
+end
+local allowed = 0
+if wait == 0 then
+    allowed = 1
+end
+local remaining = -1
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local level = tokens[i]
+    if allowed == 1 then
+        level = level - cost
+    end
+    redis.call('HSET', KEYS[i], 'tokens', tostring(level), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity / rate) + 1000)
+    if remaining < 0 or level < remaining then
+        remaining = level
+    end
+end
+return {allowed, math.ceil(wait), math.floor(remaining)}
+"""
+
+
+class RateLimitExceededError(Exception):
+    """Vượt token bucket - trả 429 + Retry-After"""
+
+    def __init__(self, group: str, scope: str, retry_after: float, limit: int):
+        self.group = group
+        self.scope = scope
+        self.limit = limit
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        super().__init__(f"Rate limit exceeded for {group} ({scope}), retry after {self.retry_after}s")
+
+
+@dataclass
+class RateLimitDecision:
+    """Kết quả kiểm tra token bucket"""
+    allowed: bool
+    group: str
+    scope: str
+    limit: int
+    remaining: int = 0
+    retry_after: float = 0.0
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(max(self.remaining, 0)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(max(1, int(math.ceil(self.retry_after))))
+        return headers
+
+
+def route_group(path: str) -> Optional[str]:
+    """Bucket group của một route (None = không giới hạn)"""
+    for prefix, group in ROUTE_GROUPS:
+        if path == prefix or path.startswith(prefix + '/'):
+            return group
+    return None
+
+
+class RateLimiter:
+    """Token bucket trên Redis (Lua script atomic) cho các nhóm route chat / admin / sync"""
+
+    def __init__(self, config: Optional[ChatAgentRAGConfig] = None, client: Optional[redis.Redis] = None):
+        self.config = config or get_config(RATE_LIMIT_PROFILE)
+        self.enabled = self.config.enable_rate_limiting
+        # Giới hạn theo user (requests/phút); bucket IP = limit × RATE_LIMIT_IP_MULTIPLIER
+        self.limits = {
+            GROUP_CHAT: self.config.rate_limit_per_minute,
+            GROUP_ADMIN: RATE_LIMIT_ADMIN_PER_MINUTE,
+            GROUP_SYNC: RATE_LIMIT_SYNC_PER_MINUTE,
+        }
+        self._client = client
+        self._script = None
+        self._last_error_log = 0.0
+        self._skip_until = 0.0
+        self.allowed = 0
+        self.rejected: Dict[str, int] = {}
+        self.errors = 0
+
+    @property
+    def client(self) -> redis.Redis:
+        """Redis client riêng với timeout ngắn (Redis chậm -> fail-open nhanh)"""
+        if self._client is None:
+            password = os.getenv('REDIS_PASSWORD', None)
+            self._client = redis.Redis(
+                host=os.getenv('REDIS_HOST', 'localhost'),
+                port=int(os.getenv('REDIS_PORT', 6379)),
+                db=int(os.getenv('REDIS_DB', 0)),
+                password=password if password else None,
+                socket_connect_timeout=RATE_LIMIT_REDIS_TIMEOUT,
+                socket_timeout=RATE_LIMIT_REDIS_TIMEOUT
+            )
+        return self._client
+
+    @property
+    def script(self):
+        """Lua script đã register (EVALSHA, tự fallback EVAL khi Redis chưa cache script)"""
+        if self._script is None:
+            self._script = self.client.register_script(TOKEN_BUCKET_LUA)
+        return self._script
+
+    def bucket_key(self, group: str, scope: str, identity: str) -> str:
+        return f"{RATE_LIMIT_KEY_PREFIX}:{group}:{scope}:{identity}"
+
+    def ip_limit(self, group: str) -> int:
+        return max(1, int(self.limits[group] * RATE_LIMIT_IP_MULTIPLIER))
+
+    def _consume(self, group: str, buckets: List[Tuple[str, str, int]], cost: int = 1) -> RateLimitDecision:
+        """
+        Trừ token atomic trên các bucket (scope, key, limit/phút)
+
+        Returns:
+            RateLimitDecision (scope = bucket chặt nhất trong các bucket)
+        """
+        scope = "+".join(b[0] for b in buckets)
+        limit = min(b[2] for b in buckets)
+        if not self.enabled or not buckets or time.monotonic() < self._skip_until:
+            return RateLimitDecision(True, group, scope, limit, limit)
+        args = [cost]
+        for _, _, per_minute in buckets:
+            args += [per_minute, per_minute / 60000.0]  # capacity = limit/phút, refill theo ms
+        try:
+            allowed, wait_ms, remaining = self.script(keys=[b[1] for b in buckets], args=args)
+        except redis.RedisError as e:
+            self.errors += 1
+            now = time.monotonic()
+            self._skip_until = now + RATE_LIMIT_ERROR_BACKOFF
+            if now - self._last_error_log > 60:
+                self._last_error_log = now
+                print(f"[RateLimit] Redis error, allowing request (fail-open): {e}")
+            return RateLimitDecision(True, group, scope, limit, limit)
+
+        decision = RateLimitDecision(bool(allowed), group, scope, limit, int(remaining), int(wait_ms) / 1000.0)
+        if decision.allowed:
+            self.allowed += 1
+        else:
+            key = f"{group}:{scope}"
+            self.rejected[key] = self.rejected.get(key, 0) + 1
+        return decision
+
+    def check_ip(self, group: str, ip: str) -> RateLimitDecision:
+        """Bucket theo IP của một nhóm route"""
+        return self._consume(group, [('ip', self.bucket_key(group, 'ip', ip), self.ip_limit(group))])
+
+    def check_user(self, group: str, user_id: str) -> RateLimitDecision:
+        """Bucket theo user đã xác thực của một nhóm route"""
+        return self._consume(group, [('user', self.bucket_key(group, 'user', user_id), self.limits[group])])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "profile": RATE_LIMIT_PROFILE,
+            "limits_per_minute": dict(self.limits),
+            "ip_multiplier": RATE_LIMIT_IP_MULTIPLIER,
+            "allowed": self.allowed,
+            "rejected": dict(self.rejected),
+            "redis_errors": self.errors,
+        }
+
+
+def client_ip(headers: Dict[str, str], client: Optional[Tuple[str, int]]) -> str:
+    """IP client (X-Forwarded-For chỉ khi RATE_LIMIT_TRUST_PROXY)"""
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = headers.get('x-forwarded-for')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return client[0] if client else 'unknown'
+
+
+def rate_limit_response_body(decision: RateLimitDecision) -> Dict[str, Any]:
+    return {
+        "detail": "Bạn gửi yêu cầu quá nhanh, vui lòng thử lại sau.",
+        "group": decision.group,
+        "scope": decision.scope,
+        "retry_after": max(1, int(math.ceil(decision.retry_after)))
+    }
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware: bucket theo IP cho mọi route thuộc nhóm chat / admin / sync
+    (bucket theo user ở dependency `user_rate_limit`, vì cần xác thực JWT)
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        group = route_group(scope.get("path", ""))
+        limiter = get_rate_limiter()
+        if group is None or not limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get("headers", [])}
+        ip = client_ip(headers, scope.get("client"))
+        decision = await asyncio.to_thread(limiter.check_ip, group, ip)
+        if not decision.allowed:
+            body = json.dumps(rate_limit_response_body(decision), ensure_ascii=False).encode('utf-8')
+            response_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+            response_headers += [(k.lower().encode(), v.encode()) for k, v in decision.headers().items()]
+            await send({"type": "http.response.start", "status": 429, "headers": response_headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (k.lower().encode(), v.encode()) for k, v in decision.headers().items()
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+def user_rate_limit(group: str = GROUP_CHAT):
+    """
+    FastAPI dependency: bucket theo user đã xác thực (JWT) cho một nhóm route
+    Request không có JWT hợp lệ chỉ bị giới hạn theo IP (middleware)
+
+    Raises:
+        RateLimitExceededError: hết token -> app trả 429 + Retry-After
+    """
+    from services.jwt_util import JwtUtil
+
+    async def dependency(request: Request) -> None:
+        limiter = get_rate_limiter()
+        if not limiter.enabled:
+            return
+        authorization = request.headers.get('authorization')
+        if not authorization:
+            return
+        token = authorization[7:] if authorization.startswith("Bearer ") else authorization
+        if not JwtUtil.validate_token(token):
+            return
+        user_id = JwtUtil.extract_user_id(token)
+        if not user_id:
+            return
+        decision = await asyncio.to_thread(limiter.check_user, group, str(user_id))
+        if not decision.allowed:
+            raise RateLimitExceededError(group, decision.scope, decision.retry_after, decision.limit)
+
+    return dependency
+
+
+# Global singleton instance
+_rate_limiter: Optional[RateLimiter] = None
+
+def get_rate_limiter() -> RateLimiter:
+    """Get global rate limiter instance"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+        status = "enabled" if _rate_limiter.enabled else "disabled"
+        print(f"[RateLimit] Token buckets {status} (profile: {RATE_LIMIT_PROFILE}, "
+              f"per minute: {_rate_limiter.limits})")
+    return _rate_limiter
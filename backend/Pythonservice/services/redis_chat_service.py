@@ -1,21 +1,304 @@
 """
 Redis Chat History Service
 Manages chat session history using Redis
+- Ghi message (append + session index + metadata + TTL) là MỘT Lua script: một round trip,
+  atomic; batch import gửi script của mọi session trong một pipeline
+- Key layout / encode message nằm ở RedisChatKeys, dùng chung với bản asyncio
+  (services/async_redis_chat_service.py) mà các route chat / history / admin await
+- Thống kê admin được cập nhật ngay khi ghi (không KEYS): counter message / session,
+  sorted set user và session theo lần hoạt động cuối, sorted set session theo hoạt động của từng user
+- History phân trang bằng cursor (score = timestamp của message, ZRANGEBYSCORE ... LIMIT),
+  danh sách session của user theo lần hoạt động cuối (activity index)
+- Rolling summary của session (services/chat_memory_service.py) nằm cạnh session:
+  hash summary / covered (số message đầu session đã được tóm tắt) / updated_at, xoá cùng session
 """
 import redis
 import json
 import os
+import time
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 from pydantic import BaseModel
 
+# Số message tối đa trong một lần gọi script (giới hạn kích thước ARGV khi import lớn)
+CHAT_SAVE_BATCH_SIZE = int(os.getenv('CHAT_SAVE_BATCH_SIZE', 500))
+# Số message mặc định / tối đa của một trang history (cursor pagination, export stream)
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', 100))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_MAX_PAGE_SIZE', 500))
+
+# Thống kê chat toàn cục (không TTL - session hết hạn được prune theo lần hoạt động cuối)
+CHAT_STATS_KEY = "chat:stats"  # hash counter: messages, sessions, rebuilt_at
+CHAT_STATS_USERS_KEY = "chat:stats:users"  # zset user_id -> lần hoạt động cuối (epoch)
+CHAT_STATS_SESSIONS_KEY = "chat:stats:sessions"  # zset session key -> lần hoạt động cuối (epoch)
+CHAT_STATS_SESSION_COUNTS_KEY = "chat:stats:session_counts"  # hash session key -> số message
+
+# Append message(s) vào session + cập nhật session index / metadata + làm mới TTL + thống kê, atomic
+# KEYS: session zset, user sessions set, session meta hash, user activity zset,
+#       stats hash, stats users zset, stats sessions zset, stats session counts hash
+# ARGV: ttl, session_id, user_id, now, rồi (score, message_json, timestamp) cho từng message
+SAVE_MESSAGES_LUA = """
+local ttl = tonumber(ARGV[1])
+local now = ARGV[4]
+local first_ts, last_ts
+for i = 5, #ARGV, 3 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+    first_ts = first_ts or ARGV[i + 2]
+    last_ts = ARGV[i + 2]
+end
+redis.call('SADD', KEYS[2], ARGV[2])
+local count = redis.call('ZCARD', KEYS[1])
+redis.call('HSET', KEYS[3], 'session_id', ARGV[2], 'user_id', ARGV[3],
+           'last_updated', last_ts, 'message_count', count)
+redis.call('HSETNX', KEYS[3], 'created_at', first_ts)
+redis.call('ZADD', KEYS[4], now, ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', tonumber(now) - ttl)
+for i = 1, 4 do
+    redis.call('EXPIRE', KEYS[i], ttl)
+end
+-- Thống kê: cộng phần chênh số message của session, đếm session mới, user hoạt động gần nhất
+local previous = tonumber(redis.call('HGET', KEYS[8], KEYS[1])) or 0
+redis.call('HSET', KEYS[8], KEYS[1], count)
+redis.call('HINCRBY', KEYS[5], 'messages', count - previous)
+if redis.call('ZADD', KEYS[7], now, KEYS[1]) == 1 then
+    redis.call('HINCRBY', KEYS[5], 'sessions', 1)
+end
+redis.call('ZADD', KEYS[6], now, ARGV[3])
+return count
+"""
+
+# Số lệnh của mỗi session trong MULTI pipeline fallback (RedisChatKeys._queue_multi_save)
+SAVE_PIPELINE_COMMANDS = 14
+# Số lệnh của mỗi session khi xoá (RedisChatKeys._queue_drop_sessions)
+DROP_PIPELINE_COMMANDS = 7
+
 class ChatMessage(BaseModel):
     """Chat message model for Redis storage"""
     role: str
     content: str
     timestamp: str
 
-class RedisChatService:
+class RedisChatKeys:
+    """Key layout + encode message dùng chung cho RedisChatService (sync) và AsyncRedisChatService"""
+    
+    ttl: int
+    
+    def get_session_key(self, session_id: str) -> str:
+        """Generate Redis key for session"""
+        return f"chat:session:{session_id}"
+    
+    def get_user_session_key(self, user_id: str, session_id: str) -> str:
+        """Generate user-specific session key to ensure user isolation"""
+        # This creates a namespace per user for session data
+        return f"chat:user:{user_id}:session:{session_id}"
+    
+    def get_user_sessions_key(self, user_id: str) -> str:
+        """Generate Redis key for user's session list"""
+        return f"chat:user:{user_id}:sessions"
+    
+    def get_message_key(self, session_id: str, index: int) -> str:
+        """Generate Redis key for individual message"""
+        return f"chat:message:{session_id}:{index}"
+    
+    def get_session_meta_key(self, user_id: str, session_id: str) -> str:
+        """Generate Redis key for session metadata hash"""
+        return f"chat:user:{user_id}:session:{session_id}:meta"
+    
+    def get_user_activity_key(self, user_id: str) -> str:
+        """Generate Redis key for user's sessions sorted by last activity"""
+        return f"chat:user:{user_id}:activity"
+    
+    def get_session_summary_key(self, user_id: str, session_id: str) -> str:
+        """Generate Redis key for session rolling summary hash"""
+        return f"chat:user:{user_id}:session:{session_id}:summary"
+    
+    @staticmethod
+    def parse_user_session_key(key: str) -> Optional[Tuple[str, str]]:
+        """chat:user:{user_id}:session:{session_id} -> (user_id, session_id); None với key khác (meta, summary...)"""
+        if not key.startswith("chat:user:") or key.endswith((":meta", ":summary")):
+            return None
+        user_id, separator, session_id = key[len("chat:user:"):].partition(":session:")
+        if not separator or not user_id or not session_id:
+            return None
+        return user_id, session_id
+    
+    @staticmethod
+    def _parse_messages(messages_json: List[str], user_id: Optional[str] = None) -> List[dict]:
+        """JSON -> dict, bỏ message hỏng; user_id -> chỉ giữ message của user này"""
+        messages = []
+        for msg_json in messages_json:
+            try:
+                msg_dict = json.loads(msg_json)
+            except (TypeError, ValueError):
+                continue
+            if user_id is None or msg_dict.get("user_id") == user_id:
+                messages.append(msg_dict)
+        return messages
+    
+    @staticmethod
+    def _order_sessions(recent: List[str], members: Iterable[str]) -> List[str]:
+        """Session theo activity index (mới nhất trước), rồi session chưa có trong index (ghi trước khi có index)"""
+        indexed = set(recent)
+        return list(recent) + sorted((session_id for session_id in members if session_id not in indexed), reverse=True)
+    
+    # === HISTORY CURSOR ===
+    # Cursor = "<score>:<skip>": score (timestamp) của message cuối trang trước + số message cùng
+    # score đã trả - trang sau bắt đầu từ score đó (inclusive) và bỏ qua skip message, không trùng / sót
+    # khi nhiều message có cùng timestamp
+    
+    @staticmethod
+    def decode_history_cursor(cursor: str) -> Tuple[float, int]:
+        """Raises ValueError nếu cursor không hợp lệ"""
+        score, separator, skip = cursor.rpartition(":")
+        if not separator:
+            raise ValueError(f"Invalid history cursor: {cursor!r}")
+        return float(score), int(skip)
+    
+    def _history_range(self, cursor: Optional[str], reverse: bool) -> Tuple[Any, Any, int]:
+        """(min/max score, đầu còn lại, skip) cho ZRANGEBYSCORE / ZREVRANGEBYSCORE"""
+        if cursor:
+            score, skip = self.decode_history_cursor(cursor)
+            return score, ("-inf" if reverse else "+inf"), skip
+        return ("+inf" if reverse else "-inf"), ("-inf" if reverse else "+inf"), 0
+    
+    def _history_page(self, rows: List[Tuple[str, float]], limit: int, cursor: Optional[str]) -> Tuple[List[dict], Optional[str]]:
+        """rows (limit + 1 dòng, WITHSCORES) -> (messages của trang, cursor trang sau hoặc None)"""
+        if len(rows) <= limit:
+            return self._parse_messages([member for member, _ in rows]), None
+        rows = rows[:limit]
+        last_score = rows[-1][1]
+        skip = sum(1 for _, score in rows if score == last_score)
+        if cursor:
+            start_score, start_skip = self.decode_history_cursor(cursor)
+            if start_score == last_score:
+                skip += start_skip  # Cả trang cùng một score
+        return self._parse_messages([member for member, _ in rows]), f"{last_score!r}:{skip}"
+    
+    # === SESSION MEMORY (rolling summary) ===
+    
+    @staticmethod
+    def _session_summary(summary: Dict[str, str], size: int) -> Dict[str, Any]:
+        """HGETALL summary + ZCARD session -> {"summary", "covered", "size"}"""
+        covered = int(summary.get("covered") or 0) if summary else 0
+        if covered > size:
+            # Summary còn lại của session cùng ID đã bị xoá -> bỏ qua
+            summary, covered = {}, 0
+        return {"summary": (summary.get("summary") or None) if summary else None, "covered": covered, "size": size}
+    
+    def _session_memory(self, summary: Dict[str, str], size: int, rows: List[str], user_id: str) -> Dict[str, Any]:
+        """Như _session_summary + "messages": các message chưa được tóm tắt trong rows (message cuối session)"""
+        state = self._session_summary(summary, size)
+        skip = max(0, state["covered"] - (size - len(rows)))
+        state["messages"] = self._parse_messages(rows[skip:], user_id)
+        return state
+    
+    def _group_by_session(self, messages: Iterable[Dict[str, Any]]) -> Dict[Tuple[str, str], List[Tuple[float, str, str]]]:
+        """(user_id, session_id) -> [(score, message_json, timestamp)], giữ thứ tự trong từng session"""
+        sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]] = {}
+        for message in messages:
+            user_id = message["user_id"]
+            timestamp = message["timestamp"]
+            # Create message dict with user_id for context
+            message_json = json.dumps({
+                "role": message["role"],
+                "content": message["content"],
+                "model": message["model"],
+                "timestamp": timestamp,
+                "user_id": user_id
+            }, ensure_ascii=False)
+            # Sorted set score = timestamp để giữ thứ tự
+            score = datetime.fromisoformat(timestamp).timestamp()
+            sessions.setdefault((user_id, message["session_id"]), []).append((score, message_json, timestamp))
+        return sessions
+    
+    def _session_keys(self, user_id: str, session_id: str) -> List[str]:
+        """KEYS của SAVE_MESSAGES_LUA (user-specific keys for isolation + thống kê)"""
+        return [
+            self.get_user_session_key(user_id, session_id),
+            self.get_user_sessions_key(user_id),
+            self.get_session_meta_key(user_id, session_id),
+            self.get_user_activity_key(user_id),
+            CHAT_STATS_KEY,
+            CHAT_STATS_USERS_KEY,
+            CHAT_STATS_SESSIONS_KEY,
+            CHAT_STATS_SESSION_COUNTS_KEY,
+        ]
+    
+    def _script_calls(self, sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]]) -> List[Tuple[List[str], List[Any], int]]:
+        """(KEYS, ARGV, số message) của SAVE_MESSAGES_LUA: một call cho mỗi session (chunk CHAT_SAVE_BATCH_SIZE)"""
+        calls = []
+        now = time.time()
+        for (user_id, session_id), entries in sessions.items():
+            for start in range(0, len(entries), CHAT_SAVE_BATCH_SIZE):
+                chunk = entries[start:start + CHAT_SAVE_BATCH_SIZE]
+                args: List[Any] = [self.ttl, session_id, user_id, now]
+                for entry in chunk:
+                    args.extend(entry)
+                calls.append((self._session_keys(user_id, session_id), args, len(chunk)))
+        return calls
+    
+    def _queue_multi_save(self, pipe, sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]]) -> None:
+        """Các lệnh của SAVE_MESSAGES_LUA (trừ message_count / counter) cho MULTI pipeline - SAVE_PIPELINE_COMMANDS lệnh / session"""
+        now = time.time()
+        for (user_id, session_id), entries in sessions.items():
+            session_key, sessions_key, meta_key, activity_key = self._session_keys(user_id, session_id)[:4]
+            pipe.zadd(session_key, {message_json: score for score, message_json, _ in entries})
+            pipe.sadd(sessions_key, session_id)
+            pipe.hset(meta_key, mapping={"session_id": session_id, "user_id": user_id,
+                                         "last_updated": entries[-1][2]})
+            pipe.hsetnx(meta_key, "created_at", entries[0][2])
+            pipe.zadd(activity_key, {session_id: now})
+            for key in (session_key, sessions_key, meta_key, activity_key):
+                pipe.expire(key, self.ttl)
+            pipe.zcard(session_key)  # 9
+            pipe.hget(CHAT_STATS_SESSION_COUNTS_KEY, session_key)  # 10: số message trước đó
+            pipe.zadd(CHAT_STATS_SESSIONS_KEY, {session_key: now})  # 11: 1 nếu session mới
+            pipe.zadd(CHAT_STATS_USERS_KEY, {user_id: now})
+            pipe.zremrangebyscore(activity_key, "-inf", now - self.ttl)
+    
+    def _queue_message_counts(self, pipe, sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]],
+                              results: List[Any]) -> None:
+        """Ghi message_count + counter thống kê từ kết quả _queue_multi_save"""
+        for position, (user_id, session_id) in enumerate(sessions):
+            base = position * SAVE_PIPELINE_COMMANDS
+            count, previous, is_new = results[base + 9], int(results[base + 10] or 0), results[base + 11]
+            pipe.hset(self.get_session_meta_key(user_id, session_id), "message_count", count)
+            pipe.hset(CHAT_STATS_SESSION_COUNTS_KEY, self.get_user_session_key(user_id, session_id), count)
+            pipe.hincrby(CHAT_STATS_KEY, "messages", count - previous)
+            if is_new:
+                pipe.hincrby(CHAT_STATS_KEY, "sessions", 1)
+    
+    def _queue_drop_sessions(self, pipe, user_id: str, session_ids: List[str]) -> None:
+        """
+        Xoá session của user + gỡ khỏi thống kê (MULTI) - DROP_PIPELINE_COMMANDS lệnh / session;
+        kết quả đưa vào _queue_drop_counts để trừ counter
+        """
+        activity_key = self.get_user_activity_key(user_id)
+        sessions_key = self.get_user_sessions_key(user_id)
+        for session_id in session_ids:
+            session_key = self.get_user_session_key(user_id, session_id)
+            pipe.zrem(CHAT_STATS_SESSIONS_KEY, session_key)  # 0: 1 nếu session đang được đếm
+            pipe.hget(CHAT_STATS_SESSION_COUNTS_KEY, session_key)  # 1: số message đã đếm
+            pipe.hdel(CHAT_STATS_SESSION_COUNTS_KEY, session_key)
+            pipe.delete(session_key)
+            pipe.delete(self.get_session_meta_key(user_id, session_id), self.get_session_summary_key(user_id, session_id))
+            pipe.zrem(activity_key, session_id)
+            pipe.srem(sessions_key, session_id)
+    
+    def _queue_drop_counts(self, pipe, session_count: int, results: List[Any]) -> int:
+        """Trừ counter theo kết quả _queue_drop_sessions, trả về số session đã gỡ khỏi thống kê"""
+        dropped = messages = 0
+        for position in range(session_count):
+            base = position * DROP_PIPELINE_COMMANDS
+            if results[base]:
+                dropped += 1
+                messages += int(results[base + 1] or 0)
+        if dropped:
+            pipe.hincrby(CHAT_STATS_KEY, "sessions", -dropped)
+            pipe.hincrby(CHAT_STATS_KEY, "messages", -messages)
+        return dropped
+
+
+class RedisChatService(RedisChatKeys):
     """Service for managing chat history in Redis"""
     
     def __init__(self, host: str = None, port: int = None, db: int = None, 
@@ -51,24 +334,11 @@ class RedisChatService:
         except Exception as e:
             print(f"[Redis] Connection failed: {str(e)}")
             self.client = None
+        
+        self._save_script = self.client.register_script(SAVE_MESSAGES_LUA) if self.client else None
+        self._lua_supported = True  # False -> server không chạy được EVAL, ghi bằng MULTI pipeline
     
-    def get_session_key(self, session_id: str) -> str:
-        """Generate Redis key for session"""
-        return f"chat:session:{session_id}"
-    
-    def get_user_session_key(self, user_id: str, session_id: str) -> str:
-        """Generate user-specific session key to ensure user isolation"""
-        # This creates a namespace per user for session data
-        return f"chat:user:{user_id}:session:{session_id}"
-    
-    def get_user_sessions_key(self, user_id: str) -> str:
-        """Generate Redis key for user's session list"""
-        return f"chat:user:{user_id}:sessions"
-    
-    def get_message_key(self, session_id: str, index: int) -> str:
-        """Generate Redis key for individual message"""
-        return f"chat:message:{session_id}:{index}"
-    
+
     def save_message(self, session_id: str, user_id: str, role: str, content: str, model: str, timestamp: str) -> bool:
         """Save single message to Redis with user association and isolation
         
@@ -83,54 +353,79 @@ class RedisChatService:
         Returns:
             True if message saved successfully
         """
+        message = {"role": role, "content": content, "model": model, "timestamp": timestamp}
+        return self.save_messages(session_id, user_id, [message]) == 1
+    
+    def save_messages(self, session_id: str, user_id: str, messages: List[Dict[str, Any]]) -> int:
+        """Save nhiều message của MỘT session (một round trip cho mỗi CHAT_SAVE_BATCH_SIZE message)
+        
+        Args:
+            session_id: Chat session ID
+            user_id: User ID
+            messages: List dict {role, content, model, timestamp}
+        
+        Returns:
+            Số message đã lưu
+        """
+        return self.import_messages(
+            {**message, "session_id": session_id, "user_id": user_id} for message in messages
+        )
+    
+    def import_messages(self, messages: Iterable[Dict[str, Any]]) -> int:
+        """Batch import message của nhiều session - script của mọi session đi chung một pipeline
+        
+        Args:
+            messages: Iterable dict {session_id, user_id, role, content, model, timestamp}
+        
+        Returns:
+            Số message đã lưu (0 nếu lỗi - batch là một pipeline)
+        """
         if not self.client:
-            return False
+            return 0
         
         try:
-            # Use user-specific session key for isolation
-            user_session_key = self.get_user_session_key(user_id, session_id)
-            user_sessions_key = self.get_user_sessions_key(user_id)
-            
-            # Create message dict with user_id for context
-            message_data = {
-                "role": role,
-                "content": content,
-                "model": model,
-                "timestamp": timestamp,
-                "user_id": user_id
-            }
-            
-            # Store message as JSON
-            message_json = json.dumps(message_data, ensure_ascii=False)
-            
-            # Add to sorted set with timestamp as score for ordering
-            timestamp_obj = datetime.fromisoformat(timestamp)
-            timestamp_score = timestamp_obj.timestamp()
-            self.client.zadd(user_session_key, {message_json: timestamp_score})
-            
-            # Add session to user's session list (if not already there)
-            self.client.sadd(user_sessions_key, session_id)
-            
-            # Store session metadata with user_id for verification
-            session_meta = {
-                "session_id": session_id,
-                "user_id": user_id,
-                "created_at": timestamp,
-                "last_updated": timestamp,
-                "message_count": self.client.zcard(user_session_key)
-            }
-            session_meta_key = f"chat:user:{user_id}:session:{session_id}:meta"
-            self.client.hset(session_meta_key, mapping=session_meta)
-            
-            # Set expiration for all keys
-            self.client.expire(user_session_key, self.ttl)
-            self.client.expire(user_sessions_key, self.ttl)
-            self.client.expire(session_meta_key, self.ttl)
-            
-            return True
+            sessions = self._group_by_session(messages)
+            if not sessions:
+                return 0
+            if self._lua_supported:
+                try:
+                    return self._save_with_script(sessions)
+                except redis.exceptions.ResponseError as e:
+                    if 'unknown command' not in str(e).lower():
+                        raise
+                    print(f"[Redis] EVAL not supported, saving messages with MULTI pipeline: {e}")
+                    self._lua_supported = False
+            return self._save_with_pipeline(sessions)
         except Exception as e:
             print(f"[Redis Error] Failed to save message: {str(e)}")
-            return False
+            return 0
+    
+    def _save_with_script(self, sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]]) -> int:
+        """
+        Một script call cho mỗi session (chunk): một call -> EVALSHA trực tiếp (một round trip),
+        nhiều call -> chung một pipeline (pipeline kiểm tra SCRIPT EXISTS trước khi gửi)
+        """
+        calls = self._script_calls(sessions)
+        if len(calls) == 1:
+            keys, args, _ = calls[0]
+            self._save_script(keys=keys, args=args)
+        else:
+            pipe = self.client.pipeline(transaction=False)
+            for keys, args, _ in calls:
+                self._save_script(keys=keys, args=args, client=pipe)
+            pipe.execute()
+        return sum(count for _, _, count in calls)
+    
+    def _save_with_pipeline(self, sessions: Dict[Tuple[str, str], List[Tuple[float, str, str]]]) -> int:
+        """Fallback khi server không có Lua: MULTI pipeline, message_count ghi ở round trip thứ hai"""
+        pipe = self.client.pipeline(transaction=True)
+        self._queue_multi_save(pipe, sessions)
+        results = pipe.execute()
+        
+        pipe = self.client.pipeline(transaction=False)
+        self._queue_message_counts(pipe, sessions, results)
+        pipe.execute()
+        return sum(len(entries) for entries in sessions.values())
     
     def get_session_history(self, session_id: str, user_id: str = None) -> List[dict]:
         """Get all messages from a session
@@ -180,20 +475,28 @@ class RedisChatService:
             return False
         
         try:
-            # Use user-specific key if user_id provided
+            # Use user-specific key if user_id provided (xoá cả metadata + gỡ khỏi thống kê)
             if user_id:
-                session_key = self.get_user_session_key(user_id, session_id)
-                meta_key = f"chat:user:{user_id}:session:{session_id}:meta"
-                self.client.delete(meta_key)
+                self._drop_sessions(user_id, [session_id])
             else:
-                session_key = self.get_session_key(session_id)
-            
-            self.client.delete(session_key)
+                self.client.delete(self.get_session_key(session_id))
             return True
         except Exception as e:
             print(f"[Redis Error] Failed to clear session: {str(e)}")
             return False
     
+    def _drop_sessions(self, user_id: str, session_ids: List[str]) -> int:
+        """Xoá session (messages + meta + summary) của user và trừ khỏi thống kê, trả về số session đã gỡ"""
+        if not session_ids:
+            return 0
+        pipe = self.client.pipeline(transaction=True)
+        self._queue_drop_sessions(pipe, user_id, session_ids)
+        results = pipe.execute()
+        pipe = self.client.pipeline(transaction=False)
+        dropped = self._queue_drop_counts(pipe, len(session_ids), results)
+        pipe.execute()
+        return dropped
+    
     def get_session_size(self, session_id: str, user_id: str = None) -> int:
         """Get number of messages in session
         
@@ -262,26 +565,56 @@ class RedisChatService:
         except:
             return False
     
-    def get_user_sessions(self, user_id: str) -> List[str]:
-        """Get all session IDs for a user
+    def get_user_sessions(self, user_id: str, offset: int = 0, limit: Optional[int] = None) -> List[str]:
+        """Get session IDs for a user
         
         Args:
             user_id: User ID
+            offset: Bỏ qua N session đầu (phân trang)
+            limit: Số session tối đa (None = tất cả)
             
         Returns:
-            List of session IDs associated with the user
+            List of session IDs associated with the user, most recent activity first
         """
         if not self.client:
             return []
         
         try:
-            user_sessions_key = self.get_user_sessions_key(user_id)
-            sessions = self.client.smembers(user_sessions_key)
-            return sorted(list(sessions), reverse=True)  # Most recent first
+            pipe = self.client.pipeline(transaction=False)
+            pipe.zrevrange(self.get_user_activity_key(user_id), 0, -1)
+            pipe.smembers(self.get_user_sessions_key(user_id))
+            recent, members = pipe.execute()
+            sessions = self._order_sessions(recent, members)  # Most recent first
+            return sessions[offset:offset + limit] if limit else sessions[offset:]
         except Exception as e:
             print(f"[Redis Error] Failed to get user sessions: {str(e)}")
             return []
     
+    def get_session_history_page(self, session_id: str, user_id: str, cursor: Optional[str] = None,
+                                 limit: int = CHAT_HISTORY_PAGE_SIZE, reverse: bool = False) -> Tuple[List[dict], Optional[str]]:
+        """Một trang history của session theo cursor (xem _history_range)
+        
+        Args:
+            cursor: Cursor trả về từ trang trước (None = trang đầu)
+            limit: Số message tối đa của trang
+            reverse: True -> mới nhất trước
+        
+        Returns:
+            (messages, next_cursor) - next_cursor None khi hết
+        
+        Raises:
+            ValueError: cursor không hợp lệ
+        """
+        if not self.client:
+            return [], None
+        start, end, skip = self._history_range(cursor, reverse)
+        session_key = self.get_user_session_key(user_id, session_id)
+        if reverse:
+            rows = self.client.zrevrangebyscore(session_key, start, end, start=skip, num=limit + 1, withscores=True)
+        else:
+            rows = self.client.zrangebyscore(session_key, start, end, start=skip, num=limit + 1, withscores=True)
+        return self._history_page(rows, limit, cursor)
+    
     def get_user_full_history(self, user_id: str) -> dict:
         """Get full chat history for a user across all sessions
         
@@ -357,6 +690,57 @@ class RedisChatService:
             print(f"[Redis Error] Failed to get session context: {str(e)}")
             return []
     
+    def get_session_memory(self, session_id: str, user_id: str, window: int) -> Dict[str, Any]:
+        """Rolling summary + các message chưa tóm tắt trong `window` message cuối (một round trip)
+        
+        Returns:
+            {"summary", "covered", "size", "messages"} - summary None nếu session chưa được tóm tắt
+        """
+        if not self.client:
+            return {"summary": None, "covered": 0, "size": 0, "messages": []}
+        try:
+            summary_key = self.get_session_summary_key(user_id, session_id)
+            session_key = self.get_user_session_key(user_id, session_id)
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hgetall(summary_key)
+            pipe.zcard(session_key)
+            pipe.zrange(session_key, -window, -1)
+            pipe.expire(summary_key, self.ttl)  # Summary sống cùng session đang hoạt động
+            summary, size, rows, _ = pipe.execute()
+            return self._session_memory(summary, size, rows, user_id)
+        except Exception as e:
+            print(f"[Redis Error] Failed to get session memory: {str(e)}")
+            return {"summary": None, "covered": 0, "size": 0, "messages": []}
+    
+    def get_session_summary(self, session_id: str, user_id: str) -> Dict[str, Any]:
+        """Rolling summary của session: {"summary", "covered", "size"}"""
+        if not self.client:
+            return {"summary": None, "covered": 0, "size": 0}
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hgetall(self.get_session_summary_key(user_id, session_id))
+        pipe.zcard(self.get_user_session_key(user_id, session_id))
+        summary, size = pipe.execute()
+        return self._session_summary(summary, size)
+    
+    def get_session_slice(self, session_id: str, user_id: str, start: int, stop: int) -> List[dict]:
+        """Message thứ start .. stop - 1 của session (theo thứ tự thời gian)"""
+        if not self.client or stop <= start:
+            return []
+        rows = self.client.zrange(self.get_user_session_key(user_id, session_id), start, stop - 1)
+        return self._parse_messages(rows, user_id)
+    
+    def save_session_summary(self, session_id: str, user_id: str, summary: str, covered: int) -> bool:
+        """Lưu rolling summary đã gộp `covered` message đầu session (cùng TTL với session)"""
+        if not self.client:
+            return False
+        summary_key = self.get_session_summary_key(user_id, session_id)
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hset(summary_key, mapping={"summary": summary, "covered": covered,
+                                        "updated_at": datetime.now().isoformat()})
+        pipe.expire(summary_key, self.ttl)
+        pipe.execute()
+        return True
+    
     def clear_user_history(self, user_id: str) -> bool:
         """Clear all chat history for a user
         
@@ -372,13 +756,11 @@ class RedisChatService:
         try:
             # Get all sessions for user
             sessions = self.get_user_sessions(user_id)
+            self._drop_sessions(user_id, sessions)
             
-            for session_id in sessions:
-                self.clear_session(session_id)
-            
-            # Clear user sessions set
-            user_sessions_key = self.get_user_sessions_key(user_id)
-            self.client.delete(user_sessions_key)
+            # Clear user sessions set / activity index
+            self.client.delete(self.get_user_sessions_key(user_id), self.get_user_activity_key(user_id))
+            self.client.zrem(CHAT_STATS_USERS_KEY, user_id)
             
             return True
         except Exception as e:
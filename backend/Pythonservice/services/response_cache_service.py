@@ -0,0 +1,168 @@
+"""
+Chat Response Cache Service
+Cache câu trả lời LLM cho câu hỏi catalog KHÔNG có dữ liệu cá nhân và KHÔNG có history
+("điện thoại giá rẻ", "laptop gaming dưới 25 triệu", suggestion chips... ở lượt đầu của session)
+- Key = hash(normalized query + model + temperature + catalog version)
+  -> sync products/discounts/knowledge tăng catalog version, entry cũ tự hết hiệu lực
+- Lưu trong Redis với TTL + LRU eviction (sorted set theo thời điểm truy cập)
+- Cache hit bỏ qua hoàn toàn lượt gọi Groq
+- Đọc / ghi qua async connection pool (redis.asyncio) - không chặn event loop của route chat
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Optional, Dict, Any
+
+from services.async_redis_chat_service import get_async_redis_service
+from services.catalog_version_service import get_catalog_version_async
+
+# === CONFIG (env) ===
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 1800))  # 30 phút
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2000))
+
+ENTRY_KEY_PREFIX = "chat:respcache:entry:"
+LRU_KEY = "chat:respcache:lru"
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Chuẩn hoá câu hỏi để các biến thể nhỏ dùng chung một entry:
+    NFC, lowercase, bỏ dấu câu, gộp khoảng trắng (GIỮ dấu tiếng Việt - "rẻ" khác "re")
+    """
+    text = unicodedata.normalize('NFC', query or "").lower()
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class ResponseCacheService:
+    """Redis-backed response cache với TTL + LRU"""
+
+    def __init__(self, ttl: int = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 enabled: bool = RESPONSE_CACHE_ENABLED):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        print(f"[ResponseCache] Initialized (enabled: {enabled}, TTL: {ttl}s, max entries: {max_entries})")
+
+    def _redis(self):
+        """Redis client nếu đang kết nối, None nếu không"""
+        if not self.enabled:
+            return None
+        try:
+            return get_async_redis_service().client
+        except Exception:
+            return None
+
+    def make_key(self, query: str, model: str, temperature: float, catalog_version: int) -> str:
+        """Cache key cho một câu hỏi catalog (catalog_version: ChatRetrievalResult.catalog_version)"""
+        raw = f"v{catalog_version}|{model}|{round(float(temperature), 2)}|{normalize_query(query)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Lấy entry theo key (cập nhật LRU khi hit)
+
+        Returns:
+            Dict {message, finish_reason, model, cached_at} hoặc None
+        """
+        client = self._redis()
+        if client is None or not key:
+            return None
+        try:
+            raw = await client.get(ENTRY_KEY_PREFIX + key)
+            if raw is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            await client.zadd(LRU_KEY, {key: time.time()})
+            with self._lock:
+                self.hits += 1
+            return json.loads(raw)
+        except Exception as e:
+            print(f"[ResponseCache] Get failed: {e}")
+            return None
+
+    async def set(self, key: str, message: str, model: str, finish_reason: Optional[str] = None) -> bool:
+        """Lưu câu trả lời, evict entry ít dùng nhất nếu vượt max_entries"""
+        client = self._redis()
+        if client is None or not key or not message:
+            return False
+        try:
+            entry = {
+                "message": message,
+                "finish_reason": finish_reason,
+                "model": model,
+                "cached_at": time.time()
+            }
+            async with client.pipeline() as pipe:
+                pipe.set(ENTRY_KEY_PREFIX + key, json.dumps(entry, ensure_ascii=False), ex=self.ttl)
+                pipe.zadd(LRU_KEY, {key: time.time()})
+                pipe.zcard(LRU_KEY)
+                size = (await pipe.execute())[-1]
+            with self._lock:
+                self.stores += 1
+
+            if size > self.max_entries:
+                await self._evict(client, size - self.max_entries)
+            return True
+        except Exception as e:
+            print(f"[ResponseCache] Set failed: {e}")
+            return False
+
+    async def _evict(self, client, count: int) -> None:
+        """Xoá `count` entry truy cập lâu nhất"""
+        oldest = await client.zpopmin(LRU_KEY, count)
+        if not oldest:
+            return
+        await client.delete(*[ENTRY_KEY_PREFIX + key for key, _ in oldest])
+        with self._lock:
+            self.evictions += len(oldest)
+
+    async def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters của process hiện tại + số entry trong Redis"""
+        client = self._redis()
+        size = None
+        if client is not None:
+            try:
+                size = await client.zcard(LRU_KEY)
+            except Exception:
+                pass
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "connected": client is not None,
+                "entries": size,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "catalog_version": await get_catalog_version_async(),
+            }
+
+
+# Global singleton instance
+_response_cache: Optional[ResponseCacheService] = None
+
+def get_response_cache() -> ResponseCacheService:
+    """Get global response cache instance"""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCacheService()
+    return _response_cache
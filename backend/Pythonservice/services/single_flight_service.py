@@ -0,0 +1,233 @@
+"""
+Single-Flight Service
+Gộp các request GIỐNG HỆT nhau đang chạy cùng lúc thành MỘT lần thực thi
+(promo lên sóng -> hàng trăm user gửi cùng một câu -> một lượt retrieval + một call LLM)
+- Key = stage + normalized query + catalog version (+ model/params) - do caller tạo qua make_key()
+- Request đầu tiên (leader) chạy công việc trong một task riêng; các request sau (follower)
+  chờ cùng future đó. Leader bị huỷ (client ngắt) không làm hỏng kết quả của follower
+- Lỗi của leader được trả cho mọi follower (không retry hàng loạt)
+- Mặc định process-local. SINGLE_FLIGHT_REDIS_LOCK=true: leader giữ Redis lock (SET NX PX),
+  worker khác chờ kết quả xuất hiện ở nơi dùng chung (response cache) thay vì gọi LLM lần nữa;
+  lock / poll đi qua async connection pool (không chặn event loop)
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from services.async_redis_chat_service import get_async_redis_service
+
+# === CONFIG (env) ===
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+SINGLE_FLIGHT_REDIS_LOCK = os.getenv('SINGLE_FLIGHT_REDIS_LOCK', 'false').lower() == 'true'
+# TTL của Redis lock (ms) - lớn hơn thời gian một call LLM chậm nhất
+SINGLE_FLIGHT_LOCK_TTL_MS = int(os.getenv('SINGLE_FLIGHT_LOCK_TTL_MS', 60000))
+# Worker khác chờ tối đa bao lâu (giây) trước khi tự chạy
+SINGLE_FLIGHT_LOCK_WAIT = float(os.getenv('SINGLE_FLIGHT_LOCK_WAIT', 30))
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', 0.1))
+
+LOCK_KEY_PREFIX = "chat:singleflight:lock:"
+
+# Chỉ xoá lock nếu vẫn là của mình (lock hết hạn rồi bị worker khác lấy thì không xoá nhầm)
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+T = TypeVar('T')
+
+
+def make_key(stage: str, *parts: Any) -> str:
+    """Key single-flight: stage + các thành phần (normalized query, catalog version, model...)"""
+    raw = "|".join(str(part) for part in parts)
+    return f"{stage}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class SingleFlight:
+    """Gộp các lần gọi trùng key đang chạy (asyncio, một event loop)"""
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT_ENABLED, redis_lock: bool = SINGLE_FLIGHT_REDIS_LOCK):
+        self.enabled = enabled
+        self.redis_lock = redis_lock
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._release_script = None
+        self._lock = threading.Lock()
+        self.leaders: Dict[str, int] = {}
+        self.followers: Dict[str, int] = {}
+        self.remote_hits: Dict[str, int] = {}
+
+    def _count(self, counter: Dict[str, int], key: str) -> None:
+        stage = key.split(':', 1)[0]
+        with self._lock:
+            counter[stage] = counter.get(stage, 0) + 1
+
+    def inflight(self, key: str) -> Optional[asyncio.Future]:
+        """Future của lần gọi đang chạy với key này (None nếu không có)"""
+        return self._inflight.get(key) if self.enabled and key else None
+
+    def begin(self, key: str) -> asyncio.Future:
+        """
+        Đăng ký làm leader cho key (caller tự gọi finish) - dùng khi kết quả chỉ có
+        sau một quá trình dài (stream), không bọc được trong một coroutine
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._count(self.leaders, key)
+        return future
+
+    def finish(self, key: str, future: asyncio.Future, result: Any = None,
+               error: Optional[BaseException] = None) -> None:
+        """Trả kết quả (hoặc lỗi) cho các follower và bỏ key khỏi danh sách đang chạy"""
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        elif error is not None:
+            future.set_exception(error)
+            future.exception()  # không có follower thì không log "exception was never retrieved"
+        else:
+            future.set_result(result)
+
+    async def follow(self, key: str, future: asyncio.Future) -> Any:
+        """
+        Chờ kết quả của leader (huỷ follower không huỷ công việc của leader)
+        None = leader kết thúc mà không có kết quả dùng chung (ví dụ stream bị ngắt)
+        """
+        self._count(self.followers, key)
+        return await asyncio.shield(future)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]],
+                 remote_result: Optional[Callable[[], Awaitable[Optional[T]]]] = None) -> T:
+        """
+        Chạy func một lần cho mọi lần gọi trùng key đang diễn ra
+
+        Args:
+            key: Key từ make_key()
+            func: Coroutine factory thực hiện công việc
+            remote_result: (chế độ Redis lock) coroutine factory đọc kết quả leader ở worker khác
+                           đã lưu (ví dụ response cache); None = chỉ gộp trong process
+
+        Returns:
+            Kết quả của func (dùng chung giữa các lần gọi - không được sửa tại chỗ)
+        """
+        if not self.enabled or not key:
+            return await func()
+
+        future = self._inflight.get(key)
+        if future is not None:
+            result = await self.follow(key, future)
+            if result is not None:
+                return result
+            # Leader (begin/finish) kết thúc mà không có kết quả dùng chung -> tự chạy
+            return await func()
+
+        future = self.begin(key)
+
+        async def run() -> None:
+            try:
+                if self.redis_lock and remote_result is not None:
+                    result = await self._run_with_redis_lock(key, func, remote_result)
+                else:
+                    result = await func()
+            except BaseException as e:
+                self.finish(key, future, error=e)
+            else:
+                self.finish(key, future, result)
+
+        # Task riêng: leader bị huỷ thì công việc vẫn chạy xong cho follower
+        asyncio.get_running_loop().create_task(run())
+        return await asyncio.shield(future)
+
+    # === REDIS LOCK (cross-worker) ===
+
+    def _redis(self):
+        """Async Redis client (None nếu chưa khởi tạo được)"""
+        try:
+            return get_async_redis_service().client
+        except Exception:
+            return None
+
+    async def _try_lock(self, client, lock_key: str, token: str) -> bool:
+        return bool(await client.set(lock_key, token, nx=True, px=SINGLE_FLIGHT_LOCK_TTL_MS))
+
+    async def _release(self, client, lock_key: str, token: str) -> None:
+        if self._release_script is None or self._release_script.registered_client is not client:
+            self._release_script = client.register_script(RELEASE_LOCK_LUA)
+        await self._release_script(keys=[lock_key], args=[token])
+
+    async def _run_with_redis_lock(self, key: str, func: Callable[[], Awaitable[T]],
+                                   remote_result: Callable[[], Awaitable[Optional[T]]]) -> T:
+        """Leader giữ Redis lock; worker khác chờ remote_result() thay vì chạy lại"""
+        client = self._redis()
+        if client is None:
+            return await func()
+        lock_key = LOCK_KEY_PREFIX + key
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self._try_lock(client, lock_key, token)
+        except Exception as e:
+            print(f"[SingleFlight] Redis lock failed, running locally: {e}")
+            return await func()
+
+        if acquired:
+            try:
+                return await func()
+            finally:
+                try:
+                    await self._release(client, lock_key, token)
+                except Exception as e:
+                    print(f"[SingleFlight] Redis lock release failed (expires in TTL): {e}")
+
+        # Worker khác đang chạy: chờ kết quả của nó hoặc lock biến mất (xong/lỗi/hết hạn)
+        deadline = time.monotonic() + SINGLE_FLIGHT_LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+            try:
+                result = await remote_result()
+                if result is not None:
+                    self._count(self.remote_hits, key)
+                    return result
+                if not await client.exists(lock_key):
+                    break
+            except Exception as e:
+                print(f"[SingleFlight] Waiting for remote result failed: {e}")
+                break
+        # Leader ở worker khác không để lại kết quả dùng được -> tự chạy
+        return await func()
+
+    def stats(self) -> Dict[str, Any]:
+        """Số lần chạy thật (leader) / được gộp (follower) theo stage"""
+        with self._lock:
+            leaders = dict(self.leaders)
+            followers = dict(self.followers)
+            remote_hits = dict(self.remote_hits)
+        return {
+            "enabled": self.enabled,
+            "redis_lock": self.redis_lock,
+            "inflight": len(self._inflight),
+            "leaders": leaders,
+            "followers": followers,
+            "remote_hits": remote_hits,
+            "coalesced_ratio": {
+                stage: round(followers.get(stage, 0) / (leaders[stage] + followers.get(stage, 0)), 3)
+                for stage in leaders
+            },
+        }
+
+
+# Global singleton instance
+_single_flight: Optional[SingleFlight] = None
+
+def get_single_flight() -> SingleFlight:
+    """Get global single-flight instance"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight